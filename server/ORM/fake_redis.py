@@ -0,0 +1,430 @@
+# -*- coding: utf-8 -*-
+
+""" An in-process server speaking the Redis protocol, for tests and local development without a Redis.
+
+It keeps its data in memory and implements the subset of Redis the repositories use: strings, hashes, sorted sets,
+pipelining, MULTI/EXEC and WATCH. Commands run one at a time under a single lock, like in Redis, so that commands and
+transactions are atomic. It is not meant to be fast, nor complete.
+
+"""
+
+import bisect
+import logging
+import socketserver
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from server.ORM.resp import RespError, read_reply
+
+logger = logging.getLogger(__name__)
+
+_WRONG_TYPE = RespError('WRONGTYPE Operation against a key holding the wrong kind of value')
+
+_QUEUED = object()
+
+
+class _SortedSet(object):
+
+    def __init__(self):
+
+        self.scores = {}  # type: Dict[str, float]
+
+        # (score, member), sorted: the order of ZRANGE
+        self.entries = []  # type: List[Tuple[float, str]]
+
+    def add(self, member: str, score: float) -> bool:
+
+        existing = self.scores.get(member)
+
+        if existing is not None:
+            if existing == score:
+                return False
+            self.entries.remove((existing, member))
+
+        self.scores[member] = score
+        bisect.insort(self.entries, (score, member))
+
+        return existing is None
+
+    def remove(self, member: str) -> bool:
+
+        score = self.scores.pop(member, None)
+
+        if score is None:
+            return False
+
+        del self.entries[bisect.bisect_left(self.entries, (score, member))]
+
+        return True
+
+    def __len__(self):
+
+        return len(self.entries)
+
+
+def _format_score(score: float) -> str:
+
+    return str(int(score)) if score.is_integer() else repr(score)
+
+
+def _lex_position(entries: List[Tuple[float, str]], bound: str, upper: bool) -> int:
+    # ZRANGEBYLEX assumes all the members have the same score
+    if bound == '-':
+        return 0
+    if bound == '+':
+        return len(entries)
+    if bound[0] not in '[(':
+        raise RespError('ERR min or max not valid string range item')
+    score = entries[0][0] if entries else 0
+    inclusive = bound[0] == '['
+    if upper == inclusive:
+        return bisect.bisect_right(entries, (score, bound[1:]))
+    return bisect.bisect_left(entries, (score, bound[1:]))
+
+
+class _Client(object):
+    """ the per-connection state. """
+
+    def __init__(self):
+
+        # the commands queued since MULTI, None outside of a transaction
+        self.queue = None  # type: Optional[List[List[str]]]
+
+        # key -> its version when it was WATCHed
+        self.watched = {}  # type: Dict[str, int]
+
+
+class FakeRedisServer(object):
+    """ a Redis protocol server, in a background thread.
+
+    Usage:
+        server = FakeRedisServer().start()
+        client = RespClient(port=server.port)
+        ...
+        server.stop()
+
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+
+        self._lock = threading.Lock()
+
+        self._data = {}
+
+        # key -> number of times it was written, for WATCH
+        self._versions = {}  # type: Dict[str, int]
+
+        fake = self
+
+        class Handler(socketserver.StreamRequestHandler):
+
+            # replies are small writes: without it, a pipeline stalls on delayed acks
+            disable_nagle_algorithm = True
+
+            def handle(self):
+                fake._serve(self.rfile, self.wfile)
+
+        self._server = socketserver.ThreadingTCPServer((host, port), Handler, bind_and_activate=False)
+
+        self._server.daemon_threads = True
+
+        self._server.allow_reuse_address = True
+
+        self._server.server_bind()
+
+        self._server.server_activate()
+
+        self.host, self.port = self._server.server_address[:2]
+
+        self._thread = None
+
+    def start(self) -> 'FakeRedisServer':
+
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,), name='fake-redis',
+                                        daemon=True)
+
+        self._thread.start()
+
+        return self
+
+    def stop(self) -> None:
+
+        self._server.shutdown()
+
+        self._server.server_close()
+
+        self._thread.join()
+
+    def _serve(self, rfile, wfile) -> None:
+
+        client = _Client()
+
+        while True:
+            try:
+                command = read_reply(rfile)
+            except (ConnectionError, OSError, ValueError):
+                return
+            if not isinstance(command, list) or not command:
+                wfile.write(b'-ERR protocol error\r\n')
+                return
+            wfile.write(self._encode(self._dispatch(client, command)))
+            wfile.flush()
+
+    def _encode(self, reply) -> bytes:
+
+        if reply is None:
+            return b'$-1\r\n'
+        if reply is _QUEUED:
+            return b'+QUEUED\r\n'
+        if isinstance(reply, RespError):
+            return b'-' + str(reply).encode('utf-8') + b'\r\n'
+        if isinstance(reply, bool):
+            return b':%d\r\n' % reply
+        if isinstance(reply, int):
+            return b':%d\r\n' % reply
+        if isinstance(reply, list):
+            return b'*%d\r\n' % len(reply) + b''.join(self._encode(item) for item in reply)
+        if isinstance(reply, tuple):
+            # a status reply
+            return b'+' + reply[0].encode('utf-8') + b'\r\n'
+        data = str(reply).encode('utf-8')
+        return b'$%d\r\n%s\r\n' % (len(data), data)
+
+    def _dispatch(self, client: _Client, command: List[str]):
+
+        name = command[0].upper()
+
+        if name == 'MULTI':
+            if client.queue is not None:
+                return RespError('ERR MULTI calls can not be nested')
+            client.queue = []
+            return ('OK',)
+
+        if name == 'DISCARD':
+            client.queue = None
+            client.watched = {}
+            return ('OK',)
+
+        if name == 'EXEC':
+            if client.queue is None:
+                return RespError('ERR EXEC without MULTI')
+            queue, client.queue = client.queue, None
+            with self._lock:
+                watched, client.watched = client.watched, {}
+                if any(self._versions.get(key, 0) != version for key, version in watched.items()):
+                    return None
+                return [self._run(queued) for queued in queue]
+
+        if name == 'WATCH':
+            if client.queue is not None:
+                return RespError('ERR WATCH inside MULTI is not allowed')
+            with self._lock:
+                for key in command[1:]:
+                    client.watched.setdefault(key, self._versions.get(key, 0))
+            return ('OK',)
+
+        if name == 'UNWATCH':
+            client.watched = {}
+            return ('OK',)
+
+        if client.queue is not None:
+            if not hasattr(self, '_cmd_' + name.lower()):
+                return RespError("ERR unknown command '{}'".format(command[0]))
+            client.queue.append(command)
+            return _QUEUED
+
+        with self._lock:
+            return self._run(command)
+
+    def _run(self, command: List[str]):
+
+        handler = getattr(self, '_cmd_' + command[0].lower(), None)
+
+        if handler is None:
+            return RespError("ERR unknown command '{}'".format(command[0]))
+
+        try:
+            return handler(*command[1:])
+        except TypeError:
+            return RespError("ERR wrong number of arguments for '{}' command".format(command[0].lower()))
+        except ValueError:
+            return RespError('ERR value is not a valid float or integer')
+        except RespError as e:
+            return e
+
+    # --- data -------------------------------------------------------------------------------------------------------
+
+    def _get(self, key: str, kind: type, create: bool = False):
+
+        value = self._data.get(key)
+
+        if value is None:
+            if not create:
+                return None
+            value = self._data[key] = kind()
+
+        if not isinstance(value, kind):
+            raise _WRONG_TYPE
+
+        return value
+
+    def _touch(self, key: str) -> None:
+
+        self._versions[key] = self._versions.get(key, 0) + 1
+
+    def _drop_if_empty(self, key: str) -> None:
+
+        if not len(self._data[key]):
+            del self._data[key]
+
+    # --- commands ---------------------------------------------------------------------------------------------------
+
+    def _cmd_ping(self, message: str = None):
+        return ('PONG',) if message is None else message
+
+    def _cmd_select(self, db: str):
+        return ('OK',)
+
+    def _cmd_flushdb(self):
+        for key in self._data:
+            self._touch(key)
+        self._data.clear()
+        return ('OK',)
+
+    def _cmd_dbsize(self):
+        return len(self._data)
+
+    def _cmd_exists(self, *keys: str):
+        return sum(key in self._data for key in keys)
+
+    def _cmd_del(self, key: str, *keys: str):
+        deleted = 0
+        for key in (key,) + keys:
+            if self._data.pop(key, None) is not None:
+                self._touch(key)
+                deleted += 1
+        return deleted
+
+    def _cmd_get(self, key: str):
+        return self._get(key, str)
+
+    def _cmd_set(self, key: str, value: str, *options: str):
+        options = {option.upper() for option in options}
+        if 'NX' in options and key in self._data:
+            return None
+        if 'XX' in options and key not in self._data:
+            return None
+        self._data[key] = value
+        self._touch(key)
+        return ('OK',)
+
+    def _cmd_hget(self, key: str, field: str):
+        return (self._get(key, dict) or {}).get(field)
+
+    def _cmd_hmget(self, key: str, field: str, *fields: str):
+        values = self._get(key, dict) or {}
+        return [values.get(field) for field in (field,) + fields]
+
+    def _cmd_hgetall(self, key: str):
+        return [item for pair in (self._get(key, dict) or {}).items() for item in pair]
+
+    def _cmd_hlen(self, key: str):
+        return len(self._get(key, dict) or {})
+
+    def _cmd_hset(self, key: str, field: str, value: str, *pairs: str):
+        if len(pairs) % 2:
+            raise TypeError()
+        values = self._get(key, dict, create=True)
+        pairs = (field, value) + pairs
+        added = 0
+        for i in range(0, len(pairs), 2):
+            added += pairs[i] not in values
+            values[pairs[i]] = pairs[i + 1]
+        self._touch(key)
+        return added
+
+    def _cmd_hsetnx(self, key: str, field: str, value: str):
+        values = self._get(key, dict, create=True)
+        if field in values:
+            return 0
+        values[field] = value
+        self._touch(key)
+        return 1
+
+    def _cmd_hdel(self, key: str, field: str, *fields: str):
+        values = self._get(key, dict)
+        if values is None:
+            return 0
+        deleted = 0
+        for field in (field,) + fields:
+            if values.pop(field, None) is not None:
+                deleted += 1
+        if deleted:
+            self._touch(key)
+            self._drop_if_empty(key)
+        return deleted
+
+    def _cmd_zadd(self, key: str, score: str, member: str, *pairs: str):
+        if len(pairs) % 2:
+            raise TypeError()
+        zset = self._get(key, _SortedSet, create=True)
+        pairs = (score, member) + pairs
+        added = 0
+        for i in range(0, len(pairs), 2):
+            added += zset.add(pairs[i + 1], float(pairs[i]))
+        self._touch(key)
+        return added
+
+    def _cmd_zrem(self, key: str, member: str, *members: str):
+        zset = self._get(key, _SortedSet)
+        if zset is None:
+            return 0
+        removed = sum(zset.remove(member) for member in (member,) + members)
+        if removed:
+            self._touch(key)
+            self._drop_if_empty(key)
+        return removed
+
+    def _cmd_zcard(self, key: str):
+        return len(self._get(key, _SortedSet) or ())
+
+    def _cmd_zscore(self, key: str, member: str):
+        score = (self._get(key, _SortedSet) or _SortedSet()).scores.get(member)
+        return _format_score(score) if score is not None else None
+
+    def _cmd_zmscore(self, key: str, member: str, *members: str):
+        scores = (self._get(key, _SortedSet) or _SortedSet()).scores
+        return [_format_score(scores[member]) if member in scores else None for member in (member,) + members]
+
+    def _cmd_zrange(self, key: str, start: str, stop: str, *options: str):
+        entries = (self._get(key, _SortedSet) or _SortedSet()).entries
+        start, stop = int(start), int(stop)
+        if start < 0:
+            start = max(len(entries) + start, 0)
+        stop = len(entries) + stop if stop < 0 else min(stop, len(entries) - 1)
+        page = entries[start:stop + 1]
+        if 'WITHSCORES' in (option.upper() for option in options):
+            return [item for score, member in page for item in (member, _format_score(score))]
+        return [member for _, member in page]
+
+    def _cmd_zrangebylex(self, key: str, low: str, high: str, *options: str):
+        entries = (self._get(key, _SortedSet) or _SortedSet()).entries
+        start, stop = _lex_position(entries, low, False), _lex_position(entries, high, True)
+        page = entries[start:max(start, stop)]
+        if options:
+            if len(options) != 3 or options[0].upper() != 'LIMIT':
+                raise RespError('ERR syntax error')
+            offset, count = int(options[1]), int(options[2])
+            page = page[offset:] if count < 0 else page[offset:offset + count]
+        return [member for _, member in page]
+
+    def _cmd_zrevrangebylex(self, key: str, high: str, low: str, *options: str):
+        entries = (self._get(key, _SortedSet) or _SortedSet()).entries
+        start, stop = _lex_position(entries, low, False), _lex_position(entries, high, True)
+        page = entries[start:max(start, stop)][::-1]
+        if options:
+            if len(options) != 3 or options[0].upper() != 'LIMIT':
+                raise RespError('ERR syntax error')
+            offset, count = int(options[1]), int(options[2])
+            page = page[offset:] if count < 0 else page[offset:offset + count]
+        return [member for _, member in page]
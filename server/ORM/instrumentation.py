@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+""" Timing hooks for the repositories.
+
+Decorate a repository class with @instrumented('<name>') and every public method of that class records its call
+count, cumulative time and the number of rows it returned (exposed at /metrics). Calls slower than the configured
+threshold are written to the slow-op log along with their arguments. A per-request breakdown of the repository time
+can be collected with start_breakdown() / stop_breakdown().
+
+"""
+
+import contextvars
+import functools
+import inspect
+import logging
+import time
+from typing import Dict, Callable, Iterator, Optional
+
+from server import metrics
+
+logger = logging.getLogger(__name__)
+
+slow_ops_logger = logging.getLogger('server.ORM.slow_ops')
+
+repository_calls_total = metrics.REGISTRY.counter(
+    'repository_calls_total', 'Total repository method calls.', ('repository', 'method'))
+
+repository_seconds_total = metrics.REGISTRY.counter(
+    'repository_seconds_total', 'Cumulative time spent in repository methods, in seconds.', ('repository', 'method'))
+
+repository_rows_total = metrics.REGISTRY.counter(
+    'repository_rows_total', 'Total rows returned by repository methods.', ('repository', 'method'))
+
+# calls slower than this (in seconds) go to the slow-op log. None disables the slow-op log.
+_slow_op_threshold = 0.05
+
+# per-request breakdown: '<repository>.<method>' -> [calls, seconds]
+_breakdown = contextvars.ContextVar('repository_breakdown', default=None)
+
+
+def configure(slow_op_threshold_ms: float = None) -> None:
+    """ configures the instrumentation.
+
+    Args:
+        slow_op_threshold_ms: calls slower than this go to the slow-op log. None disables the slow-op log.
+
+    Returns:
+        None
+
+    """
+
+    global _slow_op_threshold
+
+    _slow_op_threshold = slow_op_threshold_ms / 1000 if slow_op_threshold_ms is not None else None
+
+
+def start_breakdown() -> contextvars.Token:
+    """ starts collecting the repository time of the current request (or task). """
+
+    return _breakdown.set({})
+
+
+def stop_breakdown(token: contextvars.Token) -> Dict[str, list]:
+    """ stops collecting and returns the breakdown as '<repository>.<method>' -> [calls, seconds]. """
+
+    breakdown = _breakdown.get()
+
+    _breakdown.reset(token)
+
+    return breakdown or {}
+
+
+def _count_rows(result) -> Optional[int]:
+    """ the number of rows of a result: its length for a collection, 1 for a single record, 0 for None.
+
+    An iterator or generator can't be counted without consuming it (and the caller would then get nothing), so its
+    rows are unknown: None.
+
+    """
+
+    if result is None:
+        return 0
+
+    if isinstance(result, (list, tuple, set, frozenset, dict)):
+        return len(result)
+
+    if isinstance(result, Iterator):
+        return None
+
+    return 1
+
+
+def _timed(repository: str, method: str, func: Callable) -> Callable:
+
+    labels = (repository, method)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            repository_calls_total.inc(labels)
+            repository_seconds_total.inc(labels, elapsed)
+            breakdown = _breakdown.get()
+            if breakdown is not None:
+                entry = breakdown.setdefault(repository + '.' + method, [0, 0.0])
+                entry[0] += 1
+                entry[1] += elapsed
+            if _slow_op_threshold is not None and elapsed > _slow_op_threshold:
+                # args[0] is the repository itself
+                slow_ops_logger.warning('slow repository call: %s.%s took %.1f ms, args: %s, kwargs: %s',
+                                        repository, method, elapsed * 1000, args[1:], kwargs)
+        rows = _count_rows(result)
+        if rows is not None:
+            repository_rows_total.inc(labels, rows)
+        return result
+
+    return wrapper
+
+
+def instrumented(repository: str):
+    """ class decorator: instruments every public method defined by a repository class.
+
+    Args:
+        repository: the name to report the repository under (e.g. 'users')
+
+    Returns:
+        the class decorator
+
+    """
+
+    def decorator(cls):
+        for name, member in list(vars(cls).items()):
+            if name.startswith('_') or not inspect.isfunction(member):
+                continue
+            setattr(cls, name, _timed(repository, name, member))
+        return cls
+
+    return decorator
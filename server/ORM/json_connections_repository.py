@@ -2,44 +2,99 @@
 
 import json
 import logging
-import uuid
-from typing import Set, Iterable
+from bisect import bisect_left, insort
+from itertools import islice
+from typing import Set, Iterable, List, Tuple
 
+from server import ids
 from server.exceptions import DataIntegrityException
+from server.ORM.instrumentation import instrumented
+from server.ORM.locks import ReadWriteLock, StripedLock
 
 from server.models import Connection, ConnectionsRepository
 
 logger = logging.getLogger(__name__)
 
 
+@instrumented('connections')
 class JsonConnectionsRepository(ConnectionsRepository):
 
-    def __init__(self, json_file: str):
+    def __init__(self, json_file: str, lock_stripes: int = 64):
 
         super().__init__()
 
+        # guards the connections list: scans in shared mode, create/delete mutate it in exclusive mode
+        self._lock = ReadWriteLock()
+
+        # serializes the check-then-act of create/delete per pair of users, other pairs don't contend
+        self._pair_locks = StripedLock(lock_stripes)
+
         self.connections = []
 
+        # user -> {connected user: connection}, maintained on create/delete so that count() and the lookups by users
+        # never scan
+        self._adjacency = {}
+
+        # user -> [(creation time, connected user)], kept sorted on create/delete: the recent connections are a slice
+        # read backwards
+        self._timelines = {}
+
         for connection_dict in json.load(open(json_file)).get('connections', []):
             connection = self._object_mapper(connection_dict)
             self.connections.append(connection)
+            self._index(connection)
 
     @staticmethod
     def _object_mapper(connection_dict: dict) -> Connection:
 
         try:
             user1_id, user2_id = connection_dict['users'][0], connection_dict['users'][1]
-            return Connection(connection_id=connection_dict['id'], users={user1_id, user2_id})
+            return Connection(connection_id=connection_dict['id'], users={user1_id, user2_id},
+                              created=float(connection_dict.get('created', 0.0)))
         except KeyError or IndexError as e:
             message = "malformed data in json file"
             logger.error(message)
             raise DataIntegrityException(message, e)
 
+    @staticmethod
+    def _pairs(users: Set[str]) -> Set[Tuple[str, str]]:
+
+        # min/max rather than unpacking: the data may hold a connection of a user with themselves
+        user1, user2 = min(users), max(users)
+
+        return {(user1, user2), (user2, user1)}
+
+    def _index(self, connection: Connection) -> None:
+
+        for user, other in self._pairs(connection.users):
+            self._adjacency.setdefault(user, {})[other] = connection
+            insort(self._timelines.setdefault(user, []), (connection.created, other))
+
+    def _unindex(self, connection: Connection) -> None:
+
+        for user, other in self._pairs(connection.users):
+            neighbours = self._adjacency[user]
+            del neighbours[other]
+            if not neighbours:
+                del self._adjacency[user]
+            timeline = self._timelines[user]
+            del timeline[bisect_left(timeline, (connection.created, other))]
+            if not timeline:
+                del self._timelines[user]
+
+    def _find(self, users: Set[str]) -> Connection:
+
+        if not users:
+            return None
+
+        return self._adjacency.get(min(users), {}).get(max(users))
+
     def get_by_id(self, connection_id) -> Connection:
 
-        for connection in self.connections:
-            if connection.id == connection_id:
-                return connection
+        with self._lock.read():
+            for connection in self.connections:
+                if connection.id == connection_id:
+                    return connection
 
         message = "connection not found: {}".format(connection_id)
 
@@ -49,40 +104,82 @@ class JsonConnectionsRepository(ConnectionsRepository):
 
     def get(self, users: Set[str]) -> Connection:
 
-        for connection in self.connections:
-            if connection.users == users:
-                return connection
+        with self._lock.read():
+            connection = self._find(users)
 
-        message = "connection not found: {}".format(users)
+        if connection is not None:
+            return connection
 
-        logger.error(message)
+        logger.debug('connection not found: %s', users)
 
     def get_all(self, user: str, offset: int, limit: int) -> Iterable[Connection]:
 
-        connections = []
+        # a page of the adjacency of the user, in the order the connections were made
+        with self._lock.read():
+            return list(islice(self._adjacency.get(user, {}).values(), offset, offset + limit))
 
-        for connection in self.connections:
-            if user in connection.users:
-                connections.append(connection)
+    def get_recent(self, user: str, cursor: Tuple[float, str] = None, since: float = None,
+                   limit: int = 50) -> List[Connection]:
 
-        return connections
+        with self._lock.read():
+            timeline = self._timelines.get(user, [])
+            end = bisect_left(timeline, tuple(cursor)) if cursor is not None else len(timeline)
+            start = max(end - limit, bisect_left(timeline, (since,)) if since is not None else 0)
+            neighbours = self._adjacency.get(user, {})
+            return [neighbours[other] for _, other in reversed(timeline[start:end])]
 
-    def create(self, users: Set[str]) -> Connection:
+    def count(self, user: str) -> int:
 
-        if self.get(users) is None:
-            connection = Connection(str(uuid.uuid4()), users)
-            self.connections.append(connection)
-            return connection
-        else:
-            message = "connection already exists: {}".format(users)
-            logger.error(message)
-            raise DataIntegrityException(message)
+        with self._lock.read():
+            return len(self._adjacency.get(user, ()))
+
+    def connected(self, user: str, others: Iterable[str]) -> Set[str]:
+
+        with self._lock.read():
+            neighbours = self._adjacency.get(user, {})
+            return {other for other in others if other in neighbours}
+
+    def create(self, users: Set[str], created: float = None) -> Connection:
+
+        with self._pair_locks(frozenset(users)):
+            with self._lock.read():
+                existing_connection = self._find(users)
+            if existing_connection is None:
+                connection_id = ids.new_id()
+                connection = Connection(connection_id, users,
+                                        created if created is not None else ids.timestamp_of(connection_id))
+                with self._lock.write():
+                    self.connections.append(connection)
+                    self._index(connection)
+                return connection
+
+        message = "connection already exists: {}".format(users)
+        logger.error(message)
+        raise DataIntegrityException(message)
+
+    def create_many(self, pairs: Iterable[Set[str]]) -> List[Connection]:
+
+        connections = []
+
+        # one exclusive section for the whole batch: the checks and the adds can't interleave with another write
+        with self._lock.write():
+            for users in pairs:
+                if self._find(users) is None:
+                    connection_id = ids.new_id()
+                    connection = Connection(connection_id, set(users), ids.timestamp_of(connection_id))
+                    self.connections.append(connection)
+                    self._index(connection)
+                    connections.append(connection)
+
+        return connections
 
     def delete(self, users: Set[str]) -> None:
 
-        for connection in self.connections:
-            if connection.users == users:
+        with self._pair_locks(frozenset(users)), self._lock.write():
+            connection = self._find(users)
+            if connection is not None:
                 self.connections.remove(connection)
+                self._unindex(connection)
                 return
 
         message = "connection not found: {}".format(users)
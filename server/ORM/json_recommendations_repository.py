@@ -2,26 +2,39 @@
 
 import json
 import logging
-import uuid
-from typing import Iterable
+from bisect import insort
+from typing import Dict, Iterable, List
 
+from server import ids
 from server.exceptions import DataIntegrityException
+from server.ORM.instrumentation import instrumented
+from server.ORM.locks import ReadWriteLock
 from server.models import Recommendation, RecommendationsRepository
 
 logger = logging.getLogger(__name__)
 
 
+@instrumented('recommendations')
 class JsonRecommendationsRepository(RecommendationsRepository):
 
     def __init__(self, json_file: str):
 
         super().__init__()
 
-        self.recommendations = set()
+        # guards the recommendations: reads in shared mode, saves and deletes in exclusive mode
+        self._lock = ReadWriteLock()
+
+        # recommendation id -> recommendation
+        self.recommendations = {}
+
+        # user -> [(-score, recommended user, recommendation id)], kept sorted on save so that a page is a slice
+        self._ranked = {}
+
+        # (user, recommended user) -> recommendation id, a recommended user appears once per user
+        self._pairs = {}
 
         for user_dict in json.load(open(json_file)).get('recommendations', []):
-            recommendation = self._object_mapper(user_dict)
-            self.recommendations.add(recommendation)
+            self._add(self._object_mapper(user_dict))
 
     @staticmethod
     def _object_mapper(user_dict: dict) -> Recommendation:
@@ -29,32 +42,92 @@ class JsonRecommendationsRepository(RecommendationsRepository):
         try:
             return Recommendation(recommendation_id=user_dict['id'],
                                   user=user_dict['user_id'],
-                                  recommended_user=user_dict['recommended_user_id'])
+                                  recommended_user=user_dict['recommended_user_id'],
+                                  score=float(user_dict.get('score', 0.0)))
         except KeyError as e:
             message = "malformed data in json file"
             logger.error(message)
             raise DataIntegrityException(message, e)
 
+    def _add(self, recommendation: Recommendation) -> None:
+
+        # first: a score that can't be ranked fails before anything is written
+        entry = (-recommendation.score, recommendation.recommended_user, recommendation.id)
+
+        existing_id = self._pairs.get((recommendation.user, recommendation.recommended_user))
+
+        if existing_id is not None:
+            self._remove(existing_id)
+
+        self.recommendations[recommendation.id] = recommendation
+        self._pairs[(recommendation.user, recommendation.recommended_user)] = recommendation.id
+        insort(self._ranked.setdefault(recommendation.user, []), entry)
+
+    def _remove(self, recommendation_id: str) -> None:
+
+        recommendation = self.recommendations.pop(recommendation_id)
+
+        del self._pairs[(recommendation.user, recommendation.recommended_user)]
+
+        ranked = self._ranked[recommendation.user]
+        ranked.remove((-recommendation.score, recommendation.recommended_user, recommendation.id))
+        if not ranked:
+            del self._ranked[recommendation.user]
+
     def get(self, user: str, offset: int, limit: int) -> Iterable[Recommendation]:
 
-        recommendations = set()
+        with self._lock.read():
+            page = self._ranked.get(user, [])[offset:offset + limit]
+            return [self.recommendations[recommendation_id] for _, _, recommendation_id in page]
+
+    def count(self, user: str) -> int:
+
+        with self._lock.read():
+            return len(self._ranked.get(user, ()))
+
+    def save(self, user: str, recommended_user: str, score: float = 0.0) -> Recommendation:
 
-        for recommendation in self.recommendations:
-            if recommendation.user == user:
-                recommendations.add(recommendation)
+        with self._lock.write():
+            existing_id = self._pairs.get((user, recommended_user))
+            recommendation = Recommendation(recommendation_id=existing_id or ids.new_id(), user=user,
+                                            recommended_user=recommended_user, score=score)
+            self._add(recommendation)
 
-        return recommendations
+        return recommendation
 
-    def save(self, user: str, recommended_user: str) -> Recommendation:
+    def replace_all(self, user: str, scores: Dict[str, float]) -> List[Recommendation]:
 
-        recommendation = Recommendation(recommendation_id=str(uuid.uuid4()), user=user, recommended_user=recommended_user)
-        self.recommendations.add(recommendation)
-        return Recommendation
+        with self._lock.write():
+            existing = {recommended_user: self.recommendations[recommendation_id]
+                        for _, recommended_user, recommendation_id in self._ranked.get(user, ())}
+            saved = [Recommendation(recommendation_id=existing[recommended_user].id if recommended_user in existing
+                                    else ids.new_id(), user=user, recommended_user=recommended_user, score=score)
+                     for recommended_user, score in scores.items()]
+            for recommended_user, recommendation in existing.items():
+                if recommended_user not in scores:
+                    self._remove(recommendation.id)
+            for recommendation in saved:
+                previous = existing.get(recommendation.recommended_user)
+                # the unchanged ones stay where they are ranked
+                if previous is None or previous.score != recommendation.score:
+                    self._add(recommendation)
+
+        return saved
 
     def delete(self, recommendation_id: str) -> None:
 
-        raise NotImplementedError()
+        with self._lock.write():
+            if recommendation_id in self.recommendations:
+                self._remove(recommendation_id)
+                return
+
+        message = "recommendation not found: {}".format(recommendation_id)
+
+        logger.error(message)
+
+        raise KeyError(message)
 
     def total(self) -> int:
 
-        return len(self.recommendations)
+        with self._lock.read():
+            return len(self.recommendations)
@@ -1,31 +1,42 @@
 # -*- coding: utf-8 -*-
 
+import bisect
 import json
 import logging
-import uuid
-
-from faker import Faker
-from faker.providers import internet
+from typing import Dict, List
 
+from server import ids
 from server.exceptions import DataIntegrityException
+from server.ORM.instrumentation import instrumented
+from server.ORM.locks import ReadWriteLock, StripedLock
 from server.models import Profile, User, UsersRepository
 
 logger = logging.getLogger(__name__)
 
-fake = Faker()
-fake.add_provider(internet)
-
+@instrumented('users')
 class JsonUsersRepository(UsersRepository):
 
-    def __init__(self, json_file: str):
+    def __init__(self, json_file: str, lock_stripes: int = 64):
 
         super().__init__()
 
-        self.users = []
+        # guards the college index: scans run in shared mode, create/delete (and re-indexing) in exclusive mode
+        self._lock = ReadWriteLock()
+
+        # serializes the updates (and the deletion) of a single user, updates of different users don't contend
+        self._user_locks = StripedLock(lock_stripes)
+
+        # user id -> current version of the user. The users are immutable, and a dict lookup or assignment is atomic:
+        # the lookups by id read it without any lock, an update swaps in the new version in one assignment
+        self.users = {}
+
+        # secondary index: college -> sorted ids of the users at that college
+        self._college_index = {}  # type: Dict[str, List[str]]
 
         for user_dict in json.load(open(json_file)).get('users', []):
             user = self._object_mapper(user_dict)
-            self.users.append(user)
+            self.users[user.id] = user
+            self._index(user)
 
     @staticmethod
     def _object_mapper(user_dict: dict) -> User:
@@ -39,42 +50,87 @@ class JsonUsersRepository(UsersRepository):
             logger.error(message)
             raise DataIntegrityException(message, e)
 
+    def _index(self, user: User) -> None:
+
+        bisect.insort(self._college_index.setdefault(user.profile.college, []), user.id)
+
+    def _unindex(self, user: User) -> None:
+
+        user_ids = self._college_index.get(user.profile.college, [])
+
+        position = bisect.bisect_left(user_ids, user.id)
+
+        if position < len(user_ids) and user_ids[position] == user.id:
+            del user_ids[position]
+
+        if not user_ids:
+            self._college_index.pop(user.profile.college, None)
+
     def get(self, user_id: str) -> User:
 
-        for user in self.users:
-            if user.id == user_id:
-                return user
+        user = self.users.get(user_id)
 
-        message = "user not found: {}".format(user_id)
+        if user is not None:
+            return user
 
-        logger.error(message)
+        logger.debug('user not found: %s', user_id)
+
+    def get_many(self, user_ids: List[str]) -> Dict[str, User]:
+
+        users = {user_id: self.users.get(user_id) for user_id in user_ids}
+
+        return {user_id: user for user_id, user in users.items() if user is not None}
+
+    def get_by_college(self, college: str, cursor: str = None, limit: int = 50) -> List[User]:
+
+        with self._lock.read():
+            user_ids = self._college_index.get(college, [])
+            start = bisect.bisect_right(user_ids, cursor) if cursor is not None else 0
+            return [self.users[user_id] for user_id in user_ids[start:start + limit]]
 
     def create(self, email: str, profile: Profile) -> User:
 
-        user = User(fake.user_name(), email, profile)
+        user = User(ids.new_id(), email, profile)
 
-        self.users.append(user)
+        with self._lock.write():
+            self.users[user.id] = user
+            self._index(user)
 
-        return self.get(user.id)
+        return user
 
     def update(self, user_id: str, profile: Profile) -> User:
 
-        for existing_user in self.users:
-            if existing_user.id == user_id:
-                existing_user.profile = profile
-                break
+        with self._user_locks(user_id):
+            existing_user = self.users.get(user_id)
+
+            if existing_user is None:
+                return None
+
+            user = existing_user.with_profile(profile)
+
+            if existing_user.profile.college == profile.college:
+                # readers see either the previous or the new version, never a mix of both
+                self.users[user_id] = user
+            else:
+                # the user moves in the college index as well: readers must not see it indexed under both colleges
+                with self._lock.write():
+                    self._unindex(existing_user)
+                    self.users[user_id] = user
+                    self._index(user)
 
-        return self.get(user_id)
+        return user
 
     def delete(self, user_id: str) -> None:
 
-        for existing_user in self.users:
-            if existing_user.id == user_id:
-                self.users.remove(existing_user)
-                break
+        # serialized with the updates of the user: an update in flight must not bring the user back
+        with self._user_locks(user_id), self._lock.write():
+            existing_user = self.users.pop(user_id, None)
+            if existing_user is not None:
+                self._unindex(existing_user)
+                return
 
         message = "user not found: {}".format(user_id)
 
         logger.error(message)
 
-        raise KeyError(message)
\ No newline at end of file
+        raise KeyError(message)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+""" Locks for the in-process repositories.
+
+A single global lock would serialize every request of a threaded server. The repositories instead combine:
+    * a ReadWriteLock around their shared collections: any number of readers, or a single writer.
+    * a StripedLock for per-key critical sections (check-then-act on one user or one connection), so that writes to
+      different keys don't contend.
+
+"""
+
+import threading
+from contextlib import contextmanager
+from typing import Hashable
+
+
+class ReadWriteLock(object):
+    """ a writer-preferring reader-writer lock.
+
+    Readers share the lock, writers hold it exclusively. Waiting writers block new readers, so a steady stream of
+    reads can't starve the writes. The lock is not reentrant: don't acquire it again while holding it.
+
+    """
+
+    def __init__(self):
+
+        self._condition = threading.Condition(threading.Lock())
+
+        self._readers = 0
+
+        self._writer = False
+
+        self._writers_waiting = 0
+
+    def acquire_read(self) -> None:
+
+        with self._condition:
+            while self._writer or self._writers_waiting:
+                self._condition.wait()
+            self._readers += 1
+
+    def release_read(self) -> None:
+
+        with self._condition:
+            self._readers -= 1
+            if self._readers == 0:
+                self._condition.notify_all()
+
+    def acquire_write(self) -> None:
+
+        with self._condition:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._condition.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+
+    def release_write(self) -> None:
+
+        with self._condition:
+            self._writer = False
+            self._condition.notify_all()
+
+    @contextmanager
+    def read(self):
+        """ holds the lock in shared mode for the duration of a with block. """
+
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        """ holds the lock in exclusive mode for the duration of a with block. """
+
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+
+class StripedLock(object):
+    """ a fixed set of locks, keys are mapped to one of them by hash.
+
+    Two keys only contend if they land on the same stripe, while memory stays bounded whatever the number of keys.
+
+    """
+
+    def __init__(self, stripes: int = 64):
+
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    def __call__(self, key: Hashable) -> threading.Lock:
+        """ gets the lock guarding a key. Use it as a context manager. """
+
+        return self._locks[hash(key) % len(self._locks)]
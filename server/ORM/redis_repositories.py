@@ -0,0 +1,580 @@
+# -*- coding: utf-8 -*-
+
+""" Repositories on Redis data types.
+
+Keys:
+    user:<id>                       hash: email, name, college, version
+    users:college:<college>         sorted set of the user ids at a college (all scored 0: ordered by id)
+    connections:pairs               hash: '<user1> <user2>' (user1 <= user2) -> '<connection id> <created>'
+    connections:users               hash: connection id -> '<user1> <user2> <created>'
+    connections:<user>              sorted set of the connected users (scored 0: ordered by id)
+    connections:recent:<user>       sorted set of '<created> <connected user> <connection id>' (scored 0: ordered by
+                                    creation time, then by connected user)
+    recommendations:<user>          sorted set of the recommended users, scored -score: best first, ties by id
+    recommendations:ids:<user>      hash: recommended user -> recommendation id
+    recommendation:<id>             hash: user, recommended_user
+
+The creation times of the connections (<created>) are milliseconds since the unix epoch, zero-padded to 15 digits so
+that their lexical order is their numeric order.
+
+Multi-key operations (multi-gets, batch adds, replacing all the recommendations of a user) are pipelined: one round
+trip to the server whatever the number of keys. Writes spanning several keys run in MULTI/EXEC transactions, the
+check-then-act ones (updates, deletes, creating connections) as optimistic WATCH transactions, so that the repositories
+stay consistent with several processes writing to the same server.
+
+"""
+
+import json
+import logging
+from itertools import islice
+from typing import Dict, Iterable, List, Set, Tuple
+
+from server import ids
+from server.exceptions import DataIntegrityException
+from server.ORM.instrumentation import instrumented
+from server.ORM.resp import RespClient, RespConnection
+from server.models import Connection, ConnectionsRepository, Profile, Recommendation, RecommendationsRepository, \
+    User, UsersRepository
+
+logger = logging.getLogger(__name__)
+
+
+def _batches(items: Iterable, size: int) -> Iterable[List]:
+
+    iterator = iter(items)
+
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _hash(reply: List[str]) -> Dict[str, str]:
+    """ the reply of HGETALL, as a dict. """
+
+    return dict(zip(reply[::2], reply[1::2]))
+
+
+@instrumented('users')
+class RedisUsersRepository(UsersRepository):
+
+    shared = True
+
+    def __init__(self, client: RespClient, json_file: str = None, batch_size: int = 1000):
+        """
+        Args:
+            client: the client of the Redis server
+            json_file: a snapshot to load into the server (loading is idempotent: the users are written with their
+                ids). None to use the data already there
+            batch_size: the number of users written per round trip when loading
+
+        """
+
+        super().__init__()
+
+        self.client = client
+
+        if json_file is not None:
+            for batch in _batches(json.load(open(json_file)).get('users', []), batch_size):
+                commands = []
+                for user_dict in batch:
+                    user = self._object_mapper(user_dict)
+                    commands.extend(self._write_commands(user))
+                self.client.transaction(commands)
+
+    @staticmethod
+    def _object_mapper(user_dict: dict) -> User:
+
+        try:
+            return User(user_id=user_dict['id'],
+                        email=user_dict['email'],
+                        profile=Profile(name=user_dict['name'], college=user_dict['college']),
+                        version=int(user_dict.get('version', 1)))
+        except KeyError as e:
+            message = "malformed data in json file"
+            logger.error(message)
+            raise DataIntegrityException(message, e)
+
+    @staticmethod
+    def _key(user_id: str) -> str:
+
+        return 'user:' + user_id
+
+    @staticmethod
+    def _college_key(college: str) -> str:
+
+        return 'users:college:' + college
+
+    def _from_hash(self, user_id: str, fields: Dict[str, str]) -> User:
+
+        return self._object_mapper(dict(fields, id=user_id)) if fields else None
+
+    def _write_commands(self, user: User) -> List[Tuple]:
+
+        return [('HSET', self._key(user.id), 'email', user.email, 'name', user.profile.name,
+                 'college', user.profile.college, 'version', user.version),
+                ('ZADD', self._college_key(user.profile.college), 0, user.id)]
+
+    def get(self, user_id: str) -> User:
+
+        user = self._from_hash(user_id, _hash(self.client.execute('HGETALL', self._key(user_id))))
+
+        if user is not None:
+            return user
+
+        logger.debug('user not found: %s', user_id)
+
+    def get_many(self, user_ids: List[str]) -> Dict[str, User]:
+
+        user_ids = list(dict.fromkeys(user_ids))
+
+        replies = self.client.pipeline([('HGETALL', self._key(user_id)) for user_id in user_ids])
+
+        users = {user_id: self._from_hash(user_id, _hash(reply)) for user_id, reply in zip(user_ids, replies)}
+
+        return {user_id: user for user_id, user in users.items() if user is not None}
+
+    def get_by_college(self, college: str, cursor: str = None, limit: int = 50) -> List[User]:
+
+        user_ids = self.client.execute('ZRANGEBYLEX', self._college_key(college),
+                                       '(' + cursor if cursor is not None else '-', '+', 'LIMIT', 0, limit)
+
+        users = self.get_many(user_ids)
+
+        # a user deleted in between is left out
+        return [users[user_id] for user_id in user_ids if user_id in users]
+
+    def create(self, email: str, profile: Profile) -> User:
+
+        user = User(ids.new_id(), email, profile)
+
+        self.client.transaction(self._write_commands(user))
+
+        return user
+
+    def update(self, user_id: str, profile: Profile) -> User:
+
+        key = self._key(user_id)
+
+        updated = []
+
+        def build(connection: RespConnection):
+            del updated[:]
+            existing_user = self._from_hash(user_id, _hash(connection.execute('HGETALL', key)))
+            if existing_user is None:
+                return None
+            user = existing_user.with_profile(profile)
+            updated.append(user)
+            commands = self._write_commands(user)
+            if existing_user.profile.college != profile.college:
+                commands.append(('ZREM', self._college_key(existing_user.profile.college), user_id))
+            return commands
+
+        # concurrent updates of the user are serialized by the version check: the loser retries on the new version
+        self.client.watch([key], build)
+
+        return updated[0] if updated else None
+
+    def delete(self, user_id: str) -> None:
+
+        key = self._key(user_id)
+
+        def build(connection: RespConnection):
+            college = connection.execute('HGET', key, 'college')
+            if college is None:
+                message = "user not found: {}".format(user_id)
+                logger.error(message)
+                raise KeyError(message)
+            return [('DEL', key), ('ZREM', self._college_key(college), user_id)]
+
+        self.client.watch([key], build)
+
+
+@instrumented('connections')
+class RedisConnectionsRepository(ConnectionsRepository):
+
+    shared = True
+
+    _PAIRS = 'connections:pairs'
+
+    _USERS = 'connections:users'
+
+    def __init__(self, client: RespClient, json_file: str = None, batch_size: int = 1000):
+        """
+        Args:
+            client: the client of the Redis server
+            json_file: a snapshot to load into the server (the connections already there are skipped). None to use
+                the data already there
+            batch_size: the number of connections written per round trip when loading
+
+        """
+
+        super().__init__()
+
+        self.client = client
+
+        if json_file is not None:
+            for batch in _batches(json.load(open(json_file)).get('connections', []), batch_size):
+                self._create_many([self._object_mapper(connection_dict) for connection_dict in batch])
+
+    @staticmethod
+    def _object_mapper(connection_dict: dict) -> Connection:
+
+        try:
+            user1_id, user2_id = connection_dict['users'][0], connection_dict['users'][1]
+            return Connection(connection_id=connection_dict['id'], users={user1_id, user2_id},
+                              created=float(connection_dict.get('created', 0.0)))
+        except (KeyError, IndexError) as e:
+            message = "malformed data in json file"
+            logger.error(message)
+            raise DataIntegrityException(message, e)
+
+    @staticmethod
+    def _pair(users: Set[str]) -> Tuple[str, str]:
+
+        # min/max rather than unpacking: the data may hold a connection of a user with themselves
+        return min(users), max(users)
+
+    @staticmethod
+    def _adjacency_key(user: str) -> str:
+
+        return 'connections:' + user
+
+    @staticmethod
+    def _timeline_key(user: str) -> str:
+
+        return 'connections:recent:' + user
+
+    @staticmethod
+    def _millis(created: float) -> str:
+
+        return '{:015d}'.format(int(round(created * 1000)))
+
+    @staticmethod
+    def _connection(users: Tuple[str, str], value: str) -> Connection:
+        """ the connection of a pair of users, from its value in connections:pairs. """
+
+        connection_id, created = value.split(' ')
+
+        return Connection(connection_id, set(users), int(created) / 1000)
+
+    def _create_many(self, connections: List[Connection]) -> List[Connection]:
+        """ creates the connections whose pairs are free, in one optimistic transaction on connections:pairs.
+
+        The pairs are read (HMGET) and claimed (HSET) in the same MULTI/EXEC as the indexes of the connections: a
+        connection is either fully written or not at all, and a concurrent create or delete of any pair retries the
+        transaction.
+
+        """
+
+        created = []
+
+        def build(connection: RespConnection):
+            del created[:]
+            fields = ['{} {}'.format(*self._pair(new.users)) for new in connections]
+            taken = set(field for field, value in zip(fields, connection.execute('HMGET', self._PAIRS, *fields))
+                        if value is not None)
+            commands = []
+            for field, new in zip(fields, connections):
+                if field in taken:
+                    continue
+                # the batch may connect the same pair twice: the first one wins
+                taken.add(field)
+                created.append(new)
+                user1, user2 = self._pair(new.users)
+                millis = self._millis(new.created)
+                commands.extend([('HSET', self._PAIRS, field, '{} {}'.format(new.id, millis)),
+                                 ('HSET', self._USERS, new.id, '{} {}'.format(field, millis)),
+                                 ('ZADD', self._adjacency_key(user1), 0, user2),
+                                 ('ZADD', self._adjacency_key(user2), 0, user1),
+                                 ('ZADD', self._timeline_key(user1), 0, '{} {} {}'.format(millis, user2, new.id)),
+                                 ('ZADD', self._timeline_key(user2), 0, '{} {} {}'.format(millis, user1, new.id))])
+            return commands or None
+
+        if connections:
+            self.client.watch([self._PAIRS], build)
+
+        return created
+
+    def get_by_id(self, connection_id) -> Connection:
+
+        value = self.client.execute('HGET', self._USERS, connection_id)
+
+        if value is not None:
+            user1, user2, created = value.split(' ')
+            return Connection(connection_id, {user1, user2}, int(created) / 1000)
+
+        message = "connection not found: {}".format(connection_id)
+
+        logger.error(message)
+
+        raise KeyError(message)
+
+    def get(self, users: Set[str]) -> Connection:
+
+        user1, user2 = self._pair(users)
+
+        value = self.client.execute('HGET', self._PAIRS, '{} {}'.format(user1, user2))
+
+        if value is not None:
+            return self._connection((user1, user2), value)
+
+        logger.debug('connection not found: %s', users)
+
+    def get_all(self, user: str, offset: int, limit: int) -> Iterable[Connection]:
+
+        if limit <= 0:
+            return []
+
+        others = self.client.execute('ZRANGE', self._adjacency_key(user), offset, offset + limit - 1)
+
+        if not others:
+            return []
+
+        pairs = [self._pair({user, other}) for other in others]
+
+        values = self.client.execute('HMGET', self._PAIRS, *['{} {}'.format(*pair) for pair in pairs])
+
+        # a connection deleted in between is left out
+        return [self._connection(pair, value) for value, pair in zip(values, pairs) if value is not None]
+
+    def get_recent(self, user: str, cursor: Tuple[float, str] = None, since: float = None,
+                   limit: int = 50) -> List[Connection]:
+
+        if limit <= 0:
+            return []
+
+        # the members of the cursor's connection are '<created> <connected user> <id>': greater than the bound
+        high = '({} {}'.format(self._millis(cursor[0]), cursor[1]) if cursor is not None else '+'
+
+        low = '[' + self._millis(since) if since is not None else '-'
+
+        members = self.client.execute('ZREVRANGEBYLEX', self._timeline_key(user), high, low, 'LIMIT', 0, limit)
+
+        connections = []
+
+        for member in members:
+            created, other, connection_id = member.split(' ')
+            connections.append(Connection(connection_id, {user, other}, int(created) / 1000))
+
+        return connections
+
+    def count(self, user: str) -> int:
+
+        return self.client.execute('ZCARD', self._adjacency_key(user))
+
+    def connected(self, user: str, others: Iterable[str]) -> Set[str]:
+
+        others = list(others)
+
+        if not others:
+            return set()
+
+        scores = self.client.execute('ZMSCORE', self._adjacency_key(user), *others)
+
+        return {other for other, score in zip(others, scores) if score is not None}
+
+    @staticmethod
+    def _new(users: Set[str], created: float = None) -> Connection:
+
+        connection_id = ids.new_id()
+
+        return Connection(connection_id, set(users),
+                          created if created is not None else ids.timestamp_of(connection_id))
+
+    def create(self, users: Set[str], created: float = None) -> Connection:
+
+        connections = self._create_many([self._new(users, created)])
+
+        if connections:
+            return connections[0]
+
+        message = "connection already exists: {}".format(users)
+        logger.error(message)
+        raise DataIntegrityException(message)
+
+    def create_many(self, pairs: Iterable[Set[str]]) -> List[Connection]:
+        """ creates several connections, in one optimistic transaction. The pairs already connected are skipped.
+
+        Args:
+            pairs: the users to connect, two by two
+
+        Returns:
+            the connections created
+
+        """
+
+        return self._create_many([self._new(users) for users in pairs])
+
+    def delete(self, users: Set[str]) -> None:
+
+        user1, user2 = self._pair(users)
+
+        field = '{} {}'.format(user1, user2)
+
+        def build(connection: RespConnection):
+            value = connection.execute('HGET', self._PAIRS, field)
+            if value is None:
+                message = "connection not found: {}".format(users)
+                logger.error(message)
+                raise KeyError(message)
+            connection_id, millis = value.split(' ')
+            return [('HDEL', self._PAIRS, field),
+                    ('HDEL', self._USERS, connection_id),
+                    ('ZREM', self._adjacency_key(user1), user2),
+                    ('ZREM', self._adjacency_key(user2), user1),
+                    ('ZREM', self._timeline_key(user1), '{} {} {}'.format(millis, user2, connection_id)),
+                    ('ZREM', self._timeline_key(user2), '{} {} {}'.format(millis, user1, connection_id))]
+
+        # the connection read is the one removed: a concurrent delete and re-create of the pair retries
+        self.client.watch([self._PAIRS], build)
+
+
+@instrumented('recommendations')
+class RedisRecommendationsRepository(RecommendationsRepository):
+
+    shared = True
+
+    def __init__(self, client: RespClient, json_file: str = None, batch_size: int = 1000):
+        """
+        Args:
+            client: the client of the Redis server
+            json_file: a snapshot to load into the server (loading is idempotent: the recommendations are written with
+                their ids). None to use the data already there
+            batch_size: the number of recommendations written per round trip when loading
+
+        """
+
+        super().__init__()
+
+        self.client = client
+
+        if json_file is not None:
+            for batch in _batches(json.load(open(json_file)).get('recommendations', []), batch_size):
+                commands = []
+                for user_dict in batch:
+                    commands.extend(self._write_commands(self._object_mapper(user_dict)))
+                self.client.transaction(commands)
+
+    @staticmethod
+    def _object_mapper(user_dict: dict) -> Recommendation:
+
+        try:
+            return Recommendation(recommendation_id=user_dict['id'],
+                                  user=user_dict['user_id'],
+                                  recommended_user=user_dict['recommended_user_id'],
+                                  score=float(user_dict.get('score', 0.0)))
+        except KeyError as e:
+            message = "malformed data in json file"
+            logger.error(message)
+            raise DataIntegrityException(message, e)
+
+    @staticmethod
+    def _key(recommendation_id: str) -> str:
+
+        return 'recommendation:' + recommendation_id
+
+    @staticmethod
+    def _ranked_key(user: str) -> str:
+
+        return 'recommendations:' + user
+
+    @staticmethod
+    def _ids_key(user: str) -> str:
+
+        return 'recommendations:ids:' + user
+
+    def _write_commands(self, recommendation: Recommendation) -> List[Tuple]:
+
+        user, recommended_user = recommendation.user, recommendation.recommended_user
+
+        # sorted sets are ascending: the negated score ranks the best first, ties by recommended user
+        return [('HSET', self._key(recommendation.id), 'user', user, 'recommended_user', recommended_user),
+                ('HSET', self._ids_key(user), recommended_user, recommendation.id),
+                ('ZADD', self._ranked_key(user), -recommendation.score, recommended_user)]
+
+    def get(self, user: str, offset: int, limit: int) -> Iterable[Recommendation]:
+
+        if limit <= 0:
+            return []
+
+        ranked = self.client.execute('ZRANGE', self._ranked_key(user), offset, offset + limit - 1, 'WITHSCORES')
+
+        if not ranked:
+            return []
+
+        recommended_users, scores = ranked[::2], ranked[1::2]
+
+        recommendation_ids = self.client.execute('HMGET', self._ids_key(user), *recommended_users)
+
+        # 0.0 rather than -0.0
+        return [Recommendation(recommendation_id, user, recommended_user, -float(score) or 0.0)
+                for recommendation_id, recommended_user, score in zip(recommendation_ids, recommended_users, scores)
+                if recommendation_id is not None]
+
+    def count(self, user: str) -> int:
+
+        return self.client.execute('ZCARD', self._ranked_key(user))
+
+    def save(self, user: str, recommended_user: str, score: float = 0.0) -> Recommendation:
+
+        saved = []
+
+        def build(connection: RespConnection):
+            existing_id = connection.execute('HGET', self._ids_key(user), recommended_user)
+            saved[:] = [Recommendation(recommendation_id=existing_id or ids.new_id(), user=user,
+                                       recommended_user=recommended_user, score=score)]
+            return self._write_commands(saved[0])
+
+        # two saves of the same pair must not both allocate an id
+        self.client.watch([self._ids_key(user)], build)
+
+        return saved[0]
+
+    def replace_all(self, user: str, scores: Dict[str, float]) -> List[Recommendation]:
+        """ replaces all the recommendations of a user, atomically and in one round trip (after reading the current
+        ones). The recommended users kept keep their recommendation ids.
+
+        Args:
+            user: the user
+            scores: the recommended users, mapped to their scores
+
+        Returns:
+            the recommendations saved
+
+        """
+
+        saved = []
+
+        def build(connection: RespConnection):
+            existing_ids = _hash(connection.execute('HGETALL', self._ids_key(user)))
+            saved[:] = [Recommendation(recommendation_id=existing_ids.get(recommended_user) or ids.new_id(),
+                                       user=user, recommended_user=recommended_user, score=score)
+                        for recommended_user, score in scores.items()]
+            commands = [('DEL', self._ranked_key(user), self._ids_key(user),
+                         *[self._key(recommendation_id) for recommended_user, recommendation_id in existing_ids.items()
+                           if recommended_user not in scores])]
+            for recommendation in saved:
+                commands.extend(self._write_commands(recommendation))
+            return commands
+
+        self.client.watch([self._ids_key(user)], build)
+
+        return saved
+
+    def delete(self, recommendation_id: str) -> None:
+
+        key = self._key(recommendation_id)
+
+        def build(connection: RespConnection):
+            user, recommended_user = connection.execute('HMGET', key, 'user', 'recommended_user')
+            if user is None:
+                message = "recommendation not found: {}".format(recommendation_id)
+                logger.error(message)
+                raise KeyError(message)
+            return [('DEL', key),
+                    ('HDEL', self._ids_key(user), recommended_user),
+                    ('ZREM', self._ranked_key(user), recommended_user)]
+
+        self.client.watch([key], build)
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+
+""" A minimal client for the Redis protocol (RESP2).
+
+Just enough for the Redis repositories: single commands, pipelines (many commands sent in one write, their replies
+read back in order: one round trip), MULTI/EXEC transactions and optimistic WATCH transactions. It talks to any server
+speaking the protocol: Redis itself, or the in-process fake used by the tests {@see server.ORM.fake_redis}.
+
+Bulk replies are decoded as utf-8 strings.
+
+"""
+
+import logging
+import os
+import socket
+import threading
+import weakref
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence
+from urllib.parse import urlparse
+
+from server import metrics
+
+logger = logging.getLogger(__name__)
+
+resp_round_trips_total = metrics.REGISTRY.counter(
+    'resp_round_trips_total', 'Round trips to the Redis server (a pipeline is one round trip).')
+
+resp_commands_total = metrics.REGISTRY.counter(
+    'resp_commands_total', 'Commands sent to the Redis server.')
+
+resp_transaction_retries_total = metrics.REGISTRY.counter(
+    'resp_transaction_retries_total', 'Optimistic transactions retried because a watched key changed.')
+
+
+# the clients created, to drop their pooled connections in forked children
+_clients = weakref.WeakSet()
+
+
+class RespError(Exception):
+    """ Thrown when the server replies with an error. """
+
+
+def encode_command(args: Sequence) -> bytes:
+    """ encodes a command as a RESP array of bulk strings. """
+
+    parts = [b'*%d\r\n' % len(args)]
+
+    for arg in args:
+        if isinstance(arg, bytes):
+            data = arg
+        elif isinstance(arg, float):
+            data = repr(arg).encode()
+        else:
+            data = str(arg).encode('utf-8')
+        parts.append(b'$%d\r\n%s\r\n' % (len(data), data))
+
+    return b''.join(parts)
+
+
+def read_reply(rfile):
+    """ reads one reply. An error reply is returned as a RespError, not raised: the replies after it must be read. """
+
+    line = rfile.readline()
+
+    if not line.endswith(b'\r\n'):
+        raise ConnectionError('connection closed by the server')
+
+    kind, payload = line[:1], line[1:-2]
+
+    if kind == b'+':
+        return payload.decode('utf-8')
+    if kind == b'-':
+        return RespError(payload.decode('utf-8'))
+    if kind == b':':
+        return int(payload)
+    if kind == b'$':
+        length = int(payload)
+        if length == -1:
+            return None
+        data = rfile.read(length + 2)
+        if len(data) != length + 2:
+            raise ConnectionError('connection closed by the server')
+        return data[:-2].decode('utf-8')
+    if kind == b'*':
+        length = int(payload)
+        if length == -1:
+            return None
+        return [read_reply(rfile) for _ in range(length)]
+
+    raise ConnectionError('malformed reply: {!r}'.format(line))
+
+
+def _raise_errors(replies: List) -> List:
+
+    for reply in replies:
+        if isinstance(reply, RespError):
+            raise reply
+
+    return replies
+
+
+class RespConnection(object):
+    """ a connection to the server. Not thread-safe: a connection serves one caller at a time. """
+
+    def __init__(self, host: str, port: int, db: int = 0, timeout: float = None):
+
+        self._socket = socket.create_connection((host, port), timeout=timeout)
+
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        self._rfile = self._socket.makefile('rb')
+
+        if db:
+            self.execute('SELECT', db)
+
+    def _round_trip(self, commands: Sequence[Sequence]) -> List:
+
+        self._socket.sendall(b''.join(encode_command(command) for command in commands))
+
+        resp_round_trips_total.inc()
+        resp_commands_total.inc(amount=len(commands))
+
+        return [read_reply(self._rfile) for _ in commands]
+
+    def execute(self, *args):
+        """ sends a command and returns its reply. A RespError is thrown for an error reply. """
+
+        return _raise_errors(self._round_trip([args]))[0]
+
+    def pipeline(self, commands: Sequence[Sequence]) -> List:
+        """ sends several commands in one round trip and returns their replies, in order.
+
+        The commands are not atomic: other clients' commands may run in between. A RespError is thrown for the first
+        error reply, once all the replies are read.
+
+        """
+
+        if not commands:
+            return []
+
+        return _raise_errors(self._round_trip(commands))
+
+    def transaction(self, commands: Sequence[Sequence]) -> Optional[List]:
+        """ runs several commands atomically (MULTI/EXEC), in one round trip.
+
+        Returns:
+            their replies, or None if the transaction was aborted because a WATCHed key changed
+
+        """
+
+        replies = _raise_errors(self._round_trip([('MULTI',)] + list(commands) + [('EXEC',)]))
+
+        return _raise_errors(replies[-1]) if replies[-1] is not None else None
+
+    def close(self) -> None:
+
+        try:
+            self._rfile.close()
+            self._socket.close()
+        except OSError:
+            pass
+
+
+class RespClient(object):
+    """ a thread-safe client, keeping a pool of connections to the server. """
+
+    def __init__(self, host: str = 'localhost', port: int = 6379, db: int = 0, timeout: float = 5.0,
+                 max_idle_connections: int = 32):
+
+        self.host = host
+
+        self.port = port
+
+        self.db = db
+
+        self.timeout = timeout
+
+        self.max_idle_connections = max_idle_connections
+
+        self._lock = threading.Lock()
+
+        self._idle = []  # type: List[RespConnection]
+
+        _clients.add(self)
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs) -> 'RespClient':
+        """ a client for a redis://host:port/db url. """
+
+        parsed = urlparse(url)
+
+        if parsed.scheme != 'redis':
+            raise ValueError('not a redis:// url: {}'.format(url))
+
+        return cls(host=parsed.hostname or 'localhost', port=parsed.port or 6379,
+                   db=int(parsed.path.lstrip('/') or 0), **kwargs)
+
+    @contextmanager
+    def connection(self) -> Iterator[RespConnection]:
+        """ borrows a connection from the pool. A connection that failed (in any way) is closed, not given back. """
+
+        with self._lock:
+            connection = self._idle.pop() if self._idle else None
+
+        if connection is None:
+            connection = RespConnection(self.host, self.port, self.db, self.timeout)
+
+        try:
+            yield connection
+        except BaseException:
+            # a reply may be left unread, or a WATCH left set
+            connection.close()
+            raise
+
+        with self._lock:
+            if len(self._idle) < self.max_idle_connections:
+                self._idle.append(connection)
+                return
+
+        connection.close()
+
+    def execute(self, *args):
+        """ {@see RespConnection.execute} """
+
+        with self.connection() as connection:
+            return connection.execute(*args)
+
+    def pipeline(self, commands: Sequence[Sequence]) -> List:
+        """ {@see RespConnection.pipeline} """
+
+        with self.connection() as connection:
+            return connection.pipeline(commands)
+
+    def transaction(self, commands: Sequence[Sequence]) -> List:
+        """ {@see RespConnection.transaction} """
+
+        with self.connection() as connection:
+            return connection.transaction(commands)
+
+    def watch(self, keys: Iterable[str], build: Callable[[RespConnection], Optional[Sequence[Sequence]]]):
+        """ runs an optimistic (check-and-set) transaction.
+
+        The keys are WATCHed, then build reads what it needs through the connection it is given and returns the
+        commands to run atomically. If one of the keys changed in the meantime the transaction is aborted by the
+        server, and the whole of it (build included) is retried.
+
+        Args:
+            keys: the keys build reads
+            build: reads the current state and returns the commands to run, or None to write nothing. May throw to
+                abort the transaction
+
+        Returns:
+            the replies of the commands, None if build returned None
+
+        """
+
+        keys = list(keys)
+
+        while True:
+            with self.connection() as connection:
+                connection.execute('WATCH', *keys)
+                commands = build(connection)
+                if commands is None:
+                    connection.execute('UNWATCH')
+                    return None
+                replies = connection.transaction(commands)
+            if replies is not None:
+                return replies
+            resp_transaction_retries_total.inc()
+            logger.debug('a watched key changed, retrying the transaction on %s', keys)
+
+    def _reset_after_fork(self) -> None:
+
+        # the pooled connections are shared with the parent process: two processes talking over one socket would get
+        # each other's replies. Closing the child's copies leaves the parent's open
+        idle, self._idle = self._idle, []
+
+        self._lock = threading.Lock()
+
+        for connection in idle:
+            connection.close()
+
+    def close(self) -> None:
+        """ closes the idle connections. """
+
+        with self._lock:
+            idle, self._idle = self._idle, []
+
+        for connection in idle:
+            connection.close()
+
+
+def _reset_clients_after_fork() -> None:
+
+    for client in list(_clients):
+        client._reset_after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_clients_after_fork)
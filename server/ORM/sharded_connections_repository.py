@@ -0,0 +1,577 @@
+# -*- coding: utf-8 -*-
+
+""" A connections repository partitioned across local shard processes.
+
+Users are mapped to shards with a consistent hash ring. Every edge is stored on the shards of both of its endpoints,
+so the connections of a user (and point queries about them) are answered by a single shard. Operations spanning
+several users, like the mutual connections of two users, are scattered to the shards involved and gathered back.
+
+Adding or removing a shard only moves the users whose owner changes on the ring (~1/N of them), while the rest of the
+graph stays in place.
+
+"""
+
+import atexit
+import hashlib
+import json
+import logging
+import multiprocessing
+import threading
+from bisect import bisect, bisect_left, insort
+from contextlib import ExitStack
+from itertools import islice
+from typing import Set, Iterable, List, Dict, Tuple
+
+from server import ids
+from server.exceptions import DataIntegrityException
+from server.ORM.instrumentation import instrumented
+from server.ORM.locks import ReadWriteLock, StripedLock
+from server.models import Connection, ConnectionsRepository
+
+logger = logging.getLogger(__name__)
+
+
+def _hash(key: str) -> int:
+    # stable across processes and runs, unlike hash()
+    return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+
+
+class ConsistentHashRing(object):
+    """ maps keys to nodes. Every node owns a number of virtual points on the ring to even out the load.
+
+    """
+
+    def __init__(self, nodes: Iterable[str], vnodes: int = 64):
+
+        self.nodes = list(nodes)
+
+        self.vnodes = vnodes
+
+        points = sorted((_hash('{}#{}'.format(node, i)), node) for node in self.nodes for i in range(vnodes))
+
+        self._keys = [point for point, _ in points]
+
+        self._nodes = [node for _, node in points]
+
+    def node(self, key: str) -> str:
+        """ gets the node owning a key. """
+
+        return self._nodes[bisect(self._keys, _hash(key)) % len(self._keys)]
+
+
+# --- shard process -----------------------------------------------------------------------------------------------
+
+
+class _ShardData(object):
+    """ what a shard holds about the users it owns. """
+
+    def __init__(self):
+
+        # user -> {connected user: (connection id, creation time)}
+        self.adjacency = {}
+
+        # user -> [(creation time, connected user)], sorted: the recent connections are a slice read backwards
+        self.timelines = {}
+
+    def add(self, user: str, other: str, connection_id: str, created: float) -> None:
+
+        neighbours = self.adjacency.setdefault(user, {})
+
+        if other in neighbours:
+            self.remove(user, other)
+            neighbours = self.adjacency.setdefault(user, {})
+
+        neighbours[other] = (connection_id, created)
+
+        insort(self.timelines.setdefault(user, []), (created, other))
+
+    def remove(self, user: str, other: str) -> bool:
+
+        neighbours = self.adjacency.get(user)
+
+        if neighbours is None or other not in neighbours:
+            return False
+
+        _, created = neighbours.pop(other)
+        if not neighbours:
+            del self.adjacency[user]
+
+        timeline = self.timelines[user]
+        del timeline[bisect_left(timeline, (created, other))]
+        if not timeline:
+            del self.timelines[user]
+
+        return True
+
+
+def _shard_add(shard: _ShardData, edges: List[Tuple[str, str, str, float]]) -> None:
+
+    for user, other, connection_id, created in edges:
+        shard.add(user, other, connection_id, created)
+
+
+def _shard_remove(shard: _ShardData, edges: List[Tuple[str, str]]) -> int:
+
+    return sum(shard.remove(user, other) for user, other in edges)
+
+
+def _shard_get(shard: _ShardData, user: str, other: str) -> Tuple[str, float]:
+
+    return shard.adjacency.get(user, {}).get(other)
+
+
+def _shard_page(shard: _ShardData, user: str, offset: int, limit: int) -> List[Tuple[str, str, float]]:
+
+    neighbours = shard.adjacency.get(user, {})
+
+    return [(connection_id, other, created)
+            for other, (connection_id, created) in islice(neighbours.items(), offset, offset + limit)]
+
+
+def _shard_recent(shard: _ShardData, user: str, cursor: Tuple[float, str], since: float,
+                  limit: int) -> List[Tuple[str, str, float]]:
+
+    timeline = shard.timelines.get(user, [])
+
+    end = bisect_left(timeline, tuple(cursor)) if cursor is not None else len(timeline)
+
+    start = max(end - limit, bisect_left(timeline, (since,)) if since is not None else 0)
+
+    neighbours = shard.adjacency[user] if timeline else {}
+
+    return [(neighbours[other][0], other, created) for created, other in reversed(timeline[start:end])]
+
+
+def _shard_degree(shard: _ShardData, user: str) -> int:
+
+    return len(shard.adjacency.get(user, {}))
+
+
+def _shard_neighbours(shard: _ShardData, user: str) -> List[str]:
+
+    return list(shard.adjacency.get(user, {}))
+
+
+def _shard_connected(shard: _ShardData, user: str, others: List[str]) -> List[str]:
+
+    neighbours = shard.adjacency.get(user, {})
+
+    return [other for other in others if other in neighbours]
+
+
+def _shard_find_id(shard: _ShardData, connection_id: str) -> Tuple[str, str, float]:
+
+    for user, neighbours in shard.adjacency.items():
+        for other, (existing_id, created) in neighbours.items():
+            if existing_id == connection_id:
+                return user, other, created
+
+
+def _shard_extract(shard: _ShardData, nodes: List[str], vnodes: int, name: str) -> Dict:
+    """ removes and returns the users this shard no longer owns under a new ring. """
+
+    ring = ConsistentHashRing(nodes, vnodes)
+
+    moved = {user: shard.adjacency[user] for user in list(shard.adjacency) if ring.node(user) != name}
+
+    for user in moved:
+        del shard.adjacency[user]
+        del shard.timelines[user]
+
+    return moved
+
+
+def _shard_load(shard: _ShardData, entries: Dict) -> None:
+
+    for user, neighbours in entries.items():
+        for other, (connection_id, created) in neighbours.items():
+            shard.add(user, other, connection_id, created)
+
+
+def _shard_stats(shard: _ShardData) -> Dict:
+
+    return {'users': len(shard.adjacency), 'edges': sum(len(neighbours) for neighbours in shard.adjacency.values())}
+
+
+_SHARD_OPERATIONS = {
+    'add': _shard_add,
+    'remove': _shard_remove,
+    'get': _shard_get,
+    'page': _shard_page,
+    'recent': _shard_recent,
+    'degree': _shard_degree,
+    'neighbours': _shard_neighbours,
+    'connected': _shard_connected,
+    'find_id': _shard_find_id,
+    'extract': _shard_extract,
+    'load': _shard_load,
+    'stats': _shard_stats,
+}
+
+
+def _shard_main(conn) -> None:
+    """ the loop of a shard process: answers (operation, args) requests until told to stop. """
+
+    shard = _ShardData()
+
+    while True:
+        operation, args = conn.recv()
+        if operation == 'stop':
+            conn.send((True, None))
+            return
+        try:
+            conn.send((True, _SHARD_OPERATIONS[operation](shard, *args)))
+        except Exception as e:
+            conn.send((False, repr(e)))
+
+
+class _Shard(object):
+    """ the handle the parent process keeps on a shard process. """
+
+    def __init__(self, name: str, context):
+
+        self.name = name
+
+        self.conn, child_conn = context.Pipe()
+
+        self.process = context.Process(target=_shard_main, args=(child_conn,), name=name, daemon=True)
+
+        self.process.start()
+
+        child_conn.close()
+
+        # a pipe carries one request/response at a time
+        self.lock = threading.Lock()
+
+    def send(self, operation: str, *args) -> None:
+
+        self.conn.send((operation, args))
+
+    def receive(self):
+
+        ok, result = self.conn.recv()
+
+        if not ok:
+            raise RuntimeError('shard {} failed: {}'.format(self.name, result))
+
+        return result
+
+    def call(self, operation: str, *args):
+
+        with self.lock:
+            self.send(operation, *args)
+            return self.receive()
+
+    def stop(self) -> None:
+
+        with self.lock:
+            self.send('stop')
+            self.receive()
+
+        self.process.join()
+
+
+@instrumented('connections')
+class ShardedConnectionsRepository(ConnectionsRepository):
+
+    def __init__(self, json_file: str = None, shards: int = 4, vnodes: int = 64, lock_stripes: int = 64):
+
+        super().__init__()
+
+        self._context = multiprocessing.get_context()
+
+        self._vnodes = vnodes
+
+        # regular operations hold the topology in shared mode, resharding holds it in exclusive mode
+        self._topology = ReadWriteLock()
+
+        # serializes the check-then-act of create/delete per pair of users
+        self._pair_locks = StripedLock(lock_stripes)
+
+        self._shards = {}
+
+        self._next_shard = 0
+
+        for _ in range(shards):
+            self._start_shard()
+
+        self._ring = ConsistentHashRing(self._shards, vnodes)
+
+        if json_file is not None:
+            edges = [self._object_mapper(connection_dict)
+                     for connection_dict in json.load(open(json_file)).get('connections', [])]
+            self._add_edges(edges)
+
+        atexit.register(self.close)
+
+    @staticmethod
+    def _object_mapper(connection_dict: dict) -> Tuple[str, str, str, float]:
+
+        try:
+            return connection_dict['id'], connection_dict['users'][0], connection_dict['users'][1], \
+                float(connection_dict.get('created', 0.0))
+        except (KeyError, IndexError) as e:
+            message = "malformed data in json file"
+            logger.error(message)
+            raise DataIntegrityException(message, e)
+
+    def _start_shard(self) -> _Shard:
+
+        name = 'connections-shard-{}'.format(self._next_shard)
+
+        self._next_shard += 1
+
+        self._shards[name] = _Shard(name, self._context)
+
+        return self._shards[name]
+
+    def _shard_of(self, user: str) -> _Shard:
+
+        return self._shards[self._ring.node(user)]
+
+    def _scatter(self, requests: List[Tuple[_Shard, str, tuple]]) -> List:
+        """ sends requests to several shards at once, and gathers the results in order.
+
+        The shard locks are taken in a global order, so that concurrent scatters can't deadlock.
+
+        """
+
+        shards = sorted({shard.name: shard for shard, _, _ in requests}.values(), key=lambda shard: shard.name)
+
+        for shard in shards:
+            shard.lock.acquire()
+
+        try:
+            pending = {}
+            for index, (shard, operation, args) in enumerate(requests):
+                pending.setdefault(shard.name, []).append(index)
+            results = [None] * len(requests)
+            # one request in flight per pipe: send the first request of every shard, then alternate
+            for round_index in range(max(len(indices) for indices in pending.values())):
+                sent = []
+                for name, indices in pending.items():
+                    if round_index < len(indices):
+                        shard, operation, args = requests[indices[round_index]]
+                        shard.send(operation, *args)
+                        sent.append((shard, indices[round_index]))
+                for shard, index in sent:
+                    results[index] = shard.receive()
+            return results
+        finally:
+            for shard in shards:
+                shard.lock.release()
+
+    def _add_edges(self, edges: List[Tuple[str, str, str, float]]) -> None:
+
+        per_shard = {}
+
+        for connection_id, user1, user2, created in edges:
+            per_shard.setdefault(self._ring.node(user1), []).append((user1, user2, connection_id, created))
+            per_shard.setdefault(self._ring.node(user2), []).append((user2, user1, connection_id, created))
+
+        self._scatter([(self._shards[name], 'add', (shard_edges,)) for name, shard_edges in per_shard.items()])
+
+    def get_by_id(self, connection_id) -> Connection:
+
+        with self._topology.read():
+            results = self._scatter([(shard, 'find_id', (connection_id,)) for shard in self._shards.values()])
+
+        for result in results:
+            if result is not None:
+                user, other, created = result
+                return Connection(connection_id, {user, other}, created)
+
+        message = "connection not found: {}".format(connection_id)
+
+        logger.error(message)
+
+        raise KeyError(message)
+
+    def get(self, users: Set[str]) -> Connection:
+
+        user1, user2 = min(users), max(users)
+
+        with self._topology.read():
+            found = self._shard_of(user1).call('get', user1, user2)
+
+        if found is not None:
+            connection_id, created = found
+            return Connection(connection_id, {user1, user2}, created)
+
+        logger.debug('connection not found: %s', users)
+
+    def get_all(self, user: str, offset: int, limit: int) -> Iterable[Connection]:
+
+        with self._topology.read():
+            page = self._shard_of(user).call('page', user, offset, limit)
+
+        return [Connection(connection_id, {user, other}, created) for connection_id, other, created in page]
+
+    def get_recent(self, user: str, cursor: Tuple[float, str] = None, since: float = None,
+                   limit: int = 50) -> List[Connection]:
+
+        with self._topology.read():
+            page = self._shard_of(user).call('recent', user, cursor, since, limit)
+
+        return [Connection(connection_id, {user, other}, created) for connection_id, other, created in page]
+
+    def count(self, user: str) -> int:
+
+        with self._topology.read():
+            return self._shard_of(user).call('degree', user)
+
+    def connected(self, user: str, others: Iterable[str]) -> Set[str]:
+
+        with self._topology.read():
+            return set(self._shard_of(user).call('connected', user, list(others)))
+
+    def create(self, users: Set[str], created: float = None) -> Connection:
+
+        user1, user2 = min(users), max(users)
+
+        with self._pair_locks(frozenset(users)), self._topology.read():
+            if self._shard_of(user1).call('get', user1, user2) is None:
+                connection_id = ids.new_id()
+                connection = Connection(connection_id, {user1, user2},
+                                        created if created is not None else ids.timestamp_of(connection_id))
+                self._add_edges([(connection.id, user1, user2, connection.created)])
+                return connection
+
+        message = "connection already exists: {}".format(users)
+        logger.error(message)
+        raise DataIntegrityException(message)
+
+    def create_many(self, pairs: Iterable[Set[str]]) -> List[Connection]:
+
+        # ordered and deduplicated
+        pairs = list(dict.fromkeys((min(users), max(users)) for users in pairs))
+
+        # taken in a global order, so that concurrent batches can't deadlock
+        locks = sorted({id(lock): lock for lock in (self._pair_locks(frozenset(pair)) for pair in pairs)}.values(),
+                       key=id)
+
+        connections = []
+
+        with ExitStack() as stack:
+            for lock in locks:
+                stack.enter_context(lock)
+            with self._topology.read():
+                # one request per pair, sent to all the shards at once
+                found = self._scatter([(self._shard_of(user1), 'get', (user1, user2))
+                                       for user1, user2 in pairs]) if pairs else []
+                for (user1, user2), existing in zip(pairs, found):
+                    if existing is None:
+                        connection_id = ids.new_id()
+                        connections.append(Connection(connection_id, {user1, user2}, ids.timestamp_of(connection_id)))
+                if connections:
+                    self._add_edges([(connection.id, min(connection.users), max(connection.users), connection.created)
+                                     for connection in connections])
+
+        return connections
+
+    def delete(self, users: Set[str]) -> None:
+
+        user1, user2 = min(users), max(users)
+
+        with self._pair_locks(frozenset(users)), self._topology.read():
+            removed = self._scatter([(self._shard_of(user1), 'remove', ([(user1, user2)],)),
+                                     (self._shard_of(user2), 'remove', ([(user2, user1)],))])
+
+        if sum(removed) == 0:
+            message = "connection not found: {}".format(users)
+            logger.error(message)
+            raise KeyError(message)
+
+    def mutual_connections(self, user1: str, user2: str) -> Set[str]:
+        """ gets the users connected to both users.
+
+        The adjacencies of both users are fetched from their shards in parallel, then intersected.
+
+        Args:
+            user1: the first user
+            user2: the second user
+
+        Returns:
+            the ids of the users connected to both
+
+        """
+
+        with self._topology.read():
+            neighbours1, neighbours2 = self._scatter([(self._shard_of(user1), 'neighbours', (user1,)),
+                                                      (self._shard_of(user2), 'neighbours', (user2,))])
+
+        return set(neighbours1).intersection(neighbours2)
+
+    def _redistribute(self, entries: Dict) -> None:
+
+        per_shard = {}
+
+        for user, neighbours in entries.items():
+            per_shard.setdefault(self._ring.node(user), {})[user] = neighbours
+
+        if per_shard:
+            self._scatter([(self._shards[name], 'load', (shard_entries,)) for name, shard_entries in per_shard.items()])
+
+    def add_shard(self) -> str:
+        """ starts a new shard and moves to it the users it now owns on the ring.
+
+        Returns:
+            the name of the new shard
+
+        """
+
+        with self._topology.write():
+            shard = self._start_shard()
+            nodes = list(self._shards)
+            moved = {}
+            for result in self._scatter([(existing, 'extract', (nodes, self._vnodes, existing.name))
+                                         for existing in self._shards.values() if existing is not shard]):
+                moved.update(result)
+            self._ring = ConsistentHashRing(nodes, self._vnodes)
+            self._redistribute(moved)
+
+        logger.info('added shard %s, %s users moved', shard.name, len(moved))
+
+        return shard.name
+
+    def remove_shard(self, name: str) -> None:
+        """ moves the users of a shard to the remaining shards, and stops it.
+
+        Args:
+            name: the name of the shard
+
+        Returns:
+            None
+
+        """
+
+        with self._topology.write():
+            if len(self._shards) == 1:
+                raise ValueError('cannot remove the last shard')
+            shard = self._shards[name]
+            nodes = [node for node in self._shards if node != name]
+            moved = shard.call('extract', nodes, self._vnodes, name)
+            del self._shards[name]
+            self._ring = ConsistentHashRing(nodes, self._vnodes)
+            self._redistribute(moved)
+            shard.stop()
+
+        logger.info('removed shard %s, %s users moved', name, len(moved))
+
+    def stats(self) -> Dict[str, Dict]:
+        """ gets the number of users and (directed) edges held by every shard. """
+
+        with self._topology.read():
+            names = list(self._shards)
+            results = self._scatter([(self._shards[name], 'stats', ()) for name in names])
+
+        return dict(zip(names, results))
+
+    def close(self) -> None:
+        """ stops all the shard processes. """
+
+        with self._topology.write():
+            for shard in self._shards.values():
+                if shard.process.is_alive():
+                    shard.stop()
+            self._shards = {}
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import functools
+import logging
+from concurrent.futures import Executor
+from typing import Dict, Set, Iterable, List, Tuple
+
+from server.models import User, Profile, Connection, Recommendation, UsersRepository, ConnectionsRepository, \
+    RecommendationsRepository, AsyncUsersRepository, AsyncConnectionsRepository, AsyncRecommendationsRepository
+
+logger = logging.getLogger(__name__)
+
+
+class _ThreadPoolAdapter(object):
+    """ runs the calls of a blocking repository in a thread pool, so that they can be awaited.
+
+    """
+
+    def __init__(self, repository, executor: Executor):
+
+        self.repository = repository
+
+        self.executor = executor
+
+    async def _run(self, func, *args, **kwargs):
+
+        loop = asyncio.get_running_loop()
+
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+
+class ThreadPoolUsersRepository(_ThreadPoolAdapter, AsyncUsersRepository):
+    """ exposes a (sync) UsersRepository through the AsyncUsersRepository contract.
+
+    """
+
+    def __init__(self, repository: UsersRepository, executor: Executor):
+
+        super().__init__(repository, executor)
+
+    async def get(self, user_id: str) -> User:
+
+        return await self._run(self.repository.get, user_id)
+
+    async def get_many(self, user_ids: List[str]) -> Dict[str, User]:
+
+        return await self._run(self.repository.get_many, user_ids)
+
+    async def get_by_college(self, college: str, cursor: str = None, limit: int = 50) -> List[User]:
+
+        return await self._run(self.repository.get_by_college, college, cursor, limit)
+
+    async def create(self, email: str, profile: Profile) -> User:
+
+        return await self._run(self.repository.create, email, profile)
+
+    async def update(self, user_id: str, profile: Profile) -> User:
+
+        return await self._run(self.repository.update, user_id, profile)
+
+    async def delete(self, user_id: str) -> None:
+
+        return await self._run(self.repository.delete, user_id)
+
+
+class ThreadPoolConnectionsRepository(_ThreadPoolAdapter, AsyncConnectionsRepository):
+    """ exposes a (sync) ConnectionsRepository through the AsyncConnectionsRepository contract.
+
+    """
+
+    def __init__(self, repository: ConnectionsRepository, executor: Executor):
+
+        super().__init__(repository, executor)
+
+    async def get_by_id(self, connection_id) -> Connection:
+
+        return await self._run(self.repository.get_by_id, connection_id)
+
+    async def get(self, users: Set[str]) -> Connection:
+
+        return await self._run(self.repository.get, users)
+
+    async def get_all(self, user: str, offset: int, limit: int) -> Iterable[Connection]:
+
+        # materialize the iterable inside the pool, lazy repositories would otherwise do their I/O on the event loop
+        return await self._run(lambda: list(self.repository.get_all(user, offset, limit)))
+
+    async def get_recent(self, user: str, cursor: Tuple[float, str] = None, since: float = None,
+                         limit: int = 50) -> List[Connection]:
+
+        return await self._run(self.repository.get_recent, user, cursor, since, limit)
+
+    async def count(self, user: str) -> int:
+
+        return await self._run(self.repository.count, user)
+
+    async def connected(self, user: str, others: Iterable[str]) -> Set[str]:
+
+        return await self._run(self.repository.connected, user, list(others))
+
+    async def create(self, users: Set[str], created: float = None) -> Connection:
+
+        return await self._run(self.repository.create, users, created)
+
+    async def create_many(self, pairs: Iterable[Set[str]]) -> List[Connection]:
+
+        return await self._run(self.repository.create_many, list(pairs))
+
+    async def delete(self, users: Set[str]) -> None:
+
+        return await self._run(self.repository.delete, users)
+
+
+class ThreadPoolRecommendationsRepository(_ThreadPoolAdapter, AsyncRecommendationsRepository):
+    """ exposes a (sync) RecommendationsRepository through the AsyncRecommendationsRepository contract.
+
+    """
+
+    def __init__(self, repository: RecommendationsRepository, executor: Executor):
+
+        super().__init__(repository, executor)
+
+    async def get(self, user: str, offset: int, limit: int) -> Iterable[Recommendation]:
+
+        return await self._run(lambda: list(self.repository.get(user, offset, limit)))
+
+    async def count(self, user: str) -> int:
+
+        return await self._run(self.repository.count, user)
+
+    async def save(self, user: str, recommended_user: str, score: float = 0.0) -> Recommendation:
+
+        return await self._run(self.repository.save, user, recommended_user, score)
+
+    async def replace_all(self, user: str, scores: Dict[str, float]) -> List[Recommendation]:
+
+        return await self._run(self.repository.replace_all, user, scores)
+
+    async def delete(self, recommendation_id: str) -> None:
+
+        return await self._run(self.repository.delete, recommendation_id)
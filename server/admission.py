@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+
+""" Admission control: keeps the latency SLA under overload by refusing work early rather than queueing it forever.
+
+Every request belongs to a route class (e.g. 'read', 'write', 'bulk'), and every class has a concurrency limit and a
+priority. A request that can't run right away waits in a priority queue: cheap reads go before writes, writes before
+bulk operations. When the wait a request can expect is longer than the queue budget, it is shed right away with a 503
+and a Retry-After header, instead of timing out after having consumed resources. Each caller is also held to a token
+bucket, answered with a 429 when it runs dry.
+
+The classes flagged as not shared (like long polls, which mostly sleep) only count against their own limit, not the
+shared capacity.
+
+"""
+
+import bisect
+import itertools
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from server import metrics
+from server.exceptions import AdmissionRejectedException
+
+logger = logging.getLogger(__name__)
+
+admission_admitted_total = metrics.REGISTRY.counter(
+    'admission_admitted_total', 'Requests admitted, by route class.', ('route_class',))
+
+admission_shed_total = metrics.REGISTRY.counter(
+    'admission_shed_total', 'Requests shed, by route class and reason (rate_limit, queue_full, queue_timeout).',
+    ('route_class', 'reason'))
+
+admission_queued = metrics.REGISTRY.gauge(
+    'admission_queued', 'Requests waiting for admission, by route class.', ('route_class',))
+
+admission_wait_seconds_total = metrics.REGISTRY.counter(
+    'admission_wait_seconds_total', 'Cumulative time spent waiting for admission, in seconds.', ('route_class',))
+
+
+class CallerRateLimiter(object):
+    """ one token bucket per caller: `rate` requests per second, in bursts of up to `burst`. Thread-safe.
+
+    Only the `max_callers` most recent callers are tracked, a forgotten caller starts again with a full bucket.
+
+    """
+
+    def __init__(self, rate: float, burst: int, max_callers: int = 100000):
+
+        self.rate = rate
+
+        self.burst = burst
+
+        self.max_callers = max_callers
+
+        # caller -> [tokens, last refill], least recent first
+        self._buckets = OrderedDict()
+
+        self._lock = threading.Lock()
+
+    def acquire(self, caller: str, tokens: int = 1) -> float:
+        """ takes tokens from the bucket of a caller: all of them, or none.
+
+        Args:
+            caller: the caller identity
+            tokens: the number of tokens to take, at most `burst`
+
+        Returns:
+            0 if the tokens were taken, otherwise the number of seconds until there are enough
+
+        """
+
+        now = time.monotonic()
+
+        with self._lock:
+            bucket = self._buckets.get(caller)
+            if bucket is None:
+                bucket = self._buckets[caller] = [self.burst, now]
+                if len(self._buckets) > self.max_callers:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(caller)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < tokens:
+                return (tokens - bucket[0]) / self.rate
+            bucket[0] -= tokens
+            return 0
+
+
+class RouteClass(object):
+    """ models the admission settings of a class of routes.
+
+    """
+
+    def __init__(self, name: str, priority: int, limit: int, shared: bool = True):
+
+        self.name = name
+
+        # lower goes first
+        self.priority = priority
+
+        self.limit = limit
+
+        # whether the requests of this class take a slot of the shared capacity
+        self.shared = shared
+
+        self.running = 0
+
+
+class _Waiter(object):
+
+    def __init__(self, route_class: RouteClass):
+
+        self.route_class = route_class
+
+        self.event = threading.Event()
+
+        self.admitted = False
+
+
+class AdmissionController(object):
+    """ admits, queues or sheds requests. Thread-safe.
+
+    Usage:
+
+        ticket = admission.admit('read', caller)   # raises AdmissionRejectedException
+        try:
+            ...serve the request...
+        finally:
+            admission.release(ticket)
+
+    """
+
+    def __init__(self, capacity: int, classes: Dict[str, RouteClass], queue_budget: float,
+                 callers: Optional[CallerRateLimiter] = None):
+        """
+        Args:
+            capacity: the number of requests of the shared classes served at once
+            classes: the route classes, by name
+            queue_budget: the longest a request may wait for admission, in seconds
+            callers: the per-caller rate limits, None for no limit
+
+        """
+
+        self.capacity = capacity
+
+        self.classes = classes
+
+        self.queue_budget = queue_budget
+
+        self.callers = callers
+
+        self._lock = threading.Lock()
+
+        self._running = 0
+
+        # (priority, arrival, waiter), in admission order
+        self._queue = []
+
+        self._arrivals = itertools.count()
+
+        # moving average of the time a request holds its slot, used to estimate the queue wait
+        self._service_time = 0.01
+
+    def _can_run(self, route_class: RouteClass) -> bool:
+
+        if route_class.running >= route_class.limit:
+            return False
+
+        return not route_class.shared or self._running < self.capacity
+
+    def _start(self, route_class: RouteClass) -> None:
+
+        route_class.running += 1
+
+        if route_class.shared:
+            self._running += 1
+
+    def _ahead(self, route_class: RouteClass) -> int:
+        """ the number of queued requests that a new request of a class would have to let go first. """
+
+        return sum(1 for priority, _, waiter in self._queue
+                   if waiter.route_class is route_class or
+                   (route_class.shared and waiter.route_class.shared and priority <= route_class.priority))
+
+    def _expected_wait(self, route_class: RouteClass) -> float:
+        """ the wait of a new request of a class: the requests queued ahead of it, served `slots` at a time. """
+
+        ahead = self._ahead(route_class)
+
+        slots = min(route_class.limit, self.capacity) if route_class.shared else route_class.limit
+
+        return (ahead + 1) * self._service_time / max(slots, 1)
+
+    def _shed(self, route_class: RouteClass, reason: str, retry_after: float, status: int = 503):
+
+        admission_shed_total.inc((route_class.name, reason))
+
+        logger.info('shed a %s request: %s', route_class.name, reason)
+
+        message = 'too many requests' if status == 429 else 'the server is overloaded'
+
+        raise AdmissionRejectedException(message + ', please retry later', max(1, math.ceil(retry_after)), status)
+
+    def admit(self, class_name: str, caller: str = None) -> tuple:
+        """ waits for a request to be admitted.
+
+        Args:
+            class_name: the route class of the request
+            caller: the caller identity, for the rate limits
+
+        Returns:
+            the ticket to release() once the request is served
+
+        Raises:
+            AdmissionRejectedException: if the request is shed
+
+        """
+
+        route_class = self.classes[class_name]
+
+        if self.callers is not None and caller is not None:
+            wait = self.callers.acquire(caller)
+            if wait:
+                self._shed(route_class, 'rate_limit', wait, status=429)
+
+        with self._lock:
+            # don't overtake the requests already waiting with the same or a higher priority
+            if self._can_run(route_class) and not self._ahead(route_class):
+                self._start(route_class)
+                admission_admitted_total.inc((route_class.name,))
+                return route_class, time.perf_counter()
+
+            expected_wait = self._expected_wait(route_class)
+            if expected_wait > self.queue_budget:
+                self._shed(route_class, 'queue_full', expected_wait)
+
+            waiter = _Waiter(route_class)
+            entry = (route_class.priority, next(self._arrivals), waiter)
+            bisect.insort(self._queue, entry)
+
+        admission_queued.inc((route_class.name,))
+        start = time.perf_counter()
+
+        waiter.event.wait(self.queue_budget)
+
+        admission_queued.dec((route_class.name,))
+        admission_wait_seconds_total.inc((route_class.name,), time.perf_counter() - start)
+
+        with self._lock:
+            if not waiter.admitted:
+                # timed out: a grant can't race us, grants are made under the lock
+                self._queue.remove(entry)
+                self._shed(route_class, 'queue_timeout', self._expected_wait(route_class))
+
+        admission_admitted_total.inc((route_class.name,))
+
+        return route_class, time.perf_counter()
+
+    def release(self, ticket: tuple) -> None:
+        """ frees the slot of a served request, and admits the next waiting ones that can run. """
+
+        route_class, start = ticket
+
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            route_class.running -= 1
+            if route_class.shared:
+                self._running -= 1
+                self._service_time += 0.1 * (elapsed - self._service_time)
+
+            position = 0
+            while position < len(self._queue):
+                waiter = self._queue[position][2]
+                if self._can_run(waiter.route_class):
+                    del self._queue[position]
+                    self._start(waiter.route_class)
+                    waiter.admitted = True
+                    waiter.event.set()
+                else:
+                    position += 1
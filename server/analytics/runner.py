@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+""" Offline graph analytics, for capacity planning.
+
+Loads the whole connection graph, either by streaming a data snapshot or through the ConnectionsRepository contract,
+and reports the degree distribution (with its p99), the connected components and the triangle count as JSON.
+
+Usage (from the server directory):
+
+    python -m server.analytics --snapshot ext/data.json
+    python -m server.analytics --snapshot ext/data.json --repository --output report.json
+
+"""
+
+import argparse
+import json
+import logging
+import time
+from typing import Dict, Iterable, List
+
+from server.analytics import graph as graphs
+from server.analytics.snapshot import iter_arrays
+from server.models import ConnectionsRepository
+
+logger = logging.getLogger(__name__)
+
+
+def load_snapshot(path: str, chunk_size: int = 1 << 20) -> graphs.Graph:
+    """ builds the graph from a snapshot, streamed: the snapshot is never loaded in memory as a whole.
+
+    Args:
+        path: the snapshot, in the ext/data.json layout
+        chunk_size: the number of characters read at once
+
+    Returns:
+        the graph. Users without connections are part of it
+
+    """
+
+    graph = graphs.Graph()
+
+    with open(path) as fp:
+        for key, item in iter_arrays(fp, ('users', 'connections'), chunk_size):
+            if key == 'users':
+                graph.node(item['id'])
+            else:
+                graph.add_edge(item['users'][0], item['users'][1])
+
+    return graph
+
+
+def load_repository(repository: ConnectionsRepository, user_ids: Iterable[str], page_size: int = 1000) -> graphs.Graph:
+    """ builds the graph through the ConnectionsRepository contract, one user at a time.
+
+    Every connection is listed by both its users: it is kept once, from the user with the smaller id.
+
+    Args:
+        repository: the connections
+        user_ids: every user id
+        page_size: the number of connections fetched per call
+
+    Returns:
+        the graph
+
+    """
+
+    graph = graphs.Graph()
+
+    for user_id in user_ids:
+        graph.node(user_id)
+        # a repository not honoring the offset would return everything on every call: pages are deduplicated
+        others = set()
+        offset = 0
+        while True:
+            page = list(repository.get_all(user_id, offset, page_size))
+            fresh = 0
+            for connection in page:
+                # a self-connection has no other user: not an edge, dropped like in Graph.add_edge
+                other = next(iter(connection.users - {user_id}), user_id)
+                if other in others:
+                    continue
+                others.add(other)
+                fresh += 1
+                if user_id < other:
+                    graph.add_edge(user_id, other)
+            if len(page) < page_size or not fresh:
+                break
+            offset += page_size
+
+    return graph
+
+
+def _snapshot_user_ids(path: str) -> Iterable[str]:
+
+    with open(path) as fp:
+        for _, item in iter_arrays(fp, ('users',)):
+            yield item['id']
+
+
+def run(snapshot: str, through_repository: bool = False) -> Dict:
+    """ loads the graph and computes the report.
+
+    Args:
+        snapshot: the data snapshot
+        through_repository: read the connections through the configured ConnectionsRepository (the snapshot then
+            only provides the user ids)
+
+    Returns:
+        the report, as a dict
+
+    """
+
+    start = time.perf_counter()
+
+    if through_repository:
+        # set up only when needed: the app (and its repositories) is not needed to read a snapshot
+        from server.app import config
+        graph = load_repository(config.connectionsRepository, _snapshot_user_ids(snapshot))
+        source = 'repository'
+    else:
+        graph = load_snapshot(snapshot)
+        source = 'snapshot'
+
+    loaded = time.perf_counter()
+
+    report = graphs.report(graph)
+
+    report['meta'] = {
+        'source': source,
+        'snapshot': snapshot,
+        'load_seconds': round(loaded - start, 3),
+        'compute_seconds': round(time.perf_counter() - loaded, 3)
+    }
+
+    return report
+
+
+def main(argv: List[str] = None) -> int:
+
+    parser = argparse.ArgumentParser(prog='python -m server.analytics', description='offline graph analytics')
+    parser.add_argument('--snapshot', default='ext/data.json', help='the data snapshot (ext/data.json layout)')
+    parser.add_argument('--repository', action='store_true',
+                        help='read the connections through the configured repository instead of the snapshot')
+    parser.add_argument('--output', help='write the report to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    output = json.dumps(run(args.snapshot, args.repository), indent=2, sort_keys=True)
+
+    if args.output:
+        with open(args.output, 'w') as fl:
+            fl.write(output)
+    else:
+        print(output)
+
+    return 0
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+""" Streaming reader for data snapshots (the ext/data.json layout).
+
+A snapshot is one json object of arrays: {"users": [...], "connections": [...], ...}. json.load would materialize all
+of it; this reader decodes the array items one at a time from a bounded buffer, so memory stays proportional to the
+largest item, not to the file.
+
+"""
+
+import json
+import re
+from typing import IO, Iterable, Iterator, Tuple
+
+_NON_WHITESPACE = re.compile(r'[^ \t\n\r]')
+
+
+class _Reader(object):
+
+    def __init__(self, fp: IO[str], chunk_size: int):
+
+        self.fp = fp
+
+        self.chunk_size = chunk_size
+
+        self.buffer = ''
+
+        self.pos = 0
+
+        self.eof = False
+
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+
+        if self.eof:
+            return False
+
+        chunk = self.fp.read(self.chunk_size)
+
+        if not chunk:
+            self.eof = True
+            return False
+
+        # drop what was consumed, so that the buffer doesn't grow with the file
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+
+        return True
+
+    def peek(self) -> str:
+        """ the next non-whitespace character, without consuming it. Empty at the end of the file. """
+
+        while True:
+            match = _NON_WHITESPACE.search(self.buffer, self.pos)
+            if match is not None:
+                self.pos = match.start()
+                return self.buffer[self.pos]
+            self.pos = len(self.buffer)
+            if not self._fill():
+                return ''
+
+    def expect(self, char: str) -> None:
+
+        if self.peek() != char:
+            raise ValueError('malformed snapshot: expected {!r} at {!r}'.format(char, self.buffer[self.pos:][:40]))
+
+        self.pos += 1
+
+    def decode(self):
+        """ decodes the next json value, reading more of the file until it is complete. """
+
+        self.peek()
+
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                if self._fill():
+                    continue
+                raise
+            if end == len(self.buffer) and self._fill():
+                # a number may go on in the next chunk
+                continue
+            self.pos = end
+            return value
+
+
+def iter_arrays(fp: IO[str], keys: Iterable[str], chunk_size: int = 1 << 20) -> Iterator[Tuple[str, object]]:
+    """ streams the items of some top-level arrays of a snapshot.
+
+    Args:
+        fp: the snapshot, opened in text mode
+        keys: the names of the arrays to read, the other values are skipped (an item at a time)
+        chunk_size: the number of characters read at once
+
+    Returns:
+        an iterator of (array name, item), in file order
+
+    """
+
+    keys = set(keys)
+
+    reader = _Reader(fp, chunk_size)
+
+    reader.expect('{')
+
+    if reader.peek() == '}':
+        return
+
+    while True:
+        key = reader.decode()
+        reader.expect(':')
+
+        if reader.peek() == '[':
+            reader.expect('[')
+            if reader.peek() == ']':
+                reader.expect(']')
+            else:
+                while True:
+                    item = reader.decode()
+                    if key in keys:
+                        yield key, item
+                    if reader.peek() == ']':
+                        reader.expect(']')
+                        break
+                    reader.expect(',')
+        else:
+            reader.decode()
+
+        if reader.peek() == '}':
+            return
+        reader.expect(',')
@@ -1,12 +1,16 @@
 # -*- coding: utf-8 -*-
 
 import os
+import time
 from importlib import import_module
 
-from flask import Flask, jsonify
+from flask import Flask, jsonify, g, request
 from flask_cors import CORS
 from flask_restful import Api
 
+from server import admission, ids, metrics, utils
+from server.exceptions import AdmissionRejectedException
+from server.ORM import instrumentation
 from server.settings import log
 
 app = Flask(__name__)
@@ -23,4 +27,134 @@ config = import_module('server.settings.' + mode)
 
 log.configure_logging(config.log_config_file)
 
+instrumentation.configure(slow_op_threshold_ms=config.REPOSITORY_SLOW_OP_THRESHOLD_MS)
+
+ids.configure(node=config.ID_NODE)
+
+# request instrumentation, served at /metrics
+http_requests_total = metrics.REGISTRY.counter(
+    'http_requests_total', 'Total HTTP requests served.', ('method', 'route', 'status'))
+
+http_request_duration_seconds = metrics.REGISTRY.histogram(
+    'http_request_duration_seconds', 'HTTP request latency in seconds.', ('method', 'route', 'status'),
+    buckets=config.METRICS_LATENCY_BUCKETS)
+
+http_requests_in_flight = metrics.REGISTRY.gauge(
+    'http_requests_in_flight', 'HTTP requests currently being served.', ('method', 'route'))
+
+
+def _route_label() -> str:
+    # the url rule (not the raw path) keeps the label cardinality bounded
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+@app.before_request
+def _start_request_timer():
+    g.metrics_labels = (request.method, _route_label())
+    http_requests_in_flight.inc(g.metrics_labels)
+    if config.REPOSITORY_TIMING_DEBUG_HEADER and config.REPOSITORY_TIMING_DEBUG_HEADER in request.headers:
+        g.repository_breakdown_token = instrumentation.start_breakdown()
+    g.metrics_start = time.perf_counter()
+
+
+@app.after_request
+def _record_request_metrics(response):
+    elapsed = time.perf_counter() - g.metrics_start
+    labels = g.metrics_labels + (str(response.status_code),)
+    http_request_duration_seconds.observe(labels, elapsed)
+    http_requests_total.inc(labels)
+    g.metrics_recorded = True
+    if 'repository_breakdown_token' in g:
+        response.headers['Server-Timing'] = _server_timing(instrumentation.stop_breakdown(g.repository_breakdown_token),
+                                                           elapsed)
+        del g.repository_breakdown_token
+    return response
+
+
+def _server_timing(breakdown, elapsed: float) -> str:
+    # one entry per repository method, plus the whole request: the difference is spent outside the repositories
+    entries = ['{};dur={:.3f};desc="{} calls"'.format(name, seconds * 1000, calls)
+               for name, (calls, seconds) in sorted(breakdown.items())]
+    entries.append('total;dur={:.3f}'.format(elapsed * 1000))
+    return ', '.join(entries)
+
+
+# admission control, {@see server.admission}
+admission_controller = None
+
+if config.ADMISSION_CAPACITY:
+    admission_controller = admission.AdmissionController(
+        capacity=config.ADMISSION_CAPACITY,
+        classes={name: admission.RouteClass(name, priority, limit, shared)
+                 for name, (priority, limit, shared) in config.ADMISSION_CLASSES.items()},
+        queue_budget=config.ADMISSION_QUEUE_BUDGET_MS / 1000)
+    if config.ADMISSION_CALLER_RATE:
+        admission_controller.callers = admission.CallerRateLimiter(config.ADMISSION_CALLER_RATE,
+                                                                   config.ADMISSION_CALLER_BURST)
+
+
+def _route_class() -> str:
+    if request.endpoint == 'userlist' and 'ids' in request.args:
+        # the query-string flavour of the multi-get
+        return config.ADMISSION_ROUTE_CLASSES.get('userlookup', 'read')
+    if request.endpoint in config.ADMISSION_ROUTE_CLASSES:
+        return config.ADMISSION_ROUTE_CLASSES[request.endpoint]
+    return 'read' if request.method in ('GET', 'HEAD', 'OPTIONS') else 'write'
+
+
+def _caller() -> str:
+    if request.remote_addr in config.ADMISSION_TRUSTED_PROXIES:
+        return request.headers.get(config.ADMISSION_CALLER_HEADER) or request.remote_addr
+    return request.remote_addr
+
+
+def charge_caller(tokens: int) -> float:
+    """ takes more tokens from the bucket of the caller of the current request, e.g. one per sub-request of a batch.
+
+    Returns:
+        0 if they were taken (or the callers are not rate-limited), otherwise the number of seconds until there are
+        enough
+
+    """
+
+    if admission_controller is None or admission_controller.callers is None:
+        return 0
+
+    return admission_controller.callers.acquire(_caller(), tokens)
+
+
+# registered after the metrics hooks: shed requests are still counted
+@app.before_request
+def _admit_request():
+    if admission_controller is None:
+        return None
+    route_class = _route_class()
+    if route_class is None:
+        return None
+    try:
+        g.admission_ticket = admission_controller.admit(route_class, _caller())
+    except AdmissionRejectedException as e:
+        return utils.format_error(e.message), e.status, {'Retry-After': str(e.retry_after)}
+    return None
+
+
+@app.teardown_request
+def _release_request(exception=None):
+    if 'admission_ticket' in g:
+        admission_controller.release(g.admission_ticket)
+
+
+@app.teardown_request
+def _finish_request_metrics(exception=None):
+    if 'metrics_labels' not in g:
+        return
+    http_requests_in_flight.dec(g.metrics_labels)
+    if 'repository_breakdown_token' in g:
+        instrumentation.stop_breakdown(g.repository_breakdown_token)
+    if not g.get('metrics_recorded', False):
+        # after_request is skipped when the request failed with an unhandled exception
+        labels = g.metrics_labels + ('500',)
+        http_request_duration_seconds.observe(labels, time.perf_counter() - g.metrics_start)
+        http_requests_total.inc(labels)
+
 from server import views
@@ -0,0 +1,665 @@
+# -*- coding: utf-8 -*-
+
+""" ASGI entry point.
+
+Serves the same routes as the flask app (see views.py), but on top of the AsyncController, so that a single process
+can keep thousands of requests in flight. The existing (blocking) repositories are run in a thread pool.
+
+Run it with any ASGI server, for example:
+
+    uvicorn server.asgi:application
+
+"""
+
+import asyncio
+import json
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+from urllib.parse import parse_qsl
+
+from werkzeug.http import parse_etags, quote_etag
+
+from server import utils
+from server.app import app, api, config
+from server.async_controller import AsyncController
+from server.exceptions import DataIntegrityException, ChangesExpiredException
+from server.ORM.threaded_repositories import ThreadPoolUsersRepository, ThreadPoolConnectionsRepository, \
+    ThreadPoolRecommendationsRepository
+from server.resources import User, UserList, Connection, Recommendation, Changes, HotUsers, Batch, hot_users, \
+    hottest_readers, persist_hot_users, record_hot_user, journal
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(max_workers=config.ASGI_THREAD_POOL_SIZE, thread_name_prefix='repository')
+
+controller = AsyncController(
+    users_repository=ThreadPoolUsersRepository(config.usersRepository, executor),
+    connections_repository=ThreadPoolConnectionsRepository(config.connectionsRepository, executor),
+    recommendations_repository=ThreadPoolRecommendationsRepository(config.recommendationsRepository, executor),
+    journal=journal)
+
+
+class Request(object):
+    """ the parts of an incoming ASGI http request that the handlers need.
+
+    """
+
+    def __init__(self, method: str, args: Dict[str, str], body: bytes, headers: Dict[str, str] = None):
+
+        self.method = method
+
+        self.args = args
+
+        self.body = body
+
+        # lower-cased names
+        self.headers = headers or {}
+
+    def get_json(self):
+
+        return json.loads(self.body) if self.body else None
+
+
+def _url_for(resource, **values) -> str:
+    """ builds a url with the flask url map, so that the links match the ones served by the flask app.
+
+    Never await inside the pushed context: it must not leak across tasks.
+
+    """
+
+    with app.test_request_context():
+        return api.url_for(resource, **values)
+
+
+def _links(resource, user_id: str) -> List[Dict]:
+
+    with app.test_request_context():
+        return resource._generate_hateoas_links(user_id)
+
+
+def _next_page_link(resource, user_id: str, offset: int, limit: int) -> Dict:
+
+    return {
+        'rel': 'next',
+        'href': _url_for(resource, user_id=user_id, offset=offset, limit=limit),
+        'action': 'GET',
+        'types': ['application/json']
+    }
+
+
+async def get_user(request: Request, user_id: str):
+    """ {@see resources.User.get} """
+
+    user, connections = await asyncio.gather(controller.get_user(user_id), controller.count_connections(user_id))
+    if user is None:
+        return utils.format_error("the user ID was not found"), 404
+
+    etag = User._etag(user, connections)
+
+    headers = {'ETag': quote_etag(etag)}
+
+    if parse_etags(request.headers.get('if-none-match')).contains_weak(etag):
+        return None, 304, headers
+
+    resp_dict = {
+        '_data': User._json_mapper(user),
+        '_meta': {'connections': connections, 'version': user.version},
+        '_description': None,
+        '_links': _links(User, user_id)
+    }
+
+    return resp_dict, 200, headers
+
+
+async def patch_user(request: Request, user_id: str):
+    """ {@see resources.User.patch} """
+
+    patch = request.get_json()
+
+    try:
+        user = await controller.update_user_details(user_id, **patch)
+    except KeyError:
+        message = "no record found for user: {}".format(user_id)
+        logger.error(message)
+        return utils.format_error(message), 404
+
+    resp_dict = {
+        '_data': User._json_mapper(user),
+        '_meta': {'version': user.version},
+        '_description': None,
+        '_links': _links(User, user_id)
+    }
+
+    return resp_dict, 200, {'Location': _url_for(User, user_id=user.id)}
+
+
+async def get_user_list(request: Request):
+    """ {@see resources.UserList.get} """
+
+    if 'ids' in request.args:
+        return await _lookup_users([user_id for user_id in request.args['ids'].split(',') if user_id])
+
+    college = request.args.get('college')
+    if college is None:
+        message = "listing all users is not supported. Please specify college=<college> or ids=<id>,<id>... in " \
+                  "query params."
+        logger.error(message)
+        return utils.format_error(message), 400
+
+    cursor = request.args.get('cursor')
+
+    limit = min(int(request.args.get('limit', 50)), config.USERS_MAX_PAGE_SIZE)
+
+    users = await controller.get_users_by_college(college, cursor, limit)
+
+    links = []
+
+    if users and len(users) >= limit:
+        links.append({
+            'rel': 'next',
+            'href': _url_for(UserList, college=college, cursor=users[-1].id, limit=limit),
+            'action': 'GET',
+            'types': ['application/json']
+        })
+
+    resp_dict = {
+        '_data': [User._json_mapper(user) for user in users],
+        '_description': None,
+        '_links': links
+    }
+
+    return resp_dict, 200
+
+
+async def _lookup_users(user_ids: List[str]):
+    """ {@see resources.UserLookup.lookup} """
+
+    if not user_ids or len(user_ids) > config.USERS_LOOKUP_MAX_IDS:
+        message = "please specify between 1 and {} user ids.".format(config.USERS_LOOKUP_MAX_IDS)
+        logger.error(message)
+        return utils.format_error(message), 400
+
+    users, missing = await controller.get_users(user_ids)
+
+    resp_dict = {
+        '_data': [User._json_mapper(user) for user in users],
+        '_meta': {'missing': missing},
+        '_description': None,
+        '_links': []
+    }
+
+    return resp_dict, 200
+
+
+async def post_user_lookup(request: Request):
+    """ {@see resources.UserLookup.post} """
+
+    try:
+        payload = request.get_json() or {}
+    except ValueError:
+        payload = {}
+
+    user_ids = payload.get('ids') if isinstance(payload, dict) else None
+
+    if not isinstance(user_ids, list) or not all(isinstance(user_id, str) for user_id in user_ids):
+        message = "please specify the user ids as a list: {\"ids\": [<id>, <id>...]}"
+        logger.error(message)
+        return utils.format_error(message), 400
+
+    return await _lookup_users(user_ids)
+
+
+async def post_user_list(request: Request):
+    """ {@see resources.UserList.post} """
+
+    payload = request.get_json()
+
+    try:
+        user = await controller.add_user(email=payload['email'], name=payload['name'], college=payload['college'])
+    except KeyError:
+        message = "unable to parse one of the following: email, name, college"
+        logger.error(message)
+        return utils.format_error(message), 400
+
+    resp_dict = {
+        '_data': User._json_mapper(user),
+        '_description': None,
+        '_links': _links(User, user.id)
+    }
+
+    return resp_dict, 201, {'Location': _url_for(User, user_id=user.id)}
+
+
+async def get_connections(request: Request, user_id: str):
+    """ {@see resources.Connection.get} """
+
+    user = await controller.get_user(user_id)
+    if user is None:
+        return utils.format_error("the user ID was not found"), 404
+
+    order = request.args.get('order')
+
+    if order == 'recent':
+        return await _get_recent_connections(request, user_id)
+
+    if order is not None:
+        message = "unknown order: {}. Only order=recent is supported.".format(order)
+        logger.error(message)
+        return utils.format_error(message), 400
+
+    offset = int(request.args.get('offset', 0))
+
+    limit = int(request.args.get('limit', 50))
+
+    connected_users, total = await asyncio.gather(controller.get_connections(user_id, offset, limit),
+                                                  controller.count_connections(user_id))
+
+    resp_dict = {
+        '_data': [Connection._json_mapper(user) for user in connected_users],
+        '_meta': {'total': total},
+        '_description': None,
+        '_links': [_next_page_link(Connection, user_id, offset + len(connected_users), limit)] +
+                  _links(Connection, user_id)
+    }
+
+    return resp_dict, 200
+
+
+async def _get_recent_connections(request: Request, user_id: str):
+    """ {@see resources.Connection._get_recent} """
+
+    try:
+        cursor, since, limit = Connection._parse_recent_args(request.args)
+    except ValueError as e:
+        message = "recent connections: {}. Expecting since=<seconds since the unix epoch> and the cursor of the " \
+                  "next link.".format(e)
+        logger.error(message)
+        return utils.format_error(message), 400
+
+    (connected_users, next_cursor), total = await asyncio.gather(
+        controller.get_recent_connections(user_id, cursor, since, limit), controller.count_connections(user_id))
+
+    links = []
+
+    if next_cursor is not None:
+        with app.test_request_context():
+            links.append(Connection._recent_link(user_id, next_cursor, since, limit))
+
+    resp_dict = {
+        '_data': [dict(Connection._json_mapper(user), connected_at=created) for user, created in connected_users],
+        '_meta': {'total': total},
+        '_description': None,
+        '_links': links + _links(Connection, user_id)
+    }
+
+    return resp_dict, 200
+
+
+async def post_connection(request: Request, user_id: str):
+    """ {@see resources.Connection.post} """
+
+    user = await controller.get_user(user_id)
+    if user is None:
+        return utils.format_error("the user ID was not found"), 404
+
+    try:
+        user_id_to_connect = request.get_json()['id']
+    except KeyError:
+        message = "add connection: expecting id in payload"
+        logger.error(message)
+        return utils.format_error(message), 400
+
+    resp_dict = {
+        '_data': None,
+        '_description': None,
+        '_links': _links(Connection, user_id)
+    }
+
+    try:
+        await controller.add_connection(user_id, user_id_to_connect)
+        return resp_dict, 201
+    except DataIntegrityException:
+        return resp_dict, 409
+
+
+async def delete_connection(request: Request, user_id: str):
+    """ {@see resources.Connection.delete} """
+
+    try:
+        user_id_to_disconnect = request.args['user']
+    except KeyError:
+        message = 'can only delete connections one at a time. Please specify user=<user_id> in query params.'
+        logger.error(message)
+        return utils.format_error(message), 404
+
+    await controller.remove_connection(user_id, user_id_to_disconnect)
+
+    return {}, 204
+
+
+async def post_batch_connection(request: Request, user_id: str):
+    """ {@see resources.BatchConnection.post} """
+
+    try:
+        payload = request.get_json() or {}
+    except ValueError:
+        payload = {}
+
+    user_ids_to_connect = payload.get('ids') if isinstance(payload, dict) else None
+
+    if not isinstance(user_ids_to_connect, list) or \
+            not all(isinstance(user_id_to_connect, str) for user_id_to_connect in user_ids_to_connect):
+        message = "please specify the user ids as a list: {\"ids\": [<id>, <id>...]}"
+        logger.error(message)
+        return utils.format_error(message), 400
+
+    await controller.batch_add_connections(user_id, user_ids_to_connect)
+
+    resp_dict = {
+        '_data': None,
+        '_description': None,
+        '_links': _links(Connection, user_id)
+    }
+
+    return resp_dict, 202
+
+
+async def get_connection_search(request: Request, user_id: str):
+    """ {@see resources.ConnectionSearch.get} """
+
+    user = await controller.get_user(user_id)
+    if user is None:
+        return utils.format_error("the user ID was not found"), 404
+
+    try:
+        prefix = request.args['prefix']
+    except KeyError:
+        message = 'search connections: please specify prefix=<prefix> in query params.'
+        logger.error(message)
+        return utils.format_error(message), 400
+
+    limit = int(request.args.get('limit', 10))
+
+    connected_users = await controller.search_connections(user_id, prefix, limit)
+
+    resp_dict = {
+        '_data': [Connection._json_mapper(user) for user in connected_users],
+        '_description': None,
+        '_links': _links(Connection, user_id)
+    }
+
+    return resp_dict, 200
+
+
+async def get_recommendations(request: Request, user_id: str):
+    """ {@see resources.Recommendation.get} """
+
+    user = await controller.get_user(user_id)
+    if user is None:
+        return utils.format_error("the user ID was not found"), 404
+
+    offset = int(request.args.get('offset', 0))
+
+    limit = int(request.args.get('limit', 50))
+
+    (recommended_users, next_offset), total = await asyncio.gather(
+        controller.get_recommendations(user_id, offset, limit), controller.count_recommendations(user_id))
+
+    resp_dict = {
+        '_data': [Recommendation._json_mapper(user) for user in recommended_users],
+        '_meta': {'total': total},
+        '_description': None,
+        '_links': [_next_page_link(Recommendation, user_id, next_offset, limit)] + _links(Recommendation, user_id)
+    }
+
+    return resp_dict, 200
+
+
+async def get_changes(request: Request):
+    """ {@see resources.Changes.get} """
+
+    since = request.args.get('since')
+
+    since = int(since) if since is not None else None
+
+    limit = int(request.args.get('limit', 100))
+
+    wait = float(request.args.get('wait', config.CHANGES_MAX_WAIT_SECONDS))
+
+    try:
+        changes = await controller.get_changes(since, limit, wait)
+    except ChangesExpiredException as e:
+        resp_dict = utils.format_error(e.message)
+        resp_dict['_meta'] = {'head': e.head}
+        return resp_dict, 410
+
+    last = changes[-1].seq if changes else since or 0
+
+    resp_dict = {
+        '_data': [Changes._json_mapper(change) for change in changes],
+        '_meta': {'last': last},
+        '_description': None,
+        '_links': [
+            {
+                'rel': 'next',
+                'href': _url_for(Changes, since=last, limit=limit),
+                'action': 'GET',
+                'types': ['application/json']
+            }
+        ]
+    }
+
+    return resp_dict, 200
+
+
+async def get_hot_users(request: Request):
+    """ {@see resources.HotUsers.get} """
+
+    if not hot_users:
+        return utils.format_error("hot user tracking is disabled"), 404
+
+    limit = int(request.args.get('limit', config.HOT_USERS_TOP_K))
+
+    resp_dict = {
+        '_data': {kind: [{'id': user_id, 'count': count} for user_id, count in tracker.top(limit)]
+                  for kind, tracker in hot_users.items()},
+        '_meta': {'window': config.HOT_USERS_WINDOW_SECONDS},
+        '_description': None,
+        '_links': [
+            {
+                'rel': 'self',
+                'href': _url_for(HotUsers),
+                'action': 'GET',
+                'types': ['application/json']
+            },
+            {
+                'rel': 'warm',
+                'href': _url_for(HotUsers),
+                'action': 'POST',
+                'types': ['application/json']
+            }
+        ]
+    }
+
+    return resp_dict, 200
+
+
+async def post_hot_users(request: Request):
+    """ {@see resources.HotUsers.post} """
+
+    if not hot_users:
+        return utils.format_error("hot user tracking is disabled"), 404
+
+    user_ids = [user_id for user_id, _ in hot_users['reads'].top(config.HOT_USERS_WARM_COUNT)]
+
+    resp_dict = {
+        '_data': None,
+        '_meta': {'warmed': await controller.warm(user_ids)},
+        '_description': None,
+        '_links': []
+    }
+
+    return resp_dict, 200
+
+
+async def post_batch(request: Request):
+    """ {@see resources.Batch.post} """
+
+    try:
+        payload = request.get_json()
+    except ValueError:
+        payload = None
+
+    items, error = Batch.parse(payload)
+
+    if error is not None:
+        logger.error(error)
+        return utils.format_error(error), 400
+
+    async def run(item: Dict) -> Dict:
+        path, _, query = item['path'].partition('?')
+        if Batch.refused(path, item['method']):
+            return {'status': 400, 'headers': {}, 'body': Batch.refusal(item)}
+        body = json.dumps(item['body']).encode('utf-8') if item.get('body') is not None else b''
+        resp = await application.dispatch(path, Request(item['method'], dict(parse_qsl(query)), body))
+        return {'status': resp[1], 'headers': resp[2] if len(resp) > 2 else {}, 'body': resp[0]}
+
+    results = [None] * len(items)
+
+    failed = False
+
+    for group in Batch.groups(items, bool(payload.get('concurrent_reads'))):
+        if failed:
+            for index in group:
+                results[index] = {'status': 424, 'headers': {},
+                                  'body': utils.format_error('skipped: a previous request failed')}
+            continue
+        for index, result in zip(group, await asyncio.gather(*[run(items[index]) for index in group])):
+            results[index] = result
+        failed = payload.get('stop_on_error', False) and any(results[index]['status'] >= 400 for index in group)
+
+    resp_dict = {
+        '_data': results,
+        '_description': None,
+        '_links': []
+    }
+
+    return resp_dict, 200
+
+
+class AsgiApplication(object):
+    """ a minimal ASGI application routing the api paths to the async handlers above.
+
+    """
+
+    def __init__(self, prefix: str = '/api/v1'):
+
+        self.prefix = prefix
+
+        self.routes = [
+            (re.compile(prefix + r'/users$'), {'GET': get_user_list, 'POST': post_user_list}),
+            # before /users/<user_id>, as in the flask url map
+            (re.compile(prefix + r'/users/lookup$'), {'POST': post_user_lookup}),
+            (re.compile(prefix + r'/users/(?P<user_id>[^/]+)$'), {'GET': get_user, 'PATCH': patch_user}),
+            (re.compile(prefix + r'/users/(?P<user_id>[^/]+)/connections$'),
+             {'GET': get_connections, 'POST': post_connection, 'DELETE': delete_connection}),
+            (re.compile(prefix + r'/users/(?P<user_id>[^/]+)/connections/batch$'), {'POST': post_batch_connection}),
+            (re.compile(prefix + r'/users/(?P<user_id>[^/]+)/connections/search$'), {'GET': get_connection_search}),
+            (re.compile(prefix + r'/users/(?P<user_id>[^/]+)/recommendations$'), {'GET': get_recommendations}),
+            (re.compile(prefix + r'/changes$'), {'GET': get_changes}),
+            (re.compile(prefix + r'/admin/hot-users$'), {'GET': get_hot_users, 'POST': post_hot_users}),
+            (re.compile(prefix + r'/batch$'), {'POST': post_batch}),
+        ]
+
+    async def __call__(self, scope, receive, send):
+
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+
+        if scope['type'] != 'http':
+            return
+
+        body = b''
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+
+        args = dict(parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+
+        headers = {key.decode('latin-1').lower(): value.decode('latin-1') for key, value in scope.get('headers', [])}
+
+        request = Request(scope['method'], args, body, headers)
+
+        resp = await self.dispatch(scope['path'], request)
+
+        resp_dict, status = resp[0], resp[1]
+        headers = resp[2] if len(resp) > 2 else {}
+
+        # not modified: no body
+        payload = json.dumps(resp_dict).encode('utf-8') if status != 304 else b''
+
+        raw_headers = [(b'content-type', b'application/json'), (b'content-length', str(len(payload)).encode())]
+        raw_headers += [(key.lower().encode('latin-1'), value.encode('latin-1')) for key, value in headers.items()]
+
+        await send({'type': 'http.response.start', 'status': status, 'headers': raw_headers})
+        await send({'type': 'http.response.body', 'body': payload})
+
+    async def dispatch(self, path: str, request: Request):
+        """ routes a request to its handler.
+
+        Args:
+            path: the request path
+            request: the request
+
+        Returns:
+            a (response dict, status[, headers]) tuple
+
+        """
+
+        method_not_allowed = False
+
+        for pattern, handlers in self.routes:
+            match = pattern.match(path)
+            if match is None:
+                continue
+            handler = handlers.get(request.method)
+            if handler is None:
+                # a later route may match with this method (GET /users/lookup is a user), as in the flask url map
+                method_not_allowed = True
+                continue
+            params = match.groupdict()
+            if 'user_id' in params:
+                record_hot_user(params['user_id'], request.method)
+            try:
+                return await handler(request, **params)
+            except Exception:
+                logger.exception('unhandled error while serving %s %s', request.method, path)
+                return utils.format_error("internal server error"), 500
+
+        if method_not_allowed:
+            return utils.format_error("the method is not allowed for the requested URL"), 405
+
+        return utils.format_error("the requested URL was not found on the server"), 404
+
+    @staticmethod
+    async def _lifespan(receive, send):
+
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                persist_hot_users()
+                # bounded by HOT_USERS_WARM_COUNT: cheap enough to finish before serving
+                await controller.warm(hottest_readers())
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+application = AsgiApplication()
@@ -0,0 +1,607 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+import sys
+from typing import AsyncContextManager, Dict, Hashable, Iterable, Set, List, Tuple, Union
+
+from server.app import config
+from server.changes import Change, ChangeFeed
+from server.models import User, Profile, AsyncUsersRepository, AsyncConnectionsRepository, \
+    AsyncRecommendationsRepository
+from server.search import ConnectionNameIndex
+from server.singleflight import AsyncSingleFlight
+from server.unit_of_work import AsyncUnitOfWork, Journal, async_unit_of_work
+
+logger = logging.getLogger(__name__)
+
+
+class _AsyncStripedLock(object):
+    """ the asyncio counterpart of ORM.locks.StripedLock.
+
+    The locks are created on first use, so that they belong to the running event loop.
+
+    """
+
+    def __init__(self, stripes: int = 64):
+
+        self._locks = [None] * stripes
+
+    def __call__(self, key: Hashable) -> asyncio.Lock:
+        """ gets the lock guarding a key. Use it as an async context manager. """
+
+        stripe = hash(key) % len(self._locks)
+
+        if self._locks[stripe] is None:
+            self._locks[stripe] = asyncio.Lock()
+
+        return self._locks[stripe]
+
+
+class AsyncController(object):
+    """ The async counterpart of the Controller. {@see server.controller.Controller}
+
+    Exposes the same business operations, but talks to the async repository contracts so that a single process can
+    keep many requests in flight while the data stores are busy. Independent repository calls (like resolving the
+    users of a page of connections) are issued concurrently.
+
+    """
+
+    def __init__(self, users_repository: AsyncUsersRepository,
+                 connections_repository: AsyncConnectionsRepository,
+                 recommendations_repository: AsyncRecommendationsRepository,
+                 name_index: ConnectionNameIndex = None,
+                 change_feed: ChangeFeed = None,
+                 journal: Journal = None):
+
+        self.usersRepository = users_repository
+
+        self.connectionsRepository = connections_repository
+
+        self.recommendationsRepository = recommendations_repository
+
+        # typeahead over the names of the connections, kept current by the mutations below
+        self.nameIndex = name_index if name_index is not None else \
+            ConnectionNameIndex(max_users=config.CONNECTION_SEARCH_INDEX_MAX_USERS)
+
+        # every mutation below is appended to this feed, {@see get_changes}
+        self.changeFeed = change_feed if change_feed is not None else ChangeFeed(retention=config.CHANGES_RETENTION)
+
+        # held from the write to the append of its change, so that the changes of an entity are sequenced in the
+        # order they were made
+        self._change_locks = _AsyncStripedLock()
+
+        # where the units of work are committed, None to keep the writes in memory only
+        self.journal = journal
+
+        # concurrent identical page reads (hot users) share one backend call
+        wait_timeout = config.READ_COALESCING_WAIT_TIMEOUT_MS / 1000 \
+            if config.READ_COALESCING_WAIT_TIMEOUT_MS is not None else None
+
+        self._connection_reads = AsyncSingleFlight('connections', timeout=wait_timeout)
+
+        self._recommendation_reads = AsyncSingleFlight('recommendations', timeout=wait_timeout)
+
+    async def get_user(self, user_id: str) -> User:
+        """ gets a user given the id.
+
+        Args:
+            user_id: id of the user to get
+
+        Returns:
+            the User object
+
+        """
+
+        return await self.usersRepository.get(user_id)
+
+    async def get_users(self, user_ids: List[str]) -> Tuple[List[User], List[str]]:
+        """ gets several users given their ids, in one repository call. {@see Controller.get_users}
+
+        """
+
+        user_ids = list(dict.fromkeys(user_ids))
+
+        found = await self.usersRepository.get_many(user_ids)
+
+        return [found[user_id] for user_id in user_ids if user_id in found], \
+               [user_id for user_id in user_ids if user_id not in found]
+
+    async def get_users_by_college(self, college: str, cursor: str = None, limit: int = 50) -> List[User]:
+        """ gets the users at a college.
+
+        Paginated with a cursor: pass the id of the last user of a page to get the next one.
+
+        Args:
+            college: the college
+            cursor: the id of the last user of the previous page, None for the first page
+            limit: the maximum number of results to retrieve in one go
+
+        Returns:
+            the users at the college, ordered by id
+
+        """
+
+        limit = limit if limit < config.USERS_MAX_PAGE_SIZE else config.USERS_MAX_PAGE_SIZE
+
+        return await self.usersRepository.get_by_college(college, cursor, limit)
+
+    async def update_user_details(self, user_id: str, **kwargs) -> User:
+        """ updates a user.
+
+        Args:
+            user_id: id of the user to update
+            kwargs: field to update: new value
+
+        Returns:
+            the new version of the user. A KeyError is thrown if the user does not exist.
+
+        """
+
+        updatable_fields = [
+            'name',
+            'college'
+        ]
+
+        async with self._unit_of_work() as work:
+            await work.lock(self._change_locks(('user', user_id)))
+
+            user = await self.get_user(user_id)
+
+            if user is None:
+                raise KeyError("user not found: {}".format(user_id))
+
+            changes = {item: kwargs[item] for item in kwargs if item in updatable_fields}
+            logger.debug('fields %s will be updated for user %s', sorted(changes), user_id)
+
+            # profiles are immutable: the new version of the user gets a new one
+            profile = user.profile.replace(**changes)
+
+            previous_profile = user.profile
+
+            user = await self.usersRepository.update(user_id, profile)
+
+            if user is None:
+                # deleted meanwhile
+                raise KeyError("user not found: {}".format(user_id))
+
+            work.on_rollback(self.usersRepository.update, user_id, previous_profile)
+
+            if 'name' in kwargs:
+                work.after_commit(self.nameIndex.rename, user_id, user.profile.name)
+
+            work.publish('user.updated', {'id': user_id, 'name': profile.name, 'college': profile.college,
+                                          'version': user.version})
+
+        return user
+
+    async def add_user(self, email: str, name: str, college: str) -> User:
+        """ adds a user to the system.
+
+        Args:
+            email
+            name
+            college
+
+        Returns:
+            the created User object
+
+        """
+
+        profile = Profile(name=name, college=college)
+
+        logger.info('a new user signed up with email: %s', email)
+
+        # the user and their seeded recommendations are committed together
+        async with self._unit_of_work() as work:
+            user = await self.usersRepository.create(email, profile)
+
+            work.on_rollback(self.usersRepository.delete, user.id)
+
+            # no change lock needed: nobody else knows the new id yet
+            work.publish('user.created', {'id': user.id, 'email': email, 'name': name, 'college': college})
+
+            recommendations = self._seed_initial_recommendations()
+
+            await self.add_recommendations(user.id, recommendations)
+
+        return user
+
+    async def remove_user(self, user_id: str) -> None:
+        """ removes a user from the system.
+
+        Args:
+            user_id: id of the user to remove
+
+        Returns:
+            None
+
+        """
+
+        logger.info('deleting user %s', user_id)
+
+        async with self._unit_of_work() as work:
+            await work.lock(self._change_locks(('user', user_id)))
+            # no inverse {@see Controller.remove_user}
+            await self.usersRepository.delete(user_id)
+            work.publish('user.deleted', {'id': user_id})
+
+    async def get_connections(self, user_id: str, offset: int = 0, limit: int = 50) -> Set[User]:
+        """ gets all the connections/friends of a user.
+
+        Args:
+            user_id: id of the user
+            offset: the starting index from where to retrieve the results
+            limit: the maximum number of results to retrieve in one go
+
+        Returns:
+            an unordered set of all the connected users.
+
+        """
+
+        limit = limit if limit < config.CONNECTIONS_MAX_PAGE_SIZE else config.CONNECTIONS_MAX_PAGE_SIZE
+
+        # a set of its own for every caller of a coalesced read
+        return set(await self._connection_reads.do((user_id, offset, limit), self._get_connections,
+                                                   user_id, offset, limit))
+
+    async def _get_connections(self, user_id: str, offset: int, limit: int) -> Set[User]:
+
+        connections = list(await self.connectionsRepository.get_all(user_id, offset, limit))
+
+        if len(connections) > limit:
+            # fail-safe in case the repository does not honor the limit
+            logger.warning('the data repository returned more than the limit: %s', limit)
+            connections = connections[:limit]
+
+        # {@see Controller._get_connections}
+        connected_users = [next(iter(connection.users - {user_id}), user_id) for connection in connections]
+
+        users = await asyncio.gather(*[self.get_user(connected_user) for connected_user in connected_users])
+
+        return set(users)
+
+    async def get_recent_connections(self, user_id: str, cursor: Tuple[float, str] = None, since: float = None,
+                                     limit: int = 50) -> Tuple[List[Tuple[User, float]], Tuple[float, str]]:
+        """ gets the connections/friends of a user, the most recent first.
+
+        {@see server.controller.Controller.get_recent_connections}
+
+        """
+
+        limit = limit if limit < config.CONNECTIONS_MAX_PAGE_SIZE else config.CONNECTIONS_MAX_PAGE_SIZE
+
+        users, next_cursor = await self._connection_reads.do(('recent', user_id, cursor, since, limit),
+                                                             self._get_recent_connections, user_id, cursor, since,
+                                                             limit)
+
+        # the result may be shared with concurrent callers
+        return list(users), next_cursor
+
+    async def _get_recent_connections(self, user_id: str, cursor: Tuple[float, str], since: float,
+                                      limit: int) -> Tuple[List[Tuple[User, float]], Tuple[float, str]]:
+
+        connections = await self.connectionsRepository.get_recent(user_id, cursor, since, limit)
+
+        # a connection of the user with themselves has no other user
+        others = [next(iter(connection.users - {user_id}), user_id) for connection in connections]
+
+        found = await self.usersRepository.get_many(others)
+
+        users = [(found[other], connection.created) for other, connection in zip(others, connections) if other in found]
+
+        next_cursor = (connections[-1].created, others[-1]) if connections and len(connections) >= limit else None
+
+        return users, next_cursor
+
+    async def count_connections(self, user_id: str) -> int:
+        """ counts the connections/friends of a user.
+
+        Args:
+            user_id: id of the user
+
+        Returns:
+            the number of connections of the user
+
+        """
+
+        return await self.connectionsRepository.count(user_id)
+
+    async def add_connection(self, user1: str, user2: str) -> None:
+        """ adds a connection between two users.
+
+        Args:
+            user1: the first user
+            user2: the second user
+
+        Returns:
+            None
+            An exception might be thrown if such a connection already exists.
+
+        """
+
+        logger.info('adding a new connection between %s and %s', user1, user2)
+
+        async with self._unit_of_work() as work:
+            await work.lock(self._change_locks(('connection', frozenset((user1, user2)))))
+            connection = await self.connectionsRepository.create({user1, user2})
+            work.on_rollback(self.connectionsRepository.delete, {user1, user2})
+            work.after_commit(self._index_connection, user1, user2)
+            work.publish('connection.created', {'users': sorted((user1, user2)), 'created': connection.created})
+
+    async def batch_add_connections(self, user: str, user_ids_to_connect: List[str]) -> List[str]:
+        """ connects a user to several users at once (batch mode). {@see Controller.batch_add_connections}
+
+        """
+
+        others = [other for other in dict.fromkeys(user_ids_to_connect) if other != user]
+
+        logger.info('adding %s new connections for %s', len(others), user)
+
+        async with self._unit_of_work() as work:
+            # taken in a global order, so that concurrent batches can't deadlock
+            for lock in sorted({id(lock): lock for lock in (self._change_locks(('connection', frozenset((user, other))))
+                                                            for other in others)}.values(), key=id):
+                await work.lock(lock)
+            connections = await self.connectionsRepository.create_many([{user, other} for other in others])
+            connected = []
+            for connection in connections:
+                other = next(iter(connection.users - {user}))
+                work.on_rollback(self.connectionsRepository.delete, {user, other})
+                work.after_commit(self._index_connection, user, other)
+                work.publish('connection.created', {'users': sorted((user, other)), 'created': connection.created})
+                connected.append(other)
+
+        return connected
+
+    async def remove_connection(self, user1: str, user2: str) -> None:
+        """ removes an (existing) connection between two users.
+
+        Args:
+            user1: the first user
+            user2: the second user
+
+        Returns:
+            None
+            An exception might be thrown if such a connection does not exist.
+
+        """
+
+        logger.info('removing the connection between %s and %s', user1, user2)
+
+        async with self._unit_of_work() as work:
+            await work.lock(self._change_locks(('connection', frozenset((user1, user2)))))
+            connection = await self.connectionsRepository.get({user1, user2})
+            await self.connectionsRepository.delete({user1, user2})
+            # restored with its creation time {@see Controller.remove_connection}
+            work.on_rollback(self.connectionsRepository.create, {user1, user2}, connection.created)
+            work.after_commit(self.nameIndex.remove, user1, user2)
+            work.after_commit(self.nameIndex.remove, user2, user1)
+            work.publish('connection.deleted', {'users': sorted((user1, user2))})
+
+    async def search_connections(self, user_id: str, prefix: str, limit: int = 10) -> List[User]:
+        """ finds the connections of a user whose name has a word starting with a prefix (typeahead).
+
+        {@see server.controller.Controller.search_connections}
+
+        """
+
+        limit = limit if limit < config.CONNECTION_SEARCH_MAX_RESULTS else config.CONNECTION_SEARCH_MAX_RESULTS
+
+        friend_ids = self.nameIndex.search(user_id, prefix, limit)
+
+        if friend_ids is None:
+            await self._build_name_index(user_id)
+            friend_ids = self.nameIndex.search(user_id, prefix, limit) or []
+
+        users = await asyncio.gather(*[self.get_user(friend_id) for friend_id in friend_ids])
+
+        return [user for user in users if user is not None]
+
+    async def _build_name_index(self, user_id: str) -> None:
+
+        log = self.nameIndex.start_build(user_id)
+
+        snapshot = None
+
+        try:
+            connections = await self.connectionsRepository.get_all(user_id, 0, sys.maxsize)
+            friends = await asyncio.gather(*[self.get_user(next(iter(connection.users - {user_id}), user_id))
+                                             for connection in connections])
+            snapshot = [(friend.id, friend.profile.name) for friend in friends if friend is not None]
+        finally:
+            self.nameIndex.finish_build(user_id, log, snapshot)
+
+    async def _index_connection(self, user1: str, user2: str) -> None:
+
+        users = await asyncio.gather(self.get_user(user1), self.get_user(user2))
+
+        for owner, friend in ((user1, users[1]), (user2, users[0])):
+            if friend is not None:
+                self.nameIndex.add(owner, friend.id, friend.profile.name)
+
+    async def check_connection_exists(self, user1: str, user2: str) -> bool:
+        """ checks if two users are connected.
+
+        Args:
+            user1: the first user
+            user2: the second user
+
+        Returns:
+            True if a such a connection exists, False otherwise.
+
+        """
+
+        connection = await self.connectionsRepository.get({user1, user2})
+
+        return connection is not None
+
+    async def get_recommendations(self, user_id: str, offset: int = 0, limit: int = 50) -> Tuple[List[User], int]:
+        """ fetches the friend/connection recommendations for a user, best first. {@see Controller}
+
+        Args:
+            user_id: id of the user
+            offset: the starting index from where to retrieve the results
+            limit: the maximum number of results to retrieve in one go
+
+        Returns:
+            the recommended users by descending score, and the offset of the next page
+
+        """
+
+        limit = limit if limit < config.RECOMMENDATIONS_MAX_PAGE_SIZE else config.RECOMMENDATIONS_MAX_PAGE_SIZE
+
+        users, next_offset = await self._recommendation_reads.do((user_id, offset, limit), self._get_recommendations,
+                                                                 user_id, offset, limit)
+
+        return list(users), next_offset
+
+    async def _get_recommendations(self, user_id: str, offset: int, limit: int) -> Tuple[List[User], int]:
+
+        users = []
+
+        skipped = 0
+
+        while len(users) < limit:
+            wanted = limit - len(users) + min(skipped, config.RECOMMENDATIONS_MAX_SKIPPED - skipped)
+            recommendations = list(await self.recommendationsRepository.get(user_id, offset, wanted))
+            if len(recommendations) > wanted:
+                # fail-safe in case the repository does not honor the limit
+                logger.warning('the data repository returned more than the limit: %s', wanted)
+                recommendations = recommendations[:wanted]
+
+            recommended_ids = [recommendation.recommended_user for recommendation in recommendations]
+            connected = await self.connectionsRepository.connected(user_id, recommended_ids)
+            found = await self.usersRepository.get_many([recommended_id for recommended_id in recommended_ids
+                                                         if recommended_id not in connected])
+
+            for recommendation in recommendations:
+                offset += 1
+                user = found.get(recommendation.recommended_user)
+                if user is None or user.id == user_id:
+                    skipped += 1
+                    continue
+                users.append(user)
+                if len(users) == limit:
+                    break
+
+            if len(recommendations) < wanted or skipped >= config.RECOMMENDATIONS_MAX_SKIPPED:
+                break
+
+        return users, offset
+
+    async def count_recommendations(self, user_id: str) -> int:
+        """ counts the recommendations of a user.
+
+        Args:
+            user_id: id of the user
+
+        Returns:
+            the number of recommendations of the user
+
+        """
+
+        return await self.recommendationsRepository.count(user_id)
+
+    async def add_recommendations(self, user_id: str, recommended_users: Union[Set[str], Dict[str, float]]) -> None:
+        """ adds the (newly generated) recommendations for a user to the system.
+
+        Args:
+            user_id: id of the user
+            recommended_users: the user ids of the recommended users, mapped to their scores. A set (without scores)
+                scores them all 0
+
+        Returns:
+            None
+
+        """
+
+        scores = recommended_users if isinstance(recommended_users, dict) else dict.fromkeys(recommended_users, 0.0)
+
+        async with self._unit_of_work() as work:
+            await work.lock(self._change_locks(('recommendations', user_id)))
+
+            # the scores before the update, to restore on rollback
+            previous_scores = {}
+            count = await self.recommendationsRepository.count(user_id)
+            if count:
+                for recommendation in await self.recommendationsRepository.get(user_id, offset=0, limit=count):
+                    previous_scores[recommendation.recommended_user] = recommendation.score
+
+            if scores:
+                logger.info('adding %s new recommendations for %s: %s', len(scores), user_id, scores)
+                # registered first: restoring the previous scores also undoes a write that failed half-way
+                work.on_rollback(self.recommendationsRepository.replace_all, user_id, previous_scores)
+                # one repository call (one round trip for the shared repositories), keeping the other recommendations
+                await self.recommendationsRepository.replace_all(user_id, {**previous_scores, **scores})
+                # one change for the whole batch
+                work.publish('recommendations.added', {'user': user_id, 'recommended_users': list(scores)})
+
+    async def delete_recommendations(self, user_id: str) -> None:
+        """ deletes the (stale) recommendations for a user.
+
+        Args:
+            user_id: id of the user
+
+        Returns:
+            None
+
+        """
+
+        deleted = []
+
+        async with self._unit_of_work() as work:
+            await work.lock(self._change_locks(('recommendations', user_id)))
+
+            # all of them: the repository honors the limit
+            count = await self.recommendationsRepository.count(user_id)
+            recommendations = await self.recommendationsRepository.get(user_id, offset=0, limit=count)
+
+            for recommendation in recommendations:
+                logger.info('removing the recommendation for %s: %s', user_id, recommendation.recommended_user)
+                await self.recommendationsRepository.delete(recommendation.id)
+                work.on_rollback(self.recommendationsRepository.save, user_id, recommendation.recommended_user,
+                                 recommendation.score)
+                deleted.append(recommendation.recommended_user)
+
+            if deleted:
+                work.publish('recommendations.deleted', {'user': user_id, 'recommended_users': deleted})
+
+    async def get_changes(self, since: int = None, limit: int = 100, wait: float = 0) -> List[Change]:
+        """ gets the changes made after a sequence number (long poll). {@see Controller.get_changes}
+
+        """
+
+        limit = limit if limit < config.CHANGES_MAX_BATCH_SIZE else config.CHANGES_MAX_BATCH_SIZE
+
+        wait = wait if wait < config.CHANGES_MAX_WAIT_SECONDS else config.CHANGES_MAX_WAIT_SECONDS
+
+        return await self.changeFeed.read_async(since, limit, wait)
+
+    async def warm(self, user_ids: Iterable[str]) -> int:
+        """ fills the caches of some users ahead of their requests. {@see Controller.warm}
+
+        """
+
+        built = 0
+
+        for user_id in user_ids:
+            if self.nameIndex.touch(user_id) or await self.get_user(user_id) is None:
+                continue
+            await self._build_name_index(user_id)
+            built += 1
+
+        return built
+
+    def _unit_of_work(self) -> AsyncContextManager[AsyncUnitOfWork]:
+        """ runs the writes of an operation as a unit of work. {@see Controller._unit_of_work} """
+
+        return async_unit_of_work(self.journal, self.changeFeed)
+
+    def _seed_initial_recommendations(self) -> Set[str]:
+        """ generates some initial recommendations for the newly-created user. {@see Controller}
+
+        """
+        recommended_users = {'rryan', 'sarahdavis'}
+
+        return recommended_users
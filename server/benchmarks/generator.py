@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+""" Seeded synthetic social graph generator.
+
+Produces data in the same layout as ext/data.json (users, connections, recommendations), so that it can be loaded by
+any of the json repositories. Degrees follow a power law: a few users have thousands of connections, most have a
+handful, which is what a social graph looks like and what stresses the per-user code paths.
+
+"""
+
+import json
+import random
+from typing import Dict, List
+
+from faker import Faker
+
+# standard benchmark sizes
+SIZES = (1000, 10000, 100000)
+
+# the connections are made over the year before this time (2019-01-01T00:00:00Z, seconds since the unix epoch)
+CREATED_BEFORE = 1546300800
+
+
+def _power_law_degrees(rng: random.Random, users: int, exponent: float, min_degree: int, max_degree: int) -> List[int]:
+    """ samples one target degree per user from a (truncated) pareto distribution.
+
+    """
+
+    degrees = []
+
+    for _ in range(users):
+        degree = int(min_degree * rng.paretovariate(exponent - 1))
+        degrees.append(min(degree, max_degree))
+
+    return degrees
+
+
+def generate(users: int, seed: int = 42, exponent: float = 2.5, min_degree: int = 2, max_degree: int = 5000,
+             recommendations_per_user: int = 5, colleges: int = 50) -> Dict[str, List[Dict]]:
+    """ generates a synthetic social graph.
+
+    Edges are drawn with the configuration model: every user gets as many "stubs" as its target degree, and the stubs
+    are paired at random. Self-loops and duplicate edges are dropped, so the realised degrees are slightly lower than
+    the targets.
+
+    Args:
+        users: the number of users
+        seed: the seed, the same seed always generates the same graph
+        exponent: the exponent of the degree distribution (P(k) ~ k^-exponent)
+        min_degree: the minimum target degree of a user
+        max_degree: the maximum target degree of a user (the README's ~5k connections per user)
+        recommendations_per_user: the number of recommendations generated for every user
+        colleges: the number of distinct colleges
+
+    Returns:
+        the data as a dict, in the ext/data.json layout
+
+    """
+
+    rng = random.Random(seed)
+
+    fake = Faker()
+    fake.seed_instance(seed)
+
+    user_ids = ['user{}'.format(i) for i in range(users)]
+
+    users_data = [
+        {
+            'id': user_id,
+            'email': '{}@example.com'.format(user_id),
+            'name': fake.name(),
+            'college': 'college{}'.format(rng.randrange(colleges))
+        }
+        for user_id in user_ids
+    ]
+
+    stubs = []
+    for index, degree in enumerate(_power_law_degrees(rng, users, exponent, min_degree, max_degree)):
+        stubs += [index] * degree
+    rng.shuffle(stubs)
+
+    edges = set()
+    for i in range(0, len(stubs) - 1, 2):
+        user1, user2 = stubs[i], stubs[i + 1]
+        if user1 != user2:
+            edges.add((min(user1, user2), max(user1, user2)))
+
+    # a generator of its own: drawing the creation times doesn't change the rest of the graph
+    clock = random.Random('{}-created'.format(seed))
+
+    connections_data = [
+        {'id': 'c{}'.format(i), 'users': [user_ids[user1], user_ids[user2]],
+         'created': round(CREATED_BEFORE - clock.uniform(0, 365 * 24 * 3600), 3)}
+        for i, (user1, user2) in enumerate(sorted(edges))
+    ]
+
+    recommendations_data = []
+    for index, user_id in enumerate(user_ids):
+        for recommended in rng.sample(range(users), min(recommendations_per_user, users - 1)):
+            if recommended == index:
+                continue
+            recommendations_data.append({
+                'id': 'r{}'.format(len(recommendations_data)),
+                'user_id': user_id,
+                'recommended_user_id': user_ids[recommended],
+                'score': round(rng.random(), 3)
+            })
+
+    return {
+        'users': users_data,
+        'connections': connections_data,
+        'recommendations': recommendations_data
+    }
+
+
+def write(data: Dict[str, List[Dict]], json_file: str) -> None:
+    """ writes generated data to a json file that the json repositories can load. """
+
+    with open(json_file, 'w') as fl:
+        json.dump(data, fl)
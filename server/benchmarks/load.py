@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+""" HTTP load generator: the throughput of a running server.
+
+A number of concurrent clients, each on its own connection (reopened when the server closes it), read users and their
+connections (picked at random from a snapshot) for a given duration, as fast as the server answers. It reports the
+requests per second and the latency percentiles. Meant to compare serving modes, e.g. `flask run` against
+`python -m server.prefork`.
+
+The clients tell themselves apart with the caller header of admission control, so that its per-caller rate limit
+doesn't cap the load. The server only reads that header from trusted addresses: start it with
+SOCIAL_APP_TRUSTED_PROXIES=127.0.0.1 (the address of the load generator).
+
+Usage (from the server directory, the server being started with the same snapshot):
+
+    python -m server.benchmarks.load --url http://127.0.0.1:5000 --snapshot ext/data.json --concurrency 32
+
+"""
+
+import argparse
+import http.client
+import json
+import random
+import sys
+import threading
+import time
+from typing import Dict, List
+from urllib.parse import urlparse
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+
+    # not the one of the runner: importing it would load the whole app into the load generator
+    return sorted_values[min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))]
+
+
+def _client(url: str, paths: List[str], seed: int, deadline: float, durations: List[float], errors: List[int]) -> None:
+
+    parsed = urlparse(url)
+
+    # a caller of its own per client {@see server.benchmarks.load}
+    headers = {'X-Caller-Id': 'load-{}'.format(seed)}
+
+    rng = random.Random(seed)
+
+    connection = None
+
+    while time.monotonic() < deadline:
+        path = rng.choice(paths)
+        start = time.perf_counter()
+        try:
+            if connection is None:
+                connection = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=10)
+            connection.request('GET', path, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            if response.status != 200:
+                errors[0] += 1
+                continue
+        except (OSError, http.client.HTTPException):
+            errors[0] += 1
+            connection = None
+            continue
+        durations.append(time.perf_counter() - start)
+
+
+def run(url: str, user_ids: List[str], concurrency: int, duration: float, seed: int = 42) -> Dict:
+    """ loads a server for a while.
+
+    Args:
+        url: the base url of the server
+        user_ids: the users to read
+        concurrency: the number of concurrent clients
+        duration: for how long (in seconds)
+        seed: seeds the choice of the users
+
+    Returns:
+        the throughput and latency statistics
+
+    """
+
+    paths = ['/api/v1/users/{}'.format(user_id) for user_id in user_ids] + \
+            ['/api/v1/users/{}/connections'.format(user_id) for user_id in user_ids]
+
+    deadline = time.monotonic() + duration
+
+    # per client: no contention on the lists
+    durations = [[] for _ in range(concurrency)]
+    errors = [[0] for _ in range(concurrency)]
+
+    threads = [threading.Thread(target=_client, args=(url, paths, seed + i, deadline, durations[i], errors[i]))
+               for i in range(concurrency)]
+
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    merged = sorted(value for client_durations in durations for value in client_durations)
+
+    return {
+        'url': url,
+        'concurrency': concurrency,
+        'duration_seconds': round(elapsed, 3),
+        'requests': len(merged),
+        'errors': sum(client_errors[0] for client_errors in errors),
+        'requests_per_sec': round(len(merged) / elapsed, 1),
+        'p50_ms': round(_percentile(merged, 0.50) * 1000, 3) if merged else None,
+        'p99_ms': round(_percentile(merged, 0.99) * 1000, 3) if merged else None,
+    }
+
+
+def main(argv: List[str] = None) -> int:
+
+    parser = argparse.ArgumentParser(prog='python -m server.benchmarks.load', description='HTTP load generator')
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='the base url of the server')
+    parser.add_argument('--snapshot', default='ext/data.json', help='the snapshot the server was started with')
+    parser.add_argument('--concurrency', type=int, default=32, help='the number of concurrent clients')
+    parser.add_argument('--duration', type=float, default=20, help='for how long to load the server (seconds)')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    with open(args.snapshot) as fl:
+        user_ids = [user['id'] for user in json.load(fl).get('users', [])]
+
+    print(json.dumps(run(args.url, user_ids, args.concurrency, args.duration, args.seed), indent=2))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
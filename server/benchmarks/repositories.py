@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+
+""" Repository benchmarks: every operation of every backend, at several data sizes.
+
+The same synthetic graph is loaded into each backend, then each repository operation is timed on it. The results are
+a matrix (backend x size x operation) to pick a backend with: the load time, and the latency of every operation. The
+contracts the backends share are checked by server/tests/repository_conformance.py.
+
+The redis backend runs against the in-process fake server (server.ORM.fake_redis) unless --redis-url is given: its
+numbers then measure the round trips and the fake, not Redis itself. The database at --redis-url is flushed before
+every size: give it a scratch database.
+
+Usage (from the server directory):
+
+    python -m server.benchmarks.repositories --sizes 1000 10000 --samples 200
+    python -m server.benchmarks.repositories --backends json redis --redis-url redis://localhost:6379/15 --table
+
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+from server.benchmarks import generator
+from server.benchmarks.runner import _run
+from server.models import Profile
+from server.ORM.fake_redis import FakeRedisServer
+from server.ORM.json_connections_repository import JsonConnectionsRepository
+from server.ORM.json_recommendations_repository import JsonRecommendationsRepository
+from server.ORM.json_users_repository import JsonUsersRepository
+from server.ORM.redis_repositories import RedisUsersRepository, RedisConnectionsRepository, \
+    RedisRecommendationsRepository
+from server.ORM.resp import RespClient
+from server.ORM.sharded_connections_repository import ShardedConnectionsRepository
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('json', 'sharded', 'redis')
+
+
+def _json_backend(json_file: str, redis_url: str = None) -> Dict:
+
+    return {'users': JsonUsersRepository(json_file), 'connections': JsonConnectionsRepository(json_file),
+            'recommendations': JsonRecommendationsRepository(json_file)}
+
+
+def _sharded_backend(json_file: str, redis_url: str = None) -> Dict:
+
+    # connections only: the users and the recommendations are not sharded
+    repository = ShardedConnectionsRepository(json_file)
+
+    return {'connections': repository, 'close': repository.close}
+
+
+def _redis_backend(json_file: str, redis_url: str = None) -> Dict:
+
+    server = None
+
+    if redis_url is None:
+        server = FakeRedisServer().start()
+        client = RespClient(port=server.port)
+    else:
+        client = RespClient.from_url(redis_url)
+        client.execute('FLUSHDB')
+
+    def close() -> None:
+        client.close()
+        if server is not None:
+            server.stop()
+
+    return {'users': RedisUsersRepository(client, json_file),
+            'connections': RedisConnectionsRepository(client, json_file),
+            'recommendations': RedisRecommendationsRepository(client, json_file), 'close': close}
+
+
+_FACTORIES = {'json': _json_backend, 'sharded': _sharded_backend, 'redis': _redis_backend}
+
+
+def repository_benchmarks(repositories: Dict, user_ids: List[str], seed: int, samples: int) -> Dict[str, Dict]:
+    """ benchmarks every operation of the repositories of a backend.
+
+    Args:
+        repositories: kind ('users', 'connections', 'recommendations') -> repository. The kinds the backend doesn't
+            have are skipped
+        user_ids: the ids of the users in the graph
+        seed: the seed used to pick the users to query
+        samples: the number of timed calls per operation
+
+    Returns:
+        the statistics of every operation
+
+    """
+
+    rng = random.Random(seed)
+
+    picks = [rng.choice(user_ids) for _ in range(samples + 10)]
+
+    batches = [rng.sample(user_ids, min(50, len(user_ids))) for _ in range(samples + 10)]
+
+    results = {}
+
+    def run(name: str, func: Callable[[int], None]) -> None:
+        _run(results, name, func, samples)
+
+    users = repositories.get('users')
+    if users is not None:
+        colleges = [users.get(user_id).profile.college for user_id in picks]
+        created = []
+        run('users.get', lambda i: users.get(picks[i]))
+        run('users.get_many', lambda i: users.get_many(batches[i]))
+        run('users.get_by_college', lambda i: users.get_by_college(colleges[i], limit=50))
+        run('users.create',
+            lambda i: created.append(users.create('benchmark-{}@example.com'.format(i), Profile('Benchmark', 'x'))))
+        run('users.update', lambda i: users.update(picks[i], Profile('Name {}'.format(i), colleges[i])))
+        run('users.delete', lambda i: users.delete(created[i].id))
+
+    connections = repositories.get('connections')
+    if connections is not None:
+        # pairs with users that don't exist yet: create never collides, delete always finds what it removes
+        new_pairs = [{picks[i], 'benchmark-{}'.format(i)} for i in range(len(picks))]
+        run('connections.get_all', lambda i: connections.get_all(picks[i], 0, 50))
+        run('connections.get_recent', lambda i: connections.get_recent(picks[i], limit=50))
+        run('connections.count', lambda i: connections.count(picks[i]))
+        run('connections.connected', lambda i: connections.connected(picks[i], batches[i]))
+        run('connections.create', lambda i: connections.create(new_pairs[i]))
+        run('connections.get', lambda i: connections.get(new_pairs[i]))
+        run('connections.delete', lambda i: connections.delete(new_pairs[i]))
+
+    recommendations = repositories.get('recommendations')
+    if recommendations is not None:
+        saved = []
+        run('recommendations.get', lambda i: recommendations.get(picks[i], 0, 20))
+        run('recommendations.count', lambda i: recommendations.count(picks[i]))
+        run('recommendations.save',
+            lambda i: saved.append(recommendations.save(picks[i], 'benchmark-{}'.format(i), i / samples)))
+        run('recommendations.delete', lambda i: recommendations.delete(saved[i].id))
+
+    return results
+
+
+def run(sizes: List[int], backends: List[str], seed: int, samples: int, redis_url: str = None) -> Dict:
+    """ loads a graph of every size into every backend and benchmarks the repositories.
+
+    Returns:
+        the run, as a JSON-serializable dict: results[backend][size][operation]
+
+    """
+
+    results = {backend: {} for backend in backends}
+
+    for size in sizes:
+        data = generator.generate(size, seed=seed)
+        user_ids = [user['id'] for user in data['users']]
+        with tempfile.TemporaryDirectory() as directory:
+            json_file = os.path.join(directory, 'data.json')
+            generator.write(data, json_file)
+            for backend in backends:
+                start = time.perf_counter()
+                repositories = _FACTORIES[backend](json_file, redis_url)
+                load_seconds = time.perf_counter() - start
+                try:
+                    stats = repository_benchmarks(repositories, user_ids, seed, samples)
+                finally:
+                    if 'close' in repositories:
+                        repositories['close']()
+                results[backend][str(size)] = dict(stats, load={'seconds': load_seconds})
+                logger.info('%s at %s users: loaded in %.3fs', backend, size, load_seconds)
+
+    return {
+        'meta': {
+            'sizes': sizes,
+            'backends': backends,
+            'redis': redis_url or 'in-process fake',
+            'seed': seed,
+            'samples': samples,
+            'python': platform.python_version(),
+            'platform': platform.platform()
+        },
+        'results': results
+    }
+
+
+def table(run_dict: Dict, statistic: str = 'p50_ms') -> str:
+    """ renders the results as a text matrix: one row per operation, one column per backend and size. """
+
+    results = run_dict['results']
+
+    columns = [(backend, size) for backend in sorted(results) for size in results[backend]]
+
+    operations = sorted({operation for backend, size in columns for operation in results[backend][size]})
+
+    def cell(stats: Dict) -> str:
+        if stats is None:
+            return '-'
+        if 'seconds' in stats:
+            return '{:.2f}s'.format(stats['seconds'])
+        if statistic not in stats:
+            return 'skipped'
+        return '{:.3f}'.format(stats[statistic])
+
+    rows = [['operation ({})'.format(statistic)] + ['{} {}'.format(backend, size) for backend, size in columns]]
+    rows += [[operation] + [cell(results[backend][size].get(operation)) for backend, size in columns]
+             for operation in operations]
+
+    widths = [max(len(row[index]) for row in rows) for index in range(len(rows[0]))]
+
+    return '\n'.join('  '.join(value.ljust(width) for value, width in zip(row, widths)).rstrip() for row in rows)
+
+
+def main(argv: List[str] = None) -> int:
+
+    parser = argparse.ArgumentParser(prog='python -m server.benchmarks.repositories',
+                                     description='repository benchmarks, per backend and data size')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(generator.SIZES[:2]),
+                        help='the sizes of the synthetic graphs (users)')
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--samples', type=int, default=200, help='timed calls per operation')
+    parser.add_argument('--redis-url', help='a scratch Redis database (flushed!) instead of the in-process fake')
+    parser.add_argument('--output', help='write the results to this file instead of stdout')
+    parser.add_argument('--table', action='store_true', help='print a matrix of the p50 latencies instead of JSON')
+    args = parser.parse_args(argv)
+
+    try:
+        logging.disable(logging.CRITICAL - 1)
+        run_dict = run(args.sizes, args.backends, args.seed, args.samples, args.redis_url)
+    finally:
+        logging.disable(logging.NOTSET)
+
+    if args.output:
+        with open(args.output, 'w') as fl:
+            fl.write(json.dumps(run_dict, indent=2, sort_keys=True))
+
+    print(table(run_dict) if args.table else json.dumps(run_dict, indent=2, sort_keys=True))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+
+""" End-to-end benchmarks.
+
+Runs micro-benchmarks of every Controller operation and HTTP-level benchmarks of every route (through flask's test
+client, so without any network) against a synthetic graph. Results are written out as JSON, and can be compared
+against a stored baseline: the run fails if any operation got slower than the baseline by more than the threshold.
+
+Usage (from the server directory):
+
+    python -m server.benchmarks --users 10000 --output results.json
+    python -m server.benchmarks --users 10000 --save-baseline benchmarks/baseline.json
+    python -m server.benchmarks --users 10000 --baseline benchmarks/baseline.json --threshold 0.25
+
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+from server.app import app, admission_controller  # first: sets up the app, the views and the resources
+from server import resources
+from server.benchmarks import generator
+from server.controller import Controller
+from server.ORM.json_connections_repository import JsonConnectionsRepository
+from server.ORM.json_recommendations_repository import JsonRecommendationsRepository
+from server.ORM.json_users_repository import JsonUsersRepository
+
+logger = logging.getLogger(__name__)
+
+# the statistic compared against the baseline
+COMPARED_STATISTIC = 'p50_ms'
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+
+    return sorted_values[index]
+
+
+def measure(func: Callable[[int], None], samples: int, warmup: int = 5) -> Dict:
+    """ times a function over a number of samples.
+
+    Args:
+        func: the function to time. It receives the index of the sample.
+        samples: the number of timed calls
+        warmup: the number of untimed calls made first
+
+    Returns:
+        the latency statistics (in milliseconds) and the throughput
+
+    """
+
+    for i in range(warmup):
+        func(samples + i)
+
+    durations = []
+
+    for i in range(samples):
+        start = time.perf_counter()
+        func(i)
+        durations.append(time.perf_counter() - start)
+
+    durations.sort()
+
+    total = sum(durations)
+
+    return {
+        'samples': samples,
+        'mean_ms': total / samples * 1000,
+        'p50_ms': _percentile(durations, 0.50) * 1000,
+        'p95_ms': _percentile(durations, 0.95) * 1000,
+        'p99_ms': _percentile(durations, 0.99) * 1000,
+        'ops_per_sec': samples / total if total else None
+    }
+
+
+def _run(results: Dict, name: str, func: Callable[[int], None], samples: int) -> None:
+
+    try:
+        results[name] = measure(func, samples)
+    except NotImplementedError:
+        results[name] = {'skipped': 'not implemented by the repository'}
+
+    logger.info('%s: %s', name, results[name])
+
+
+def controller_benchmarks(controller, user_ids: List[str], seed: int, samples: int) -> Dict[str, Dict]:
+    """ benchmarks every Controller operation.
+
+    Args:
+        controller: the controller, wired to repositories holding the synthetic graph
+        user_ids: the ids of the users in the graph
+        seed: the seed used to pick the users to query
+        samples: the number of timed calls per operation
+
+    Returns:
+        the statistics of every operation
+
+    """
+
+    rng = random.Random(seed)
+
+    # a fixed sequence of users, reused across operations so that runs are comparable
+    picks = [rng.choice(user_ids) for _ in range(samples + 10)]
+
+    # connections to users that don't exist yet, so that add_connection never collides and remove_connection always
+    # finds what it removes
+    new_pairs = [(picks[i], 'benchmark-{}'.format(i)) for i in range(len(picks))]
+
+    results = {}
+
+    _run(results, 'controller.get_user', lambda i: controller.get_user(picks[i]), samples)
+    _run(results, 'controller.update_user_details',
+         lambda i: controller.update_user_details(picks[i], name='Name {}'.format(i)), samples)
+    _run(results, 'controller.add_user',
+         lambda i: controller.add_user('benchmark-{}@example.com'.format(i), 'Benchmark User', 'college0'), samples)
+    _run(results, 'controller.get_connections', lambda i: controller.get_connections(picks[i]), samples)
+    _run(results, 'controller.add_connection', lambda i: controller.add_connection(*new_pairs[i]), samples)
+    _run(results, 'controller.check_connection_exists',
+         lambda i: controller.check_connection_exists(*new_pairs[i]), samples)
+    _run(results, 'controller.remove_connection', lambda i: controller.remove_connection(*new_pairs[i]), samples)
+    _run(results, 'controller.get_recommendations', lambda i: controller.get_recommendations(picks[i]), samples)
+    _run(results, 'controller.add_recommendations',
+         lambda i: controller.add_recommendations(picks[i], {picks[-i - 1]}), samples)
+    _run(results, 'controller.delete_recommendations', lambda i: controller.delete_recommendations(picks[i]), samples)
+
+    return results
+
+
+def http_benchmarks(client, user_ids: List[str], seed: int, samples: int, prefix: str = '/api/v1') -> Dict[str, Dict]:
+    """ benchmarks every route through the flask test client.
+
+    Args:
+        client: the flask test client
+        user_ids: the ids of the users in the graph
+        seed: the seed used to pick the users to query
+        samples: the number of timed calls per route
+        prefix: the api prefix
+
+    Returns:
+        the statistics of every route
+
+    """
+
+    rng = random.Random(seed)
+
+    picks = [rng.choice(user_ids) for _ in range(samples + 10)]
+
+    def call(method: str, path: str, expected: int, **kwargs) -> None:
+        response = client.open(prefix + path, method=method, **kwargs)
+        if response.status_code != expected:
+            raise AssertionError('{} {} returned {}, expected {}'.format(method, path, response.status_code, expected))
+
+    results = {}
+
+    _run(results, 'http.GET /users/<user_id>', lambda i: call('GET', '/users/' + picks[i], 200), samples)
+    _run(results, 'http.PATCH /users/<user_id>',
+         lambda i: call('PATCH', '/users/' + picks[i], 200, json={'name': 'Name {}'.format(i)}), samples)
+    _run(results, 'http.POST /users',
+         lambda i: call('POST', '/users', 201, json={'email': 'http-{}@example.com'.format(i),
+                                                     'name': 'Benchmark User', 'college': 'college0'}), samples)
+    _run(results, 'http.GET /users/<user_id>/connections',
+         lambda i: call('GET', '/users/{}/connections'.format(picks[i]), 200), samples)
+    _run(results, 'http.POST /users/<user_id>/connections',
+         lambda i: call('POST', '/users/{}/connections'.format(picks[i]), 201, json={'id': 'http-{}'.format(i)}),
+         samples)
+    _run(results, 'http.DELETE /users/<user_id>/connections',
+         lambda i: call('DELETE', '/users/{}/connections'.format(picks[i]), 204,
+                        query_string={'user': 'http-{}'.format(i)}), samples)
+    _run(results, 'http.POST /users/<user_id>/connections/batch',
+         lambda i: call('POST', '/users/{}/connections/batch'.format(picks[i]), 202, json={'ids': picks[:20]}),
+         samples)
+    _run(results, 'http.GET /users/<user_id>/recommendations',
+         lambda i: call('GET', '/users/{}/recommendations'.format(picks[i]), 200), samples)
+
+    return results
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], threshold: float) -> List[str]:
+    """ compares results against a baseline.
+
+    Args:
+        results: the 'results' section of a run
+        baseline: the 'results' section of the baseline run
+        threshold: the tolerated slowdown, as a fraction (0.25 means up to 25% slower)
+
+    Returns:
+        a description of every regression, empty if there are none
+
+    """
+
+    regressions = []
+
+    for name, stats in sorted(results.items()):
+        baseline_stats = baseline.get(name)
+        if not baseline_stats or COMPARED_STATISTIC not in stats or COMPARED_STATISTIC not in baseline_stats:
+            continue
+        current, previous = stats[COMPARED_STATISTIC], baseline_stats[COMPARED_STATISTIC]
+        if previous > 0 and current > previous * (1 + threshold):
+            regressions.append('{}: {} went from {:.3f} to {:.3f} (+{:.0%})'
+                               .format(name, COMPARED_STATISTIC, previous, current, current / previous - 1))
+
+    return regressions
+
+
+def run(users: int, seed: int, samples: int) -> Dict:
+    """ generates a graph of the given size, loads it and runs all the benchmarks.
+
+    Returns:
+        the run, as a JSON-serializable dict
+
+    """
+
+    data = generator.generate(users, seed=seed)
+
+    user_ids = [user['id'] for user in data['users']]
+
+    with tempfile.TemporaryDirectory() as directory:
+        json_file = os.path.join(directory, 'data.json')
+        generator.write(data, json_file)
+
+        def load() -> Controller:
+            return Controller(users_repository=JsonUsersRepository(json_file),
+                              connections_repository=JsonConnectionsRepository(json_file),
+                              recommendations_repository=JsonRecommendationsRepository(json_file))
+
+        results = controller_benchmarks(load(), user_ids, seed, samples)
+
+        # the resources talk to the module-level controller: point it to a fresh copy of the graph
+        resources.controller = load()
+
+        # the benchmark is a single caller going as fast as it can: keep the admission queue, lift the rate limit
+        if admission_controller is not None:
+            callers, admission_controller.callers = admission_controller.callers, None
+        try:
+            results.update(http_benchmarks(app.test_client(), user_ids, seed, samples))
+        finally:
+            if admission_controller is not None:
+                admission_controller.callers = callers
+
+    return {
+        'meta': {
+            'users': users,
+            'connections': len(data['connections']),
+            'recommendations': len(data['recommendations']),
+            'seed': seed,
+            'samples': samples,
+            'python': platform.python_version(),
+            'platform': platform.platform()
+        },
+        'results': results
+    }
+
+
+def main(argv: List[str] = None) -> int:
+
+    parser = argparse.ArgumentParser(prog='python -m server.benchmarks', description='end-to-end benchmarks')
+    parser.add_argument('--users', type=int, default=generator.SIZES[0],
+                        help='the size of the synthetic graph, usually one of {}'.format(generator.SIZES))
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--samples', type=int, default=200, help='timed calls per operation')
+    parser.add_argument('--output', help='write the results to this file instead of stdout')
+    parser.add_argument('--baseline', help='compare the results against this stored run')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='tolerated slowdown against the baseline, as a fraction')
+    parser.add_argument('--save-baseline', help='store the results as a baseline in this file')
+    parser.add_argument('--log-level', default='CRITICAL',
+                        help='only log messages at or above this level while benchmarking. Compare runs at DEBUG and '
+                             'CRITICAL to measure the logging overhead per request.')
+    args = parser.parse_args(argv)
+
+    try:
+        # logging.disable drops everything at or below the given level, on every logger
+        logging.disable(logging.getLevelName(args.log_level.upper()) - 1)
+        run_dict = run(args.users, args.seed, args.samples)
+    finally:
+        logging.disable(logging.NOTSET)
+
+    output = json.dumps(run_dict, indent=2, sort_keys=True)
+
+    if args.output:
+        with open(args.output, 'w') as fl:
+            fl.write(output)
+    else:
+        print(output)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as fl:
+            fl.write(output)
+
+    if args.baseline:
+        with open(args.baseline) as fl:
+            baseline = json.load(fl)
+        if baseline.get('meta', {}).get('users') != args.users:
+            logger.warning('the baseline was recorded with a different graph size: %s',
+                           baseline.get('meta', {}).get('users'))
+        regressions = compare(run_dict['results'], baseline.get('results', {}), args.threshold)
+        for regression in regressions:
+            print('REGRESSION ' + regression, file=sys.stderr)
+        if regressions:
+            return 1
+
+    return 0
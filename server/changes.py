@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+""" Change-data-capture feed.
+
+Every mutation made through the controller is appended to an in-memory, sequenced stream of changes. Consumers (search
+indexers, caches, recommenders...) follow it with `since=<the last sequence number they processed>` instead of
+re-reading full lists. Only the last `retention` changes are kept: a consumer lagging further behind gets a
+ChangesExpiredException and has to resync. So does a consumer ahead of the feed: the feed starts over at 0 when the
+process restarts, the sequence numbers it saw before are gone.
+
+Reads are long polls: when there is nothing new, they wait (up to a timeout) for the next change. Both threads and
+asyncio tasks can wait.
+
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from itertools import islice
+from typing import Dict, List
+
+from server.exceptions import ChangesExpiredException
+
+logger = logging.getLogger(__name__)
+
+
+class Change(object):
+    """ models a change in the feed.
+
+    """
+
+    def __init__(self, seq: int, change_type: str, data: Dict, timestamp: float):
+
+        self.seq = seq
+
+        self.type = change_type
+
+        self.data = data
+
+        self.timestamp = timestamp
+
+
+def _wake(future: asyncio.Future) -> None:
+
+    if not future.done():
+        future.set_result(None)
+
+
+class ChangeFeed(object):
+    """ a bounded, sequenced stream of changes. Thread-safe.
+
+    Sequence numbers start at 1 and have no gaps.
+
+    """
+
+    def __init__(self, retention: int = 10000):
+
+        self.retention = retention
+
+        self._changes = deque(maxlen=retention)
+
+        self._head = 0
+
+        self._condition = threading.Condition()
+
+        # (loop, future) of the asyncio tasks waiting for the next change
+        self._async_waiters = set()
+
+    @property
+    def head(self) -> int:
+        """ the sequence number of the last change, 0 if there was none. """
+
+        return self._head
+
+    def append(self, change_type: str, data: Dict) -> int:
+        """ appends a change to the feed and wakes up the waiting readers.
+
+        Args:
+            change_type: the type of change, e.g. 'connection.created'
+            data: the details of the change, json serializable
+
+        Returns:
+            the sequence number of the change
+
+        """
+
+        with self._condition:
+            self._head += 1
+            seq = self._head
+            self._changes.append(Change(seq, change_type, data, time.time()))
+            self._condition.notify_all()
+            waiters, self._async_waiters = self._async_waiters, set()
+
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+
+        return seq
+
+    def _read(self, since: int, limit: int) -> List[Change]:
+        """ the changes after `since`. Call with the condition held. """
+
+        oldest = self._changes[0].seq if self._changes else self._head + 1
+
+        if since is None:
+            since = oldest - 1
+        elif since < oldest - 1:
+            message = "the changes since {} are no longer retained, the oldest one is {}".format(since, oldest)
+            logger.warning(message)
+            raise ChangesExpiredException(message, self._head)
+        elif since > self._head:
+            # the feed is in memory: a cursor ahead of the head was given by a previous run, whose changes are lost
+            message = "unknown changes: {} is ahead of the feed, whose last change is {}".format(since, self._head)
+            logger.warning(message)
+            raise ChangesExpiredException(message, self._head)
+
+        # consumers are usually close to the head: walk from the right, the cost depends on the lag, not the retention
+        lag = self._head - since
+
+        if lag <= 0:
+            return []
+
+        changes = list(islice(reversed(self._changes), lag))
+        changes.reverse()
+
+        return changes[:limit]
+
+    def read(self, since: int = None, limit: int = 100, timeout: float = 0) -> List[Change]:
+        """ gets the changes after a sequence number, waiting for one if there is none yet.
+
+        Args:
+            since: the sequence number of the last change seen, None for all the retained changes
+            limit: the maximum number of changes to return
+            timeout: how long to wait for a change, in seconds
+
+        Returns:
+            the changes, oldest first. Empty if none came in before the timeout.
+
+        Raises:
+            ChangesExpiredException: if the changes after `since` are no longer retained, or `since` is ahead of
+                the head
+
+        """
+
+        deadline = time.monotonic() + timeout
+
+        with self._condition:
+            while True:
+                changes = self._read(since, limit)
+                remaining = deadline - time.monotonic()
+                if changes or remaining <= 0:
+                    return changes
+                self._condition.wait(remaining)
+
+    async def read_async(self, since: int = None, limit: int = 100, timeout: float = 0) -> List[Change]:
+        """ the asyncio variant of read(): waits without blocking the event loop. {@see read} """
+
+        loop = asyncio.get_running_loop()
+
+        deadline = loop.time() + timeout
+
+        while True:
+            with self._condition:
+                changes = self._read(since, limit)
+                remaining = deadline - loop.time()
+                if changes or remaining <= 0:
+                    return changes
+                waiter = (loop, loop.create_future())
+                self._async_waiters.add(waiter)
+
+            try:
+                await asyncio.wait_for(waiter[1], remaining)
+            except asyncio.TimeoutError:
+                with self._condition:
+                    self._async_waiters.discard(waiter)
@@ -1,13 +1,22 @@
 # -*- coding: utf-8 -*-
 
 import logging
-from typing import Set
+import sys
+from typing import ContextManager, Dict, Iterable, Set, List, Tuple, Union
 
 from server.app import config
+from server.changes import Change, ChangeFeed
 from server.models import User, Profile, UsersRepository, ConnectionsRepository, RecommendationsRepository
+from server.ORM.locks import StripedLock
+from server.search import ConnectionNameIndex
+from server.singleflight import SingleFlight
+from server.unit_of_work import Journal, UnitOfWork, unit_of_work
 
 logger = logging.getLogger(__name__)
 
+# the messages logged once per row, rate-limited in the logging config
+rows_logger = logging.getLogger(__name__ + '.rows')
+
 
 class Controller(object):
     """ Responsible for managing data flows. All business logic should be encapsulated here.
@@ -24,7 +33,10 @@ class Controller(object):
 
     def __init__(self, users_repository: UsersRepository,
                  connections_repository: ConnectionsRepository,
-                 recommendations_repository: RecommendationsRepository):
+                 recommendations_repository: RecommendationsRepository,
+                 name_index: ConnectionNameIndex = None,
+                 change_feed: ChangeFeed = None,
+                 journal: Journal = None):
 
         self.usersRepository = users_repository
 
@@ -32,6 +44,28 @@ class Controller(object):
 
         self.recommendationsRepository = recommendations_repository
 
+        # typeahead over the names of the connections, kept current by the mutations below
+        self.nameIndex = name_index if name_index is not None else \
+            ConnectionNameIndex(max_users=config.CONNECTION_SEARCH_INDEX_MAX_USERS)
+
+        # every mutation below is appended to this feed, {@see get_changes}
+        self.changeFeed = change_feed if change_feed is not None else ChangeFeed(retention=config.CHANGES_RETENTION)
+
+        # held from the write to the append of its change, so that the changes of an entity are sequenced in the
+        # order they were made
+        self._change_locks = StripedLock()
+
+        # where the units of work are committed, None to keep the writes in memory only
+        self.journal = journal
+
+        # concurrent identical page reads (hot users) share one backend call
+        wait_timeout = config.READ_COALESCING_WAIT_TIMEOUT_MS / 1000 \
+            if config.READ_COALESCING_WAIT_TIMEOUT_MS is not None else None
+
+        self._connection_reads = SingleFlight('connections', timeout=wait_timeout)
+
+        self._recommendation_reads = SingleFlight('recommendations', timeout=wait_timeout)
+
     def get_user(self, user_id: str) -> User:
         """ gets a user given the id.
 
@@ -45,6 +79,43 @@ class Controller(object):
 
         return self.usersRepository.get(user_id)
 
+    def get_users(self, user_ids: List[str]) -> Tuple[List[User], List[str]]:
+        """ gets several users given their ids, in one repository call.
+
+        Args:
+            user_ids: ids of the users to get. Duplicates are looked up once
+
+        Returns:
+            the users found, in the order of their ids, and the ids not found
+
+        """
+
+        user_ids = list(dict.fromkeys(user_ids))
+
+        found = self.usersRepository.get_many(user_ids)
+
+        return [found[user_id] for user_id in user_ids if user_id in found], \
+               [user_id for user_id in user_ids if user_id not in found]
+
+    def get_users_by_college(self, college: str, cursor: str = None, limit: int = 50) -> List[User]:
+        """ gets the users at a college.
+
+        Paginated with a cursor: pass the id of the last user of a page to get the next one.
+
+        Args:
+            college: the college
+            cursor: the id of the last user of the previous page, None for the first page
+            limit: the maximum number of results to retrieve in one go
+
+        Returns:
+            the users at the college, ordered by id
+
+        """
+
+        limit = limit if limit < config.USERS_MAX_PAGE_SIZE else config.USERS_MAX_PAGE_SIZE
+
+        return self.usersRepository.get_by_college(college, cursor, limit)
+
     def update_user_details(self, user_id: str, **kwargs) -> User:
         """ updates a user.
 
@@ -53,7 +124,7 @@ class Controller(object):
             kwargs: field to update: new value
 
         Returns:
-            the updated User object
+            the new version of the user. A KeyError is thrown if the user does not exist.
 
         """
 
@@ -62,14 +133,37 @@ class Controller(object):
             'college'
         ]
 
-        profile = self.get_user(user_id).profile
+        with self._unit_of_work() as work:
+            work.lock(self._change_locks(('user', user_id)))
+
+            user = self.get_user(user_id)
+
+            if user is None:
+                raise KeyError("user not found: {}".format(user_id))
+
+            changes = {item: kwargs[item] for item in kwargs if item in updatable_fields}
+            logger.debug('fields %s will be updated for user %s', sorted(changes), user_id)
+
+            # profiles are immutable: the new version of the user gets a new one
+            profile = user.profile.replace(**changes)
+
+            previous_profile = user.profile
+
+            user = self.usersRepository.update(user_id, profile)
+
+            if user is None:
+                # deleted meanwhile
+                raise KeyError("user not found: {}".format(user_id))
+
+            work.on_rollback(self.usersRepository.update, user_id, previous_profile)
 
-        for item in kwargs:
-            if item in updatable_fields:
-                logger.debug('field {} will be updated for user {}'.format(item, user_id))
-                setattr(profile, item, kwargs[item])
+            if 'name' in kwargs:
+                work.after_commit(self.nameIndex.rename, user_id, user.profile.name)
 
-        return self.usersRepository.update(user_id, profile)
+            work.publish('user.updated', {'id': user_id, 'name': profile.name, 'college': profile.college,
+                                          'version': user.version})
+
+        return user
 
     def add_user(self, email: str, name: str, college: str) -> User:
         """ adds a user to the system.
@@ -88,13 +182,20 @@ class Controller(object):
 
         profile = Profile(name=name, college=college)
 
-        logger.info('a new user signed up with email: {}'.format(email))
+        logger.info('a new user signed up with email: %s', email)
+
+        # the user and their seeded recommendations are committed together
+        with self._unit_of_work() as work:
+            user = self.usersRepository.create(email, profile)
 
-        user = self.usersRepository.create(email, profile)
+            work.on_rollback(self.usersRepository.delete, user.id)
 
-        recommendations = self._seed_initial_recommendations()
+            # no change lock needed: nobody else knows the new id yet
+            work.publish('user.created', {'id': user.id, 'email': email, 'name': name, 'college': college})
 
-        self.add_recommendations(user.id, recommendations)
+            recommendations = self._seed_initial_recommendations()
+
+            self.add_recommendations(user.id, recommendations)
 
         return user
 
@@ -109,9 +210,14 @@ class Controller(object):
 
         """
 
-        logger.info('deleting user {}'.format(user_id))
+        logger.info('deleting user %s', user_id)
 
-        self.usersRepository.delete(user_id)
+        with self._unit_of_work() as work:
+            work.lock(self._change_locks(('user', user_id)))
+            # no inverse: a user can't be re-created with its id. It is the last write of its unit of work, so it is
+            # only left behind if the journal can't be written
+            self.usersRepository.delete(user_id)
+            work.publish('user.deleted', {'id': user_id})
 
     def get_connections(self, user_id: str, offset: int = 0, limit: int = 50) -> Set[User]:
         """ gets all the connections/friends of a user.
@@ -130,22 +236,88 @@ class Controller(object):
 
         limit = limit if limit < config.CONNECTIONS_MAX_PAGE_SIZE else config.CONNECTIONS_MAX_PAGE_SIZE
 
+        # a set of its own for every caller of a coalesced read
+        return set(self._connection_reads.do((user_id, offset, limit), self._get_connections, user_id, offset, limit))
+
+    def _get_connections(self, user_id: str, offset: int, limit: int) -> Set[User]:
+
         connections_iterator = self.connectionsRepository.get_all(user_id, offset, limit)
 
         users = set()
 
+        # checked once per page rather than once per row
+        debug = rows_logger.isEnabledFor(logging.DEBUG)
+
         for connection in connections_iterator:
-            connected_user = connection.users.difference({user_id}).pop()
-            logger.debug('found connection with id: {} and users: {}. Connected user deduced is {}'
-                         .format(connection.id, connection.users, connected_user))
+            # a self-connection lists the user itself, like the recent connections do
+            connected_user = next(iter(connection.users - {user_id}), user_id)
+            if debug:
+                rows_logger.debug('found connection with id: %s and users: %s. Connected user deduced is %s',
+                                  connection.id, connection.users, connected_user)
             users.add(self.get_user(connected_user))
             # fail-safe in case the repository does not honor the limit
             if len(users) >= limit:
-                logger.warning('the data repository returned more than the limit: {}'.format(limit))
+                logger.warning('the data repository returned more than the limit: %s', limit)
                 break
 
         return users
 
+    def get_recent_connections(self, user_id: str, cursor: Tuple[float, str] = None, since: float = None,
+                               limit: int = 50) -> Tuple[List[Tuple[User, float]], Tuple[float, str]]:
+        """ gets the connections/friends of a user, the most recent first.
+
+        Paginated with a cursor: pass the cursor returned with a page to get the next one. The cost is proportional to
+        the page size, not to the number of connections.
+
+        Args:
+            user_id: id of the user
+            cursor: the cursor returned with the previous page, None for the first page
+            since: only the connections made at or after this time (seconds since the unix epoch), None for all
+            limit: the maximum number of results to retrieve in one go
+
+        Returns:
+            the connected users with the time they got connected, most recent first, and the cursor of the next page
+            (None on the last page). Users who no longer exist are left out, so a page may be short of the limit.
+
+        """
+
+        limit = limit if limit < config.CONNECTIONS_MAX_PAGE_SIZE else config.CONNECTIONS_MAX_PAGE_SIZE
+
+        users, next_cursor = self._connection_reads.do(('recent', user_id, cursor, since, limit),
+                                                       self._get_recent_connections, user_id, cursor, since, limit)
+
+        # the result may be shared with concurrent callers
+        return list(users), next_cursor
+
+    def _get_recent_connections(self, user_id: str, cursor: Tuple[float, str], since: float,
+                                limit: int) -> Tuple[List[Tuple[User, float]], Tuple[float, str]]:
+
+        connections = self.connectionsRepository.get_recent(user_id, cursor, since, limit)
+
+        # a connection of the user with themselves has no other user
+        others = [next(iter(connection.users - {user_id}), user_id) for connection in connections]
+
+        found = self.usersRepository.get_many(others)
+
+        users = [(found[other], connection.created) for other, connection in zip(others, connections) if other in found]
+
+        next_cursor = (connections[-1].created, others[-1]) if connections and len(connections) >= limit else None
+
+        return users, next_cursor
+
+    def count_connections(self, user_id: str) -> int:
+        """ counts the connections/friends of a user.
+
+        Args:
+            user_id: id of the user
+
+        Returns:
+            the number of connections of the user
+
+        """
+
+        return self.connectionsRepository.count(user_id)
+
     def add_connection(self, user1: str, user2: str) -> None:
         """ adds a connection between two users.
 
@@ -164,14 +336,20 @@ class Controller(object):
 
         """
 
-        logger.info('adding a new connection between {} and {}'.format(user1, user2))
+        logger.info('adding a new connection between %s and %s', user1, user2)
 
-        self.connectionsRepository.create({user1, user2})
+        with self._unit_of_work() as work:
+            work.lock(self._change_locks(('connection', frozenset((user1, user2)))))
+            connection = self.connectionsRepository.create({user1, user2})
+            work.on_rollback(self.connectionsRepository.delete, {user1, user2})
+            work.after_commit(self._index_connection, user1, user2)
+            work.publish('connection.created', {'users': sorted((user1, user2)), 'created': connection.created})
 
-    def batch_add_connections(self, user: str, user_ids_to_connect: str) -> None:
-        """ adds a connection between two users (batch mode).
+    def batch_add_connections(self, user: str, user_ids_to_connect: List[str]) -> List[str]:
+        """ connects a user to several users at once (batch mode).
 
-        offloads the batch processing to a task queue. Should ideally return a job status to track.
+        The connections are created with one repository call, as one unit of work. The users already connected to the
+        user, and the user itself, are skipped.
 
         Args:
             user: the first user
@@ -181,12 +359,29 @@ class Controller(object):
             not imply any kind of inherent order.
 
         Returns:
-            None
+            the ids of the users newly connected to the user
 
         """
 
-        #raise NotImplementedError() # commented out to allow the API to demonstrate its functionality.
-        pass
+        others = [other for other in dict.fromkeys(user_ids_to_connect) if other != user]
+
+        logger.info('adding %s new connections for %s', len(others), user)
+
+        with self._unit_of_work() as work:
+            # taken in a global order, so that concurrent batches can't deadlock
+            for lock in sorted({id(lock): lock for lock in (self._change_locks(('connection', frozenset((user, other))))
+                                                            for other in others)}.values(), key=id):
+                work.lock(lock)
+            connections = self.connectionsRepository.create_many([{user, other} for other in others])
+            connected = []
+            for connection in connections:
+                other = next(iter(connection.users - {user}))
+                work.on_rollback(self.connectionsRepository.delete, {user, other})
+                work.after_commit(self._index_connection, user, other)
+                work.publish('connection.created', {'users': sorted((user, other)), 'created': connection.created})
+                connected.append(other)
+
+        return connected
 
     def remove_connection(self, user1: str, user2: str) -> None:
         """ removes an (existing) connection between two users.
@@ -206,9 +401,67 @@ class Controller(object):
 
         """
 
-        logger.info('removing the connection between {} and {}'.format(user1, user2))
+        logger.info('removing the connection between %s and %s', user1, user2)
+
+        with self._unit_of_work() as work:
+            work.lock(self._change_locks(('connection', frozenset((user1, user2)))))
+            connection = self.connectionsRepository.get({user1, user2})
+            self.connectionsRepository.delete({user1, user2})
+            # restored with its creation time: it keeps its place among the recent connections
+            work.on_rollback(self.connectionsRepository.create, {user1, user2}, connection.created)
+            work.after_commit(self.nameIndex.remove, user1, user2)
+            work.after_commit(self.nameIndex.remove, user2, user1)
+            work.publish('connection.deleted', {'users': sorted((user1, user2))})
+
+    def search_connections(self, user_id: str, prefix: str, limit: int = 10) -> List[User]:
+        """ finds the connections of a user whose name has a word starting with a prefix (typeahead).
+
+        The first search of a user builds the name index of their connections, the next ones are a bisect into it.
+
+        Args:
+            user_id: id of the user
+            prefix: the prefix to match, case and accent insensitive
+            limit: the maximum number of results
+
+        Returns:
+            the matching connected users, ordered by the matching part of their name
+
+        """
+
+        limit = limit if limit < config.CONNECTION_SEARCH_MAX_RESULTS else config.CONNECTION_SEARCH_MAX_RESULTS
+
+        friend_ids = self.nameIndex.search(user_id, prefix, limit)
+
+        if friend_ids is None:
+            self._build_name_index(user_id)
+            friend_ids = self.nameIndex.search(user_id, prefix, limit) or []
 
-        self.connectionsRepository.delete({user1, user2})
+        users = [self.get_user(friend_id) for friend_id in friend_ids]
+
+        return [user for user in users if user is not None]
+
+    def _build_name_index(self, user_id: str) -> None:
+
+        # changes made while the snapshot is read are logged by the index and replayed on top of it
+        log = self.nameIndex.start_build(user_id)
+
+        snapshot = None
+
+        try:
+            friends = []
+            for connection in self.connectionsRepository.get_all(user_id, 0, sys.maxsize):
+                friend = self.get_user(next(iter(connection.users - {user_id}), user_id))
+                if friend is not None:
+                    friends.append((friend.id, friend.profile.name))
+            snapshot = friends
+        finally:
+            self.nameIndex.finish_build(user_id, log, snapshot)
+
+    def _index_connection(self, user1: str, user2: str) -> None:
+
+        for owner, friend in ((user1, self.get_user(user2)), (user2, self.get_user(user1))):
+            if friend is not None:
+                self.nameIndex.add(owner, friend.id, friend.profile.name)
 
     def check_connection_exists(self, user1: str, user2: str) -> bool:
         """ checks if two users are connected.
@@ -231,10 +484,12 @@ class Controller(object):
 
         return connection is not None
 
-    def get_recommendations(self, user_id: str, offset: int = 0, limit: int = 50) -> Set[User]:
-        """ fetches the friend/connection recommendations for a user.
+    def get_recommendations(self, user_id: str, offset: int = 0, limit: int = 50) -> Tuple[List[User], int]:
+        """ fetches the friend/connection recommendations for a user, best first.
 
-        Paginated for predictable performance across users.
+        Paginated for predictable performance across users. Recommendations of users who are now connected to the
+        user (or who no longer exist) are skipped, and the page is backfilled with the next ones: a page is full
+        unless the recommendations run out, or more than RECOMMENDATIONS_MAX_SKIPPED of them were skipped.
 
         Args:
             user_id: id of the user
@@ -242,28 +497,76 @@ class Controller(object):
             limit: the maximum number of results to retrieve in one go
 
         Returns:
-            an unordered set of all the recommended users.
+            the recommended users by descending score, and the offset of the next page. Since recommendations are
+            skipped, the next offset can be larger than offset + the number of users.
 
         """
 
         limit = limit if limit < config.RECOMMENDATIONS_MAX_PAGE_SIZE else config.RECOMMENDATIONS_MAX_PAGE_SIZE
 
-        recommendations_iterator = self.recommendationsRepository.get(user_id, offset, limit)
+        users, next_offset = self._recommendation_reads.do((user_id, offset, limit), self._get_recommendations,
+                                                           user_id, offset, limit)
+
+        # the result may be shared with concurrent callers
+        return list(users), next_offset
+
+    def _get_recommendations(self, user_id: str, offset: int, limit: int) -> Tuple[List[User], int]:
+
+        users = []
+
+        skipped = 0
+
+        # checked once per page rather than once per row
+        debug = rows_logger.isEnabledFor(logging.DEBUG)
+
+        while len(users) < limit:
+            # the missing users, plus as many more as were skipped so far (within the skip budget), so that a backfill
+            # usually takes a single more read
+            wanted = limit - len(users) + min(skipped, config.RECOMMENDATIONS_MAX_SKIPPED - skipped)
+            recommendations = list(self.recommendationsRepository.get(user_id, offset, wanted))
+            if len(recommendations) > wanted:
+                # fail-safe in case the repository does not honor the limit
+                logger.warning('the data repository returned more than the limit: %s', wanted)
+                recommendations = recommendations[:wanted]
+
+            recommended_ids = [recommendation.recommended_user for recommendation in recommendations]
+            # one call each for the whole batch, against the adjacency index and the users
+            connected = self.connectionsRepository.connected(user_id, recommended_ids)
+            found = self.usersRepository.get_many([recommended_id for recommended_id in recommended_ids
+                                                   if recommended_id not in connected])
+
+            for recommendation in recommendations:
+                offset += 1
+                if debug:
+                    rows_logger.debug('found recommendation with id: %s, user: %s and recommended user: %s',
+                                      recommendation.id, recommendation.user, recommendation.recommended_user)
+                user = found.get(recommendation.recommended_user)
+                if user is None or user.id == user_id:
+                    skipped += 1
+                    continue
+                users.append(user)
+                if len(users) == limit:
+                    break
+
+            if len(recommendations) < wanted or skipped >= config.RECOMMENDATIONS_MAX_SKIPPED:
+                break
+
+        return users, offset
 
-        users = set()
+    def count_recommendations(self, user_id: str) -> int:
+        """ counts the recommendations of a user.
 
-        for recommendation in recommendations_iterator:
-            logger.debug('found recommendation with id: {}, user: {} and recommended user: {}'
-                         .format(recommendation.id, recommendation.user, recommendation.recommended_user))
-            users.add(self.get_user(recommendation.recommended_user))
-            # fail-safe in case the repository does not honor the limit
-            if len(users) >= limit:
-                logger.warning('the data repository returned more than the limit: {}'.format(limit))
-                break
+        Args:
+            user_id: id of the user
 
-        return users
+        Returns:
+            the number of recommendations of the user
 
-    def add_recommendations(self, user_id: str, recommended_users: Set[str]) -> None:
+        """
+
+        return self.recommendationsRepository.count(user_id)
+
+    def add_recommendations(self, user_id: str, recommended_users: Union[Set[str], Dict[str, float]]) -> None:
         """ adds the (newly generated) recommendations for a user to the system.
 
         The recommendations will usually be generated by a (separate long-running) job.
@@ -272,16 +575,34 @@ class Controller(object):
 
         Args:
             user_id: id of the user
-            recommended_users: an unordered set of the user ids of the recommended users
+            recommended_users: the user ids of the recommended users, mapped to their scores. A set (without scores)
+                scores them all 0
 
         Returns:
             None
 
         """
 
-        for recommended_user in recommended_users:
-            logger.info('adding a new recommendation for {}: {}'.format(user_id, recommended_user))
-            self.recommendationsRepository.save(user_id, recommended_user)
+        scores = recommended_users if isinstance(recommended_users, dict) else dict.fromkeys(recommended_users, 0.0)
+
+        with self._unit_of_work() as work:
+            work.lock(self._change_locks(('recommendations', user_id)))
+
+            # the scores before the update, to restore on rollback
+            previous_scores = {}
+            count = self.recommendationsRepository.count(user_id)
+            if count:
+                for recommendation in self.recommendationsRepository.get(user_id, offset=0, limit=count):
+                    previous_scores[recommendation.recommended_user] = recommendation.score
+
+            if scores:
+                logger.info('adding %s new recommendations for %s: %s', len(scores), user_id, scores)
+                # registered first: restoring the previous scores also undoes a write that failed half-way
+                work.on_rollback(self.recommendationsRepository.replace_all, user_id, previous_scores)
+                # one repository call (one round trip for the shared repositories), keeping the other recommendations
+                self.recommendationsRepository.replace_all(user_id, {**previous_scores, **scores})
+                # one change for the whole batch
+                work.publish('recommendations.added', {'user': user_id, 'recommended_users': list(scores)})
 
     def delete_recommendations(self, user_id: str) -> None:
         """ deletes the (stale) recommendations for a user.
@@ -297,11 +618,80 @@ class Controller(object):
 
         """
 
-        recommendations = self.recommendationsRepository.get(user_id, offset=0, limit=50)
+        deleted = []
+
+        with self._unit_of_work() as work:
+            work.lock(self._change_locks(('recommendations', user_id)))
+
+            # all of them: the repository honors the limit
+            count = self.recommendationsRepository.count(user_id)
+            recommendations = self.recommendationsRepository.get(user_id, offset=0, limit=count)
+
+            for recommendation in recommendations:
+                logger.info('removing the recommendation for %s: %s', user_id, recommendation.recommended_user)
+                self.recommendationsRepository.delete(recommendation.id)
+                work.on_rollback(self.recommendationsRepository.save, user_id, recommendation.recommended_user,
+                                 recommendation.score)
+                deleted.append(recommendation.recommended_user)
+
+            if deleted:
+                work.publish('recommendations.deleted', {'user': user_id, 'recommended_users': deleted})
+
+    def get_changes(self, since: int = None, limit: int = 100, wait: float = 0) -> List[Change]:
+        """ gets the changes made after a sequence number (long poll).
+
+        Consumers process the changes in order, then ask for the next ones with `since` set to the sequence number of
+        the last change they processed.
+
+        Args:
+            since: the sequence number of the last change seen, None for all the retained changes
+            limit: the maximum number of changes to return
+            wait: how long to wait for a change when there is none yet, in seconds
+
+        Returns:
+            the changes, oldest first. Empty if none came in while waiting.
+            A ChangesExpiredException is thrown if the changes after `since` are no longer retained.
+
+        """
+
+        limit = limit if limit < config.CHANGES_MAX_BATCH_SIZE else config.CHANGES_MAX_BATCH_SIZE
+
+        wait = wait if wait < config.CHANGES_MAX_WAIT_SECONDS else config.CHANGES_MAX_WAIT_SECONDS
+
+        return self.changeFeed.read(since, limit, wait)
+
+    def warm(self, user_ids: Iterable[str]) -> int:
+        """ fills the caches of some users ahead of their requests, e.g. the hot users ({@see server.hotkeys}).
+
+        The only cache filled on demand is the name index of the connections (typeahead): it is built for the users
+        that are not indexed yet, and marked as recently used for the others.
+
+        Args:
+            user_ids: ids of the users, hottest first
+
+        Returns:
+            the number of indexes built
+
+        """
+
+        built = 0
+
+        for user_id in user_ids:
+            if self.nameIndex.touch(user_id) or self.get_user(user_id) is None:
+                continue
+            self._build_name_index(user_id)
+            built += 1
+
+        return built
+
+    def _unit_of_work(self) -> ContextManager[UnitOfWork]:
+        """ runs the writes of an operation as a unit of work: committed together, or undone together.
+
+        Operations called from within an operation join its unit of work. {@see server.unit_of_work}
+
+        """
 
-        for recommendation in recommendations:
-            logger.info('removing the recommendation for {}: {}'.format(user_id, recommendation.recommended_user))
-            self.recommendationsRepository.delete(recommendation.id)
+        return unit_of_work(self.journal, self.changeFeed)
 
     def _seed_initial_recommendations(self) -> Set[str]:
         """ generates some initial recommendations for the newly-created user.
@@ -13,3 +13,34 @@ class DataIntegrityException(Exception):
         self.message = message
 
         self.exception = exception
+
+
+class ChangesExpiredException(Exception):
+    """ Thrown by the change feed.
+
+     Thrown when the changes asked for are older than the retained ones, or ahead of the feed (its sequence restarted):
+     the consumer has to resync from the repositories, then follow the feed from `head`.
+
+    """
+
+    def __init__(self, message=None, head=None):
+
+        self.message = message
+
+        self.head = head
+
+
+class AdmissionRejectedException(Exception):
+    """ Thrown by the admission control.
+
+     Thrown when a request is shed: the server is overloaded (503), or the caller exceeded its rate limit (429).
+
+    """
+
+    def __init__(self, message=None, retry_after=None, status=503):
+
+        self.message = message
+
+        self.retry_after = retry_after
+
+        self.status = status
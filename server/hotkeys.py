@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+
+""" Heavy hitters: which keys (user ids) dominate the traffic, in bounded memory.
+
+Every hit is counted in a count-min sketch: `depth` rows of `width` counters, a key incrementing one counter per row.
+The estimated count of a key is the smallest of its counters: never below the true count, and above it by at most
+e / width of the total count with probability 1 - e^-depth (0.13% with 98% confidence for the defaults). Memory does
+not depend on the number of distinct keys.
+
+The sliding window is made of `buckets` sketches, each covering window / buckets seconds: the oldest is subtracted
+from the window's sketch and recycled when its time is up. The top-K candidates are re-estimated against the window
+at that point, so that users who went quiet drop out of the list.
+
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Hashable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class CountMinSketch(object):
+    """ approximate counts of a stream of keys. Not thread-safe.
+
+    """
+
+    def __init__(self, width: int = 2048, depth: int = 4):
+
+        self.width = width
+
+        self.depth = depth
+
+        self._rows = [[0] * width for _ in range(depth)]
+
+    def indexes(self, key: Hashable) -> List[int]:
+        """ the counter of a key in every row. Computed once per hit, for the sketches sharing the same dimensions. """
+
+        # double hashing over the two halves of one 64 bit hash: rows derived from hash((row, key)) would be shifted
+        # copies of each other, so that keys colliding in one row would collide in all of them
+        value = hash(key) & 0xFFFFFFFFFFFFFFFF
+
+        low, high = value & 0xFFFFFFFF, (value >> 32) | 1
+
+        return [(low + row * high) % self.width for row in range(self.depth)]
+
+    def add(self, key: Hashable, count: int = 1, indexes: List[int] = None) -> int:
+        """ counts a key.
+
+        Returns:
+            the new estimated count of the key
+
+        """
+
+        indexes = indexes if indexes is not None else self.indexes(key)
+
+        estimate = None
+
+        for row, index in zip(self._rows, indexes):
+            row[index] += count
+            estimate = row[index] if estimate is None or row[index] < estimate else estimate
+
+        return estimate
+
+    def estimate(self, key: Hashable, indexes: List[int] = None) -> int:
+        """ the estimated count of a key: at least its true count. """
+
+        indexes = indexes if indexes is not None else self.indexes(key)
+
+        return min(row[index] for row, index in zip(self._rows, indexes))
+
+    def subtract(self, other: 'CountMinSketch') -> None:
+        """ removes the counts of a sketch of the same dimensions. """
+
+        self._rows = [[mine - theirs for mine, theirs in zip(row, other_row)]
+                      for row, other_row in zip(self._rows, other._rows)]
+
+    def clear(self) -> None:
+
+        self._rows = [[0] * self.width for _ in range(self.depth)]
+
+
+class HotKeyTracker(object):
+    """ the top-K keys of a sliding window. Thread-safe.
+
+    """
+
+    def __init__(self, k: int = 100, window: float = 300, buckets: int = 10, width: int = 2048, depth: int = 4,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            k: the number of keys to track
+            window: the length of the sliding window, in seconds
+            buckets: the number of slices of the window, i.e. the granularity of its expiry
+            width: the number of counters per row of the sketches
+            depth: the number of rows of the sketches
+            clock: the time source, in seconds
+
+        """
+
+        self.k = k
+
+        self.window = window
+
+        self.buckets = buckets
+
+        self._span = window / buckets
+
+        self._clock = clock
+
+        self._lock = threading.Lock()
+
+        # the counts of the whole window, and of its slices (oldest first)
+        self._window = CountMinSketch(width, depth)
+
+        self._slices = deque(CountMinSketch(width, depth) for _ in range(buckets))
+
+        self._epoch = int(clock() / self._span)
+
+        # key -> estimated count, at most k of them, and the key with the smallest count
+        self._top = {}  # type: Dict[Hashable, int]
+
+        self._floor = None
+
+    def _advance(self, now: float) -> None:
+
+        epoch = int(now / self._span)
+
+        steps = min(epoch - self._epoch, self.buckets)
+
+        if steps <= 0:
+            return
+
+        for _ in range(steps):
+            expired = self._slices.popleft()
+            self._window.subtract(expired)
+            expired.clear()
+            self._slices.append(expired)
+
+        self._epoch = epoch
+
+        self._top = {key: self._window.estimate(key) for key in self._top}
+        self._top = {key: count for key, count in self._top.items() if count > 0}
+        self._floor = min(self._top, key=self._top.get) if self._top else None
+
+    def _offer(self, key: Hashable, estimate: int) -> None:
+
+        if key in self._top:
+            self._top[key] = estimate
+            if key == self._floor:
+                self._floor = min(self._top, key=self._top.get)
+        elif len(self._top) < self.k:
+            self._top[key] = estimate
+            if self._floor is None or estimate < self._top[self._floor]:
+                self._floor = key
+        elif estimate > self._top[self._floor]:
+            del self._top[self._floor]
+            self._top[key] = estimate
+            self._floor = min(self._top, key=self._top.get)
+
+    def record(self, key: Hashable, count: int = 1) -> None:
+        """ counts a hit of a key. """
+
+        indexes = self._window.indexes(key)
+
+        with self._lock:
+            self._advance(self._clock())
+            self._slices[-1].add(key, count, indexes)
+            self._offer(key, self._window.add(key, count, indexes))
+
+    def top(self, limit: int = None) -> List[Tuple[Hashable, int]]:
+        """ the hottest keys of the window.
+
+        Args:
+            limit: the maximum number of keys, None for K
+
+        Returns:
+            (key, estimated count) tuples, hottest first
+
+        """
+
+        with self._lock:
+            self._advance(self._clock())
+            counts = [(key, self._window.estimate(key)) for key in self._top]
+
+        counts.sort(key=lambda item: item[1], reverse=True)
+
+        return counts[:limit] if limit is not None else counts
+
+
+def save(path: str, trackers: Dict[str, HotKeyTracker]) -> None:
+    """ writes the top keys of some trackers to a file, for the next startup to warm up from. """
+
+    snapshot = {name: [key for key, _ in tracker.top()] for name, tracker in trackers.items()}
+
+    if not any(snapshot.values()):
+        return
+
+    # written aside and renamed, so that a crash never leaves a truncated snapshot behind. The temporary file is per
+    # process: the workers of a prefork server save at the same time
+    temporary = '{}.{}.tmp'.format(path, os.getpid())
+
+    with open(temporary, 'w') as f:
+        json.dump(snapshot, f)
+
+    os.replace(temporary, path)
+
+
+def load(path: str) -> Dict[str, List[str]]:
+    """ reads the top keys written by save(): tracker name -> keys, hottest first. Empty if there is no snapshot. """
+
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except ValueError:
+        logger.warning('ignoring the unreadable hot keys snapshot: %s', path)
+        return {}
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+""" Time-ordered, sortable ids.
+
+An id is a 64 bit integer made of:
+    * 41 bits: milliseconds since EPOCH (good for ~69 years)
+    * 10 bits: the node, i.e. the worker process that allocated the id (0-1023)
+    * 12 bits: a per-millisecond sequence (4096 ids per millisecond per node)
+
+It is rendered as 13 characters of Crockford's base32, zero-padded, so that sorting the strings sorts the ids by
+allocation time. Ids from different nodes never collide, and ids from one node are strictly increasing.
+
+"""
+
+import os
+import threading
+import time
+
+# 2019-01-01T00:00:00Z, in milliseconds
+EPOCH = 1546300800000
+
+NODE_BITS = 10
+
+SEQUENCE_BITS = 12
+
+MAX_NODE = (1 << NODE_BITS) - 1
+
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+_ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+
+_DECODING = {char: value for value, char in enumerate(_ALPHABET)}
+
+ID_LENGTH = 13
+
+
+def encode(value: int) -> str:
+    """ renders a 64 bit id as a fixed-width, sortable string. """
+
+    chars = []
+
+    for _ in range(ID_LENGTH):
+        chars.append(_ALPHABET[value & 31])
+        value >>= 5
+
+    return ''.join(reversed(chars))
+
+
+def decode(id_string: str) -> int:
+    """ parses an id rendered by encode(). Raises ValueError if it is not a valid id. """
+
+    if len(id_string) != ID_LENGTH:
+        raise ValueError('not an id: {}'.format(id_string))
+
+    value = 0
+
+    try:
+        for char in id_string.upper():
+            value = (value << 5) | _DECODING[char]
+    except KeyError:
+        raise ValueError('not an id: {}'.format(id_string))
+
+    return value
+
+
+def timestamp_of(id_string: str) -> float:
+    """ gets the allocation time of an id, in seconds since the unix epoch. """
+
+    return ((decode(id_string) >> (NODE_BITS + SEQUENCE_BITS)) + EPOCH) / 1000
+
+
+class IdGenerator(object):
+    """ allocates ids for one node. Thread-safe.
+
+    """
+
+    def __init__(self, node: int):
+
+        if not 0 <= node <= MAX_NODE:
+            raise ValueError('the node must be between 0 and {}: {}'.format(MAX_NODE, node))
+
+        self.node = node
+
+        self._lock = threading.Lock()
+
+        self._last_timestamp = -1
+
+        self._sequence = 0
+
+    def next_int(self) -> int:
+
+        with self._lock:
+            timestamp = int(time.time() * 1000) - EPOCH
+            if timestamp <= self._last_timestamp:
+                # same millisecond, or the clock went backwards: keep counting from the last timestamp
+                timestamp = self._last_timestamp
+                self._sequence += 1
+                if self._sequence > MAX_SEQUENCE:
+                    # the sequence is exhausted: borrow the next millisecond rather than wait for it
+                    timestamp += 1
+                    self._sequence = 0
+            else:
+                self._sequence = 0
+            self._last_timestamp = timestamp
+
+            return (timestamp << (NODE_BITS + SEQUENCE_BITS)) | (self.node << SEQUENCE_BITS) | self._sequence
+
+    def next_id(self) -> str:
+
+        return encode(self.next_int())
+
+
+_generator = None
+
+_configured_node = None
+
+_generator_lock = threading.Lock()
+
+
+def configure(node: int = None) -> None:
+    """ sets the node of this process.
+
+    Every process allocating ids must have its own node. When no node is configured, it is derived from the process
+    id (and derived again in forked children). That is a best effort: configure distinct nodes wherever several
+    processes or hosts allocate ids for the same data.
+
+    Args:
+        node: the node (0-1023), None to derive it from the process id
+
+    Returns:
+        None
+
+    """
+
+    global _generator, _configured_node
+
+    with _generator_lock:
+        _configured_node = node
+        _generator = None
+
+
+def _get_generator() -> IdGenerator:
+
+    global _generator
+
+    generator = _generator
+
+    if generator is None:
+        with _generator_lock:
+            if _generator is None:
+                node = _configured_node if _configured_node is not None else os.getpid() & MAX_NODE
+                _generator = IdGenerator(node)
+            generator = _generator
+
+    return generator
+
+
+def _reset_after_fork() -> None:
+
+    global _generator, _generator_lock
+
+    _generator_lock = threading.Lock()
+
+    if _configured_node is None:
+        _generator = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def new_id() -> str:
+    """ allocates a new id. """
+
+    return _get_generator().next_id()
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+
+""" Minimal, thread-safe metrics with a Prometheus text exposition.
+
+Metrics are kept in-process and rendered on demand (see the /metrics route). Recording a sample costs a lock
+acquisition and a dict update, which keeps the instrumentation overhead in the low microseconds.
+
+"""
+
+import threading
+from abc import abstractmethod, ABC
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Tuple
+
+# latency buckets (seconds), dense around the 500 ms SLA
+DEFAULT_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0)
+
+
+def _escape(value: str) -> str:
+
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labelnames: Iterable[str], labelvalues: Iterable[str], extra: Dict[str, str] = None) -> str:
+
+    pairs = ['{}="{}"'.format(name, _escape(value)) for name, value in zip(labelnames, labelvalues)]
+
+    if extra:
+        pairs += ['{}="{}"'.format(name, _escape(value)) for name, value in extra.items()]
+
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+
+    if value == float('inf'):
+        return '+Inf'
+
+    return repr(float(value))
+
+
+class _Metric(ABC):
+
+    type = None
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+
+        self.name = name
+
+        self.documentation = documentation
+
+        self.labelnames = tuple(labelnames)
+
+        self._lock = threading.Lock()
+
+    def _header(self) -> List[str]:
+
+        return [
+            '# HELP {} {}'.format(self.name, self.documentation),
+            '# TYPE {} {}'.format(self.name, self.type)
+        ]
+
+    @abstractmethod
+    def render(self) -> List[str]:
+        """ the lines of the metric in the text exposition, {@see _header} included. """
+
+        pass
+
+
+class Counter(_Metric):
+    """ a monotonically increasing value, per label set.
+
+    """
+
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+
+        super().__init__(name, documentation, labelnames)
+
+        self._values = {}
+
+    def inc(self, labelvalues: Tuple[str, ...] = (), amount: float = 1) -> None:
+
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def get(self, labelvalues: Tuple[str, ...] = ()) -> float:
+
+        return self._values.get(labelvalues, 0)
+
+    def render(self) -> List[str]:
+
+        with self._lock:
+            values = list(self._values.items())
+
+        return self._header() + ['{}{} {}'.format(self.name, _format_labels(self.labelnames, labelvalues),
+                                                  _format_value(value))
+                                 for labelvalues, value in values]
+
+
+class Gauge(Counter):
+    """ a value that can go up and down, per label set.
+
+    """
+
+    type = 'gauge'
+
+    def dec(self, labelvalues: Tuple[str, ...] = (), amount: float = 1) -> None:
+
+        self.inc(labelvalues, -amount)
+
+    def set(self, labelvalues: Tuple[str, ...] = (), value: float = 0) -> None:
+
+        with self._lock:
+            self._values[labelvalues] = value
+
+
+class Histogram(_Metric):
+    """ samples observations into cumulative buckets, per label set.
+
+    Quantiles (p50/p95/p99) are derived from the buckets, either by prometheus (histogram_quantile) or locally
+    through quantile().
+
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Iterable[float] = DEFAULT_LATENCY_BUCKETS):
+
+        super().__init__(name, documentation, labelnames)
+
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+        # label values -> [per-bucket (non-cumulative) counts, sum, count]
+        self._values = {}
+
+    def observe(self, labelvalues: Tuple[str, ...], value: float) -> None:
+
+        index = bisect_left(self.buckets, value)
+
+        with self._lock:
+            entry = self._values.get(labelvalues)
+            if entry is None:
+                entry = self._values[labelvalues] = [[0] * len(self.buckets), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def quantile(self, labelvalues: Tuple[str, ...], q: float) -> float:
+        """ estimates a quantile by linear interpolation inside the bucket that contains it.
+
+        Args:
+            labelvalues: the label set to look at
+            q: the quantile, between 0 and 1
+
+        Returns:
+            the estimated value, or None if nothing was observed
+
+        """
+
+        with self._lock:
+            entry = self._values.get(labelvalues)
+            if entry is None or entry[2] == 0:
+                return None
+            counts, total = list(entry[0]), entry[2]
+
+        rank = q * total
+        cumulative = 0
+        for index, count in enumerate(counts):
+            if cumulative + count >= rank and count > 0:
+                upper = self.buckets[index]
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                if upper == float('inf'):
+                    return lower
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+
+        return self.buckets[-2]
+
+    def render(self) -> List[str]:
+
+        with self._lock:
+            values = [(labelvalues, list(entry[0]), entry[1], entry[2]) for labelvalues, entry in self._values.items()]
+
+        lines = self._header()
+
+        for labelvalues, counts, total_sum, total_count in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, labelvalues, {'le': _format_value(bound)})
+                lines.append('{}_bucket{} {}'.format(self.name, labels, cumulative))
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append('{}_sum{} {}'.format(self.name, labels, _format_value(total_sum)))
+            lines.append('{}_count{} {}'.format(self.name, labels, total_count))
+
+        return lines
+
+
+class Registry(object):
+    """ holds the metrics of the process and renders them in the prometheus text format.
+
+    """
+
+    def __init__(self):
+
+        self._metrics = {}
+
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        """ registers a metric, or returns the already registered metric with the same name.
+
+        """
+
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Iterable[float] = DEFAULT_LATENCY_BUCKETS) -> Histogram:
+
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
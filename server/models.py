@@ -3,33 +3,87 @@
 from __future__ import annotations
 
 from abc import abstractmethod, ABC
-from typing import Set, Iterable
+from typing import Dict, Set, Iterable, List, Tuple
 
 
-class Profile(object):
+class _Immutable(object):
+    """ a value that can't be changed once built: a change is a new value.
+
+    Immutable values can be shared across threads without locks, a reader never sees one half-updated.
+
+    """
+
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+
+        raise AttributeError("{} is immutable, can't set {}".format(type(self).__name__, name))
+
+    def __delattr__(self, name):
+
+        raise AttributeError("{} is immutable, can't delete {}".format(type(self).__name__, name))
+
+
+class Profile(_Immutable):
     """ models the profile of a user.
 
     """
 
+    __slots__ = ('name', 'college')
+
     def __init__(self, name: str, college: str):
 
-        self.name = name
+        object.__setattr__(self, 'name', name)
 
-        self.college = college
+        object.__setattr__(self, 'college', college)
 
+    def replace(self, **changes) -> Profile:
+        """ a copy of the profile with some fields changed.
 
-class User(object):
+        Args:
+            changes: field: new value
+
+        Returns:
+            the new profile
+
+        """
+
+        return Profile(name=changes.get('name', self.name), college=changes.get('college', self.college))
+
+    def __reduce__(self):
+        # rebuilt through the constructor: restoring the slots would go through __setattr__ (pickle, copy)
+        return Profile, (self.name, self.college)
+
+
+class User(_Immutable):
     """ models a user in the app.
 
+    A user is an immutable snapshot of a version of the user record. An update publishes a new version
+    {@see with_profile} in place of the previous one, readers holding the previous one keep a consistent view.
+
     """
 
-    def __init__(self, user_id: str, email: str, profile: Profile):
+    __slots__ = ('id', 'email', 'profile', 'version')
 
-        self.id = user_id
+    def __init__(self, user_id: str, email: str, profile: Profile, version: int = 1):
 
-        self.email = email
+        object.__setattr__(self, 'id', user_id)
 
-        self.profile = profile
+        object.__setattr__(self, 'email', email)
+
+        object.__setattr__(self, 'profile', profile)
+
+        # incremented on every update: usable as an ETag, or to tell cached copies apart
+        object.__setattr__(self, 'version', version)
+
+    def with_profile(self, profile: Profile) -> User:
+        """ the next version of the user, with another profile. """
+
+        return User(self.id, self.email, profile, self.version + 1)
+
+    def __reduce__(self):
+        # {@see Profile.__reduce__}
+        return User, (self.id, self.email, self.profile, self.version)
 
     def __str__(self):
         return "User: [id: {}, name: {}, email: {}, college: {}]"\
@@ -38,6 +92,10 @@ class User(object):
 
 class UsersRepository(ABC):
 
+    # True when several processes can share the data (e.g. the workers of server.prefork): the writes of one are
+    # seen by the others
+    shared = False
+
     @abstractmethod
     def get(self, user_id: str) -> User:
         """ gets a user object from the repo.
@@ -52,6 +110,39 @@ class UsersRepository(ABC):
 
         pass
 
+    @abstractmethod
+    def get_many(self, user_ids: List[str]) -> Dict[str, User]:
+        """ gets several user objects from the repo in one go.
+
+        Args:
+            user_ids: ids of the users
+
+        Returns:
+             the users found, by id. The ids not found are left out
+
+        """
+
+        pass
+
+    @abstractmethod
+    def get_by_college(self, college: str, cursor: str = None, limit: int = 50) -> List[User]:
+        """ gets the users at a college, ordered by id.
+
+        Backed by an index on (college, user id): the cost is proportional to the page size, not to the number of
+        users.
+
+        Args:
+            college: the college
+            cursor: the id of the last user of the previous page, None for the first page
+            limit: the maximum number of results to retrieve in one go
+
+        Returns:
+             the users at the college with an id greater than the cursor
+
+        """
+
+        pass
+
     @abstractmethod
     def create(self, email: str, profile: Profile) -> User:
         """ creates and persists a new user object in the repo.
@@ -71,12 +162,15 @@ class UsersRepository(ABC):
     def update(self, user_id: str, profile: Profile) -> User:
         """ updates and persists a user object in the repo.
 
+        The user objects are never changed in place: the next version of the user {@see User.with_profile} replaces
+        the current one in a single reference swap, so that reads need no lock.
+
         Args:
             user_id: id of the user
             profile: the profile (details to update)
 
         Returns:
-             the user object that was updated
+             the new version of the user, None if the user does not exist
 
         """
 
@@ -90,7 +184,7 @@ class UsersRepository(ABC):
             user_id: id of the user
 
         Returns:
-            None
+            None. A KeyError is thrown if the user does not exist.
 
         """
 
@@ -102,15 +196,22 @@ class Connection(object):
 
     """
 
-    def __init__(self, connection_id: str, users: Set[str]):
+    def __init__(self, connection_id: str, users: Set[str], created: float = 0.0):
 
         self.id = connection_id
 
         self.users = users
 
+        # when the users got connected, in seconds since the unix epoch (milliseconds precision). 0 when unknown: the
+        # connections of the snapshots made before it was recorded
+        self.created = created
+
 
 class ConnectionsRepository(ABC):
 
+    # {@see UsersRepository.shared}
+    shared = False
+
     @abstractmethod
     def get_by_id(self, connection_id) -> Connection:
         """ gets a connection from the repo on the basis of id.
@@ -119,7 +220,7 @@ class ConnectionsRepository(ABC):
             connection_id: id of the connection
 
         Returns:
-             the connection object linked to the id
+             the connection object linked to the id. A KeyError is thrown if the connection does not exist.
 
         """
 
@@ -133,7 +234,7 @@ class ConnectionsRepository(ABC):
             users: the user ids present in the connection
 
         Returns:
-             the connection object linked to the users
+             the connection object linked to the users (in any order), None if they are not connected
 
         """
 
@@ -144,7 +245,8 @@ class ConnectionsRepository(ABC):
         """ gets all connections from the repo for a user.
 
         Prefer pagination for optimum performance across users.
-        Use offset and limit to create pages.
+        Use offset and limit to create pages: the connections are in a stable order, so that the pages of a user
+        (while no connection of theirs is made or removed) hold every connection exactly once.
 
         Args:
             user: the user id for which all linked connections are to be fetched
@@ -152,21 +254,92 @@ class ConnectionsRepository(ABC):
             limit: the maximum number of results to retrieve in one go
 
         Returns:
-             all the connection objects linked to the user
+             the connection objects linked to the user, at most limit of them
+
+        """
+
+        pass
+
+    @abstractmethod
+    def get_recent(self, user: str, cursor: Tuple[float, str] = None, since: float = None,
+                   limit: int = 50) -> List[Connection]:
+        """ gets the connections of a user, the most recent first.
+
+        Backed by a per-user index on (creation time, connected user): the cost is proportional to the page size, not
+        to the number of connections. Connections made at the same time are ordered by connected user, descending.
+
+        Args:
+            user: the user id
+            cursor: the creation time and the connected user of the last connection of the previous page, None for
+                the first page
+            since: only the connections made at or after this time (seconds since the unix epoch), None for all
+            limit: the maximum number of results to retrieve in one go
+
+        Returns:
+             the connections of the user made before the cursor, most recent first
+
+        """
+
+        pass
+
+    @abstractmethod
+    def count(self, user: str) -> int:
+        """ counts the connections of a user.
+
+        Maintained as connections are created and deleted: the cost does not depend on the number of connections.
+
+        Args:
+            user: the user id
+
+        Returns:
+             the number of connections of the user
+
+        """
+
+        pass
+
+    @abstractmethod
+    def connected(self, user: str, others: Iterable[str]) -> Set[str]:
+        """ finds which of some users are connected to a user, in one call.
+
+        Backed by an adjacency index: the cost depends on the number of users checked, not on the number of
+        connections.
+
+        Args:
+            user: the user id
+            others: the user ids to check
+
+        Returns:
+             the user ids (among others) connected to the user
 
         """
 
         pass
 
     @abstractmethod
-    def create(self, users: Set[str]) -> Connection:
+    def create(self, users: Set[str], created: float = None) -> Connection:
         """ creates and persists a connection in the repo.
 
         Args:
             users: the user ids present in the connection
+            created: when the users got connected, now if None. Given to restore a deleted connection
 
         Returns:
-             the created connection object
+             the created connection object. A DataIntegrityException is thrown if the users are already connected.
+
+        """
+
+        pass
+
+    @abstractmethod
+    def create_many(self, pairs: Iterable[Set[str]]) -> List[Connection]:
+        """ creates and persists several connections in the repo, in one go (one round trip for a remote repo).
+
+        Args:
+            pairs: the user ids of every connection to create
+
+        Returns:
+             the created connection objects. The pairs already connected (or listed twice) are skipped.
 
         """
 
@@ -180,7 +353,7 @@ class ConnectionsRepository(ABC):
             users: the user ids present in the connection
 
         Returns:
-             None
+             None. A KeyError is thrown if the users are not connected.
 
         """
 
@@ -192,7 +365,7 @@ class Recommendation(object):
 
     """
 
-    def __init__(self, recommendation_id: str, user: str, recommended_user: str):
+    def __init__(self, recommendation_id: str, user: str, recommended_user: str, score: float = 0.0):
 
         self.id = recommendation_id
 
@@ -200,9 +373,15 @@ class Recommendation(object):
 
         self.recommended_user = recommended_user
 
+        # the relevance of the recommendation, as given by the recommender: the higher, the better
+        self.score = score
+
 
 class RecommendationsRepository(ABC):
 
+    # {@see UsersRepository.shared}
+    shared = False
+
     @abstractmethod
     def get(self, user: str, offset: int, limit: int) -> Iterable[Recommendation]:
         """ gets all recommendations from the repo for a given user.
@@ -213,22 +392,59 @@ class RecommendationsRepository(ABC):
             limit: the maximum number of results to retrieve in one go
 
         Returns:
-             the recommendations for the user
+             the recommendations for the user, by descending score (ties by recommended user id)
+
+        """
+
+        pass
+
+    @abstractmethod
+    def count(self, user: str) -> int:
+        """ counts the recommendations of a user.
+
+        Maintained as recommendations are saved and deleted: the cost does not depend on the number of
+        recommendations.
+
+        Args:
+            user: the user id
+
+        Returns:
+             the number of recommendations of the user
 
         """
 
         pass
 
     @abstractmethod
-    def save(self, user: str, recommended_user: str) -> Recommendation:
+    def save(self, user: str, recommended_user: str, score: float = 0.0) -> Recommendation:
         """ create and persist a recommendation in the repo.
 
+        Saving a recommendation that already exists (same user and recommended user) updates its score.
+
         Args:
             user: the user id to which the recommendation is linked
             recommended_user
+            score: the relevance of the recommendation
+
+        Returns:
+             the created (or updated) recommendation
+
+        """
+
+        pass
+
+    @abstractmethod
+    def replace_all(self, user: str, scores: Dict[str, float]) -> List[Recommendation]:
+        """ replaces all the recommendations of a user, in one go (one round trip for a remote repo).
+
+        The recommended users kept keep their recommendation ids, the others are deleted.
+
+        Args:
+            user: the user id to which the recommendations are linked
+            scores: the recommended users, mapped to the relevance of their recommendation
 
         Returns:
-             the created recommendation
+             the saved recommendations
 
         """
 
@@ -242,8 +458,153 @@ class RecommendationsRepository(ABC):
             recommendation_id: id of the recommendation
 
         Returns:
-             None
+             None. A KeyError is thrown if the recommendation does not exist.
 
         """
 
         pass
+
+
+class AsyncUsersRepository(ABC):
+    """ the async variant of the UsersRepository contract.
+
+    Implementations are expected to not block the event loop while waiting on I/O.
+
+    """
+
+    @abstractmethod
+    async def get(self, user_id: str) -> User:
+        """ gets a user object from the repo. {@see UsersRepository.get} """
+
+        pass
+
+    @abstractmethod
+    async def get_many(self, user_ids: List[str]) -> Dict[str, User]:
+        """ gets several user objects from the repo in one go. {@see UsersRepository.get_many} """
+
+        pass
+
+    @abstractmethod
+    async def get_by_college(self, college: str, cursor: str = None, limit: int = 50) -> List[User]:
+        """ gets the users at a college, ordered by id. {@see UsersRepository.get_by_college} """
+
+        pass
+
+    @abstractmethod
+    async def create(self, email: str, profile: Profile) -> User:
+        """ creates and persists a new user object in the repo. {@see UsersRepository.create} """
+
+        pass
+
+    @abstractmethod
+    async def update(self, user_id: str, profile: Profile) -> User:
+        """ updates and persists a user object in the repo. {@see UsersRepository.update} """
+
+        pass
+
+    @abstractmethod
+    async def delete(self, user_id: str) -> None:
+        """ deletes a user object from the repo. {@see UsersRepository.delete} """
+
+        pass
+
+
+class AsyncConnectionsRepository(ABC):
+    """ the async variant of the ConnectionsRepository contract.
+
+    Implementations are expected to not block the event loop while waiting on I/O.
+
+    """
+
+    @abstractmethod
+    async def get_by_id(self, connection_id) -> Connection:
+        """ gets a connection from the repo on the basis of id. {@see ConnectionsRepository.get_by_id} """
+
+        pass
+
+    @abstractmethod
+    async def get(self, users: Set[str]) -> Connection:
+        """ gets a connection from the repo on the basis of connected users. {@see ConnectionsRepository.get} """
+
+        pass
+
+    @abstractmethod
+    async def get_all(self, user: str, offset: int, limit: int) -> Iterable[Connection]:
+        """ gets all connections from the repo for a user. {@see ConnectionsRepository.get_all} """
+
+        pass
+
+    @abstractmethod
+    async def get_recent(self, user: str, cursor: Tuple[float, str] = None, since: float = None,
+                         limit: int = 50) -> List[Connection]:
+        """ gets the connections of a user, the most recent first. {@see ConnectionsRepository.get_recent} """
+
+        pass
+
+    @abstractmethod
+    async def count(self, user: str) -> int:
+        """ counts the connections of a user. {@see ConnectionsRepository.count} """
+
+        pass
+
+    @abstractmethod
+    async def connected(self, user: str, others: Iterable[str]) -> Set[str]:
+        """ finds which of some users are connected to a user. {@see ConnectionsRepository.connected} """
+
+        pass
+
+    @abstractmethod
+    async def create(self, users: Set[str], created: float = None) -> Connection:
+        """ creates and persists a connection in the repo. {@see ConnectionsRepository.create} """
+
+        pass
+
+    @abstractmethod
+    async def create_many(self, pairs: Iterable[Set[str]]) -> List[Connection]:
+        """ creates and persists several connections in the repo. {@see ConnectionsRepository.create_many} """
+
+        pass
+
+    @abstractmethod
+    async def delete(self, users: Set[str]) -> None:
+        """ deletes a connection from the repo on the basis of connected users. {@see ConnectionsRepository.delete} """
+
+        pass
+
+
+class AsyncRecommendationsRepository(ABC):
+    """ the async variant of the RecommendationsRepository contract.
+
+    Implementations are expected to not block the event loop while waiting on I/O.
+
+    """
+
+    @abstractmethod
+    async def get(self, user: str, offset: int, limit: int) -> Iterable[Recommendation]:
+        """ gets all recommendations from the repo for a given user. {@see RecommendationsRepository.get} """
+
+        pass
+
+    @abstractmethod
+    async def count(self, user: str) -> int:
+        """ counts the recommendations of a user. {@see RecommendationsRepository.count} """
+
+        pass
+
+    @abstractmethod
+    async def save(self, user: str, recommended_user: str, score: float = 0.0) -> Recommendation:
+        """ create and persist a recommendation in the repo. {@see RecommendationsRepository.save} """
+
+        pass
+
+    @abstractmethod
+    async def replace_all(self, user: str, scores: Dict[str, float]) -> List[Recommendation]:
+        """ replaces all the recommendations of a user. {@see RecommendationsRepository.replace_all} """
+
+        pass
+
+    @abstractmethod
+    async def delete(self, recommendation_id: str) -> None:
+        """ deletes a recommendation from the repo. {@see RecommendationsRepository.delete} """
+
+        pass
@@ -0,0 +1,482 @@
+# -*- coding: utf-8 -*-
+
+""" Production serving: a preforking master and its worker processes.
+
+The master imports the app once, which loads the repositories and warms their caches, then forks the workers. The
+workers share the memory of the master copy-on-write: the preloaded data is only copied a page at a time, when it is
+written to. gc.freeze() keeps the garbage collector of the workers from touching (and so copying) every preloaded
+object.
+
+The workers all accept on the listening socket of the master, the kernel spreads the connections over them. Every
+worker serves its connections with a bounded number of threads (PREFORK_THREADS): a worker with no thread free stops
+accepting, and the connections go to the others. The master only supervises: it restarts the workers that die, and
+handles the signals:
+    TERM, INT: graceful shutdown. The workers stop accepting, finish the requests in flight (for up to
+        PREFORK_GRACEFUL_TIMEOUT_SECONDS), then exit.
+    HUP: graceful reload. The master re-executes itself, keeping the listening socket and its workers. It preloads the
+        new code and data while the old workers keep serving, starts the new workers, then shuts the old ones down
+        gracefully. No connection is refused in the meantime.
+
+Every worker allocates ids with a node of its own: ID_NODE (0 when unset) + the index of the worker, + N every other
+reload. During a reload, the retiring workers and the new ones both allocate ids: the two generations use disjoint
+nodes, and a reload is deferred until the previous workers have retired. A host running N workers takes the nodes
+ID_NODE to ID_NODE + 2N - 1: hosts sharing data need ID_NODE set to disjoint ranges.
+
+The data of the in-process (json, sharded) repositories would be per worker: the writes made by a worker would not be
+seen by the others. More than one worker is refused unless all the repositories are shared (the `shared` attribute of
+the repositories, e.g. server.ORM.redis_repositories). The change feed, the metrics and the admission limits stay per
+worker.
+
+Usage (from the server directory):
+    python -m server.prefork [--bind 0.0.0.0:5000] [--workers 4] [--threads 16]
+
+"""
+
+import argparse
+import gc
+import logging
+import os
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Set
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+logger = logging.getLogger(__name__)
+
+# environment passed to the master re-executed on reload: the inherited listening socket, the workers to retire, the
+# number of reloads so far
+_LISTEN_FD_VARIABLE = 'SOCIAL_APP_PREFORK_FD'
+
+_RETIRING_VARIABLE = 'SOCIAL_APP_PREFORK_RETIRING'
+
+_GENERATION_VARIABLE = 'SOCIAL_APP_PREFORK_GENERATION'
+
+# a worker dying sooner than this after its start is restarted after a pause, not right away
+_MIN_WORKER_LIFETIME_SECONDS = 1.0
+
+# the index of this worker, in a worker process. None elsewhere
+worker = None
+
+
+class _Handler(WSGIRequestHandler):
+
+    # how long a client that sends nothing keeps its thread, set from the settings. The handler closes the connection
+    # after every response (werkzeug has no keep-alive)
+    timeout = 5
+
+
+class _WorkerServer(BaseWSGIServer):
+    """ a WSGI server accepting on an inherited socket, with at most `threads` connections served at once. """
+
+    multithread = True
+
+    def __init__(self, host: str, port: int, app, threads: int, fd: int):
+
+        super().__init__(host, port, app, handler=_Handler, fd=fd)
+
+        # the workers share the socket: accept() must not block when another worker took the connection
+        self.socket.setblocking(False)
+
+        self.threads = threads
+
+        self._free = threading.Semaphore(threads)
+
+    def get_request(self):
+
+        if not self._free.acquire(blocking=False):
+            # busy: leave the connection to the other workers, and wait for a thread before accepting again
+            self._free.acquire()
+
+        try:
+            return super().get_request()
+        except OSError:
+            self._free.release()
+            raise
+
+    def process_request(self, request, client_address) -> None:
+
+        threading.Thread(target=self._process_request, args=(request, client_address), daemon=True).start()
+
+    def _process_request(self, request, client_address) -> None:
+
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._free.release()
+
+    def drain(self, timeout: float) -> bool:
+        """ waits until no connection is served anymore.
+
+        Returns:
+            False if some were still served after the timeout
+
+        """
+
+        deadline = time.monotonic() + timeout
+
+        for _ in range(self.threads):
+            if not self._free.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                return False
+
+        return True
+
+
+def _parse_bind(bind: str):
+
+    host, _, port = bind.rpartition(':')
+
+    return host or '0.0.0.0', int(port)
+
+
+def _listen(bind: str, backlog: int) -> socket.socket:
+    """ opens the listening socket, or takes over the one of the master that re-executed into this process. """
+
+    if _LISTEN_FD_VARIABLE in os.environ:
+        listener = socket.socket(fileno=int(os.environ.pop(_LISTEN_FD_VARIABLE)))
+        listener.set_inheritable(False)
+        return listener
+
+    host, port = _parse_bind(bind)
+
+    listener = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(backlog)
+
+    return listener
+
+
+class Master(object):
+    """ forks the workers and supervises them. {@see server.prefork} """
+
+    def __init__(self, listener: socket.socket, workers: int, graceful_timeout: float, argv: List[str]):
+        """
+        Args:
+            listener: the listening socket, shared with the workers
+            workers: the number of workers
+            graceful_timeout: how long the workers get to finish their requests on shutdown or reload (in seconds)
+            argv: the command line arguments, to re-execute the master with on reload
+
+        """
+
+        self.listener = listener
+
+        self.workers = workers
+
+        self.graceful_timeout = graceful_timeout
+
+        self.argv = argv
+
+        # pid -> index of the running workers
+        self._pids = {}  # type: Dict[int, int]
+
+        # index -> start time of the worker
+        self._started = {}  # type: Dict[int, float]
+
+        # the workers of the previous master being shut down, after a reload
+        retiring = os.environ.pop(_RETIRING_VARIABLE, '')
+        self._retiring = {int(pid) for pid in retiring.split(',') if pid}  # type: Set[int]
+
+        # the number of reloads so far
+        self.generation = int(os.environ.pop(_GENERATION_VARIABLE, '0'))
+
+        # a reload was asked for while the previous workers were still retiring
+        self._reload_pending = False
+
+        self._wakeup_read, self._wakeup_write = os.pipe()
+
+    def run(self) -> Optional[int]:
+        """ starts the workers and supervises them until shut down.
+
+        Returns:
+            None in the master, once shut down. In a worker process, the index of the worker: the caller serves it
+
+        """
+
+        os.set_blocking(self._wakeup_write, False)
+        signal.set_wakeup_fd(self._wakeup_write)
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGCHLD):
+            # the handlers do nothing: the signal numbers are read from the wakeup pipe
+            signal.signal(signum, lambda *_: None)
+
+        # the objects preloaded so far are never collected: the collector of the workers leaves their pages alone
+        gc.collect()
+        gc.freeze()
+
+        for index in range(self.workers):
+            if self._spawn(index):
+                return index
+
+        if self._retiring:
+            logger.info('reloaded, retiring the previous workers: %s', sorted(self._retiring))
+            self._signal(self._retiring, signal.SIGTERM)
+
+        while True:
+            for signum in self._wait(timeout=1.0):
+                if signum in (signal.SIGTERM, signal.SIGINT):
+                    self._stop()
+                    return None
+                if signum == signal.SIGHUP:
+                    self._reload_pending = True
+                    if self._retiring:
+                        logger.info('reload deferred until the previous workers have retired: %s',
+                                    sorted(self._retiring))
+            for index in self._reap():
+                if self._restart(index):
+                    return index
+            if self._reload_pending and not self._retiring:
+                self._reload()
+
+    def first_id_node(self, id_node: Optional[int]) -> int:
+        """ the id node of the first worker: the generations alternate between two ranges of nodes, so that the
+        workers retiring during a reload and their replacements never share a node.
+
+        Args:
+            id_node: the first id node of the host (ID_NODE), None for 0
+
+        Returns:
+            the id node of the worker of index 0, the others follow
+
+        """
+
+        return (id_node or 0) + self.generation % 2 * self.workers
+
+    def _spawn(self, index: int) -> bool:
+        """ forks a worker. Returns True in the worker. """
+
+        pid = os.fork()
+
+        if pid == 0:
+            signal.set_wakeup_fd(-1)
+            os.close(self._wakeup_read)
+            os.close(self._wakeup_write)
+            # the master shuts the workers down: a Ctrl-C sent to the whole process group is left to it
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            return True
+
+        self._pids[pid] = index
+        self._started[index] = time.monotonic()
+
+        logger.info('started worker %s (pid %s)', index, pid)
+
+        return False
+
+    def _restart(self, index: int) -> bool:
+
+        lifetime = time.monotonic() - self._started[index]
+
+        if lifetime < _MIN_WORKER_LIFETIME_SECONDS:
+            # crashing at startup: don't fork in a tight loop
+            time.sleep(_MIN_WORKER_LIFETIME_SECONDS - lifetime)
+
+        return self._spawn(index)
+
+    def _wait(self, timeout: float) -> List[int]:
+        """ waits for signals, returns their numbers. """
+
+        try:
+            readable, _, _ = select.select([self._wakeup_read], [], [], timeout)
+        except InterruptedError:
+            return []
+
+        return list(os.read(self._wakeup_read, 64)) if readable else []
+
+    def _reap(self) -> List[int]:
+        """ collects the processes that exited, returns the indexes of the workers to restart. """
+
+        dead = []
+
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return dead
+            if pid == 0:
+                return dead
+            if pid in self._retiring:
+                self._retiring.discard(pid)
+                logger.info('retired the previous worker (pid %s)', pid)
+            elif pid in self._pids:
+                index = self._pids.pop(pid)
+                logger.error('worker %s (pid %s) exited with status %s, restarting it', index, pid, status)
+                dead.append(index)
+
+    @staticmethod
+    def _signal(pids: Set[int], signum: int) -> None:
+
+        for pid in pids:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def _stop(self) -> None:
+        """ shuts the workers down gracefully, kills the ones still running after the graceful timeout. """
+
+        logger.info('shutting down %s workers', len(self._pids))
+
+        self._signal(set(self._pids) | self._retiring, signal.SIGTERM)
+
+        # a little longer than the workers give themselves
+        deadline = time.monotonic() + self.graceful_timeout + 5
+
+        while self._pids or self._retiring:
+            exited = self._wait_children(deadline)
+            if not exited:
+                logger.error('killing the workers still running: %s', sorted(set(self._pids) | self._retiring))
+                self._signal(set(self._pids) | self._retiring, signal.SIGKILL)
+                deadline = time.monotonic() + 5
+
+        self.listener.close()
+
+    def _wait_children(self, deadline: float) -> bool:
+
+        while time.monotonic() < deadline:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self._pids.clear()
+                self._retiring.clear()
+                return True
+            if pid:
+                self._pids.pop(pid, None)
+                self._retiring.discard(pid)
+                return True
+            self._wait(timeout=0.1)
+
+        return False
+
+    def _reload(self) -> None:
+        """ re-executes the master in place: same pid, so the current workers stay its children. """
+
+        from server.settings import log
+
+        logger.info('reloading')
+
+        self.listener.set_inheritable(True)
+
+        environment = dict(os.environ)
+        environment[_LISTEN_FD_VARIABLE] = str(self.listener.fileno())
+        environment[_RETIRING_VARIABLE] = ','.join(str(pid) for pid in set(self._pids) | self._retiring)
+        environment[_GENERATION_VARIABLE] = str(self.generation + 1)
+
+        log.stop_logging()
+
+        os.execve(sys.executable, [sys.executable, '-m', 'server.prefork'] + self.argv, environment)
+
+
+def serve_worker(app, listener: socket.socket, index: int, threads: int, timeout: float, graceful_timeout: float,
+                 id_node: Optional[int]) -> int:
+    """ serves requests in a worker process until it receives SIGTERM.
+
+    Returns:
+        the exit status of the worker
+
+    """
+
+    from server import ids
+    from server.settings import log
+
+    global worker
+
+    worker = index
+
+    # not derived from the process id: two workers could get the same node
+    ids.configure(node=(id_node or 0) + index)
+
+    _Handler.timeout = timeout
+
+    host, port = listener.getsockname()[:2]
+
+    server = _WorkerServer(host, port, app, threads=threads, fd=listener.fileno())
+
+    # the server has a copy of its own
+    listener.close()
+
+    def shutdown(*_):
+        # shutdown() waits for the accept loop to stop: not from the thread running it
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, shutdown)
+
+    # closes the socket once stopped
+    server.serve_forever(poll_interval=0.5)
+
+    if server.drain(graceful_timeout):
+        return 0
+
+    logger.warning('worker %s exits with requests still in flight after %ss', index, graceful_timeout)
+
+    # the threads in flight would keep the interpreter from exiting
+    log.stop_logging()
+    os._exit(1)
+
+
+def main(argv: List[str] = None) -> int:
+
+    argv = sys.argv[1:] if argv is None else argv
+
+    parser = argparse.ArgumentParser(prog='python -m server.prefork', description=__doc__.split('\n\n')[0])
+    parser.add_argument('--bind', help='host:port to listen on (default: PREFORK_BIND)')
+    parser.add_argument('--workers', type=int, help='the number of worker processes (default: PREFORK_WORKERS)')
+    parser.add_argument('--threads', type=int, help='the threads per worker (default: PREFORK_THREADS)')
+    args = parser.parse_args(argv)
+
+    # preloading: the app, its repositories and their data, once for all the workers
+    from server.app import app, config
+    from server import ids, resources, views  # noqa: F401 (views registers the routes)
+
+    workers = args.workers or config.PREFORK_WORKERS or os.cpu_count() or 1
+
+    unshared = [type(repository).__name__ for repository in
+                (config.usersRepository, config.connectionsRepository, config.recommendationsRepository)
+                if not repository.shared]
+
+    if workers > 1 and unshared:
+        parser.error('{} workers would each have a copy of the data of {}: serve them from shared repositories '
+                     '(Redis), or run 1 worker'.format(workers, ', '.join(unshared)))
+
+    # two generations of workers during a reload {@see Master.first_id_node}
+    if (config.ID_NODE or 0) + 2 * workers - 1 > ids.MAX_NODE:
+        parser.error('ID_NODE {} leaves no id node for {} workers'.format(config.ID_NODE or 0, workers))
+
+    listener = _listen(args.bind or config.PREFORK_BIND, config.PREFORK_BACKLOG)
+
+    # before forking: the workers share the warmed caches
+    resources.controller.warm(resources.hottest_readers())
+
+    logger.info('serving on %s with %s workers of %s threads', listener.getsockname()[:2], workers,
+                args.threads or config.PREFORK_THREADS)
+
+    master = Master(listener, workers, config.PREFORK_GRACEFUL_TIMEOUT_SECONDS, argv)
+
+    index = master.run()
+
+    if index is None:
+        return 0
+
+    # the hot users are tracked per worker: every worker saves its own at exit, the last one to exit wins
+    resources.persist_hot_users()
+
+    return serve_worker(app, listener, index, threads=args.threads or config.PREFORK_THREADS,
+                        timeout=config.PREFORK_SOCKET_TIMEOUT_SECONDS,
+                        graceful_timeout=config.PREFORK_GRACEFUL_TIMEOUT_SECONDS,
+                        id_node=master.first_id_node(config.ID_NODE))
+
+
+if __name__ == '__main__':
+    # run as server.prefork, not __main__: the app reads the worker index from the module it imports
+    from server.prefork import main as prefork_main
+
+    sys.exit(prefork_main())
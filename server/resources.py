@@ -1,21 +1,83 @@
 # -*- coding: utf-8 -*-
+import atexit
+import functools
 import logging
-from typing import List, Dict
+import math
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Tuple
 
 from flask import request
 from flask_restful import Resource
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import quote_etag
 
-from server import utils
+from server import hotkeys, metrics, utils
+from server.changes import Change
 from server.controller import Controller
-from server.exceptions import DataIntegrityException
+from server.exceptions import DataIntegrityException, ChangesExpiredException
 from server.models import User
-from server.app import config, api
+from server.unit_of_work import Journal
+from server.app import app, config, api, charge_caller
 
 logger = logging.getLogger(__name__)
 
+# shared with the ASGI app: both commit to the same file
+journal = Journal(config.JOURNAL_FILE, delay=config.JOURNAL_GROUP_COMMIT_DELAY_MS / 1000,
+                  max_size=config.JOURNAL_GROUP_COMMIT_MAX_SIZE) if config.JOURNAL_FILE else None
+
+if journal is not None:
+    atexit.register(journal.close)
+
 controller = Controller(users_repository=config.usersRepository,
                         connections_repository=config.connectionsRepository,
-                        recommendations_repository=config.recommendationsRepository)
+                        recommendations_repository=config.recommendationsRepository,
+                        journal=journal)
+
+# the hottest users of the per-user routes, by reads and by writes. Empty if the tracking is disabled
+hot_users = {}
+
+if config.HOT_USERS_TOP_K:
+    hot_users = {kind: hotkeys.HotKeyTracker(k=config.HOT_USERS_TOP_K, window=config.HOT_USERS_WINDOW_SECONDS)
+                 for kind in ('reads', 'writes')}
+
+
+def record_hot_user(user_id: str, method: str) -> None:
+    """ counts a request of a per-user route in the hot user trackers. """
+
+    if hot_users:
+        hot_users['reads' if method in ('GET', 'HEAD') else 'writes'].record(user_id)
+
+
+def _track_hot_user(method):
+    """ decorates the methods of the per-user resources, {@see record_hot_user}. """
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        if 'user_id' in kwargs:
+            record_hot_user(kwargs['user_id'], request.method)
+        return method(*args, **kwargs)
+
+    return wrapper
+
+
+def hottest_readers() -> List[str]:
+    """ the ids of the users whose caches are worth warming: the hottest readers of the previous run, if saved. """
+
+    if not hot_users or not config.HOT_USERS_SNAPSHOT_FILE:
+        return []
+
+    return hotkeys.load(config.HOT_USERS_SNAPSHOT_FILE).get('reads', [])[:config.HOT_USERS_WARM_COUNT]
+
+
+def persist_hot_users() -> None:
+    """ saves the hot users to HOT_USERS_SNAPSHOT_FILE at exit, for the next run to warm its caches from.
+
+    Called by the servers, not at import: the tests and the tools importing the resources must not overwrite it.
+
+    """
+
+    if hot_users and config.HOT_USERS_SNAPSHOT_FILE:
+        atexit.register(hotkeys.save, config.HOT_USERS_SNAPSHOT_FILE, hot_users)
 
 
 class User(Resource):
@@ -23,6 +85,8 @@ class User(Resource):
 
     """
 
+    method_decorators = [_track_hot_user]
+
     @staticmethod
     def _json_mapper(user: User) -> Dict:
         """ gets the json mapping for a user object.
@@ -45,6 +109,24 @@ class User(Resource):
             'college': user.profile.college
         }
 
+    @staticmethod
+    def _etag(user: User, connections: int) -> str:
+        """ gets the entity tag of the representation of a user (unquoted).
+
+        Free to compute: the users are versioned. The number of connections is part of the representation, so it is
+        part of the tag as well.
+
+        Args:
+            user: the user object
+            connections: the number of connections of the user
+
+        Returns:
+            the entity tag
+
+        """
+
+        return '{}.{}'.format(user.version, connections)
+
     @staticmethod
     def _generate_hateoas_links(user_id: str) -> List[Dict]:
         """  This method collects and returns all related resources as links.
@@ -74,6 +156,8 @@ class User(Resource):
     def get(self, user_id: str):
         """ fetches the details of a user.
 
+        Conditional: a request with an If-None-Match header matching the current ETag gets a 304 without a body.
+
         Args:
             user_id: id of the user.
 
@@ -86,13 +170,23 @@ class User(Resource):
         if user is None:
             return utils.format_error("the user ID was not found"), 404
 
+        connections = controller.count_connections(user_id)
+
+        etag = self._etag(user, connections)
+
+        headers = {'ETag': quote_etag(etag)}
+
+        if request.if_none_match.contains_weak(etag):
+            return None, 304, headers
+
         resp_dict = {
             '_data': self._json_mapper(user),
+            '_meta': {'connections': connections, 'version': user.version},
             '_description': None,
             '_links': self._generate_hateoas_links(user_id)
         }
 
-        return resp_dict
+        return resp_dict, 200, headers
 
     def patch(self, user_id: str):
         """ updates the details of a user.
@@ -107,7 +201,7 @@ class User(Resource):
 
         patch = request.get_json()
 
-        logger.debug('update user: details recieved: {}'.format(patch))
+        logger.debug('update user: details recieved: %s', patch)
 
         try:
             user = controller.update_user_details(user_id, **patch)
@@ -118,6 +212,7 @@ class User(Resource):
 
         resp_dict = {
             '_data': self._json_mapper(user),
+            '_meta': {'version': user.version},
             '_description': None,
             '_links': self._generate_hateoas_links(user_id)
         }
@@ -134,6 +229,53 @@ class UserList(Resource):
 
     """
 
+    def get(self):
+        """ fetches the users matching a filter: either a list of ids ({@see UserLookup}), or a college.
+
+        Paginated with a cursor: the next link carries the id of the last user of the page.
+
+        Args:
+            None
+
+        Returns:
+            a response object (either directly or implicitly by the framework)
+
+        """
+
+        if 'ids' in request.args:
+            return UserLookup.lookup([user_id for user_id in request.args['ids'].split(',') if user_id])
+
+        college = request.args.get('college')
+        if college is None:
+            message = "listing all users is not supported. Please specify college=<college> or ids=<id>,<id>... in " \
+                      "query params."
+            logger.error(message)
+            return utils.format_error(message), 400
+
+        cursor = request.args.get('cursor')
+
+        limit = min(int(request.args.get('limit', 50)), config.USERS_MAX_PAGE_SIZE)
+
+        users = controller.get_users_by_college(college, cursor, limit)
+
+        links = []
+
+        if users and len(users) >= limit:
+            links.append({
+                'rel': 'next',
+                'href': api.url_for(UserList, college=college, cursor=users[-1].id, limit=limit),
+                'action': 'GET',
+                'types': ['application/json']
+            })
+
+        resp_dict = {
+            '_data': [User._json_mapper(user) for user in users],
+            '_description': None,
+            '_links': links
+        }
+
+        return resp_dict
+
     def post(self):
         """ adds a user to the system.
 
@@ -147,7 +289,7 @@ class UserList(Resource):
 
         payload = request.get_json()
 
-        logger.debug('create user: details recieved: {}'.format(payload))
+        logger.debug('create user: details recieved: %s', payload)
 
         try:
             user = controller.add_user(email=payload['email'], name=payload['name'], college=payload['college'])
@@ -169,11 +311,69 @@ class UserList(Resource):
         return resp_dict, status, headers
 
 
+class UserLookup(Resource):
+    """ Resolves many user ids at once (multi-get), for the clients rendering pages full of users.
+
+    """
+
+    @staticmethod
+    def lookup(user_ids: List[str]):
+        """ gets the users with the given ids, in one repository call.
+
+        Args:
+            user_ids: ids of the users
+
+        Returns:
+            a response object: the users found in the order of their ids, and the ids not found in _meta.missing
+
+        """
+
+        if not user_ids or len(user_ids) > config.USERS_LOOKUP_MAX_IDS:
+            message = "please specify between 1 and {} user ids.".format(config.USERS_LOOKUP_MAX_IDS)
+            logger.error(message)
+            return utils.format_error(message), 400
+
+        users, missing = controller.get_users(user_ids)
+
+        resp_dict = {
+            '_data': [User._json_mapper(user) for user in users],
+            '_meta': {'missing': missing},
+            '_description': None,
+            '_links': []
+        }
+
+        return resp_dict
+
+    def post(self):
+        """ gets the users with the ids listed in the body, for lists too long for a query string.
+
+        Args:
+            None
+
+        Returns:
+            a response object (either directly or implicitly by the framework)
+
+        """
+
+        payload = request.get_json(silent=True)
+
+        user_ids = payload.get('ids') if isinstance(payload, dict) else None
+
+        if not isinstance(user_ids, list) or not all(isinstance(user_id, str) for user_id in user_ids):
+            message = "please specify the user ids as a list: {\"ids\": [<id>, <id>...]}"
+            logger.error(message)
+            return utils.format_error(message), 400
+
+        return self.lookup(user_ids)
+
+
 class Connection(Resource):
     """ Exposes a collection of Connection objects as a RESTful resource.
 
     """
 
+    method_decorators = [_track_hot_user]
+
     @staticmethod
     def _json_mapper(user: User) -> Dict:
         """ gets the json mapping for a user object.
@@ -194,6 +394,62 @@ class Connection(Resource):
             'name': user.profile.name,
         }
 
+    @staticmethod
+    def _format_cursor(cursor: Tuple[float, str]) -> str:
+        """ renders the cursor of a page of recent connections: '<creation time>:<connected user id>'. """
+
+        return '{!r}:{}'.format(*cursor)
+
+    @staticmethod
+    def _parse_recent_args(args) -> Tuple[Optional[Tuple[float, str]], Optional[float], int]:
+        """ parses the query params of a page of recent connections.
+
+        Args:
+            args: the query params
+
+        Returns:
+            the cursor, the since time and the limit. A ValueError is thrown if one of them is malformed.
+
+        """
+
+        cursor = args.get('cursor')
+
+        if cursor is not None:
+            created, _, other = cursor.partition(':')
+            if not other or not math.isfinite(float(created)):
+                raise ValueError('malformed cursor: {}'.format(cursor))
+            cursor = (float(created), other)
+
+        since = args.get('since')
+
+        since = float(since) if since is not None else None
+
+        if since is not None and not math.isfinite(since):
+            raise ValueError('not a time: {}'.format(since))
+
+        limit = int(args.get('limit', 50))
+
+        if limit < 1:
+            raise ValueError('the limit must be at least 1: {}'.format(limit))
+
+        return cursor, since, limit
+
+    @staticmethod
+    def _recent_link(user_id: str, cursor: Tuple[float, str], since: Optional[float], limit: int) -> Dict:
+        """ the link to the next page of recent connections. """
+
+        params = {'order': 'recent', 'cursor': Connection._format_cursor(cursor), 'limit': limit}
+
+        if since is not None:
+            params['since'] = since
+
+        return {
+            'rel': 'next',
+            'href': api.url_for(Connection, user_id=user_id, **params),
+            'action': 'GET',
+            'types': ['application/json']
+        }
+
     @staticmethod
     def _generate_hateoas_links(user_id: str):
         """  This method collects and returns all related resources as links.
@@ -223,7 +479,8 @@ class Connection(Resource):
     def get(self, user_id: str):
         """ fetches the connections/friends of a user.
 
-        Paginated for optimum performance across users.
+        Paginated for optimum performance across users. With order=recent, the most recent connections come first
+        (optionally only the ones made since a time), paginated with a cursor.
 
         Args:
             user_id: id of the user.
@@ -237,12 +494,22 @@ class Connection(Resource):
         if user is None:
             return utils.format_error("the user ID was not found"), 404
 
+        order = request.args.get('order')
+
+        if order == 'recent':
+            return self._get_recent(user_id)
+
+        if order is not None:
+            message = "unknown order: {}. Only order=recent is supported.".format(order)
+            logger.error(message)
+            return utils.format_error(message), 400
+
         offset = int(request.args.get('offset', 0))
 
         limit = int(request.args.get('limit', 50))
 
-        logger.debug('received a request to get the connnections for user {} with offset {} and limit {}'
-                     .format(user_id, offset, limit))
+        logger.debug('received a request to get the connnections for user %s with offset %s and limit %s',
+                     user_id, offset, limit)
 
         connected_users = controller.get_connections(user_id, offset, limit)
 
@@ -255,12 +522,36 @@ class Connection(Resource):
 
         resp_dict = {
             '_data': [self._json_mapper(user) for user in connected_users],
+            '_meta': {'total': controller.count_connections(user_id)},
             '_description': None,
             '_links': [link_for_next_page] + self._generate_hateoas_links(user_id)
         }
 
         return resp_dict
 
+    def _get_recent(self, user_id: str):
+
+        try:
+            cursor, since, limit = self._parse_recent_args(request.args)
+        except ValueError as e:
+            message = "recent connections: {}. Expecting since=<seconds since the unix epoch> and the cursor of " \
+                      "the next link.".format(e)
+            logger.error(message)
+            return utils.format_error(message), 400
+
+        connected_users, next_cursor = controller.get_recent_connections(user_id, cursor, since, limit)
+
+        links = [self._recent_link(user_id, next_cursor, since, limit)] if next_cursor is not None else []
+
+        resp_dict = {
+            '_data': [dict(self._json_mapper(user), connected_at=created) for user, created in connected_users],
+            '_meta': {'total': controller.count_connections(user_id)},
+            '_description': None,
+            '_links': links + self._generate_hateoas_links(user_id)
+        }
+
+        return resp_dict
+
     def post(self, user_id: str):
         """ creates a new connection for the current user.
 
@@ -320,6 +611,8 @@ class Connection(Resource):
 
 class BatchConnection(Resource):
 
+    method_decorators = [_track_hot_user]
+
     def post(self, user_id: str):
         """ creates multiple new connections for the current user.
 
@@ -331,7 +624,16 @@ class BatchConnection(Resource):
 
         """
 
-        user_ids_to_connect = request.get_json()['ids']
+        payload = request.get_json(silent=True)
+
+        user_ids_to_connect = payload.get('ids') if isinstance(payload, dict) else None
+
+        if not isinstance(user_ids_to_connect, list) or \
+                not all(isinstance(user_id_to_connect, str) for user_id_to_connect in user_ids_to_connect):
+            message = "please specify the user ids as a list: {\"ids\": [<id>, <id>...]}"
+            logger.error(message)
+            return utils.format_error(message), 400
+
         controller.batch_add_connections(user_id, user_ids_to_connect)
 
         resp_dict = {
@@ -343,11 +645,55 @@ class BatchConnection(Resource):
         return resp_dict, 202
 
 
+class ConnectionSearch(Resource):
+    """ Exposes a prefix search over the connections of a user (typeahead).
+
+    """
+
+    method_decorators = [_track_hot_user]
+
+    def get(self, user_id: str):
+        """ finds the connections of a user whose name has a word starting with a prefix.
+
+        Args:
+            user_id: id of the user.
+
+        Returns:
+            a response object (either directly or implicitly by the framework)
+
+        """
+
+        user = controller.get_user(user_id)
+        if user is None:
+            return utils.format_error("the user ID was not found"), 404
+
+        try:
+            prefix = request.args['prefix']
+        except KeyError:
+            message = 'search connections: please specify prefix=<prefix> in query params.'
+            logger.error(message)
+            return utils.format_error(message), 400
+
+        limit = int(request.args.get('limit', 10))
+
+        connected_users = controller.search_connections(user_id, prefix, limit)
+
+        resp_dict = {
+            '_data': [Connection._json_mapper(user) for user in connected_users],
+            '_description': None,
+            '_links': Connection._generate_hateoas_links(user_id)
+        }
+
+        return resp_dict
+
+
 class Recommendation(Resource):
     """ Exposes a collection of Recommendation objects as a RESTful resource.
 
     """
 
+    method_decorators = [_track_hot_user]
+
     @staticmethod
     def _json_mapper(user: User):
         """ gets the json mapping for a recommendation.
@@ -395,9 +741,10 @@ class Recommendation(Resource):
         ]
 
     def get(self, user_id: str):
-        """ fetches the recommendations of a user.
+        """ fetches the recommendations of a user, best first.
 
-        Paginated for optimum performance across users.
+        Paginated for optimum performance across users. Follow the next link for the next page: recommendations of
+        users already connected are skipped, so the next offset can be past offset + limit.
 
         Args:
             user_id: id of the user.
@@ -415,22 +762,330 @@ class Recommendation(Resource):
 
         limit = int(request.args.get('limit', 50))
 
-        logger.debug('recieved a request to get the recommendations for user {} with offset {} and limit {}'
-                     .format(user_id, offset, limit))
+        logger.debug('recieved a request to get the recommendations for user %s with offset %s and limit %s',
+                     user_id, offset, limit)
 
-        recommended_users = controller.get_recommendations(user_id, offset, limit)
+        recommended_users, next_offset = controller.get_recommendations(user_id, offset, limit)
 
         link_for_next_page = {
             'rel': 'next',
-            'href': api.url_for(Recommendation, user_id=user_id, offset=offset + len(recommended_users), limit=limit),
+            'href': api.url_for(Recommendation, user_id=user_id, offset=next_offset, limit=limit),
             'action': 'GET',
             'types': ['application/json']
         }
 
         resp_dict = {
             '_data': [self._json_mapper(user) for user in recommended_users],
+            '_meta': {'total': controller.count_recommendations(user_id)},
             '_description': None,
             '_links': [link_for_next_page] + self._generate_hateoas_links(user_id)
         }
 
         return resp_dict
+
+
+class Changes(Resource):
+    """ Exposes the change feed as a RESTful resource (long poll).
+
+    """
+
+    @staticmethod
+    def _json_mapper(change: Change) -> Dict:
+        """ gets the json mapping for a change.
+
+        Args:
+            change: the change
+
+        Returns:
+            the json representation de-serialized as a dict
+
+        """
+
+        return {
+            'seq': change.seq,
+            'type': change.type,
+            'timestamp': change.timestamp,
+            'data': change.data
+        }
+
+    def get(self):
+        """ fetches the changes made after a sequence number, waiting for one if there is none yet.
+
+        Consumers follow the next link: it asks for the changes after the last one of this response.
+
+        Args:
+            None
+
+        Returns:
+            a response object (either directly or implicitly by the framework)
+
+        """
+
+        since = request.args.get('since')
+
+        since = int(since) if since is not None else None
+
+        limit = int(request.args.get('limit', 100))
+
+        wait = float(request.args.get('wait', config.CHANGES_MAX_WAIT_SECONDS))
+
+        try:
+            changes = controller.get_changes(since, limit, wait)
+        except ChangesExpiredException as e:
+            resp_dict = utils.format_error(e.message)
+            resp_dict['_meta'] = {'head': e.head}
+            return resp_dict, 410
+
+        last = changes[-1].seq if changes else since or 0
+
+        resp_dict = {
+            '_data': [self._json_mapper(change) for change in changes],
+            '_meta': {'last': last},
+            '_description': None,
+            '_links': [
+                {
+                    'rel': 'next',
+                    'href': api.url_for(Changes, since=last, limit=limit),
+                    'action': 'GET',
+                    'types': ['application/json']
+                }
+            ]
+        }
+
+        return resp_dict
+
+
+class HotUsers(Resource):
+    """ Exposes the hottest users (heavy hitters) of the per-user routes, for the admins.
+
+    """
+
+    def get(self):
+        """ fetches the users with the most reads and writes over the sliding window.
+
+        Counts are estimates: never below the true count, a little above it at worst.
+
+        Args:
+            None
+
+        Returns:
+            a response object (either directly or implicitly by the framework)
+
+        """
+
+        if not hot_users:
+            return utils.format_error("hot user tracking is disabled"), 404
+
+        limit = int(request.args.get('limit', config.HOT_USERS_TOP_K))
+
+        resp_dict = {
+            '_data': {kind: [{'id': user_id, 'count': count} for user_id, count in tracker.top(limit)]
+                      for kind, tracker in hot_users.items()},
+            '_meta': {'window': config.HOT_USERS_WINDOW_SECONDS},
+            '_description': None,
+            '_links': [
+                {
+                    'rel': 'self',
+                    'href': api.url_for(HotUsers),
+                    'action': 'GET',
+                    'types': ['application/json']
+                },
+                {
+                    'rel': 'warm',
+                    'href': api.url_for(HotUsers),
+                    'action': 'POST',
+                    'types': ['application/json']
+                }
+            ]
+        }
+
+        return resp_dict
+
+    def post(self):
+        """ warms the caches of the hottest readers of the window.
+
+        Args:
+            None
+
+        Returns:
+            a response object (either directly or implicitly by the framework)
+
+        """
+
+        if not hot_users:
+            return utils.format_error("hot user tracking is disabled"), 404
+
+        user_ids = [user_id for user_id, _ in hot_users['reads'].top(config.HOT_USERS_WARM_COUNT)]
+
+        resp_dict = {
+            '_data': None,
+            '_meta': {'warmed': controller.warm(user_ids)},
+            '_description': None,
+            '_links': []
+        }
+
+        return resp_dict
+
+
+batch_items_total = metrics.REGISTRY.counter(
+    'batch_items_total', 'Sub-requests served through /batch.', ('method', 'route', 'status'))
+
+# runs the independent reads of the batches concurrently
+_batch_executor = ThreadPoolExecutor(max_workers=config.BATCH_MAX_CONCURRENCY, thread_name_prefix='batch')
+
+
+class Batch(Resource):
+    """ Runs an ordered list of sub-requests against the other routes, in one HTTP call.
+
+    Sub-requests are dispatched in-process: they go through the resources, not through the http stack (no
+    admission, no request metrics of their own: the batch is admitted and measured as a whole). Every sub-request is
+    charged to the rate limit of the caller, though, and a batch can't call the endpoints of BATCH_REFUSED_ENDPOINTS.
+
+    """
+
+    @staticmethod
+    def parse(payload) -> Tuple[Optional[List[Dict]], Optional[str]]:
+        """ validates a batch.
+
+        Args:
+            payload: the de-serialized request body
+
+        Returns:
+            the sub-requests and None, or None and the reason the batch is invalid
+
+        """
+
+        items = payload.get('requests') if isinstance(payload, dict) else None
+
+        if not isinstance(items, list) or not 0 < len(items) <= config.BATCH_MAX_REQUESTS:
+            return None, 'please specify between 1 and {} requests: {{"requests": [{{"method": <method>, ' \
+                         '"path": <path>, "body": <body>}}...]}}'.format(config.BATCH_MAX_REQUESTS)
+
+        for item in items:
+            if not isinstance(item, dict) or not isinstance(item.get('method'), str) or \
+                    not isinstance(item.get('path'), str):
+                return None, 'every request needs a method and a path: {}'.format(item)
+
+        return [dict(item, method=item['method'].upper()) for item in items], None
+
+    @staticmethod
+    def groups(items: List[Dict], concurrent_reads: bool) -> List[List[int]]:
+        """ splits the sub-requests in groups to run one after the other.
+
+        Every write is a group of its own. With concurrent_reads, the reads in between two writes form one group, whose
+        requests may run concurrently: they don't depend on each other.
+
+        Returns:
+            the groups of the indexes of the sub-requests, in order
+
+        """
+
+        groups = []
+
+        for index, item in enumerate(items):
+            if concurrent_reads and item['method'] == 'GET' and groups and items[groups[-1][0]]['method'] == 'GET':
+                groups[-1].append(index)
+            else:
+                groups.append([index])
+
+        return groups
+
+    @staticmethod
+    def refused(path: str, method: str) -> bool:
+        """ whether a batch can't call a route, {@see BATCH_REFUSED_ENDPOINTS}. """
+
+        try:
+            endpoint, _ = app.url_map.bind('localhost').match(path, method=method)
+        except HTTPException:
+            # answered with a 404 or a 405
+            return False
+
+        return endpoint in config.BATCH_REFUSED_ENDPOINTS
+
+    @staticmethod
+    def refusal(item: Dict) -> Dict:
+
+        return utils.format_error('{} {} can not be called from a batch'.format(item['method'], item['path']))
+
+    @staticmethod
+    def _dispatch(item: Dict) -> Dict:
+
+        # an app context of its own: the teardown hooks run when the sub-request ends, and must not see (and release)
+        # the admission ticket or the metrics of the batch request in `g`
+        with app.app_context(), app.test_request_context(item['path'], method=item['method'], json=item.get('body')):
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            try:
+                if request.endpoint in config.BATCH_REFUSED_ENDPOINTS:
+                    response = app.make_response((Batch.refusal(item), 400))
+                else:
+                    response = app.make_response(app.dispatch_request())
+            except HTTPException as e:
+                response = app.make_response((utils.format_error(e.description), e.code))
+            except Exception:
+                logger.exception('unhandled error while serving the batched request %s %s', item['method'],
+                                 item['path'])
+                response = app.make_response((utils.format_error('internal server error'), 500))
+
+        batch_items_total.inc((item['method'], route, str(response.status_code)))
+
+        return {
+            'status': response.status_code,
+            'headers': {key: value for key, value in response.headers.items()
+                        if key not in ('Content-Type', 'Content-Length')},
+            'body': response.get_json(silent=True)
+        }
+
+    def post(self):
+        """ runs a batch of sub-requests.
+
+        The sub-requests run in order. Set concurrent_reads to run the reads in between two writes concurrently, and
+        stop_on_error to skip the sub-requests that follow a failed one (answered with a 424).
+
+        Args:
+            None
+
+        Returns:
+            a response object (either directly or implicitly by the framework)
+
+        """
+
+        payload = request.get_json(silent=True)
+
+        items, error = self.parse(payload)
+
+        if error is not None:
+            logger.error(error)
+            return utils.format_error(error), 400
+
+        # admitted as one request, charged as many
+        wait = charge_caller(len(items))
+
+        if wait:
+            logger.info('rate limited a batch of %s requests', len(items))
+            return utils.format_error('too many requests, please retry later: every request of a batch counts'), \
+                429, {'Retry-After': str(max(1, math.ceil(wait)))}
+
+        results = [None] * len(items)
+
+        failed = False
+
+        for group in self.groups(items, bool(payload.get('concurrent_reads'))):
+            if failed:
+                for index in group:
+                    results[index] = {'status': 424, 'headers': {},
+                                      'body': utils.format_error('skipped: a previous request failed')}
+                continue
+            if len(group) == 1:
+                results[group[0]] = self._dispatch(items[group[0]])
+            else:
+                for index, result in zip(group, _batch_executor.map(self._dispatch, [items[i] for i in group])):
+                    results[index] = result
+            failed = payload.get('stop_on_error', False) and any(results[index]['status'] >= 400 for index in group)
+
+        resp_dict = {
+            '_data': results,
+            '_description': None,
+            '_links': []
+        }
+
+        return resp_dict
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+
+""" Prefix search over the names of a user's connections (typeahead).
+
+Every indexed user gets a sorted list of (key, friend id) entries, one per word of the friend's normalized name: the
+key is the name from that word on, so that 'ma' finds 'Mary Jones' and 'sc' finds 'Michael Scott'. A search is a
+bisect plus a scan of the matches, already intersected with the user's adjacency.
+
+Indexes are built lazily, on the first search of a user, and kept current by the controller on connection
+create/delete and name changes. The least recently searched users are evicted past `max_users`.
+
+"""
+
+import bisect
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(text: str) -> str:
+    """ folds case, accents and whitespace, so that 'José  ' and 'jose' index alike. """
+
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+
+    return ' '.join(''.join(char for char in decomposed if not unicodedata.combining(char)).split())
+
+
+def _keys(name: str) -> List[str]:
+
+    words = normalize(name or '').split(' ')
+
+    return [' '.join(words[i:]) for i in range(len(words))]
+
+
+class ConnectionNameIndex(object):
+    """ per-user name indexes of the connections. Thread-safe.
+
+    Building an index reads the repositories, which must not happen under the index lock. A build is therefore
+    bracketed by start_build()/finish_build(): the changes notified in between are logged, and replayed on top of the
+    snapshot the builder read, so no change is lost whatever the interleaving.
+
+    """
+
+    def __init__(self, max_users: int = 10000):
+
+        self.max_users = max_users
+
+        self._lock = threading.Lock()
+
+        # owner -> sorted [(key, friend id)], in least recently searched first order
+        self._entries = OrderedDict()  # type: OrderedDict[str, List[Tuple[str, str]]]
+
+        # owner -> {friend id: name}
+        self._friends = {}  # type: Dict[str, Dict[str, str]]
+
+        # friend id -> the owners whose index lists that friend
+        self._listed_in = {}  # type: Dict[str, Set[str]]
+
+        # owner -> the change logs of the builds in progress
+        self._building = {}  # type: Dict[str, List[list]]
+
+    def _insert(self, owner: str, friend_id: str, name: str) -> None:
+
+        self._delete(owner, friend_id)
+
+        entries = self._entries[owner]
+
+        for key in _keys(name):
+            bisect.insort(entries, (key, friend_id))
+
+        self._friends[owner][friend_id] = name
+
+        self._listed_in.setdefault(friend_id, set()).add(owner)
+
+    def _delete(self, owner: str, friend_id: str) -> None:
+
+        friends = self._friends[owner]
+
+        if friend_id not in friends:
+            return
+
+        entries = self._entries[owner]
+
+        for key in _keys(friends.pop(friend_id)):
+            position = bisect.bisect_left(entries, (key, friend_id))
+            if position < len(entries) and entries[position] == (key, friend_id):
+                del entries[position]
+
+        owners = self._listed_in[friend_id]
+        owners.discard(owner)
+        if not owners:
+            del self._listed_in[friend_id]
+
+    def _apply(self, owner: str, change: tuple) -> None:
+
+        operation, friend_id, name = change
+
+        if operation == 'add':
+            self._insert(owner, friend_id, name)
+        elif operation == 'remove':
+            self._delete(owner, friend_id)
+        elif friend_id in self._friends[owner]:
+            # rename: only if they are friends
+            self._insert(owner, friend_id, name)
+
+    def _notify(self, owner: str, change: tuple) -> None:
+
+        if owner in self._entries:
+            self._apply(owner, change)
+
+        for log in self._building.get(owner, ()):
+            log.append(change)
+
+    def _evict(self) -> None:
+
+        while len(self._entries) > self.max_users:
+            owner, _ = self._entries.popitem(last=False)
+            for friend_id in self._friends.pop(owner):
+                owners = self._listed_in[friend_id]
+                owners.discard(owner)
+                if not owners:
+                    del self._listed_in[friend_id]
+
+    def search(self, owner: str, prefix: str, limit: int) -> Optional[List[str]]:
+        """ finds the friends of a user whose name has a word starting with a prefix.
+
+        Args:
+            owner: id of the user
+            prefix: the prefix, normalized before matching
+            limit: the maximum number of results
+
+        Returns:
+            the ids of the matching friends, ordered by the matching part of their name. None if the user is not
+            indexed (yet)
+
+        """
+
+        prefix = normalize(prefix)
+
+        matches = []
+
+        with self._lock:
+            entries = self._entries.get(owner)
+            if entries is None:
+                return None
+            self._entries.move_to_end(owner)
+
+            position = bisect.bisect_left(entries, (prefix,))
+            while position < len(entries) and len(matches) < limit:
+                key, friend_id = entries[position]
+                if not key.startswith(prefix):
+                    break
+                if friend_id not in matches:
+                    matches.append(friend_id)
+                position += 1
+
+        return matches
+
+    def touch(self, owner: str) -> bool:
+        """ marks the index of a user as recently searched, e.g. to keep a hot user from being evicted.
+
+        Returns:
+            whether the user is indexed
+
+        """
+
+        with self._lock:
+            if owner not in self._entries:
+                return False
+            self._entries.move_to_end(owner)
+            return True
+
+    def start_build(self, owner: str) -> list:
+        """ starts logging the changes to a user's connections. Read the snapshot only after this call.
+
+        Returns:
+            the change log, to hand back to finish_build()
+
+        """
+
+        log = []
+
+        with self._lock:
+            self._building.setdefault(owner, []).append(log)
+
+        return log
+
+    def finish_build(self, owner: str, log: list, friends: Optional[Iterable[Tuple[str, str]]]) -> None:
+        """ publishes the index of a user, unless another build got there first.
+
+        Args:
+            owner: id of the user
+            log: the change log returned by start_build()
+            friends: the (friend id, name) snapshot read after start_build(), None to abort the build
+
+        Returns:
+            None
+
+        """
+
+        with self._lock:
+            logs = self._building[owner]
+            logs.remove(log)
+            if not logs:
+                del self._building[owner]
+
+            if friends is None or owner in self._entries:
+                return
+
+            entries = []
+            names = {}
+
+            # one sort for the snapshot rather than an insort per entry
+            for friend_id, name in friends:
+                entries += [(key, friend_id) for key in _keys(name)]
+                names[friend_id] = name
+                self._listed_in.setdefault(friend_id, set()).add(owner)
+
+            entries.sort()
+
+            self._entries[owner] = entries
+            self._friends[owner] = names
+
+            for change in log:
+                self._apply(owner, change)
+
+            self._evict()
+
+    def add(self, owner: str, friend_id: str, name: str) -> None:
+        """ notifies a new connection, in one direction. """
+
+        with self._lock:
+            self._notify(owner, ('add', friend_id, name))
+
+    def remove(self, owner: str, friend_id: str) -> None:
+        """ notifies a deleted connection, in one direction. """
+
+        with self._lock:
+            self._notify(owner, ('remove', friend_id, None))
+
+    def rename(self, user_id: str, name: str) -> None:
+        """ notifies a name change. """
+
+        with self._lock:
+            for owner in list(self._listed_in.get(user_id, ())):
+                self._apply(owner, ('rename', user_id, name))
+            for owner, logs in self._building.items():
+                for log in logs:
+                    log.append(('rename', user_id, name))
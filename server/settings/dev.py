@@ -3,6 +3,7 @@
 import os
 from pathlib import Path
 
+from server import metrics
 from server.ORM.json_connections_repository import JsonConnectionsRepository
 from server.ORM.json_recommendations_repository import JsonRecommendationsRepository
 from server.ORM.json_users_repository import JsonUsersRepository
@@ -15,8 +16,156 @@ print(log_config_file)
 
 usersRepository = JsonUsersRepository(PROJECT_ROOT + os.sep + 'ext' + os.sep + 'data.json')
 connectionsRepository = JsonConnectionsRepository(PROJECT_ROOT + os.sep + 'ext' + os.sep + 'data.json')
+# to partition the graph across local shard processes instead:
+# connectionsRepository = ShardedConnectionsRepository(PROJECT_ROOT + os.sep + 'ext' + os.sep + 'data.json', shards=4)
 recommendationsRepository = JsonRecommendationsRepository(PROJECT_ROOT + os.sep + 'ext' + os.sep + 'data.json')
+# to keep the data in Redis instead (or in anything speaking its protocol, like server.ORM.fake_redis), loaded from the
+# snapshot on first start:
+# redisClient = RespClient.from_url('redis://localhost:6379/0')
+# usersRepository = RedisUsersRepository(redisClient, PROJECT_ROOT + os.sep + 'ext' + os.sep + 'data.json')
+# connectionsRepository = RedisConnectionsRepository(redisClient, PROJECT_ROOT + os.sep + 'ext' + os.sep + 'data.json')
+# recommendationsRepository = RedisRecommendationsRepository(redisClient,
+#                                                            PROJECT_ROOT + os.sep + 'ext' + os.sep + 'data.json')
+
+# the journal of the committed writes: the writes of every controller operation (a unit of work) are committed as one
+# synced record, the operations committing at the same time share one fsync (group commit). None keeps the writes in
+# memory only
+JOURNAL_FILE = None
+
+# how long a group commit waits for more commits to join it (milliseconds). With 0, only the commits that come in
+# during the previous sync are grouped
+JOURNAL_GROUP_COMMIT_DELAY_MS = 0
+
+JOURNAL_GROUP_COMMIT_MAX_SIZE = 256
+
+USERS_MAX_PAGE_SIZE = 50
+
+# the maximum number of ids per bulk user lookup (/users?ids=, /users/lookup)
+USERS_LOOKUP_MAX_IDS = 500
 
 CONNECTIONS_MAX_PAGE_SIZE = 50
 
 RECOMMENDATIONS_MAX_PAGE_SIZE = 50
+
+# recommendations of users who are since connected (or deleted) are skipped at read time and the page backfilled
+# with the next ones: the most recommendations a page skips. A page that hits it is served short, its next link
+# resumes after the skipped ones
+RECOMMENDATIONS_MAX_SKIPPED = 100
+
+# concurrent identical connections/recommendations page reads share one backend call: the longest a caller waits
+# for the call in flight (milliseconds) before doing its own. None waits for as long as it takes
+READ_COALESCING_WAIT_TIMEOUT_MS = 500
+
+CONNECTION_SEARCH_MAX_RESULTS = 20
+
+# the number of users whose connection name index is kept in memory (least recently searched are evicted)
+CONNECTION_SEARCH_INDEX_MAX_USERS = 10000
+
+# change feed (/changes): the number of changes retained for lagging consumers, the maximum number of changes per
+# response, and the longest a long poll waits for a change (seconds)
+CHANGES_RETENTION = 10000
+
+CHANGES_MAX_BATCH_SIZE = 500
+
+CHANGES_MAX_WAIT_SECONDS = 30
+
+# hot users (/admin/hot-users): the number of users tracked, over a sliding window of that many seconds.
+# 0 disables the tracking
+HOT_USERS_TOP_K = 100
+
+HOT_USERS_WINDOW_SECONDS = 300
+
+# the hot users are saved to this file when a server (server.prefork, server.asgi) exits, and the caches of the hottest
+# readers warmed from it when it starts. A runtime path, outside the source tree (e.g.
+# /var/lib/socialapp/hot_users.json). None to not persist them
+HOT_USERS_SNAPSHOT_FILE = os.environ.get('SOCIAL_APP_HOT_USERS_FILE')
+
+HOT_USERS_WARM_COUNT = 20
+
+# batches (/batch): the maximum number of sub-requests per batch, and the number of reads run at once
+BATCH_MAX_REQUESTS = 50
+
+BATCH_MAX_CONCURRENCY = 8
+
+# the endpoints a batch can't call: nested batches, and the long polls and admin routes, which would hold the threads
+# of the batch
+BATCH_REFUSED_ENDPOINTS = ('batch', 'changes', 'hotusers')
+
+# admission control. None disables it.
+# the number of requests served at once (shared by the route classes below, except the ones flagged not shared)
+ADMISSION_CAPACITY = 64
+
+# route class -> priority (lower goes first), concurrency limit, whether it takes a slot of the shared capacity
+ADMISSION_CLASSES = {
+    'read': (0, 64, True),
+    'write': (1, 32, True),
+    'bulk': (2, 4, True),
+    # long polls mostly sleep: they don't take shared slots
+    'feed': (0, 256, False),
+}
+
+# endpoint -> route class, for the endpoints that are not plain reads (GET) or writes (other methods).
+# None exempts an endpoint from admission control.
+ADMISSION_ROUTE_CLASSES = {
+    'batchconnection': 'bulk',
+    'batch': 'bulk',
+    'changes': 'feed',
+    # a multi-get fans out to up to USERS_LOOKUP_MAX_IDS users, even when its ids are POSTed. So does GET /users?ids=
+    # ({@see server.app._route_class})
+    'userlookup': 'bulk',
+    'prometheus_metrics': None,
+    'health': None,
+}
+
+# the longest a request waits for admission: half of the 500 ms SLA, the other half is left to serve it
+ADMISSION_QUEUE_BUDGET_MS = 250
+
+# per-caller token buckets (requests per second, burst). Callers are told apart by their address.
+ADMISSION_CALLER_RATE = 100
+
+ADMISSION_CALLER_BURST = 200
+
+# the requests coming from these addresses (trusted proxies, or the gateway authenticating the callers) are told apart
+# by this header instead. It is ignored from any other address: a client could rotate it to get a fresh bucket on every
+# request, or take the one of another caller.
+ADMISSION_CALLER_HEADER = 'X-Caller-Id'
+
+ADMISSION_TRUSTED_PROXIES = frozenset(address for address in os.environ.get('SOCIAL_APP_TRUSTED_PROXIES', '').split(',')
+                                      if address)
+
+# production serving (python -m server.prefork): the address to listen on, and the number of worker processes (None:
+# one per CPU). More than one worker needs repositories sharing their data across processes (the Redis ones): with the
+# in-process json repositories, every worker would have a copy of its own. Admission control applies per worker: the
+# capacities above are multiplied by the number of workers
+PREFORK_BIND = '0.0.0.0:5000'
+
+PREFORK_WORKERS = 1
+
+# the connections a worker serves at once (one thread each), and how long a silent client keeps its thread (seconds)
+PREFORK_THREADS = 16
+
+PREFORK_SOCKET_TIMEOUT_SECONDS = 5
+
+# how long the workers get to finish the requests in flight on shutdown or reload (seconds)
+PREFORK_GRACEFUL_TIMEOUT_SECONDS = 30
+
+PREFORK_BACKLOG = 2048
+
+# size of the thread pool running the (blocking) repositories when served over ASGI
+ASGI_THREAD_POOL_SIZE = 32
+
+# latency histogram buckets (seconds) for the /metrics endpoint
+METRICS_LATENCY_BUCKETS = metrics.DEFAULT_LATENCY_BUCKETS
+
+# repository calls slower than this are written to the slow-op log (logger: server.ORM.slow_ops). None disables it.
+REPOSITORY_SLOW_OP_THRESHOLD_MS = 50
+
+# requests carrying this header get a per-repository-method time breakdown in the Server-Timing response header.
+# None disables it.
+REPOSITORY_TIMING_DEBUG_HEADER = 'X-Debug-Repository-Timing'
+
+# the node (0-1023) of this process in the generated ids, must differ between processes and hosts sharing data.
+# None derives it from the process id. The prefork workers take ID_NODE (0 when None) + their index, + PREFORK_WORKERS
+# every other reload: give every host sharing data a range of 2 * PREFORK_WORKERS nodes of its own, e.g. 0, 16, 32...
+# for 8 workers per host.
+ID_NODE = int(os.environ['SOCIAL_APP_ID_NODE']) if 'SOCIAL_APP_ID_NODE' in os.environ else None
@@ -1,13 +1,254 @@
 # -*- coding: utf-8 -*-
 
+import atexit
+import copy
+import logging
+import os
+import queue
+import sys
+import threading
+import time
 from logging.config import dictConfig
+from typing import List, Optional
 
 import yaml
 
 """ Logging configuration.
+
+The handlers declared in the config file (console, file...) are never called on the request path. Every logger hands
+its records to a bounded queue instead, and a background writer thread formats and writes them. The cost of a log
+call on the request path is the creation of a record plus a queue put. If the writer falls behind and the queue is
+full, records are dropped (and counted) rather than blocking the request.
+
+Messages must use lazy %-style arguments (logger.debug('user %s', user_id)): they are only formatted if some handler
+accepts them. The formatting happens when the record is queued, not in the writer, so that the arguments are logged as
+they were at the time of the call.
+
+To measure the overhead per request, compare a benchmark run at `--log-level DEBUG` with one at `--log-level CRITICAL`
+(see server.benchmarks).
 """
 
+_writer = None
+
+# the default formatter, for the tracebacks of the queued records
+_formatter = logging.Formatter()
+
+
+class RateLimitFilter(logging.Filter):
+    """ lets through at most `rate` records per second (with bursts of up to `burst`) for every message template.
+
+    Meant for chatty messages, like the ones logged per row: the first ones of a burst get through, the rest are
+    dropped until the bucket refills. Templates are told apart by logger name and unformatted message, so one chatty
+    message does not starve the others.
+
+    Attach it to a logger rather than to a handler: the handlers only get the records once their message is formatted.
+
+    Usage in the config file:
+
+        filters:
+          per_row:
+            (): server.settings.log.RateLimitFilter
+            rate: 10
+            burst: 50
+
+    """
+
+    def __init__(self, rate: float = 10, burst: int = 50):
+
+        super().__init__()
+
+        self.rate = rate
+
+        self.burst = burst
+
+        # (logger name, message template) -> [tokens, last refill]
+        self._buckets = {}
+
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+
+        key = (record.name, record.msg)
+
+        now = time.monotonic()
+
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                return False
+            bucket[0] -= 1
+            return True
+
+
+class _QueueingHandler(logging.Handler):
+    """ stands in for the configured handlers of a logger: enqueues the record for the writer, together with the
+    handlers it was meant for.
+
+    """
+
+    def __init__(self, writer: '_BackgroundWriter', handlers: List[logging.Handler]):
+
+        super().__init__()
+
+        self.writer = writer
+
+        self.handlers = handlers
+
+    def prepare(self, record: logging.LogRecord) -> Optional[logging.LogRecord]:
+        """ the record to queue: a copy with its message formatted and its traceback rendered (the arguments may
+        change, and the traceback keeps its frames alive, until the writer gets to it). None if none of the handlers
+        would write it.
+
+        """
+
+        if all(record.levelno < handler.level for handler in self.handlers):
+            return None
+
+        record = copy.copy(record)
+
+        record.message = record.msg = record.getMessage()
+
+        record.args = None
+
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = _formatter.formatException(record.exc_info)
+            record.exc_info = None
+
+        return record
+
+    def handle(self, record: logging.LogRecord) -> bool:
+
+        # no handler lock: the queue is thread-safe
+        self.emit(record)
+
+        return True
+
+    def emit(self, record: logging.LogRecord) -> None:
+
+        record = self.prepare(record)
+
+        if record is not None:
+            self.writer.put(self.handlers, record)
+
+
+class _BackgroundWriter(object):
+    """ a thread writing the queued records to their handlers.
+
+    """
+
+    def __init__(self, queue_size: int):
+
+        self.queue = queue.Queue(maxsize=queue_size)
+
+        self.dropped = 0
+
+        self.thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+
+    def put(self, handlers: List[logging.Handler], record: logging.LogRecord) -> None:
+
+        try:
+            self.queue.put_nowait((handlers, record))
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self) -> None:
+
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            handlers, record = item
+            for handler in handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+    def start(self) -> None:
+
+        self.thread.start()
+
+    def restart_after_fork(self) -> None:
+        """ only the forking thread survives a fork: a child process gets a queue and a writer thread of its own. """
+
+        self.queue = queue.Queue(maxsize=self.queue.maxsize)
+
+        self.thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+
+        self.thread.start()
+
+    def stop(self) -> None:
+        """ writes out the records still queued, then stops the thread. """
+
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+        if self.dropped:
+            # the queue is gone, write straight to stderr
+            sys.stderr.write('{} log records were dropped: the log queue was full\n'.format(self.dropped))
+            self.dropped = 0
+
+
+def configure_logging(log_config_file, queue_size: int = 10000):
+    """ configures logging from a yaml file, then moves all the configured handlers behind a queue.
+
+    Args:
+        log_config_file: path to the yaml config file (logging.config.dictConfig schema)
+        queue_size: the maximum number of records waiting to be written
+
+    Returns:
+        None
+
+    """
+
+    global _writer
+
+    if _writer is not None:
+        _writer.stop()
 
-def configure_logging(log_config_file):
     with open(log_config_file) as fl:
-        dictConfig(yaml.load(fl))
+        log_config = yaml.safe_load(fl)
+
+    # dictConfig adds the filters of a logger to the ones it has: configuring twice would filter twice
+    for name in log_config.get('loggers') or {}:
+        logging.getLogger(name).filters = []
+
+    dictConfig(log_config)
+
+    _writer = _BackgroundWriter(queue_size)
+
+    loggers = [logging.getLogger()] + [logger for logger in logging.Logger.manager.loggerDict.values()
+                                       if isinstance(logger, logging.Logger)]
+
+    for logger in loggers:
+        handlers = []
+        for handler in logger.handlers:
+            # loggers left alone by dictConfig may still point to the writer of a previous configuration
+            handlers += handler.handlers if isinstance(handler, _QueueingHandler) else [handler]
+        if handlers:
+            logger.handlers = [_QueueingHandler(_writer, handlers)]
+
+    _writer.start()
+
+
+def stop_logging() -> None:
+    """ writes out the records still queued, then stops the writer thread (e.g. before the process is replaced). """
+
+    if _writer is not None:
+        _writer.stop()
+
+
+def _restart_writer_after_fork() -> None:
+
+    if _writer is not None:
+        _writer.restart_after_fork()
+
+
+atexit.register(stop_logging)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_writer_after_fork)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+""" Request coalescing ("single flight").
+
+When several callers ask for the same thing at the same time (say, the first page of connections of a celebrity),
+only the first one (the leader) does the work: the others wait for its result instead of repeating the repository
+calls. Results are shared between the callers, treat them as read-only.
+
+A caller that joins a call in flight gets the result of that call, which may have started before a write that
+completed in the meantime. Reads are coalesced only while in flight, so this staleness is bounded by the duration of
+one call.
+
+"""
+
+import asyncio
+import logging
+import threading
+from typing import Callable, Dict, Hashable
+
+from server import metrics
+
+logger = logging.getLogger(__name__)
+
+singleflight_calls_total = metrics.REGISTRY.counter(
+    'singleflight_calls_total', 'Coalescable calls, by outcome: leader (did the work), coalesced (shared the result of '
+                                'a leader), timeout (gave up waiting and did the work itself).', ('name', 'outcome'))
+
+
+class _Call(object):
+
+    def __init__(self):
+
+        self.done = threading.Event()
+
+        self.result = None
+
+        self.error = None
+
+
+class SingleFlight(object):
+    """ coalesces the concurrent calls with the same key. Thread-safe.
+
+    """
+
+    def __init__(self, name: str, timeout: float = None):
+        """
+        Args:
+            name: the name to report the calls under
+            timeout: the longest a caller waits for the call in flight (in seconds) before doing the work itself,
+                None to wait for as long as it takes
+
+        """
+
+        self.name = name
+
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+
+        self._calls = {}  # type: Dict[Hashable, _Call]
+
+    def do(self, key: Hashable, func: Callable, *args):
+        """ calls func(*args), unless a call with the same key is in flight: then waits for its result.
+
+        Args:
+            key: identifies identical calls
+            func: the function to call
+            args: its arguments
+
+        Returns:
+            the result of the call. Errors are raised to every caller that shared the call.
+
+        """
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if leader:
+            singleflight_calls_total.inc((self.name, 'leader'))
+            try:
+                call.result = func(*args)
+                return call.result
+            except Exception as e:
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+        if not call.done.wait(self.timeout):
+            singleflight_calls_total.inc((self.name, 'timeout'))
+            logger.warning('gave up waiting for the call in flight: %s %s', self.name, key)
+            return func(*args)
+
+        singleflight_calls_total.inc((self.name, 'coalesced'))
+
+        if call.error is not None:
+            raise call.error
+
+        return call.result
+
+
+class AsyncSingleFlight(object):
+    """ the asyncio variant of SingleFlight: coalesces the concurrent calls of the tasks of one event loop.
+
+    """
+
+    def __init__(self, name: str, timeout: float = None):
+
+        self.name = name
+
+        self.timeout = timeout
+
+        self._calls = {}  # type: Dict[Hashable, asyncio.Future]
+
+    async def do(self, key: Hashable, func: Callable, *args):
+        """ awaits func(*args), unless a call with the same key is in flight: then awaits its result.
+        {@see SingleFlight.do}
+
+        """
+
+        future = self._calls.get(key)
+
+        if future is None:
+            singleflight_calls_total.inc((self.name, 'leader'))
+            future = self._calls[key] = asyncio.ensure_future(func(*args))
+            future.add_done_callback(lambda done: self._calls.pop(key, None) if self._calls.get(key) is done else None)
+            # shielded: a cancelled leader must not cancel the call the others are waiting for
+            return await asyncio.shield(future)
+
+        try:
+            result = await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            singleflight_calls_total.inc((self.name, 'timeout'))
+            logger.warning('gave up waiting for the call in flight: %s %s', self.name, key)
+            return await func(*args)
+
+        singleflight_calls_total.inc((self.name, 'coalesced'))
+
+        return result
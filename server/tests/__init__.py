@@ -1,5 +1,65 @@
 # -*- coding: utf-8 -*-
+""" The tests of the server, and the fixtures they share.
+
+The app is imported here, before any test module: it sets up the config that server.controller and the modules using
+it read when they are imported, so they can't be imported first.
+
+"""
+
 import os
 import sys
+import tempfile
+
+sys.path.append(os.getcwd())
+
+from server.app import app  # noqa: E402 (see above)
+from server.benchmarks import generator  # noqa: E402
+from server.controller import Controller  # noqa: E402
+from server.ORM.json_connections_repository import JsonConnectionsRepository  # noqa: E402
+from server.ORM.json_recommendations_repository import JsonRecommendationsRepository  # noqa: E402
+from server.ORM.json_users_repository import JsonUsersRepository  # noqa: E402
+
+
+class GeneratedSnapshot(object):
+    """ a TestCase mixin writing a generated graph (self.data) to a temporary snapshot (self.json_file).
+
+    The size and the seed of the graph are class attributes; the snapshot is removed after the test.
+
+    """
+
+    generated_users = 50
+
+    seed = 7
+
+    colleges = 50
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.json_file = os.path.join(self.directory.name, 'data.json')
+        self.data = generator.generate(self.generated_users, seed=self.seed, colleges=self.colleges)
+        generator.write(self.data, self.json_file)
+
+
+class JsonController(GeneratedSnapshot):
+    """ a {@see GeneratedSnapshot} loaded into the json repositories (self.users, self.connections and
+    self.recommendations), with a controller over them (self.controller).
+
+    """
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.users = JsonUsersRepository(self.json_file)
+        self.connections = self.load_connections(self.json_file)
+        self.recommendations = JsonRecommendationsRepository(self.json_file)
+        self.controller = self.build_controller()
+
+    def load_connections(self, json_file: str):
+        return JsonConnectionsRepository(json_file)
+
+    def build_controller(self, **kwargs) -> Controller:
+        """ a controller over the repositories of the test; kwargs are passed on to {@see Controller}. """
 
-sys.path.append(os.getcwd())
\ No newline at end of file
+        return Controller(users_repository=self.users, connections_repository=self.connections,
+                          recommendations_repository=self.recommendations, **kwargs)
@@ -0,0 +1,152 @@
+import threading
+import time
+import unittest
+
+from server import app as app_module
+from server.admission import AdmissionController, CallerRateLimiter, RouteClass
+from server.exceptions import AdmissionRejectedException
+
+
+def _controller(capacity: int = 1, queue_budget: float = 1.0, callers: CallerRateLimiter = None):
+    classes = {
+        'read': RouteClass('read', 0, 10),
+        'write': RouteClass('write', 1, 10),
+        'bulk': RouteClass('bulk', 2, 1),
+        'feed': RouteClass('feed', 0, 10, shared=False),
+    }
+    return AdmissionController(capacity, classes, queue_budget, callers)
+
+
+class TestCallerRateLimiter(unittest.TestCase):
+
+    def test_bursts_then_limits(self) -> None:
+        limiter = CallerRateLimiter(rate=10, burst=3)
+        assert [limiter.acquire('a') for _ in range(3)] == [0, 0, 0]
+        assert 0 < limiter.acquire('a') <= 0.1
+        # other callers have their own bucket
+        assert limiter.acquire('b') == 0
+
+    def test_takes_all_the_tokens_or_none(self) -> None:
+        limiter = CallerRateLimiter(rate=10, burst=5)
+        assert limiter.acquire('a', 3) == 0
+        assert 0.09 < limiter.acquire('a', 3) <= 0.1
+        assert limiter.acquire('a', 2) == 0
+
+
+class TestAdmissionController(unittest.TestCase):
+
+    def test_rate_limited_callers_get_a_429(self) -> None:
+        admission = _controller(capacity=10, callers=CallerRateLimiter(rate=1, burst=1))
+        admission.release(admission.admit('read', 'a'))
+        with self.assertRaises(AdmissionRejectedException) as context:
+            admission.admit('read', 'a')
+        assert context.exception.status == 429
+        assert context.exception.retry_after == 1
+
+    def test_shed_early_when_the_wait_would_exceed_the_budget(self) -> None:
+        admission = _controller(queue_budget=0.05)
+        admission._service_time = 1
+        ticket = admission.admit('read')
+
+        start = time.monotonic()
+        with self.assertRaises(AdmissionRejectedException) as context:
+            admission.admit('read')
+        assert time.monotonic() - start < 0.05
+        assert context.exception.status == 503
+
+        admission.release(ticket)
+
+    def test_shed_when_the_queue_wait_times_out(self) -> None:
+        admission = _controller(queue_budget=0.05)
+        ticket = admission.admit('read')
+        with self.assertRaises(AdmissionRejectedException):
+            admission.admit('read')
+        admission.release(ticket)
+        # the timed out request left the queue
+        admission.release(admission.admit('read'))
+
+    def test_reads_go_before_bulk_operations(self) -> None:
+        admission = _controller(capacity=1, queue_budget=5)
+        ticket = admission.admit('read')
+        order = []
+
+        def request(route_class):
+            admission.release(admission.admit(route_class))
+            order.append(route_class)
+
+        bulk = threading.Thread(target=request, args=('bulk',))
+        bulk.start()
+        while not admission._queue:
+            time.sleep(0.001)
+        read = threading.Thread(target=request, args=('read',))
+        read.start()
+        while len(admission._queue) < 2:
+            time.sleep(0.001)
+
+        admission.release(ticket)
+        bulk.join()
+        read.join()
+
+        assert order == ['read', 'bulk']
+
+    def test_class_limits_and_unshared_classes(self) -> None:
+        admission = _controller(capacity=2, queue_budget=0.05)
+        bulk = admission.admit('bulk')
+        # the bulk limit is 1, even though there is shared capacity left
+        with self.assertRaises(AdmissionRejectedException):
+            admission.admit('bulk')
+        read = admission.admit('read')
+        # the shared capacity is used up, long polls still get in
+        feed = admission.admit('feed')
+        for ticket in (bulk, read, feed):
+            admission.release(ticket)
+
+
+class TestAdmissionHook(unittest.TestCase):
+
+    def test_shed_requests_get_a_503_with_retry_after(self) -> None:
+        original = app_module.admission_controller
+        app_module.admission_controller = _controller(capacity=0, queue_budget=0)
+        try:
+            client = app_module.app.test_client()
+            response = client.get('/api/v1/users/ltaylor')
+            metrics = client.get('/metrics')
+        finally:
+            app_module.admission_controller = original
+
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '1'
+        # monitoring is exempt
+        assert metrics.status_code == 200
+        assert 'admission_shed_total{route_class="read",reason="queue_full"}' in metrics.get_data(as_text=True)
+
+    def test_multi_gets_are_bulk_operations(self) -> None:
+        for method, url, route_class in (('GET', '/api/v1/users?ids=a,b', 'bulk'),
+                                         ('POST', '/api/v1/users/lookup', 'bulk'),
+                                         ('GET', '/api/v1/users?college=a', 'read'),
+                                         ('GET', '/api/v1/users/ltaylor', 'read')):
+            with app_module.app.test_request_context(url, method=method):
+                assert app_module._route_class() == route_class, url
+
+    def _statuses(self, remote_addr: str, caller_ids) -> list:
+        original = app_module.admission_controller
+        app_module.admission_controller = _controller(capacity=10, callers=CallerRateLimiter(rate=0.001, burst=1))
+        try:
+            client = app_module.app.test_client()
+            return [client.get('/api/v1/users/ltaylor', headers={'X-Caller-Id': caller_id},
+                               environ_base={'REMOTE_ADDR': remote_addr}).status_code for caller_id in caller_ids]
+        finally:
+            app_module.admission_controller = original
+
+    def test_callers_are_told_apart_by_address(self) -> None:
+        # rotating the header doesn't get a fresh bucket
+        assert self._statuses('10.0.0.1', ['a', 'b', 'c']) == [200, 429, 429]
+
+    def test_the_caller_header_is_read_from_trusted_proxies(self) -> None:
+        trusted = app_module.config.ADMISSION_TRUSTED_PROXIES
+        app_module.config.ADMISSION_TRUSTED_PROXIES = frozenset(['10.0.0.2'])
+        try:
+            assert self._statuses('10.0.0.2', ['a', 'b', 'a']) == [200, 200, 429]
+            assert self._statuses('10.0.0.1', ['a', 'b']) == [200, 429]
+        finally:
+            app_module.config.ADMISSION_TRUSTED_PROXIES = trusted
@@ -0,0 +1,112 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+from collections import defaultdict
+from unittest import mock
+
+from server.app import config
+from server.analytics import graph as graphs
+from server.analytics import runner
+from server.analytics.snapshot import iter_arrays
+from server.benchmarks import generator
+from server.ORM.json_connections_repository import JsonConnectionsRepository
+
+
+class TestSnapshotReader(unittest.TestCase):
+
+    def test_streams_items_across_chunk_boundaries(self) -> None:
+        data = {'meta': {'skipped': [1, 2]}, 'users': [{'id': 'a'}, {'id': 'b', 'n': 12345}], 'other': [[1], [2]],
+                'connections': [{'id': 'c1', 'users': ['a', 'b']}], 'empty': [], 'number': 123456789}
+        text = json.dumps(data, indent=1)
+
+        for chunk_size in (1, 3, 7, 1 << 20):
+            items = list(iter_arrays(io.StringIO(text), ('users', 'connections', 'empty'), chunk_size))
+            assert items == [('users', {'id': 'a'}), ('users', {'id': 'b', 'n': 12345}),
+                             ('connections', {'id': 'c1', 'users': ['a', 'b']})]
+
+    def test_malformed(self) -> None:
+        with self.assertRaises(ValueError):
+            list(iter_arrays(io.StringIO('{"users": [{"id": "a"} {"id": "b"}]}'), ('users',)))
+
+
+class TestGraphStats(unittest.TestCase):
+
+    def test_small_graph(self) -> None:
+        graph = graphs.Graph()
+        # a triangle with a tail, a separate edge, an isolated user
+        for user1, user2 in (('a', 'b'), ('b', 'c'), ('c', 'a'), ('c', 'd'), ('e', 'f')):
+            graph.add_edge(user1, user2)
+        graph.node('g')
+
+        report = graphs.report(graph)
+
+        assert report['users'] == 7 and report['connections'] == 5
+        assert report['degrees']['max'] == 3 and report['degrees']['isolated'] == 1
+        assert report['degrees']['distribution'] == [[0, 1], [1, 3], [2, 2], [3, 1]]
+        assert report['components'] == {'count': 3, 'largest': 4, 'sizes': [[1, 1], [2, 1], [4, 1]]}
+        assert report['triangles']['count'] == 1
+        # 3 closed triples out of 1 + 1 + 3 = 5
+        assert report['triangles']['clustering_coefficient'] == 3 / 5
+
+
+class TestAnalytics(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.json_file = os.path.join(self.directory.name, 'data.json')
+        self.data = generator.generate(500, seed=11)
+        generator.write(self.data, self.json_file)
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_matches_a_brute_force_count(self) -> None:
+        report = runner.run(self.json_file)
+
+        adjacency = defaultdict(set)
+        for connection in self.data['connections']:
+            user1, user2 = connection['users']
+            adjacency[user1].add(user2)
+            adjacency[user2].add(user1)
+        triangles = sum(len(adjacency[user1] & adjacency[user2])
+                        for user1 in adjacency for user2 in adjacency[user1] if user1 < user2) // 3
+
+        assert report['connections'] == len(self.data['connections'])
+        assert report['triangles']['count'] == triangles
+        assert report['degrees']['max'] == max(len(friends) for friends in adjacency.values())
+
+    def test_repository_and_snapshot_agree(self) -> None:
+        from_snapshot = graphs.report(runner.load_snapshot(self.json_file, chunk_size=64))
+        user_ids = [user['id'] for user in self.data['users']]
+        from_repository = graphs.report(runner.load_repository(JsonConnectionsRepository(self.json_file), user_ids,
+                                                               page_size=3))
+
+        assert from_repository == from_snapshot
+
+    def test_cli_through_the_repository_with_a_self_connection(self) -> None:
+        self.data['connections'].append({'id': 'self', 'users': ['user0', 'user0'], 'created': 1537172010.0})
+        generator.write(self.data, self.json_file)
+        output = os.path.join(self.directory.name, 'report.json')
+
+        with mock.patch.object(config, 'connectionsRepository', JsonConnectionsRepository(self.json_file)):
+            assert runner.main(['--snapshot', self.json_file, '--repository', '--output', output]) == 0
+
+        with open(output) as fl:
+            report = json.load(fl)
+        assert report.pop('meta')['source'] == 'repository'
+        expected = runner.run(self.json_file)
+        expected.pop('meta')
+        assert report == expected
+        assert report['connections'] == len(self.data['connections']) - 1
+
+    def test_cli(self) -> None:
+        output = os.path.join(self.directory.name, 'report.json')
+
+        assert runner.main(['--snapshot', self.json_file, '--output', output]) == 0
+
+        with open(output) as fl:
+            report = json.load(fl)
+        assert report['meta']['source'] == 'snapshot'
+        assert report['users'] == 500
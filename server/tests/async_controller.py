@@ -0,0 +1,68 @@
+import asyncio
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
+
+from server.async_controller import AsyncController
+from server.models import User, Profile, Connection
+from server.ORM.threaded_repositories import ThreadPoolUsersRepository, ThreadPoolConnectionsRepository, \
+    ThreadPoolRecommendationsRepository
+
+
+class TestAsyncController(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.michael = User(user_id='mscott', email='mscott@dunder-mifflin.com', profile=Profile(name='Michael Scott', college='Scranton University'))
+        self.dwight = User(user_id='dschrute', email='dschrute@dunder-mifflin.com', profile=Profile(name='Dwight Schrute', college='Scranton University'))
+        users_repository = MagicMock()
+        users_repository.get = MagicMock(side_effect=lambda user_id: {'mscott': self.michael, 'dschrute': self.dwight}.get(user_id))
+        users_repository.create = MagicMock(return_value=self.michael)
+        users_repository.update = MagicMock(return_value=self.michael)
+        connections_repository = MagicMock()
+        connections_repository.get_all = MagicMock(return_value=iter([Connection('c1', {'mscott', 'dschrute'})]))
+        recommendations_repository = MagicMock()
+        self.executor = ThreadPoolExecutor(max_workers=4)
+        self.controller = AsyncController(ThreadPoolUsersRepository(users_repository, self.executor),
+                                          ThreadPoolConnectionsRepository(connections_repository, self.executor),
+                                          ThreadPoolRecommendationsRepository(recommendations_repository, self.executor))
+
+    def tearDown(self) -> None:
+        self.executor.shutdown()
+
+    def test_get_user(self) -> None:
+        user = asyncio.run(self.controller.get_user('mscott'))
+        assert user is self.michael
+
+    def test_update_unknown_user(self) -> None:
+        with self.assertRaises(KeyError):
+            asyncio.run(self.controller.update_user_details('nobody', college='University of New York'))
+
+    def test_add_user(self) -> None:
+        user = asyncio.run(self.controller.add_user(name='Michael Scott', email='mscott@dunder-mifflin.com', college='Scranton University'))
+        self.controller.usersRepository.repository.create.assert_called_once()
+        self.controller.recommendationsRepository.repository.replace_all.assert_called_once()
+        assert isinstance(user, User)
+
+    def test_get_connections(self) -> None:
+        users = asyncio.run(self.controller.get_connections('mscott'))
+        assert users == {self.dwight}
+
+    def test_search_connections_with_a_self_connection(self) -> None:
+        self.controller.connectionsRepository.repository.get_all = MagicMock(
+            return_value=[Connection('c1', {'mscott', 'dschrute'}), Connection('c2', {'mscott'})])
+        users = asyncio.run(self.controller.search_connections('mscott', 's'))
+        assert {user.id for user in users} == {'mscott', 'dschrute'}
+
+    def test_get_connections_with_a_self_connection(self) -> None:
+        self.controller.connectionsRepository.repository.get_all = MagicMock(
+            return_value=[Connection('c1', {'mscott', 'dschrute'}), Connection('c2', {'mscott'})])
+        users = asyncio.run(self.controller.get_connections('mscott'))
+        assert users == {self.dwight, self.michael}
+
+    def test_add_connection(self) -> None:
+        asyncio.run(self.controller.add_connection('mscott', 'dschrute'))
+        self.controller.connectionsRepository.repository.create.assert_called_once_with({'mscott', 'dschrute'}, None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+import logging
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from server.app import config
+from server.settings import log
+from server.settings.log import RateLimitFilter, _BackgroundWriter, _QueueingHandler
+
+
+def _record(msg: str, name: str = 'test', level: int = logging.DEBUG) -> logging.LogRecord:
+    return logging.LogRecord(name, level, __file__, 1, msg, (), None)
+
+
+class _Collecting(logging.Handler):
+
+    def __init__(self, level: int = logging.NOTSET):
+        super().__init__(level)
+        self.records = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.records.append(record)
+
+
+class TestRateLimitFilter(unittest.TestCase):
+
+    def test_bursts_then_drops_per_template(self) -> None:
+        limiter = RateLimitFilter(rate=0.001, burst=2)
+
+        assert [limiter.filter(_record('row %s')) for _ in range(3)] == [True, True, False]
+        # other templates, or the same template of another logger, have their own bucket
+        assert limiter.filter(_record('other %s'))
+        assert limiter.filter(_record('row %s', name='other'))
+
+    def test_refills(self) -> None:
+        limiter = RateLimitFilter(rate=100, burst=1)
+
+        assert limiter.filter(_record('row %s')) and not limiter.filter(_record('row %s'))
+        time.sleep(0.05)
+        assert limiter.filter(_record('row %s'))
+
+
+class TestBackgroundWriter(unittest.TestCase):
+
+    def test_drops_when_the_queue_is_full_and_stop_writes_out_the_rest(self) -> None:
+        writer = _BackgroundWriter(queue_size=2)
+        handler, info_handler = _Collecting(), _Collecting(logging.INFO)
+
+        for i in range(3):
+            writer.put([handler, info_handler], _record('message {}'.format(i)))
+        writer.put([handler, info_handler], _record('warning', level=logging.WARNING))
+
+        assert writer.dropped == 2
+        # only written by the thread
+        assert handler.records == []
+
+        writer.start()
+        writer.stop()
+
+        assert [record.msg for record in handler.records] == ['message 0', 'message 1']
+        # the level of every handler still applies
+        assert info_handler.records == []
+        assert not writer.thread.is_alive()
+
+
+class TestQueueingHandler(unittest.TestCase):
+
+    def test_messages_are_formatted_when_queued(self) -> None:
+        writer = _BackgroundWriter(queue_size=10)
+        handler = _Collecting()
+        logger = logging.Logger('tests.background_logging.queueing')
+        logger.addHandler(_QueueingHandler(writer, [handler]))
+
+        items = [1]
+        logger.debug('items: %s', items)
+        items.append(2)
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            logger.exception('failed')
+
+        writer.start()
+        writer.stop()
+
+        assert [record.getMessage() for record in handler.records] == ['items: [1]', 'failed']
+        assert handler.records[1].exc_info is None
+        assert 'ZeroDivisionError' in handler.records[1].exc_text
+        assert 'ZeroDivisionError' in logging.Formatter().format(handler.records[1])
+
+    def test_records_no_handler_accepts_are_not_queued(self) -> None:
+        writer = _BackgroundWriter(queue_size=10)
+        queueing = _QueueingHandler(writer, [_Collecting(logging.INFO), _Collecting(logging.WARNING)])
+
+        queueing.handle(_record('debug'))
+        assert writer.queue.qsize() == 0
+        queueing.handle(_record('info', level=logging.INFO))
+        assert writer.queue.qsize() == 1
+
+
+class TestConfigureLogging(unittest.TestCase):
+
+    def tearDown(self) -> None:
+        log.configure_logging(config.log_config_file)
+
+    def test_handlers_are_moved_behind_the_queue(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            log_file = os.path.join(directory, 'test.log')
+            config_file = os.path.join(directory, 'log.yaml')
+            with open(config_file, 'w') as fl:
+                fl.write('\n'.join([
+                    'version: 1',
+                    'disable_existing_loggers: False',
+                    'handlers:',
+                    '  file: {class: logging.FileHandler, filename: ' + repr(log_file) + '}',
+                    'loggers:',
+                    '  tests.background_logging: {level: INFO, handlers: [file], propagate: no}',
+                ]))
+
+            # twice: the second configuration must not queue the records twice
+            log.configure_logging(config_file)
+            log.configure_logging(config_file)
+
+            logger = logging.getLogger('tests.background_logging')
+            assert [type(handler) for handler in logger.handlers] == [_QueueingHandler]
+            assert [type(handler) for handler in logger.handlers[0].handlers] == [logging.FileHandler]
+
+            logger.info('written by the %s', 'writer')
+            log.stop_logging()
+            logger.handlers[0].handlers[0].close()
+
+            with open(log_file) as fl:
+                assert fl.read() == 'written by the writer\n'
+
+    def test_configuring_again_registers_nothing_at_exit(self) -> None:
+        with mock.patch('atexit.register') as register:
+            log.configure_logging(config.log_config_file)
+            log.configure_logging(config.log_config_file)
+
+        register.assert_not_called()
+
+    def test_only_the_per_row_messages_are_rate_limited(self) -> None:
+        # configured once by the app already
+        log.configure_logging(config.log_config_file)
+
+        assert [type(limiter) for limiter in logging.getLogger('server.controller.rows').filters] == \
+            [RateLimitFilter]
+        assert logging.getLogger('server.controller').filters == []
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import asyncio
+import json
+import unittest
+
+from server import app as app_module
+from server.app import app, admission_controller
+from server import resources
+from server.admission import AdmissionController, CallerRateLimiter, RouteClass
+from server.resources import Batch
+from server.tests import JsonController
+
+
+class TestBatchGroups(unittest.TestCase):
+
+    def test_reads_between_writes_are_grouped(self) -> None:
+        items = [{'method': method} for method in ('GET', 'GET', 'POST', 'GET', 'DELETE', 'GET', 'GET', 'GET')]
+
+        assert Batch.groups(items, concurrent_reads=True) == [[0, 1], [2], [3], [4], [5, 6, 7]]
+        assert Batch.groups(items, concurrent_reads=False) == [[index] for index in range(len(items))]
+
+    def test_parse(self) -> None:
+        items, error = Batch.parse({'requests': [{'method': 'get', 'path': '/api/v1/users/user1'}]})
+        assert error is None and items[0]['method'] == 'GET'
+
+        for payload in (None, [], {'requests': []}, {'requests': [{'path': '/x'}]},
+                        {'requests': [{'method': 'GET', 'path': '/x'}] * 51}):
+            assert Batch.parse(payload)[0] is None
+
+
+class TestBatch(JsonController, unittest.TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.original = resources.controller
+        resources.controller = self.controller
+        self.client = app.test_client()
+
+    def tearDown(self) -> None:
+        resources.controller = self.original
+
+    def _batch(self, requests, **options):
+        response = self.client.post('/api/v1/batch', json=dict(options, requests=requests))
+        assert response.status_code == 200
+        return response.get_json()['_data']
+
+    def test_sequence(self) -> None:
+        results = self._batch([
+            {'method': 'POST', 'path': '/api/v1/users',
+             'body': {'email': 'new@example.com', 'name': 'New', 'college': 'Nowhere'}},
+            {'method': 'POST', 'path': '/api/v1/users/user1/connections', 'body': {'id': 'user2'}},
+            {'method': 'GET', 'path': '/api/v1/users/user1/connections?limit=5'},
+            {'method': 'GET', 'path': '/api/v1/users/user1/recommendations'},
+            {'method': 'GET', 'path': '/api/v1/nowhere'},
+        ], concurrent_reads=True)
+
+        assert [result['status'] for result in results] == [201, 201, 200, 200, 404]
+        assert results[0]['body']['_data']['name'] == 'New'
+        assert results[0]['headers']['Location'].endswith('/users/' + results[0]['body']['_data']['id'])
+        assert 'user2' in [user['id'] for user in results[2]['body']['_data']]
+        assert len(results[2]['body']['_data']) <= 5
+        assert self.controller.check_connection_exists('user1', 'user2')
+
+    def test_stop_on_error(self) -> None:
+        results = self._batch([
+            {'method': 'POST', 'path': '/api/v1/users/user1/connections', 'body': {}},
+            {'method': 'POST', 'path': '/api/v1/users/user1/connections', 'body': {'id': 'user2'}},
+        ], stop_on_error=True)
+
+        assert [result['status'] for result in results] == [400, 424]
+        assert not self.controller.check_connection_exists('user1', 'user2')
+
+    def test_nested_batches_are_refused(self) -> None:
+        results = self._batch([{'method': 'POST', 'path': '/api/v1/batch', 'body': {'requests': []}}])
+
+        assert results[0]['status'] == 400
+
+    def test_long_polls_and_admin_routes_are_refused(self) -> None:
+        results = self._batch([{'method': 'GET', 'path': '/api/v1/changes?since=0&wait=30'},
+                               {'method': 'GET', 'path': '/api/v1/admin/hot-users'},
+                               {'method': 'POST', 'path': '/api/v1/admin/hot-users'},
+                               {'method': 'GET', 'path': '/api/v1/users/user1'}], concurrent_reads=True)
+
+        assert [result['status'] for result in results] == [400, 400, 400, 200]
+
+    def test_every_request_of_a_batch_is_charged_to_the_caller(self) -> None:
+        classes = {name: RouteClass(name, 0, 10) for name in ('read', 'write', 'bulk')}
+        original = app_module.admission_controller
+        app_module.admission_controller = AdmissionController(10, classes, 1.0, CallerRateLimiter(rate=0.001, burst=6))
+        try:
+            # the batch and its 2 requests
+            assert self._batch([{'method': 'GET', 'path': '/api/v1/users/user1'}] * 2)[0]['status'] == 200
+            response = self.client.post('/api/v1/batch',
+                                        json={'requests': [{'method': 'GET', 'path': '/api/v1/users/user1'}] * 3})
+        finally:
+            app_module.admission_controller = original
+
+        assert response.status_code == 429
+        assert int(response.headers['Retry-After']) >= 1
+
+    def test_batch_is_admitted_once(self) -> None:
+        self._batch([{'method': 'GET', 'path': '/api/v1/users/user1'}] * 3, concurrent_reads=True)
+        self._batch([{'method': 'GET', 'path': '/api/v1/users/user1'}])
+
+        # the sub-requests don't release the slot of the batch request
+        assert admission_controller._running == 0
+        assert all(route_class.running == 0 for route_class in admission_controller.classes.values())
+
+    def test_invalid(self) -> None:
+        assert self.client.post('/api/v1/batch', json={'requests': 'nope'}).status_code == 400
+        assert self.client.post('/api/v1/batch', data='nope', content_type='application/json').status_code == 400
+
+
+class TestAsgiBatch(unittest.TestCase):
+
+    def test_sequence(self) -> None:
+        from server import asgi
+
+        body = json.dumps({'concurrent_reads': True, 'requests': [
+            {'method': 'GET', 'path': '/api/v1/users?ids=nobody'},
+            {'method': 'GET', 'path': '/api/v1/users/nobody'},
+            {'method': 'POST', 'path': '/api/v1/batch', 'body': {}},
+            {'method': 'GET', 'path': '/api/v1/changes?wait=30'},
+        ]}).encode('utf-8')
+
+        resp_dict, status = asyncio.run(asgi.application.dispatch('/api/v1/batch', asgi.Request('POST', {}, body)))
+
+        assert status == 200
+        assert [result['status'] for result in resp_dict['_data']] == [200, 404, 400, 400]
+        assert resp_dict['_data'][0]['body']['_meta'] == {'missing': ['nobody']}
@@ -0,0 +1,42 @@
+import unittest
+
+from server.benchmarks import generator
+from server.benchmarks import repositories
+from server.benchmarks.runner import compare, measure
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_generator_is_seeded(self) -> None:
+        assert generator.generate(200, seed=7) == generator.generate(200, seed=7)
+        assert generator.generate(200, seed=7) != generator.generate(200, seed=8)
+
+    def test_generator_has_no_self_loops_or_duplicates(self) -> None:
+        data = generator.generate(500)
+        edges = [frozenset(connection['users']) for connection in data['connections']]
+        assert all(len(edge) == 2 for edge in edges)
+        assert len(edges) == len(set(edges))
+
+    def test_measure(self) -> None:
+        stats = measure(lambda i: None, samples=20)
+        assert stats['samples'] == 20
+        assert stats['p50_ms'] <= stats['p99_ms']
+
+    def test_compare(self) -> None:
+        baseline = {'op': {'p50_ms': 1.0}, 'skipped': {'skipped': 'not implemented'}}
+        assert compare({'op': {'p50_ms': 1.2}}, baseline, threshold=0.25) == []
+        assert len(compare({'op': {'p50_ms': 1.3}}, baseline, threshold=0.25)) == 1
+        assert compare({'new': {'p50_ms': 9.0}, 'skipped': {'skipped': 'x'}}, baseline, threshold=0.25) == []
+
+    def test_repository_matrix(self) -> None:
+        run_dict = repositories.run([200], ['json', 'sharded'], seed=1, samples=5)
+        assert set(run_dict['results']['json']['200']) >= {'load', 'users.get', 'connections.delete',
+                                                            'recommendations.save'}
+        assert 'users.get' not in run_dict['results']['sharded']['200']
+        rows = {row.split()[0]: row.split()[1:] for row in repositories.table(run_dict).splitlines()[1:]}
+        assert rows['users.get'][1] == '-'
+        assert rows['load'][0].endswith('s') and rows['load'][1].endswith('s')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from server.app import app
+from server import resources
+from server.changes import ChangeFeed
+from server.exceptions import ChangesExpiredException
+from server.tests import JsonController
+
+
+class TestChangeFeed(unittest.TestCase):
+
+    def test_sequence_and_batches(self) -> None:
+        feed = ChangeFeed()
+        for i in range(5):
+            assert feed.append('test', {'i': i}) == i + 1
+
+        assert [change.seq for change in feed.read(0)] == [1, 2, 3, 4, 5]
+        assert [change.seq for change in feed.read(2, limit=2)] == [3, 4]
+        assert feed.read(5) == []
+
+    def test_retention(self) -> None:
+        feed = ChangeFeed(retention=3)
+        for i in range(5):
+            feed.append('test', {'i': i})
+
+        assert [change.seq for change in feed.read()] == [3, 4, 5]
+        assert [change.seq for change in feed.read(2)] == [3, 4, 5]
+        with self.assertRaises(ChangesExpiredException) as context:
+            feed.read(1)
+        assert context.exception.head == 5
+
+    def test_cursor_ahead_of_the_feed_expired(self) -> None:
+        # e.g. a consumer of the feed before the process restarted
+        feed = ChangeFeed()
+        feed.append('test', {})
+
+        start = time.monotonic()
+        with self.assertRaises(ChangesExpiredException) as context:
+            feed.read(5000, timeout=5)
+        assert context.exception.head == 1
+        # not after a long poll
+        assert time.monotonic() - start < 1
+
+        with self.assertRaises(ChangesExpiredException):
+            asyncio.run(feed.read_async(2, timeout=5))
+
+    def test_long_poll_wakes_up_on_append(self) -> None:
+        feed = ChangeFeed()
+        threading.Timer(0.05, feed.append, args=('test', {})).start()
+
+        start = time.monotonic()
+        changes = feed.read(0, timeout=5)
+
+        assert [change.seq for change in changes] == [1]
+        assert time.monotonic() - start < 1
+
+    def test_long_poll_times_out(self) -> None:
+        assert ChangeFeed().read(0, timeout=0.05) == []
+
+    def test_async_long_poll_wakes_up_on_append_from_another_thread(self) -> None:
+        feed = ChangeFeed()
+
+        async def consume():
+            threading.Timer(0.05, feed.append, args=('test', {})).start()
+            return await feed.read_async(0, timeout=5)
+
+        assert [change.seq for change in asyncio.run(consume())] == [1]
+        assert asyncio.run(feed.read_async(1, timeout=0.05)) == []
+
+
+class TestControllerChanges(JsonController, unittest.TestCase):
+
+    def test_mutations_are_sequenced(self) -> None:
+        user = self.controller.add_user(email='new@example.com', name='New', college='Nowhere')
+        self.controller.update_user_details(user.id, name='Renamed')
+        self.controller.add_connection(user.id, 'user1')
+        self.controller.remove_connection(user.id, 'user1')
+        self.controller.remove_user(user.id)
+
+        changes = self.controller.get_changes(0)
+
+        assert [change.type for change in changes] == ['user.created', 'recommendations.added', 'user.updated',
+                                                       'connection.created', 'connection.deleted', 'user.deleted']
+        assert [change.seq for change in changes] == [1, 2, 3, 4, 5, 6]
+        assert changes[2].data == {'id': user.id, 'name': 'Renamed', 'college': 'Nowhere', 'version': 2}
+        assert changes[3].data['users'] == sorted((user.id, 'user1'))
+        assert changes[3].data['created'] > 0
+
+    def test_failed_mutations_are_not_recorded(self) -> None:
+        self.controller.add_connection('user1', 'new')
+        with self.assertRaises(Exception):
+            self.controller.add_connection('new', 'user1')
+
+        assert len(self.controller.get_changes(0)) == 1
+
+    def test_http(self) -> None:
+        original = resources.controller
+        resources.controller = self.controller
+        try:
+            client = app.test_client()
+            self.controller.add_connection('user1', 'new')
+            body = client.get('/api/v1/changes?since=0&wait=0').get_json()
+            assert [change['type'] for change in body['_data']] == ['connection.created']
+            assert body['_meta'] == {'last': 1}
+
+            next_link = body['_links'][0]['href']
+            assert client.get(next_link + '&wait=0').get_json()['_data'] == []
+
+            self.controller.changeFeed = ChangeFeed(retention=1)
+            self.controller.changeFeed.append('test', {})
+            self.controller.changeFeed.append('test', {})
+            response = client.get('/api/v1/changes?since=0&wait=0')
+            assert response.status_code == 410
+            assert response.get_json()['_meta'] == {'head': 2}
+        finally:
+            resources.controller = original
@@ -0,0 +1,160 @@
+import os
+import random
+import sys
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock
+
+from server.benchmarks import generator
+from server.controller import Controller
+from server.models import Profile
+from server.ORM.json_connections_repository import JsonConnectionsRepository
+from server.ORM.json_users_repository import JsonUsersRepository
+from server.ORM.locks import ReadWriteLock
+from server.exceptions import DataIntegrityException
+
+THREADS = 16
+
+OPERATIONS_PER_THREAD = 400
+
+
+class TestReadWriteLock(unittest.TestCase):
+
+    def test_readers_share_writers_exclude(self) -> None:
+        lock = ReadWriteLock()
+        inside = {'readers': 0, 'writers': 0, 'violations': 0}
+        guard = threading.Lock()
+
+        def reader():
+            for _ in range(200):
+                with lock.read():
+                    with guard:
+                        inside['readers'] += 1
+                        if inside['writers']:
+                            inside['violations'] += 1
+                    with guard:
+                        inside['readers'] -= 1
+
+        def writer():
+            for _ in range(200):
+                with lock.write():
+                    with guard:
+                        inside['writers'] += 1
+                        if inside['writers'] > 1 or inside['readers']:
+                            inside['violations'] += 1
+                    with guard:
+                        inside['writers'] -= 1
+
+        threads = [threading.Thread(target=reader) for _ in range(6)] + [threading.Thread(target=writer) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert inside['violations'] == 0
+
+
+class TestRepositoriesUnderConcurrency(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.switch_interval = sys.getswitchinterval()
+        # switch threads as often as possible to shake out races
+        sys.setswitchinterval(1e-6)
+        self.directory = tempfile.TemporaryDirectory()
+        json_file = os.path.join(self.directory.name, 'data.json')
+        data = generator.generate(300, seed=1)
+        generator.write(data, json_file)
+        self.user_ids = [user['id'] for user in data['users']]
+        self.users = JsonUsersRepository(json_file)
+        self.connections = JsonConnectionsRepository(json_file)
+        self.initial_connections = len(data['connections'])
+
+    def tearDown(self) -> None:
+        sys.setswitchinterval(self.switch_interval)
+        self.directory.cleanup()
+
+    def _hammer(self, worker) -> None:
+        errors = []
+
+        def run(index):
+            try:
+                worker(index, random.Random(index))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run, args=(index,)) for index in range(THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == [], errors
+
+    def test_mixed_connection_reads_and_writes(self) -> None:
+        # every thread races the others on the same small set of pairs, so creates and deletes collide
+        pairs = [('stress-{}'.format(i), 'stress-{}'.format(i + 1)) for i in range(4)]
+        created = [0] * THREADS
+        deleted = [0] * THREADS
+
+        def worker(index, rng):
+            for _ in range(OPERATIONS_PER_THREAD):
+                pair = set(rng.choice(pairs))
+                action = rng.random()
+                if action < 0.4:
+                    try:
+                        self.connections.create(pair)
+                        created[index] += 1
+                    except DataIntegrityException:
+                        pass
+                elif action < 0.7:
+                    try:
+                        self.connections.delete(pair)
+                        deleted[index] += 1
+                    except KeyError:
+                        pass
+                else:
+                    for connection in self.connections.get_all(rng.choice(self.user_ids), 0, 50):
+                        assert len(connection.users) == 2
+
+        self._hammer(worker)
+
+        all_pairs = [frozenset(connection.users) for connection in self.connections.connections]
+        # no duplicates were ever let in
+        assert len(all_pairs) == len(set(all_pairs))
+        # every successful create is matched by a delete or still present
+        remaining = sum(1 for pair in pairs if self.connections.get(set(pair)) is not None)
+        assert sum(created) - sum(deleted) == remaining
+        assert len(all_pairs) == self.initial_connections + remaining
+        # the maintained counters agree with a scan
+        for user in {user for pair in pairs for user in pair}:
+            assert self.connections.count(user) == len(self.connections.get_all(user, 0, 10000)), user
+
+    def test_profiles_are_never_seen_half_updated(self) -> None:
+        controller = Controller(self.users, self.connections, MagicMock())
+        targets = self.user_ids[:4]
+        for user_id in targets:
+            controller.update_user_details(user_id, name='name-0', college='college-0')
+        created = [0] * THREADS
+
+        def worker(index, rng):
+            for i in range(OPERATIONS_PER_THREAD):
+                user_id = rng.choice(targets)
+                action = rng.random()
+                if action < 0.3:
+                    version = '{}-{}'.format(index, i)
+                    controller.update_user_details(user_id, name='name-' + version, college='college-' + version)
+                elif action < 0.4:
+                    self.users.create('stress-{}-{}@example.com'.format(index, i), Profile(name='n', college='c'))
+                    created[index] += 1
+                else:
+                    profile = controller.get_user(user_id).profile
+                    assert profile.name[len('name-'):] == profile.college[len('college-'):], \
+                        '{} / {}'.format(profile.name, profile.college)
+
+        self._hammer(worker)
+
+        assert len(self.users.users) == len(self.user_ids) + sum(created)
+
+if __name__ == '__main__':
+    unittest.main()
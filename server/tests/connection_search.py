@@ -0,0 +1,138 @@
+import collections
+import time
+import unittest
+
+from server.app import app
+from server import resources
+from server.search import ConnectionNameIndex, normalize
+from server.tests import JsonController
+
+
+class TestConnectionNameIndex(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.index = ConnectionNameIndex()
+        log = self.index.start_build('a')
+        self.index.finish_build('a', log, [('b', 'Mary Jones'), ('c', 'Michael Scott'), ('d', 'José Martín')])
+
+    def test_normalize(self) -> None:
+        assert normalize('  José   MARTÍN ') == 'jose martin'
+
+    def test_matches_any_word_of_the_name(self) -> None:
+        assert self.index.search('a', 'M', 10) == ['d', 'b', 'c']
+        assert self.index.search('a', 'ma', 10) == ['d', 'b']
+        assert self.index.search('a', 'sc', 10) == ['c']
+        assert self.index.search('a', 'michael s', 10) == ['c']
+        assert self.index.search('a', 'x', 10) == []
+        assert self.index.search('a', 'm', 2) == ['d', 'b']
+
+    def test_users_never_searched_are_not_indexed(self) -> None:
+        assert self.index.search('b', 'm', 10) is None
+
+    def test_follows_adds_removes_and_renames(self) -> None:
+        self.index.add('a', 'e', 'Martha Kent')
+        self.index.remove('a', 'b')
+        self.index.rename('c', 'Mark Scott')
+        # not a friend of a: ignored
+        self.index.rename('z', 'Mallory')
+
+        # ordered by the matching part of the name: mark scott, martha kent, martin
+        assert self.index.search('a', 'ma', 10) == ['c', 'e', 'd']
+        assert self.index.search('a', 'michael', 10) == []
+
+    def test_changes_made_during_a_build_are_replayed(self) -> None:
+        log = self.index.start_build('x')
+        # the builder reads its snapshot, meanwhile:
+        self.index.add('x', 'new', 'Maya')
+        self.index.remove('x', 'gone')
+        self.index.rename('kept', 'Mallory')
+        self.index.finish_build('x', log, [('gone', 'Mark'), ('kept', 'Kim')])
+
+        assert self.index.search('x', 'm', 10) == ['kept', 'new']
+
+    def test_least_recently_searched_users_are_evicted(self) -> None:
+        index = ConnectionNameIndex(max_users=2)
+        for owner in ('a', 'b', 'c'):
+            index.finish_build(owner, index.start_build(owner), [('f', 'Fred')])
+
+        assert index.search('a', 'f', 10) is None
+        assert index.search('c', 'f', 10) == ['f']
+
+
+class TestSearchConnections(JsonController, unittest.TestCase):
+
+    generated_users = 5000
+
+    seed = 5
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.names = {user['id']: user['name'] for user in self.data['users']}
+        self.adjacency = collections.defaultdict(set)
+        for connection in self.data['connections']:
+            user1, user2 = connection['users']
+            self.adjacency[user1].add(user2)
+            self.adjacency[user2].add(user1)
+        self.hub = max(self.adjacency, key=lambda user_id: len(self.adjacency[user_id]))
+
+    def _expected(self, user_id: str, prefix: str):
+        return {friend for friend in self.adjacency[user_id]
+                if any(word.startswith(prefix) for word in normalize(self.names[friend]).split())}
+
+    def test_results_are_connections_matching_the_prefix(self) -> None:
+        found = self.controller.search_connections(self.hub, 'ma', limit=1000)
+
+        assert {user.id for user in found} <= self._expected(self.hub, 'ma')
+        assert len(found) == min(len(self._expected(self.hub, 'ma')), 20)
+
+    def test_index_is_kept_current(self) -> None:
+        self.controller.search_connections(self.hub, 'a')
+        stranger = next(user_id for user_id in self.names if user_id not in self.adjacency[self.hub])
+        friend = next(iter(self.adjacency[self.hub]))
+
+        self.controller.update_user_details(stranger, name='Zebulon Quux')
+        self.controller.add_connection(self.hub, stranger)
+        assert [user.id for user in self.controller.search_connections(self.hub, 'zebulon')] == [stranger]
+        # the other side was never searched, then is
+        assert self.hub in [user.id for user in self.controller.search_connections(stranger, '')]
+
+        self.controller.update_user_details(friend, name='Quentin Zyx')
+        assert [user.id for user in self.controller.search_connections(self.hub, 'zyx')] == [friend]
+
+        self.controller.remove_connection(self.hub, stranger)
+        assert self.controller.search_connections(self.hub, 'zebulon') == []
+
+    def test_a_self_connection_is_indexed_as_its_user(self) -> None:
+        self.controller.update_user_details(self.hub, name='Narcissus Echo')
+        self.controller.connectionsRepository.create({self.hub})
+
+        assert self.controller.warm([self.hub]) == 1
+        assert [user.id for user in self.controller.search_connections(self.hub, 'narc')] == [self.hub]
+
+    def test_typeahead_latency(self) -> None:
+        # the first search builds the index
+        self.controller.search_connections(self.hub, 'a')
+
+        start = time.perf_counter()
+        for prefix in ('m', 'ma', 'mar', 'mari', 'maria'):
+            self.controller.search_connections(self.hub, prefix)
+        elapsed = (time.perf_counter() - start) / 5
+
+        assert elapsed < 0.05, elapsed
+
+    def test_http(self) -> None:
+        original = resources.controller
+        resources.controller = self.controller
+        try:
+            client = app.test_client()
+            url = '/api/v1/users/{}/connections/search'.format(self.hub)
+            assert client.get(url).status_code == 400
+            assert client.get('/api/v1/users/nobody/connections/search?prefix=a').status_code == 404
+            response = client.get(url + '?prefix=ma&limit=5')
+        finally:
+            resources.controller = original
+
+        assert response.status_code == 200
+        found = {user['id'] for user in response.get_json()['_data']}
+        assert len(found) == min(5, len(self._expected(self.hub, 'ma')))
+        assert found <= self._expected(self.hub, 'ma')
@@ -0,0 +1,126 @@
+import atexit
+import os
+import random
+import tempfile
+import unittest
+from collections import Counter
+from unittest import mock
+
+from server.app import app
+from server import hotkeys, resources
+from server.hotkeys import CountMinSketch, HotKeyTracker
+from server.tests import JsonController
+
+
+class _Clock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _zipf_stream(keys: int, hits: int, seed: int = 1):
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(keys)]
+    return rng.choices(['user{}'.format(rank) for rank in range(keys)], weights, k=hits)
+
+
+class TestCountMinSketch(unittest.TestCase):
+
+    def test_estimates_never_undercount(self) -> None:
+        sketch = CountMinSketch(width=256, depth=4)
+        stream = _zipf_stream(5000, 20000)
+        for key in stream:
+            sketch.add(key)
+
+        counts = Counter(stream)
+        assert all(sketch.estimate(key) >= count for key, count in counts.items())
+        # the heavy hitters are estimated closely
+        for key, count in counts.most_common(5):
+            assert sketch.estimate(key) - count <= len(stream) * 2.72 / 256
+
+
+class TestHotKeyTracker(unittest.TestCase):
+
+    def test_finds_the_heavy_hitters(self) -> None:
+        tracker = HotKeyTracker(k=10)
+        stream = _zipf_stream(10000, 50000)
+        for key in stream:
+            tracker.record(key)
+
+        expected = [key for key, _ in Counter(stream).most_common(5)]
+        assert [key for key, _ in tracker.top(5)] == expected
+
+    def test_sliding_window(self) -> None:
+        clock = _Clock()
+        tracker = HotKeyTracker(k=3, window=60, buckets=6, clock=clock)
+        for _ in range(100):
+            tracker.record('old')
+
+        clock.now = 30
+        for _ in range(10):
+            tracker.record('new')
+        assert tracker.top() == [('old', 100), ('new', 10)]
+
+        # 'old' slides out of the window, 'new' is still in it
+        clock.now = 65
+        assert tracker.top() == [('new', 10)]
+
+        clock.now = 1000
+        assert tracker.top() == []
+
+    def test_snapshot(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'hot.json')
+            assert hotkeys.load(path) == {}
+
+            tracker = HotKeyTracker(k=2)
+            for key in ('a', 'b', 'b', 'c', 'c', 'c'):
+                tracker.record(key)
+            hotkeys.save(path, {'reads': tracker})
+
+            assert hotkeys.load(path) == {'reads': ['c', 'b']}
+
+
+class TestWarming(JsonController, unittest.TestCase):
+
+    def test_warm_builds_the_missing_indexes(self) -> None:
+        assert self.controller.nameIndex.search('user1', '', 1) is None
+
+        assert self.controller.warm(['user1', 'user2', 'missing']) == 2
+        assert self.controller.nameIndex.search('user1', '', 1) is not None
+        # already warm
+        assert self.controller.warm(['user1']) == 0
+
+    def test_http(self) -> None:
+        original_controller, original_trackers = resources.controller, dict(resources.hot_users)
+        resources.controller = self.controller
+        resources.hot_users.update({kind: HotKeyTracker(k=5) for kind in ('reads', 'writes')})
+        try:
+            client = app.test_client()
+            for _ in range(3):
+                client.get('/api/v1/users/user1/connections')
+            client.get('/api/v1/users/user2')
+            client.post('/api/v1/users/user1/connections', json={'id': 'user3'})
+
+            body = client.get('/api/v1/admin/hot-users').get_json()
+            assert body['_data']['reads'] == [{'id': 'user1', 'count': 3}, {'id': 'user2', 'count': 1}]
+            assert body['_data']['writes'] == [{'id': 'user1', 'count': 1}]
+
+            assert client.post('/api/v1/admin/hot-users').get_json()['_meta'] == {'warmed': 2}
+        finally:
+            resources.controller = original_controller
+            resources.hot_users.update(original_trackers)
+
+    def test_the_hot_users_are_only_persisted_by_the_servers(self) -> None:
+        # importing the resources (as the tests and the tools do) writes nothing
+        assert resources.config.HOT_USERS_SNAPSHOT_FILE is None
+
+        path = os.path.join(self.directory.name, 'hot_users.json')
+        with mock.patch.object(resources.config, 'HOT_USERS_SNAPSHOT_FILE', path), \
+                mock.patch.object(atexit, 'register') as register:
+            resources.persist_hot_users()
+
+        register.assert_called_once_with(hotkeys.save, path, resources.hot_users)
@@ -0,0 +1,51 @@
+import threading
+import time
+import unittest
+
+from server import ids
+from server.ids import IdGenerator
+
+
+class TestIds(unittest.TestCase):
+
+    def test_ids_are_sortable_and_strictly_increasing(self) -> None:
+        generator = IdGenerator(node=7)
+        allocated = [generator.next_id() for _ in range(20000)]
+        assert allocated == sorted(allocated)
+        assert len(set(allocated)) == len(allocated)
+        assert all(len(id_string) == ids.ID_LENGTH for id_string in allocated)
+
+    def test_nodes_never_collide(self) -> None:
+        first, second = IdGenerator(node=1), IdGenerator(node=2)
+        assert not {first.next_id() for _ in range(5000)} & {second.next_id() for _ in range(5000)}
+
+    def test_unique_across_threads(self) -> None:
+        generator = IdGenerator(node=3)
+        allocated = []
+
+        def allocate():
+            allocated.extend(generator.next_id() for _ in range(2000))
+
+        threads = [threading.Thread(target=allocate) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(set(allocated)) == 16000
+
+    def test_round_trip(self) -> None:
+        value = IdGenerator(node=5).next_int()
+        assert ids.decode(ids.encode(value)) == value
+        assert (value >> ids.SEQUENCE_BITS) & ids.MAX_NODE == 5
+        assert abs(ids.timestamp_of(ids.encode(value)) - time.time()) < 5
+        with self.assertRaises(ValueError):
+            ids.decode('rryan')
+
+    def test_invalid_node(self) -> None:
+        with self.assertRaises(ValueError):
+            IdGenerator(node=ids.MAX_NODE + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import unittest
+
+from server.app import app, config
+from server.ORM import instrumentation
+from server.ORM.instrumentation import instrumented, repository_calls_total, repository_rows_total, \
+    repository_seconds_total
+
+
+@instrumented('test_repository')
+class _Repository(object):
+
+    def get_many(self, ids):
+        return {user_id: user_id for user_id in ids}
+
+    def get(self, user_id):
+        return user_id
+
+    def missing(self):
+        return None
+
+    def stream(self, ids):
+        return (user_id for user_id in ids)
+
+    def fail(self):
+        raise KeyError('missing')
+
+    def _private(self):
+        return [1, 2, 3]
+
+
+def _counts(method: str):
+    labels = ('test_repository', method)
+    return repository_calls_total.get(labels), repository_rows_total.get(labels), repository_seconds_total.get(labels)
+
+
+class TestInstrumented(unittest.TestCase):
+
+    def tearDown(self) -> None:
+        instrumentation.configure(slow_op_threshold_ms=config.REPOSITORY_SLOW_OP_THRESHOLD_MS)
+
+    def _calls_and_rows(self, method: str, *args):
+        before = _counts(method)
+        getattr(_Repository(), method)(*args)
+        after = _counts(method)
+        assert after[2] >= before[2]
+        return after[0] - before[0], after[1] - before[1]
+
+    def test_counts_calls_and_rows(self) -> None:
+        assert self._calls_and_rows('get_many', ['a', 'b', 'c']) == (1, 3)
+        assert self._calls_and_rows('get', 'a') == (1, 1)
+        assert self._calls_and_rows('missing') == (1, 0)
+
+    def test_iterators_are_not_consumed_to_count_their_rows(self) -> None:
+        before = _counts('stream')
+        stream = _Repository().stream(['a', 'b'])
+
+        assert list(stream) == ['a', 'b']
+        assert _counts('stream')[:2] == (before[0] + 1, before[1])
+
+    def test_failed_calls_are_counted(self) -> None:
+        before = _counts('fail')
+        with self.assertRaises(KeyError):
+            _Repository().fail()
+        assert _counts('fail')[:2] == (before[0] + 1, before[1])
+
+    def test_private_methods_are_left_alone(self) -> None:
+        before = _counts('_private')
+        _Repository()._private()
+        assert _counts('_private') == before
+
+    def test_slow_calls_are_logged(self) -> None:
+        instrumentation.configure(slow_op_threshold_ms=0)
+        with self.assertLogs('server.ORM.slow_ops', 'WARNING') as logs:
+            _Repository().get('a')
+        assert len(logs.records) == 1
+        assert 'test_repository.get' in logs.output[0] and "args: ('a',)" in logs.output[0]
+
+        instrumentation.configure(slow_op_threshold_ms=None)
+        with self.assertRaises(AssertionError):
+            with self.assertLogs('server.ORM.slow_ops', 'WARNING'):
+                _Repository().get('a')
+
+    def test_breakdown(self) -> None:
+        token = instrumentation.start_breakdown()
+        _Repository().get('a')
+        _Repository().get_many(['a'])
+        _Repository().get('b')
+        breakdown = instrumentation.stop_breakdown(token)
+
+        assert {name: calls for name, (calls, _) in breakdown.items()} == \
+            {'test_repository.get': 2, 'test_repository.get_many': 1}
+        # not collected outside of a breakdown
+        _Repository().get('a')
+        assert breakdown['test_repository.get'][0] == 2
+
+
+class TestServerTiming(unittest.TestCase):
+
+    def test_only_requested_with_the_debug_header(self) -> None:
+        client = app.test_client()
+
+        response = client.get('/api/v1/users/ltaylor', headers={config.REPOSITORY_TIMING_DEBUG_HEADER: '1'})
+        assert response.status_code == 200
+        entries = [entry.strip() for entry in response.headers['Server-Timing'].split(',')]
+        assert any(entry.startswith('users.get;dur=') and entry.endswith('calls"') for entry in entries)
+        assert entries[-1].startswith('total;dur=')
+
+        assert 'Server-Timing' not in client.get('/api/v1/users/ltaylor').headers
+
+
+if __name__ == '__main__':
+    unittest.main()
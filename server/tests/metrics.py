@@ -0,0 +1,81 @@
+import unittest
+
+from server import app as app_module
+from server.metrics import Counter, Gauge, Histogram, Registry
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_counter(self) -> None:
+        counter = Counter('requests_total', 'requests', ('method',))
+        counter.inc(('GET',))
+        counter.inc(('GET',), 2)
+        assert counter.get(('GET',)) == 3
+        assert 'requests_total{method="GET"} 3.0' in counter.render()
+
+    def test_gauge(self) -> None:
+        gauge = Gauge('in_flight', 'in flight')
+        gauge.inc()
+        gauge.inc()
+        gauge.dec()
+        assert gauge.get() == 1
+
+    def test_histogram_buckets_are_cumulative(self) -> None:
+        histogram = Histogram('latency_seconds', 'latency', ('route',), buckets=(0.1, 0.5, 1.0))
+        for value in (0.05, 0.2, 0.3, 0.7, 3.0):
+            histogram.observe(('/users',), value)
+        lines = histogram.render()
+        assert 'latency_seconds_bucket{route="/users",le="0.1"} 1' in lines
+        assert 'latency_seconds_bucket{route="/users",le="0.5"} 3' in lines
+        assert 'latency_seconds_bucket{route="/users",le="+Inf"} 5' in lines
+        assert 'latency_seconds_count{route="/users"} 5' in lines
+
+    def test_histogram_quantile(self) -> None:
+        histogram = Histogram('latency_seconds', 'latency', buckets=(0.1, 0.5, 1.0))
+        for _ in range(99):
+            histogram.observe((), 0.05)
+        histogram.observe((), 0.8)
+        assert histogram.quantile((), 0.5) <= 0.1
+        assert 0.5 <= histogram.quantile((), 0.999) <= 1.0
+        assert histogram.quantile(('missing',), 0.5) is None
+
+    def test_registry_deduplicates_by_name(self) -> None:
+        registry = Registry()
+        first = registry.counter('requests_total', 'requests')
+        second = registry.counter('requests_total', 'requests')
+        assert first is second
+        assert registry.render().startswith('# HELP requests_total requests')
+
+
+
+class TestRequestMetrics(unittest.TestCase):
+
+    def test_requests_are_recorded_and_rendered(self) -> None:
+        labels = ('GET', '/api/v1/users/<string:user_id>', '200')
+        requests = app_module.http_requests_total.get(labels)
+        client = app_module.app.test_client()
+
+        assert client.get('/api/v1/users/ltaylor').status_code == 200
+        text = client.get('/metrics').get_data(as_text=True)
+
+        assert app_module.http_requests_total.get(labels) == requests + 1
+        assert app_module.http_requests_in_flight.get(labels[:2]) == 0
+        line = 'http_requests_total{method="GET",route="/api/v1/users/<string:user_id>",status="200"} ' + \
+            '{:.1f}'.format(requests + 1)
+        assert line in text.splitlines()
+        assert 'http_request_duration_seconds_count{method="GET",route="/api/v1/users/<string:user_id>",' \
+               'status="200"} ' + str(int(requests + 1)) in text.splitlines()
+        # the buckets of the settings
+        assert text.count('http_request_duration_seconds_bucket{method="GET",route="/api/v1/users/<string:user_id>",'
+                          'status="200"') == len(app_module.config.METRICS_LATENCY_BUCKETS) + 1
+
+    def test_unmatched_routes_share_a_label(self) -> None:
+        labels = ('GET', 'unmatched', '404')
+        requests = app_module.http_requests_total.get(labels)
+
+        assert app_module.app.test_client().get('/nowhere/{}'.format(requests)).status_code == 404
+        assert app_module.http_requests_total.get(labels) == requests + 1
+
+
+if __name__ == '__main__':
+    unittest.main()
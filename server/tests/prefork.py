@@ -0,0 +1,199 @@
+import http.client
+import os
+import signal
+import threading
+import time
+import unittest
+from unittest import mock
+
+from server import ids, prefork
+
+
+def _slow_app(environ, start_response):
+    time.sleep(float(environ.get('QUERY_STRING') or 0))
+    start_response('200 OK', [('Content-Type', 'text/plain'), ('Content-Length', '2')])
+    return [b'ok']
+
+
+def _pid_app(environ, start_response):
+    time.sleep(float(environ.get('QUERY_STRING') or 0))
+    body = str(os.getpid()).encode('ascii')
+    node = (ids.decode(ids.new_id()) >> ids.SEQUENCE_BITS) & ids.MAX_NODE
+    start_response('200 OK', [('Content-Type', 'text/plain'), ('Content-Length', str(len(body))),
+                              ('X-Id-Node', str(node))])
+    return [body]
+
+
+def _run_master(listener) -> None:
+    """ the forked master process: never returns to the test runner. """
+
+    status = 2
+    try:
+        index = prefork.Master(listener, 1, graceful_timeout=5, argv=[]).run()
+        status = 0 if index is None else prefork.serve_worker(_pid_app, listener, index, threads=2, timeout=5,
+                                                              graceful_timeout=5, id_node=None)
+    finally:
+        os._exit(status)
+
+
+class TestWorkerServer(unittest.TestCase):
+
+    def setUp(self) -> None:
+        listener = prefork._listen('127.0.0.1:0', 16)
+        self.port = listener.getsockname()[1]
+        self.server = prefork._WorkerServer('127.0.0.1', self.port, _slow_app, threads=2, fd=listener.fileno())
+        listener.close()
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05})
+        self.thread.start()
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.thread.join()
+
+    def _get(self, delay: float = 0) -> bytes:
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        try:
+            connection.request('GET', '/?{}'.format(delay))
+            return connection.getresponse().read()
+        finally:
+            connection.close()
+
+    def test_serves_concurrently(self) -> None:
+        replies = []
+        clients = [threading.Thread(target=lambda: replies.append(self._get(0.3))) for _ in range(2)]
+        start = time.monotonic()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+
+        assert replies == [b'ok', b'ok']
+        assert time.monotonic() - start < 0.55
+
+    def test_drain_waits_for_the_requests_in_flight(self) -> None:
+        replies = []
+        client = threading.Thread(target=lambda: replies.append(self._get(0.3)))
+        client.start()
+        time.sleep(0.1)
+
+        self.server.shutdown()
+        self.thread.join()
+
+        assert self.server.drain(timeout=5)
+        client.join()
+        assert replies == [b'ok']
+
+    def test_drain_times_out(self) -> None:
+        client = threading.Thread(target=self._get, args=(0.5,))
+        client.start()
+        time.sleep(0.1)
+
+        assert not self.server.drain(timeout=0.05)
+        client.join()
+
+    def test_refuses_several_workers_over_in_process_repositories(self) -> None:
+        with self.assertRaises(SystemExit):
+            prefork.main(['--workers', '2', '--bind', '127.0.0.1:0'])
+
+    def test_generations_use_disjoint_id_nodes(self) -> None:
+        listener = prefork._listen('127.0.0.1:0', 16)
+        self.addCleanup(listener.close)
+
+        def master(environment):
+            with mock.patch.dict(os.environ, environment):
+                created = prefork.Master(listener, 3, graceful_timeout=5, argv=[])
+            os.close(created._wakeup_read)
+            os.close(created._wakeup_write)
+            return created
+
+        def reloaded(previous):
+            with mock.patch('os.execve') as execve, mock.patch('server.settings.log.stop_logging'):
+                previous._reload()
+            return master(execve.call_args[0][2])
+
+        generations = [master({})]
+        for _ in range(2):
+            generations.append(reloaded(generations[-1]))
+
+        nodes = [set(range(generation.first_id_node(5), generation.first_id_node(5) + 3))
+                 for generation in generations]
+        assert [generation.generation for generation in generations] == [0, 1, 2]
+        # the retiring workers of a reload and their replacements
+        assert nodes[0] == {5, 6, 7} and nodes[1] == {8, 9, 10}
+        assert nodes[2] == nodes[0]
+
+    def test_parse_bind(self) -> None:
+        assert prefork._parse_bind('127.0.0.1:8000') == ('127.0.0.1', 8000)
+        assert prefork._parse_bind(':8000') == ('0.0.0.0', 8000)
+
+
+class TestMaster(unittest.TestCase):
+
+    def setUp(self) -> None:
+        listener = prefork._listen('127.0.0.1:0', 16)
+        self.port = listener.getsockname()[1]
+        self.workers = set()
+        self.nodes = set()
+        self.master = os.fork()
+        if self.master == 0:
+            _run_master(listener)
+        listener.close()
+
+    def tearDown(self) -> None:
+        if self._exit_status(timeout=0) is None:
+            os.kill(self.master, signal.SIGKILL)
+            os.waitpid(self.master, 0)
+            for pid in self.workers:
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+    def _exit_status(self, timeout: float):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                pid, status = os.waitpid(self.master, os.WNOHANG)
+            except ChildProcessError:
+                return 0
+            if pid:
+                return os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(0.05)
+
+    def _worker_pid(self, delay: float = 0) -> int:
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=10)
+        try:
+            connection.request('GET', '/?{}'.format(delay))
+            response = connection.getresponse()
+            pid = int(response.read())
+            self.nodes.add(int(response.getheader('X-Id-Node')))
+        finally:
+            connection.close()
+        self.workers.add(pid)
+        return pid
+
+    def test_restarts_dead_workers_and_stops_gracefully(self) -> None:
+        first = self._worker_pid()
+        assert first != self.master
+
+        os.kill(first, signal.SIGKILL)
+        # the connections wait in the backlog of the listening socket until the new worker accepts them
+        second = self._worker_pid()
+        assert second not in (first, self.master)
+
+        replies = []
+        client = threading.Thread(target=lambda: replies.append(self._worker_pid(0.5)))
+        client.start()
+        time.sleep(0.2)
+
+        os.kill(self.master, signal.SIGTERM)
+        client.join()
+
+        assert replies == [second]
+        # the id node is the index of the worker, not derived from its pid: the same for its replacement
+        assert self.nodes == {0}
+        assert self._exit_status(timeout=10) == 0
+        with self.assertRaises(ProcessLookupError):
+            os.kill(second, 0)
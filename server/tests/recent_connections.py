@@ -0,0 +1,143 @@
+import asyncio
+import os
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qsl
+
+from server.app import app
+from server import asgi, resources
+from server.async_controller import AsyncController
+from server.controller import Controller
+from server.ORM.threaded_repositories import ThreadPoolUsersRepository, ThreadPoolConnectionsRepository, \
+    ThreadPoolRecommendationsRepository
+from server.tests import JsonController
+from server.unit_of_work import Journal
+
+
+class TestRecentConnections(JsonController, unittest.TestCase):
+
+    generated_users = 300
+
+    seed = 3
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.timelines = {}
+        for connection in self.data['connections']:
+            user1, user2 = connection['users']
+            self.timelines.setdefault(user1, []).append((connection['created'], user2))
+            self.timelines.setdefault(user2, []).append((connection['created'], user1))
+        self.hub = max(self.timelines, key=lambda user_id: len(self.timelines[user_id]))
+
+    def _expected(self, user_id: str):
+        return [(other, created) for created, other in sorted(self.timelines[user_id], reverse=True)]
+
+    def test_pages_follow_the_cursor(self) -> None:
+        pages, cursor = [], None
+        while True:
+            users, cursor = self.controller.get_recent_connections(self.hub, cursor, limit=5)
+            pages.append([(user.id, created) for user, created in users])
+            if cursor is None:
+                break
+
+        assert [pair for page in pages for pair in page] == self._expected(self.hub)
+        assert all(len(page) == 5 for page in pages[:-1])
+        assert self.controller.get_recent_connections(self.hub, limit=0) == ([], None)
+
+    def test_since(self) -> None:
+        since = self._expected(self.hub)[3][1]
+        users, cursor = self.controller.get_recent_connections(self.hub, since=since)
+
+        assert [(user.id, created) for user, created in users] == self._expected(self.hub)[:4]
+        assert cursor is None
+
+    def test_new_connections_come_first(self) -> None:
+        stranger = next(user_id for user_id in self.timelines if user_id not in
+                        {other for _, other in self.timelines[self.hub]} | {self.hub})
+        self.controller.add_connection(self.hub, stranger)
+
+        users, _ = self.controller.get_recent_connections(self.hub, limit=2)
+        assert [user.id for user, _ in users] == [stranger, self._expected(self.hub)[0][0]]
+
+    def test_a_failed_removal_keeps_the_creation_time(self) -> None:
+        other, created = self._expected(self.hub)[2]
+        journal = Journal(os.path.join(self.directory.name, 'journal.log'))
+        controller = Controller(users_repository=self.controller.usersRepository,
+                                connections_repository=self.controller.connectionsRepository,
+                                recommendations_repository=self.controller.recommendationsRepository, journal=journal)
+        journal.close()
+
+        with self.assertRaises(ValueError):
+            controller.remove_connection(self.hub, other)
+
+        users, _ = self.controller.get_recent_connections(self.hub, limit=5)
+        assert [(user.id, created) for user, created in users] == self._expected(self.hub)[:5]
+        assert self.controller.connectionsRepository.get({self.hub, other}).created == created
+
+    def test_http(self) -> None:
+        original = resources.controller
+        resources.controller = self.controller
+        try:
+            client = app.test_client()
+            url = '/api/v1/users/{}/connections'.format(self.hub)
+            assert client.get(url + '?order=oldest').status_code == 400
+            assert client.get(url + '?order=recent&cursor=nope').status_code == 400
+            assert client.get(url + '?order=recent&since=yesterday').status_code == 400
+            for params in ('limit=0', 'limit=-1', 'since=nan', 'since=inf', 'cursor=inf:user1', 'cursor=nan:user1'):
+                assert client.get(url + '?order=recent&' + params).status_code == 400, params
+            first = client.get(url + '?order=recent&limit=3').get_json()
+            next_link = next(link['href'] for link in first['_links'] if link['rel'] == 'next')
+            second = client.get(next_link).get_json()
+        finally:
+            resources.controller = original
+
+        expected = self._expected(self.hub)
+        assert [(user['id'], user['connected_at']) for user in first['_data'] + second['_data']] == expected[:6]
+        assert first['_meta']['total'] == len(expected)
+        assert dict(parse_qsl(urlparse(next_link).query))['order'] == 'recent'
+
+    def test_both_orders_list_a_self_connection(self) -> None:
+        self.controller.connectionsRepository.create({self.hub})
+        # listed last by default, first by recency
+        degree = len(self.timelines[self.hub])
+
+        assert [user.id for user in self.controller.get_connections(self.hub, offset=degree)] == [self.hub]
+        users, _ = self.controller.get_recent_connections(self.hub, limit=1)
+        assert [user.id for user, _ in users] == [self.hub]
+
+        original = resources.controller
+        resources.controller = self.controller
+        try:
+            client = app.test_client()
+            url = '/api/v1/users/{}/connections'.format(self.hub)
+            responses = [client.get(url + '?offset={}'.format(degree)), client.get(url + '?order=recent&limit=1')]
+        finally:
+            resources.controller = original
+
+        assert [response.status_code for response in responses] == [200, 200]
+        assert [[user['id'] for user in response.get_json()['_data']] for response in responses] == [[self.hub]] * 2
+
+    def test_asgi(self) -> None:
+        executor = ThreadPoolExecutor(max_workers=2)
+        controller = AsyncController(
+            users_repository=ThreadPoolUsersRepository(self.controller.usersRepository, executor),
+            connections_repository=ThreadPoolConnectionsRepository(self.controller.connectionsRepository, executor),
+            recommendations_repository=ThreadPoolRecommendationsRepository(
+                self.controller.recommendationsRepository, executor))
+
+        original = asgi.controller
+        asgi.controller = controller
+        try:
+            request = asgi.Request('GET', {'order': 'recent', 'limit': '3'}, b'')
+            resp_dict, status = asyncio.run(asgi.get_connections(request, self.hub))
+        finally:
+            asgi.controller = original
+            executor.shutdown()
+
+        assert status == 200
+        assert [(user['id'], user['connected_at']) for user in resp_dict['_data']] == self._expected(self.hub)[:3]
+        assert 'order=recent' in next(link['href'] for link in resp_dict['_links'] if link['rel'] == 'next')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from server.app import app, config
+from server.async_controller import AsyncController
+from server.controller import Controller
+from server.ORM.json_connections_repository import JsonConnectionsRepository
+from server.ORM.json_recommendations_repository import JsonRecommendationsRepository
+from server.ORM.json_users_repository import JsonUsersRepository
+from server.ORM.threaded_repositories import ThreadPoolUsersRepository, ThreadPoolConnectionsRepository, \
+    ThreadPoolRecommendationsRepository
+
+
+class TestRecommendations(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        json_file = os.path.join(self.directory.name, 'data.json')
+        data = {
+            'users': [{'id': 'user{}'.format(i), 'email': 'user{}@example.com'.format(i), 'name': 'User {}'.format(i),
+                       'college': 'college'} for i in range(20)],
+            # user0 is already connected to the users recommended with the best scores
+            'connections': [{'id': 'c{}'.format(i), 'users': ['user0', 'user{}'.format(i)]} for i in (1, 2, 3)],
+            # user0 -> user1 (score 19) ... user19 (score 1), and a user that no longer exists
+            'recommendations': [{'id': 'r{}'.format(i), 'user_id': 'user0', 'recommended_user_id': 'user{}'.format(i),
+                                 'score': 20 - i} for i in range(1, 20)] +
+                               [{'id': 'r-ghost', 'user_id': 'user0', 'recommended_user_id': 'ghost', 'score': 15.5}]
+        }
+        with open(json_file, 'w') as fl:
+            json.dump(data, fl)
+        self.users = JsonUsersRepository(json_file)
+        self.connections = JsonConnectionsRepository(json_file)
+        self.recommendations = JsonRecommendationsRepository(json_file)
+        self.controller = Controller(users_repository=self.users, connections_repository=self.connections,
+                                     recommendations_repository=self.recommendations)
+        self.max_skipped = config.RECOMMENDATIONS_MAX_SKIPPED
+
+    def tearDown(self) -> None:
+        config.RECOMMENDATIONS_MAX_SKIPPED = self.max_skipped
+        self.directory.cleanup()
+
+    def test_repository_ranks_by_score(self) -> None:
+        page = list(self.recommendations.get('user0', 2, 3))
+        assert [recommendation.recommended_user for recommendation in page] == ['user3', 'user4', 'ghost']
+
+        # saving an existing recommendation updates its score, and returns the recommendation
+        recommendation = self.recommendations.save('user0', 'user19', 100)
+        assert recommendation.id == 'r19' and recommendation.score == 100
+        assert list(self.recommendations.get('user0', 0, 1))[0] is recommendation
+        assert self.recommendations.count('user0') == 20
+
+        self.recommendations.delete('r19')
+        assert self.recommendations.count('user0') == 19
+        with self.assertRaises(KeyError):
+            self.recommendations.delete('r19')
+
+    def test_connected_and_unknown_users_are_backfilled(self) -> None:
+        users, next_offset = self.controller.get_recommendations('user0', 0, 5)
+
+        # user1..3 are connections, ghost does not exist
+        assert [user.id for user in users] == ['user4', 'user5', 'user6', 'user7', 'user8']
+        assert next_offset == 9
+
+        users, next_offset = self.controller.get_recommendations('user0', next_offset, 5)
+        assert [user.id for user in users] == ['user9', 'user10', 'user11', 'user12', 'user13']
+
+        users, next_offset = self.controller.get_recommendations('user0', 18, 5)
+        assert [user.id for user in users] == ['user18', 'user19'] and next_offset == 20
+
+    def test_new_connections_are_excluded_at_read_time(self) -> None:
+        self.controller.add_connection('user0', 'user4')
+
+        users, _ = self.controller.get_recommendations('user0', 0, 2)
+
+        assert [user.id for user in users] == ['user5', 'user6']
+
+    def test_skips_are_bounded(self) -> None:
+        config.RECOMMENDATIONS_MAX_SKIPPED = 2
+
+        users, next_offset = self.controller.get_recommendations('user0', 0, 5)
+
+        # short page: served after 2 skips, the next page resumes after them
+        assert len(users) < 5
+        assert next_offset < 20
+
+    def test_add_recommendations_with_scores(self) -> None:
+        self.controller.delete_recommendations('user0')
+        assert self.controller.count_recommendations('user0') == 0
+
+        self.controller.add_recommendations('user0', {'user10': 0.2, 'user11': 0.9, 'user12': 0.5})
+
+        users, _ = self.controller.get_recommendations('user0', 0, 10)
+        assert [user.id for user in users] == ['user11', 'user12', 'user10']
+
+    def test_async_controller_agrees(self) -> None:
+        async def get_recommendations():
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                controller = AsyncController(
+                    users_repository=ThreadPoolUsersRepository(self.users, executor),
+                    connections_repository=ThreadPoolConnectionsRepository(self.connections, executor),
+                    recommendations_repository=ThreadPoolRecommendationsRepository(self.recommendations, executor))
+                return await controller.get_recommendations('user0', 0, 5)
+
+        users, next_offset = asyncio.run(get_recommendations())
+
+        assert [user.id for user in users] == [user.id for user in self.controller.get_recommendations('user0', 0, 5)[0]]
+        assert next_offset == 9
+
+    def test_api(self) -> None:
+        from server import resources
+
+        original = resources.controller
+        resources.controller = self.controller
+        try:
+            response = app.test_client().get('/api/v1/users/user0/recommendations?limit=5')
+        finally:
+            resources.controller = original
+
+        body = response.get_json()
+        assert [user['id'] for user in body['_data']] == ['user4', 'user5', 'user6', 'user7', 'user8']
+        assert 'offset=9' in body['_links'][0]['href']
@@ -0,0 +1,244 @@
+import threading
+import unittest
+
+from server.controller import Controller
+from server.exceptions import DataIntegrityException
+from server.models import Profile
+from server.ORM import resp
+from server.ORM.fake_redis import FakeRedisServer
+from server.ORM.json_connections_repository import JsonConnectionsRepository
+from server.ORM.json_recommendations_repository import JsonRecommendationsRepository
+from server.ORM.json_users_repository import JsonUsersRepository
+from server.ORM.redis_repositories import RedisUsersRepository, RedisConnectionsRepository, \
+    RedisRecommendationsRepository
+from server.ORM.resp import RespClient, RespError
+from server.tests import GeneratedSnapshot
+
+
+class TestRespClient(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.server = FakeRedisServer().start()
+        self.client = RespClient(port=self.server.port)
+
+    def tearDown(self) -> None:
+        self.client.close()
+        self.server.stop()
+
+    def test_pipeline_is_one_round_trip(self) -> None:
+        round_trips = resp.resp_round_trips_total.get()
+
+        replies = self.client.pipeline([('HSET', 'h', 'a', 1, 'b', 'é'), ('HGETALL', 'h'), ('HGET', 'h', 'missing'),
+                                        ('ZADD', 'z', 2.5, 'x', -1, 'y'), ('ZRANGE', 'z', 0, -1, 'WITHSCORES')])
+
+        assert replies == [2, ['a', '1', 'b', 'é'], None, 2, ['y', '-1', 'x', '2.5']]
+        assert resp.resp_round_trips_total.get() - round_trips == 1
+
+    def test_errors(self) -> None:
+        self.client.execute('SET', 'key', 'value')
+
+        with self.assertRaises(RespError):
+            self.client.pipeline([('HGET', 'key', 'field'), ('GET', 'key')])
+        # the connection is still usable
+        assert self.client.execute('GET', 'key') == 'value'
+
+    def test_watch_retries_when_a_watched_key_changes(self) -> None:
+        self.client.execute('SET', 'counter', 0)
+        attempts = []
+
+        def build(connection):
+            value = int(connection.execute('GET', 'counter'))
+            if not attempts:
+                # another client writes the key in between
+                self.client.execute('SET', 'counter', 10)
+            attempts.append(value)
+            return [('SET', 'counter', value + 1)]
+
+        self.client.watch(['counter'], build)
+
+        assert attempts == [0, 10]
+        assert self.client.execute('GET', 'counter') == '11'
+
+
+class TestRedisRepositories(GeneratedSnapshot, unittest.TestCase):
+
+    generated_users = 200
+
+    seed = 5
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.server = FakeRedisServer().start()
+        self.client = RespClient(port=self.server.port)
+        self.users = RedisUsersRepository(self.client, self.json_file, batch_size=64)
+        self.connections = RedisConnectionsRepository(self.client, self.json_file, batch_size=64)
+        self.recommendations = RedisRecommendationsRepository(self.client, self.json_file, batch_size=64)
+
+    def tearDown(self) -> None:
+        self.client.close()
+        self.server.stop()
+
+    def test_loaded_like_the_json_repositories(self) -> None:
+        users = JsonUsersRepository(self.json_file)
+        connections = JsonConnectionsRepository(self.json_file)
+        recommendations = JsonRecommendationsRepository(self.json_file)
+
+        for user_id in list(users.users)[:50]:
+            assert str(self.users.get(user_id)) == str(users.get(user_id))
+            assert {frozenset(connection.users) for connection in self.connections.get_all(user_id, 0, 10000)} == \
+                {frozenset(connection.users) for connection in connections.get_all(user_id, 0, 10000)}
+            assert self.connections.count(user_id) == connections.count(user_id)
+            assert [(recommendation.id, recommendation.recommended_user, recommendation.score)
+                    for recommendation in self.recommendations.get(user_id, 0, 100)] == \
+                [(recommendation.id, recommendation.recommended_user, recommendation.score)
+                 for recommendation in recommendations.get(user_id, 0, 100)]
+
+        college = users.get(list(users.users)[0]).profile.college
+        first = self.users.get_by_college(college, limit=3)
+        second = self.users.get_by_college(college, cursor=first[-1].id, limit=3)
+        assert [user.id for user in first + second] == \
+            [user.id for user in users.get_by_college(college, limit=6)]
+
+        # loading again is a no-op
+        RedisConnectionsRepository(self.client, self.json_file)
+        assert self.connections.count(college) == 0
+        assert self.connections.count(list(users.users)[0]) == connections.count(list(users.users)[0])
+
+    def test_users(self) -> None:
+        user = self.users.create('new@example.com', Profile('New', 'Somewhere'))
+        assert [indexed.id for indexed in self.users.get_by_college('Somewhere')] == [user.id]
+
+        updated = self.users.update(user.id, Profile('New', 'Elsewhere'))
+        assert updated.version == 2
+        assert self.users.get(user.id).profile.college == 'Elsewhere'
+        assert self.users.get_by_college('Somewhere') == []
+        assert self.users.update('missing', Profile('New', 'Elsewhere')) is None
+
+        assert set(self.users.get_many([user.id, 'missing', user.id])) == {user.id}
+
+        self.users.delete(user.id)
+        assert self.users.get(user.id) is None
+        assert self.users.get_by_college('Elsewhere') == []
+        with self.assertRaises(KeyError):
+            self.users.delete(user.id)
+
+    def test_concurrent_updates_are_not_lost(self) -> None:
+        user = self.users.create('new@example.com', Profile('New', 'Somewhere'))
+
+        def update(i):
+            for j in range(10):
+                self.users.update(user.id, Profile('New {} {}'.format(i, j), 'College {}'.format(j % 2)))
+
+        threads = [threading.Thread(target=update, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        user = self.users.get(user.id)
+        assert user.version == 41
+        # indexed under its last college only
+        assert [college for college in ('College 0', 'College 1')
+                if user.id in {indexed.id for indexed in self.users.get_by_college(college, limit=100)}] == \
+            [user.profile.college]
+
+    def test_connections(self) -> None:
+        connection = self.connections.create({'a', 'b'})
+        assert self.connections.get({'b', 'a'}).id == connection.id
+        assert self.connections.get_by_id(connection.id).users == {'a', 'b'}
+        with self.assertRaises(DataIntegrityException):
+            self.connections.create({'a', 'b'})
+
+        created = self.connections.create_many([{'a', 'c'}, {'a', 'b'}, {'a', 'd'}])
+        assert [sorted(connection.users) for connection in created] == [['a', 'c'], ['a', 'd']]
+        assert self.connections.connected('a', ['b', 'c', 'e']) == {'b', 'c'}
+        assert [sorted(connection.users) for connection in self.connections.get_all('a', 1, 2)] == \
+            [['a', 'c'], ['a', 'd']]
+
+        self.connections.delete({'a', 'b'})
+        assert self.connections.get({'a', 'b'}) is None
+        assert self.connections.count('a') == 2 and self.connections.count('b') == 0
+        with self.assertRaises(KeyError):
+            self.connections.delete({'a', 'b'})
+        with self.assertRaises(KeyError):
+            self.connections.get_by_id(connection.id)
+
+    def _racing(self, write):
+        """ a connections repository on a client of its own, whose next transaction runs `write` before its EXEC. """
+
+        client = RespClient(port=self.server.port)
+        self.addCleanup(client.close)
+        watch = client.watch
+        pending = [write]
+
+        def interleaved(keys, build):
+            def racing_build(connection):
+                commands = build(connection)
+                if pending:
+                    pending.pop()()
+                return commands
+            return watch(keys, racing_build)
+
+        client.watch = interleaved
+
+        return RedisConnectionsRepository(client)
+
+    def _indexed(self, user: str):
+        return self.connections.count(user), [connection.id for connection in self.connections.get_recent(user)]
+
+    def test_a_connection_claimed_concurrently_is_not_indexed_twice(self) -> None:
+        racing = self._racing(lambda: self.connections.create({'a', 'b'}))
+
+        with self.assertRaises(DataIntegrityException):
+            racing.create({'a', 'b'})
+
+        connection = self.connections.get({'a', 'b'})
+        assert self._indexed('a') == self._indexed('b') == (1, [connection.id])
+        assert self.connections.get_by_id(connection.id).users == {'a', 'b'}
+
+    def test_a_connection_recreated_concurrently_is_deleted_whole(self) -> None:
+        self.connections.create({'a', 'b'})
+
+        def recreate():
+            self.connections.delete({'a', 'b'})
+            self.connections.create({'a', 'b'}, 1.5)
+
+        # the delete retries on the connection created in between: nothing of either is left
+        self._racing(recreate).delete({'a', 'b'})
+
+        assert self.connections.get({'a', 'b'}) is None
+        assert self._indexed('a') == self._indexed('b') == (0, [])
+        assert self.client.execute('HLEN', 'connections:users') == \
+            self.client.execute('HLEN', 'connections:pairs')
+
+    def test_recommendations(self) -> None:
+        self.recommendations.save('a', 'x', 1)
+        kept = self.recommendations.save('a', 'y', 2)
+        self.recommendations.save('a', 'z', 2)
+        assert [(recommendation.recommended_user, recommendation.score)
+                for recommendation in self.recommendations.get('a', 0, 10)] == [('y', 2), ('z', 2), ('x', 1)]
+
+        rescored = self.recommendations.save('a', 'x', 3)
+        assert list(self.recommendations.get('a', 0, 1))[0].id == rescored.id
+        assert self.recommendations.count('a') == 3
+
+        saved = self.recommendations.replace_all('a', {'y': 0.5, 'w': 0.0})
+        assert [recommendation.id for recommendation in saved][0] == kept.id
+        assert [(recommendation.recommended_user, recommendation.score)
+                for recommendation in self.recommendations.get('a', 0, 10)] == [('w', 0.0), ('y', 0.5)][::-1]
+        with self.assertRaises(KeyError):
+            self.recommendations.delete(rescored.id)
+
+        self.recommendations.delete(kept.id)
+        assert [recommendation.recommended_user for recommendation in self.recommendations.get('a', 0, 10)] == ['w']
+
+    def test_controller(self) -> None:
+        controller = Controller(users_repository=self.users, connections_repository=self.connections,
+                                recommendations_repository=self.recommendations)
+
+        user = controller.add_user('new@example.com', 'New', 'Nowhere')
+        controller.add_recommendations(user.id, {'rryan': 2.0, 'sarahdavis': 1.0})
+        controller.add_connection(user.id, 'sarahdavis')
+
+        assert controller.count_recommendations(user.id) == 2
+        assert controller.check_connection_exists(user.id, 'sarahdavis')
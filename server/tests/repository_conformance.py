@@ -0,0 +1,357 @@
+""" The contracts of the repositories (server.models), run against every implementation.
+
+A contract is a mixin of test methods over self.repository. Every implementation gets a TestCase combining the mixin
+with the setup building it, so a new backend only has to add one small class per repository kind.
+
+"""
+
+import collections
+import os
+import tempfile
+import unittest
+
+from server.benchmarks import generator
+from server.exceptions import DataIntegrityException
+from server.models import Profile
+from server.ORM.fake_redis import FakeRedisServer
+from server.ORM.json_connections_repository import JsonConnectionsRepository
+from server.ORM.json_recommendations_repository import JsonRecommendationsRepository
+from server.ORM.json_users_repository import JsonUsersRepository
+from server.ORM.redis_repositories import RedisUsersRepository, RedisConnectionsRepository, \
+    RedisRecommendationsRepository
+from server.ORM.resp import RespClient
+from server.ORM.sharded_connections_repository import ShardedConnectionsRepository
+
+DATA = generator.generate(200, seed=11)
+
+
+def _most_common(values):
+    return collections.Counter(values).most_common(1)[0][0]
+
+
+class _Snapshot(object):
+    """ writes DATA to a temporary snapshot for the repository to load. """
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.json_file = os.path.join(self.directory.name, 'data.json')
+        generator.write(DATA, self.json_file)
+        self.repository = self.load(self.json_file)
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def load(self, json_file: str):
+        raise NotImplementedError
+
+
+class _RedisSnapshot(_Snapshot):
+
+    def setUp(self) -> None:
+        self.server = FakeRedisServer().start()
+        self.client = RespClient(port=self.server.port)
+        super().setUp()
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        self.client.close()
+        self.server.stop()
+
+
+class UsersContract(object):
+
+    def test_get(self) -> None:
+        user = self.repository.get('user0')
+        assert (user.id, user.email) == ('user0', 'user0@example.com')
+        assert user.profile.college == DATA['users'][0]['college']
+        assert self.repository.get('missing') is None
+
+    def test_get_many_leaves_the_missing_out(self) -> None:
+        assert set(self.repository.get_many(['user1', 'missing', 'user2', 'user1'])) == {'user1', 'user2'}
+        assert self.repository.get_many([]) == {}
+
+    def test_create_update_delete(self) -> None:
+        user = self.repository.create('new@example.com', Profile('New', 'Nowhere'))
+        assert self.repository.get(user.id).email == 'new@example.com'
+
+        updated = self.repository.update(user.id, Profile('New', 'Elsewhere'))
+        assert updated.version == user.version + 1
+        assert self.repository.get(user.id).profile.college == 'Elsewhere'
+        assert self.repository.update('missing', Profile('New', 'Elsewhere')) is None
+
+        self.repository.delete(user.id)
+        assert self.repository.get(user.id) is None
+
+    def test_delete_missing_raises_key_error(self) -> None:
+        with self.assertRaises(KeyError):
+            self.repository.delete('missing')
+
+        self.repository.delete('user3')
+        with self.assertRaises(KeyError):
+            self.repository.delete('user3')
+
+    def test_get_by_college_pages(self) -> None:
+        college = _most_common(user['college'] for user in DATA['users'])
+        expected = sorted(user['id'] for user in DATA['users'] if user['college'] == college)
+
+        pages, cursor = [], None
+        while True:
+            page = self.repository.get_by_college(college, cursor=cursor, limit=3)
+            assert len(page) <= 3
+            if not page:
+                break
+            pages.append([user.id for user in page])
+            cursor = page[-1].id
+
+        assert [user_id for page in pages for user_id in page] == expected
+        assert self.repository.get_by_college('nowhere') == []
+
+
+class ConnectionsContract(object):
+
+    def _others(self, user: str, offset: int = 0, limit: int = 10000):
+        return [(connection.users - {user}).pop() for connection in self.repository.get_all(user, offset, limit)]
+
+    def test_get(self) -> None:
+        user1, user2 = DATA['connections'][0]['users']
+        connection = self.repository.get({user1, user2})
+        assert connection.users == {user1, user2}
+        assert self.repository.get({user2, user1}).id == connection.id
+        assert self.repository.get_by_id(connection.id).users == {user1, user2}
+        assert self.repository.get({user1, 'missing'}) is None
+
+    def test_get_by_id_missing_raises_key_error(self) -> None:
+        with self.assertRaises(KeyError):
+            self.repository.get_by_id('missing')
+
+    def test_duplicate_raises_data_integrity_exception(self) -> None:
+        user1, user2 = DATA['connections'][0]['users']
+        with self.assertRaises(DataIntegrityException):
+            self.repository.create({user1, user2})
+        with self.assertRaises(DataIntegrityException):
+            self.repository.create({user2, user1})
+
+        self.repository.create({'new1', 'new2'})
+        with self.assertRaises(DataIntegrityException):
+            self.repository.create({'new2', 'new1'})
+        assert self.repository.count('new1') == 1
+
+    def test_delete_missing_raises_key_error(self) -> None:
+        with self.assertRaises(KeyError):
+            self.repository.delete({'user0', 'missing'})
+
+        user1, user2 = DATA['connections'][0]['users']
+        count = self.repository.count(user1)
+        self.repository.delete({user2, user1})
+        assert self.repository.get({user1, user2}) is None
+        assert self.repository.count(user1) == count - 1
+        assert user2 not in self._others(user1)
+        with self.assertRaises(KeyError):
+            self.repository.delete({user1, user2})
+
+    def test_pages_hold_every_connection_once(self) -> None:
+        user = _most_common(user for connection in DATA['connections'] for user in connection['users'])
+        expected = {(set(connection['users']) - {user}).pop()
+                    for connection in DATA['connections'] if user in connection['users']}
+
+        everything = self._others(user)
+        pages = [self._others(user, offset, 7) for offset in range(0, len(expected) + 7, 7)]
+
+        assert all(len(page) <= 7 for page in pages)
+        assert [other for page in pages for other in page] == everything
+        assert sorted(everything) == sorted(expected)
+        assert self.repository.count(user) == len(expected)
+        assert self._others(user, len(expected), 7) == []
+        assert self._others('missing') == [] and self.repository.count('missing') == 0
+
+    def test_a_self_connection_is_one_user(self) -> None:
+        assert self.repository.get({'user0'}) is None
+        count = self.repository.count('user0')
+
+        created = self.repository.create({'user0'})
+        assert created.users == {'user0'}
+        assert self.repository.get({'user0'}).id == created.id
+        assert self.repository.count('user0') == count + 1
+
+        self.repository.delete({'user0'})
+        assert self.repository.get({'user0'}) is None
+        with self.assertRaises(KeyError):
+            self.repository.delete({'user0'})
+
+    def test_create_many_skips_the_pairs_already_connected(self) -> None:
+        user1, user2 = DATA['connections'][0]['users']
+        count = self.repository.count(user1)
+
+        created = self.repository.create_many([{user1, 'new1'}, {user1, user2}, {'new1', user1}, {user1, 'new2'}])
+
+        assert [connection.users for connection in created] == [{user1, 'new1'}, {user1, 'new2'}]
+        assert self.repository.get({user1, 'new2'}).id == created[1].id
+        assert self.repository.get_by_id(created[0].id).created == created[0].created
+        assert self.repository.count(user1) == count + 2
+        assert self.repository.connected('new1', [user1]) == {user1}
+        assert self.repository.create_many([{user1, 'new1'}]) == []
+        assert self.repository.create_many([]) == []
+
+    def test_connected(self) -> None:
+        user1, user2 = DATA['connections'][0]['users']
+        assert self.repository.connected(user1, [user2, 'missing', user1]) == {user2}
+        assert self.repository.connected('missing', [user1]) == set()
+
+        created = self.repository.create({user1, 'new'})
+        assert self.repository.connected(user1, ['new']) == {'new'}
+        assert self.repository.get_by_id(created.id).users == {user1, 'new'}
+
+    def _recent(self, user: str, cursor=None, since: float = None, limit: int = 10000):
+        return [((connection.users - {user}).pop(), connection.created)
+                for connection in self.repository.get_recent(user, cursor, since, limit)]
+
+    def test_recent_pages_follow_the_creation_time(self) -> None:
+        user = _most_common(user for connection in DATA['connections'] for user in connection['users'])
+        expected = sorted((((set(connection['users']) - {user}).pop(), connection['created'])
+                           for connection in DATA['connections'] if user in connection['users']),
+                          key=lambda pair: (pair[1], pair[0]), reverse=True)
+
+        assert self._recent(user) == expected
+
+        pages, cursor = [], None
+        while True:
+            page = self._recent(user, cursor, limit=4)
+            assert len(page) <= 4
+            if not page:
+                break
+            pages.append(page)
+            cursor = (page[-1][1], page[-1][0])
+
+        assert [pair for page in pages for pair in page] == expected
+        assert self._recent('missing') == []
+
+    def test_recent_since(self) -> None:
+        user = _most_common(user for connection in DATA['connections'] for user in connection['users'])
+        everything = self._recent(user)
+        since = everything[len(everything) // 2][1]
+
+        assert self._recent(user, since=since) == [pair for pair in everything if pair[1] >= since]
+        assert self._recent(user, cursor=everything[1][::-1], since=since) == \
+            [pair for pair in everything[2:] if pair[1] >= since]
+
+    def test_recent_create_and_delete(self) -> None:
+        user1, user2 = DATA['connections'][0]['users']
+        restored_at = DATA['connections'][0]['created']
+
+        created = self.repository.create({user1, 'new'})
+        assert created.created > generator.CREATED_BEFORE
+        assert self._recent(user1, limit=1) == [('new', created.created)]
+        assert self._recent('new') == [(user1, created.created)]
+        assert self.repository.get({user1, 'new'}).created == created.created
+
+        self.repository.delete({user1, user2})
+        assert user2 not in [other for other, _ in self._recent(user1)]
+
+        # restored with its creation time: back at its place in the timeline
+        self.repository.create({user1, user2}, restored_at)
+        assert (user2, restored_at) in self._recent(user1)
+        assert self.repository.get({user1, user2}).created == restored_at
+        assert self._recent(user2, since=restored_at)[-1] == (user1, restored_at)
+
+
+class RecommendationsContract(object):
+
+    def _ranked(self, user: str, offset: int = 0, limit: int = 10000):
+        return [(recommendation.recommended_user, recommendation.score)
+                for recommendation in self.repository.get(user, offset, limit)]
+
+    def test_ranked_by_descending_score(self) -> None:
+        expected = sorted(((recommendation['recommended_user_id'], recommendation['score'])
+                           for recommendation in DATA['recommendations'] if recommendation['user_id'] == 'user0'),
+                          key=lambda pair: (-pair[1], pair[0]))
+
+        assert self._ranked('user0') == expected
+        assert [pair for offset in range(0, len(expected), 2) for pair in self._ranked('user0', offset, 2)] == expected
+        assert self.repository.count('user0') == len(expected)
+        assert self._ranked('missing') == [] and self.repository.count('missing') == 0
+
+    def test_saving_again_updates(self) -> None:
+        saved = self.repository.save('new', 'x', 1.0)
+        self.repository.save('new', 'y', 2.0)
+        rescored = self.repository.save('new', 'x', 3.0)
+
+        assert rescored.id == saved.id
+        assert self._ranked('new') == [('x', 3.0), ('y', 2.0)]
+        assert self.repository.count('new') == 2
+
+    def test_replace_all(self) -> None:
+        kept = self.repository.save('new', 'x', 1.0)
+        dropped = self.repository.save('new', 'y', 2.0)
+
+        saved = self.repository.replace_all('new', {'x': 1.0, 'z': 3.0, 'w': 0.5})
+
+        assert [(recommendation.recommended_user, recommendation.score) for recommendation in saved] == \
+            [('x', 1.0), ('z', 3.0), ('w', 0.5)]
+        assert saved[0].id == kept.id
+        assert self._ranked('new') == [('z', 3.0), ('x', 1.0), ('w', 0.5)]
+        assert self.repository.count('new') == 3
+        with self.assertRaises(KeyError):
+            self.repository.delete(dropped.id)
+
+        assert self.repository.replace_all('new', {}) == []
+        assert self._ranked('new') == [] and self.repository.count('new') == 0
+
+    def test_delete_missing_raises_key_error(self) -> None:
+        with self.assertRaises(KeyError):
+            self.repository.delete('missing')
+
+        saved = self.repository.save('new', 'x', 1.0)
+        self.repository.delete(saved.id)
+        assert self._ranked('new') == []
+        with self.assertRaises(KeyError):
+            self.repository.delete(saved.id)
+
+
+class TestJsonUsersRepository(_Snapshot, UsersContract, unittest.TestCase):
+
+    def load(self, json_file: str):
+        return JsonUsersRepository(json_file)
+
+
+class TestRedisUsersRepository(_RedisSnapshot, UsersContract, unittest.TestCase):
+
+    def load(self, json_file: str):
+        return RedisUsersRepository(self.client, json_file)
+
+
+class TestJsonConnectionsRepository(_Snapshot, ConnectionsContract, unittest.TestCase):
+
+    def load(self, json_file: str):
+        return JsonConnectionsRepository(json_file)
+
+
+class TestShardedConnectionsRepository(_Snapshot, ConnectionsContract, unittest.TestCase):
+
+    def load(self, json_file: str):
+        return ShardedConnectionsRepository(json_file, shards=3)
+
+    def tearDown(self) -> None:
+        self.repository.close()
+        super().tearDown()
+
+
+class TestRedisConnectionsRepository(_RedisSnapshot, ConnectionsContract, unittest.TestCase):
+
+    def load(self, json_file: str):
+        return RedisConnectionsRepository(self.client, json_file)
+
+
+class TestJsonRecommendationsRepository(_Snapshot, RecommendationsContract, unittest.TestCase):
+
+    def load(self, json_file: str):
+        return JsonRecommendationsRepository(json_file)
+
+
+class TestRedisRecommendationsRepository(_RedisSnapshot, RecommendationsContract, unittest.TestCase):
+
+    def load(self, json_file: str):
+        return RedisRecommendationsRepository(self.client, json_file)
+
+
+if __name__ == '__main__':
+    unittest.main()
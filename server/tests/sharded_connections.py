@@ -0,0 +1,93 @@
+import os
+import tempfile
+import unittest
+
+from server.benchmarks import generator
+from server.exceptions import DataIntegrityException
+from server.ORM.json_connections_repository import JsonConnectionsRepository
+from server.ORM.sharded_connections_repository import ShardedConnectionsRepository, ConsistentHashRing
+
+
+class TestConsistentHashRing(unittest.TestCase):
+
+    def test_adding_a_node_only_moves_its_share(self) -> None:
+        keys = ['user{}'.format(i) for i in range(5000)]
+        before = ConsistentHashRing(['a', 'b', 'c', 'd'])
+        after = ConsistentHashRing(['a', 'b', 'c', 'd', 'e'])
+        moved = [key for key in keys if before.node(key) != after.node(key)]
+        assert all(after.node(key) == 'e' for key in moved)
+        assert len(moved) < len(keys) / 3
+
+
+class TestShardedConnectionsRepository(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.directory = tempfile.TemporaryDirectory()
+        json_file = os.path.join(cls.directory.name, 'data.json')
+        generator.write(generator.generate(300, seed=3), json_file)
+        cls.reference = JsonConnectionsRepository(json_file)
+        cls.repository = ShardedConnectionsRepository(json_file, shards=3)
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.repository.close()
+        cls.directory.cleanup()
+
+    def _adjacency(self, user):
+        return {frozenset(connection.users) for connection in self.repository.get_all(user, 0, 10000)}
+
+    def _assert_matches_reference(self):
+        for user in ['user{}'.format(i) for i in range(0, 300, 7)]:
+            expected = {frozenset(connection.users) for connection in self.reference.get_all(user, 0, 10000)}
+            assert self._adjacency(user) == expected, user
+            assert self.repository.count(user) == self.reference.count(user) == len(expected), user
+
+    def test_loaded_graph_matches_the_json_repository(self) -> None:
+        self._assert_matches_reference()
+
+    def test_create_get_delete(self) -> None:
+        connection = self.repository.create({'sharded-a', 'sharded-b'})
+        assert self.repository.get({'sharded-b', 'sharded-a'}).id == connection.id
+        assert self.repository.get_by_id(connection.id).users == {'sharded-a', 'sharded-b'}
+        assert self.repository.count('sharded-a') == self.repository.count('sharded-b') == 1
+        with self.assertRaises(DataIntegrityException):
+            self.repository.create({'sharded-b', 'sharded-a'})
+        self.repository.delete({'sharded-a', 'sharded-b'})
+        assert self.repository.get({'sharded-a', 'sharded-b'}) is None
+        assert self.repository.count('sharded-a') == 0
+        with self.assertRaises(KeyError):
+            self.repository.delete({'sharded-a', 'sharded-b'})
+
+    def test_pagination(self) -> None:
+        for i in range(10):
+            self.repository.create({'sharded-hub', 'sharded-{}'.format(i)})
+        pages = [self.repository.get_all('sharded-hub', offset, 4) for offset in (0, 4, 8)]
+        assert [len(page) for page in pages] == [4, 4, 2]
+        assert len({connection.id for page in pages for connection in page}) == 10
+
+    def test_mutual_connections(self) -> None:
+        self.repository.create({'mutual-a', 'mutual-x'})
+        self.repository.create({'mutual-b', 'mutual-x'})
+        self.repository.create({'mutual-a', 'mutual-y'})
+        assert self.repository.mutual_connections('mutual-a', 'mutual-b') == {'mutual-x'}
+
+    def test_connected(self) -> None:
+        self.repository.create({'connected-a', 'connected-x'})
+        self.repository.create({'connected-a', 'connected-y'})
+        assert self.repository.connected('connected-a', ['connected-x', 'connected-z', 'connected-y']) == \
+            {'connected-x', 'connected-y'}
+
+    def test_resharding_keeps_every_edge(self) -> None:
+        total_edges = sum(stats['edges'] for stats in self.repository.stats().values())
+        name = self.repository.add_shard()
+        assert self.repository.stats()[name]['users'] > 0
+        self._assert_matches_reference()
+        self.repository.remove_shard(name)
+        assert name not in self.repository.stats()
+        assert sum(stats['edges'] for stats in self.repository.stats().values()) == total_edges
+        self._assert_matches_reference()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+import asyncio
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from server.ORM.json_connections_repository import JsonConnectionsRepository
+from server.singleflight import AsyncSingleFlight, SingleFlight
+from server.tests import JsonController
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_concurrent_calls_share_one_call(self) -> None:
+        flight = SingleFlight('test')
+        calls = []
+        release = threading.Event()
+
+        def work(key):
+            calls.append(key)
+            release.wait(5)
+            return key * 2
+
+        with ThreadPoolExecutor(8) as executor:
+            futures = [executor.submit(flight.do, 21, work, 21) for _ in range(8)]
+            time.sleep(0.1)
+            release.set()
+            results = [future.result() for future in futures]
+
+        assert results == [42] * 8
+        assert calls == [21]
+
+        # nothing in flight anymore: the next call does the work again
+        assert flight.do(21, work, 21) == 42
+        assert len(calls) == 2
+
+    def test_errors_are_raised_to_every_caller(self) -> None:
+        flight = SingleFlight('test')
+        release = threading.Event()
+
+        def fail():
+            release.wait(5)
+            raise KeyError('boom')
+
+        with ThreadPoolExecutor(4) as executor:
+            futures = [executor.submit(flight.do, 'key', fail) for _ in range(4)]
+            time.sleep(0.1)
+            release.set()
+            for future in futures:
+                with self.assertRaises(KeyError):
+                    future.result()
+
+    def test_waiters_give_up_after_the_timeout(self) -> None:
+        flight = SingleFlight('test', timeout=0.05)
+        release = threading.Event()
+        calls = []
+
+        def work(blocking):
+            calls.append(blocking)
+            if blocking:
+                release.wait(5)
+            return blocking
+
+        with ThreadPoolExecutor(1) as executor:
+            leader = executor.submit(flight.do, 'key', work, True)
+            time.sleep(0.05)
+            # the leader is stuck: this caller does the work itself
+            assert flight.do('key', work, False) is False
+            release.set()
+            assert leader.result() is True
+
+        assert calls == [True, False]
+
+    def test_async(self) -> None:
+        flight = AsyncSingleFlight('test')
+        calls = []
+
+        async def work(key):
+            calls.append(key)
+            await asyncio.sleep(0.05)
+            return key * 2
+
+        async def run():
+            return await asyncio.gather(*[flight.do(21, work, 21) for _ in range(8)])
+
+        assert asyncio.run(run()) == [42] * 8
+        assert calls == [21]
+
+    def test_async_waiters_give_up_after_the_timeout(self) -> None:
+        flight = AsyncSingleFlight('test', timeout=0.01)
+
+        async def work(delay):
+            await asyncio.sleep(delay)
+            return delay
+
+        async def run():
+            return await asyncio.gather(flight.do('key', work, 0.2), flight.do('key', work, 0))
+
+        assert asyncio.run(run()) == [0.2, 0]
+
+
+class _SlowConnectionsRepository(JsonConnectionsRepository):
+
+    def __init__(self, json_file):
+        super().__init__(json_file)
+        self.calls = 0
+        self.release = threading.Event()
+
+    def get_all(self, user, offset, limit):
+        self.calls += 1
+        self.release.wait(5)
+        return super().get_all(user, offset, limit)
+
+
+class TestControllerCoalescing(JsonController, unittest.TestCase):
+
+    def load_connections(self, json_file: str):
+        return _SlowConnectionsRepository(json_file)
+
+    def test_identical_reads_are_coalesced(self) -> None:
+        with ThreadPoolExecutor(8) as executor:
+            futures = [executor.submit(self.controller.get_connections, 'user1', 0, 10) for _ in range(6)]
+            other_page = executor.submit(self.controller.get_connections, 'user1', 10, 10)
+            time.sleep(0.1)
+            self.connections.release.set()
+            results = [future.result() for future in futures]
+            other_page.result()
+
+        # one call for the six identical reads, one for the other page
+        assert self.connections.calls == 2
+        assert all(result == results[0] for result in results)
+        # every caller gets a set of its own
+        assert len({id(result) for result in results}) == len(results)
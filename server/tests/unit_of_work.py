@@ -0,0 +1,160 @@
+import asyncio
+import os
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from server import unit_of_work
+from server.async_controller import AsyncController
+from server.ORM.threaded_repositories import ThreadPoolUsersRepository, ThreadPoolConnectionsRepository, \
+    ThreadPoolRecommendationsRepository
+from server.tests import JsonController
+from server.unit_of_work import Journal
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'journal.log')
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_concurrent_commits_share_syncs(self) -> None:
+        journal = Journal(self.path, delay=0.005)
+        syncs = unit_of_work.journal_syncs_total.get()
+        start = threading.Barrier(32)
+
+        def commit(i):
+            start.wait()
+            journal.commit({'i': i})
+
+        threads = [threading.Thread(target=commit, args=(i,)) for i in range(32)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        journal.close()
+
+        assert sorted(record['i'] for record in Journal.read(self.path)) == list(range(32))
+        assert unit_of_work.journal_syncs_total.get() - syncs < 32
+
+    def test_an_incomplete_last_record_is_skipped(self) -> None:
+        journal = Journal(self.path)
+        journal.commit({'i': 1})
+        journal.close()
+        with open(self.path, 'a') as fl:
+            fl.write('{"i": 2')
+
+        assert list(Journal.read(self.path)) == [{'i': 1}]
+
+
+class TestUnitOfWork(JsonController, unittest.TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.path = os.path.join(self.directory.name, 'journal.log')
+        self.journal = Journal(self.path)
+        self.controller = self.build_controller(journal=self.journal)
+
+    def tearDown(self) -> None:
+        self.journal.close()
+
+    def test_a_sign_up_is_one_commit(self) -> None:
+        user = self.controller.add_user('new@example.com', 'New', 'Nowhere')
+
+        records = list(Journal.read(self.path))
+        assert len(records) == 1
+        assert [change['type'] for change in records[0]['changes']] == ['user.created', 'recommendations.added']
+        assert records[0]['changes'][0]['data']['id'] == user.id
+        assert [change.type for change in self.controller.get_changes()] == ['user.created', 'recommendations.added']
+
+    def test_a_failed_operation_is_undone(self) -> None:
+        users = len(self.users.users)
+        replace_all = self.recommendations.replace_all
+        calls = []
+
+        def failing_replace_all(user, scores):
+            calls.append((user, scores))
+            if len(calls) == 1:
+                # written, then failed
+                replace_all(user, scores)
+                raise IOError('disk full')
+            return replace_all(user, scores)
+
+        self.recommendations.replace_all = failing_replace_all
+
+        with self.assertRaises(IOError):
+            self.controller.add_user('new@example.com', 'New', 'Nowhere')
+
+        # the user and the recommendations are gone, nothing was committed or published
+        assert len(self.users.users) == users
+        assert self.recommendations.count(calls[0][0]) == 0
+        assert list(Journal.read(self.path)) == []
+        assert self.controller.get_changes() == []
+
+    def test_a_rescored_recommendation_is_restored(self) -> None:
+        self.controller.add_recommendations('user1', {'user2': 0.5})
+        self.recommendations.delete = None  # a rollback must not delete it
+
+        with self.assertRaises(TypeError):
+            self.controller.add_recommendations('user1', {'user2': 0.9, 'user3': None})
+
+        assert [(recommendation.recommended_user, recommendation.score) for recommendation in
+                self.recommendations.get('user1', 0, 100) if recommendation.recommended_user == 'user2'] == \
+            [('user2', 0.5)]
+
+    def test_a_batch_of_connections_is_one_commit(self) -> None:
+        connected = {other for other in ('user2', 'user3', 'user4', 'user5', 'user6')
+                     if self.controller.check_connection_exists('user1', other)}
+        others = [other for other in ('user2', 'user3', 'user4', 'user5', 'user6') if other not in connected]
+
+        assert self.controller.batch_add_connections('user1', others + ['user1', others[0]] + list(connected)) == others
+
+        records = list(Journal.read(self.path))
+        assert len(records) == 1
+        assert [change['data']['users'] for change in records[0]['changes']] == \
+            [sorted(('user1', other)) for other in others]
+        assert all(self.controller.check_connection_exists('user1', other) for other in others)
+        assert not self.controller.check_connection_exists('user1', 'user1')
+
+    def test_a_failed_batch_of_connections_is_undone(self) -> None:
+        self.journal.close()
+
+        with self.assertRaises(ValueError):
+            self.controller.batch_add_connections('user1', ['user40', 'user41'])
+
+        assert not self.controller.check_connection_exists('user1', 'user40')
+        assert not self.controller.check_connection_exists('user1', 'user41')
+
+    def test_a_write_is_undone_if_the_journal_fails(self) -> None:
+        self.journal.close()
+
+        with self.assertRaises(ValueError):
+            self.controller.add_connection('user1', 'user40')
+
+        assert not self.controller.check_connection_exists('user1', 'user40')
+        assert self.controller.get_changes() == []
+
+    def test_async_sign_up_is_one_commit(self) -> None:
+        async def add_user():
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                controller = AsyncController(
+                    users_repository=ThreadPoolUsersRepository(self.users, executor),
+                    connections_repository=ThreadPoolConnectionsRepository(self.connections, executor),
+                    recommendations_repository=ThreadPoolRecommendationsRepository(self.recommendations, executor),
+                    journal=self.journal)
+                await asyncio.gather(*[controller.add_user('new{}@example.com'.format(i), 'New', 'Nowhere')
+                                       for i in range(10)])
+                await controller.add_connection('user1', 'user40')
+                return await controller.get_changes(), await controller.check_connection_exists('user1', 'user40')
+
+        changes, connected = asyncio.run(add_user())
+
+        records = list(Journal.read(self.path))
+        assert len(records) == 11
+        assert all(len(record['changes']) == 2 for record in records[:10])
+        assert len(changes) == 21
+        assert connected
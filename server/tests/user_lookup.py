@@ -0,0 +1,55 @@
+import asyncio
+import json
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from server.app import app
+from server import resources
+from server.async_controller import AsyncController
+from server.ORM.threaded_repositories import ThreadPoolUsersRepository, ThreadPoolConnectionsRepository, \
+    ThreadPoolRecommendationsRepository
+from server.tests import JsonController
+
+
+class TestUserLookup(JsonController, unittest.TestCase):
+
+    def test_request_order_and_missing_ids(self) -> None:
+        users, missing = self.controller.get_users(['user3', 'nobody', 'user1', 'user3', 'ghost'])
+
+        assert [user.id for user in users] == ['user3', 'user1']
+        assert missing == ['nobody', 'ghost']
+
+    def test_async(self) -> None:
+        with ThreadPoolExecutor(2) as executor:
+            controller = AsyncController(
+                users_repository=ThreadPoolUsersRepository(self.users, executor),
+                connections_repository=ThreadPoolConnectionsRepository(self.connections, executor),
+                recommendations_repository=ThreadPoolRecommendationsRepository(self.recommendations, executor))
+            users, missing = asyncio.run(controller.get_users(['user2', 'nobody', 'user1']))
+
+        assert [user.id for user in users] == ['user2', 'user1']
+        assert missing == ['nobody']
+
+    def test_http(self) -> None:
+        original = resources.controller
+        resources.controller = self.controller
+        try:
+            client = app.test_client()
+
+            body = client.get('/api/v1/users?ids=user2,nobody,user1').get_json()
+            assert [user['id'] for user in body['_data']] == ['user2', 'user1']
+            assert body['_meta'] == {'missing': ['nobody']}
+            assert body['_data'][0] == resources.User._json_mapper(self.controller.get_user('user2'))
+
+            body = client.post('/api/v1/users/lookup', json={'ids': ['user1', 'nobody']}).get_json()
+            assert [user['id'] for user in body['_data']] == ['user1']
+            assert body['_meta'] == {'missing': ['nobody']}
+
+            assert client.post('/api/v1/users/lookup', json={'ids': 'user1'}).status_code == 400
+            assert client.post('/api/v1/users/lookup', data='not json').status_code == 400
+            assert client.get('/api/v1/users?ids=').status_code == 400
+            too_many = ['user{}'.format(i) for i in range(501)]
+            assert client.post('/api/v1/users/lookup', data=json.dumps({'ids': too_many}),
+                               content_type='application/json').status_code == 400
+        finally:
+            resources.controller = original
@@ -0,0 +1,69 @@
+import unittest
+
+from server.app import app
+from server import resources
+from server.models import Profile
+from server.tests import JsonController
+
+
+class TestUsersByCollege(JsonController, unittest.TestCase):
+
+    generated_users = 500
+
+    seed = 3
+
+    colleges = 5
+
+    def _expected(self, college: str):
+        return sorted(user['id'] for user in self.data['users'] if user['college'] == college)
+
+    def test_cursor_pages_cover_the_college_in_order(self) -> None:
+        user_ids = []
+        cursor = None
+        while True:
+            page = self.users.get_by_college('college1', cursor, 7)
+            assert len(page) <= 7
+            if not page:
+                break
+            user_ids += [user.id for user in page]
+            cursor = page[-1].id
+
+        assert user_ids == self._expected('college1')
+
+    def test_index_follows_creates_updates_and_deletes(self) -> None:
+        created = self.users.create('new@example.com', Profile(name='New', college='college1'))
+        assert created.id in [user.id for user in self.users.get_by_college('college1', limit=1000)]
+
+        moved = self._expected('college2')[0]
+        self.controller.update_user_details(moved, college='college1')
+        assert moved in [user.id for user in self.users.get_by_college('college1', limit=1000)]
+        assert moved not in [user.id for user in self.users.get_by_college('college2', limit=1000)]
+
+        # a name change leaves the index alone
+        self.controller.update_user_details(moved, name='Renamed')
+        assert moved in [user.id for user in self.users.get_by_college('college1', limit=1000)]
+
+        self.users.delete(created.id)
+        assert created.id not in [user.id for user in self.users.get_by_college('college1', limit=1000)]
+
+        assert self.users.get_by_college('nowhere') == []
+
+    def test_http_follows_next_links(self) -> None:
+        original = resources.controller
+        resources.controller = self.controller
+        try:
+            client = app.test_client()
+            assert client.get('/api/v1/users').status_code == 400
+
+            user_ids = []
+            url = '/api/v1/users?college=college3&limit=10'
+            while url is not None:
+                response = client.get(url)
+                assert response.status_code == 200
+                body = response.get_json()
+                user_ids += [user['id'] for user in body['_data']]
+                url = next((link['href'] for link in body['_links'] if link['rel'] == 'next'), None)
+        finally:
+            resources.controller = original
+
+        assert user_ids == self._expected('college3')
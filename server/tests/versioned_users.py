@@ -0,0 +1,117 @@
+import asyncio
+import copy
+import pickle
+import threading
+import unittest
+
+from server.app import app
+from server import resources
+from server.models import Profile
+from server.tests import JsonController
+
+
+class TestVersionedUsers(JsonController, unittest.TestCase):
+
+    def test_users_are_immutable(self) -> None:
+        user = self.users.get('user1')
+
+        with self.assertRaises(AttributeError):
+            user.profile = Profile('Other', 'college')
+        with self.assertRaises(AttributeError):
+            user.profile.name = 'Other'
+
+    def test_users_can_be_pickled_and_copied(self) -> None:
+        user = self.controller.update_user_details('user1', name='Renamed')
+
+        for copied in (pickle.loads(pickle.dumps(user)), copy.deepcopy(user), copy.copy(user)):
+            assert (copied.id, copied.email, copied.version) == (user.id, user.email, 2)
+            assert (copied.profile.name, copied.profile.college) == ('Renamed', user.profile.college)
+            with self.assertRaises(AttributeError):
+                copied.profile.name = 'Other'
+
+        profile = pickle.loads(pickle.dumps(user.profile))
+        assert (profile.name, profile.college) == (user.profile.name, user.profile.college)
+
+    def test_updates_publish_new_versions(self) -> None:
+        before = self.users.get('user1')
+
+        after = self.controller.update_user_details('user1', name='Renamed')
+
+        assert (before.version, after.version) == (1, 2)
+        # the previous version is left untouched for whoever still holds it
+        assert before.profile.name != 'Renamed' and after.profile.name == 'Renamed'
+        assert after.profile.college == before.profile.college
+        assert self.users.get('user1') is after
+
+        with self.assertRaises(KeyError):
+            self.controller.update_user_details('nobody', name='Renamed')
+
+    def test_readers_never_see_a_half_updated_user(self) -> None:
+        self.users.update('user1', Profile('name-a', 'college-a'))
+        done = threading.Event()
+        torn = []
+
+        def writer():
+            for i in range(2000):
+                suffix = 'ab'[i % 2]
+                self.controller.update_user_details('user1', name='name-' + suffix, college='college-' + suffix)
+            done.set()
+
+        def reader():
+            while not done.is_set():
+                profile = self.users.get('user1').profile
+                if profile.name[-1] != profile.college[-1]:
+                    torn.append((profile.name, profile.college))
+                for user in self.users.get_by_college('college-a') + self.users.get_by_college('college-b'):
+                    if user.id == 'user1' and user.profile.name[-1] != user.profile.college[-1]:
+                        torn.append((user.profile.name, user.profile.college))
+
+        threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert torn == []
+        assert self.users.get('user1').version == 2002
+
+    def test_conditional_get(self) -> None:
+        original = resources.controller
+        resources.controller = self.controller
+        try:
+            client = app.test_client()
+            response = client.get('/api/v1/users/user1')
+            etag = response.headers['ETag']
+            assert response.get_json()['_meta']['version'] == 1
+
+            not_modified = client.get('/api/v1/users/user1', headers={'If-None-Match': etag})
+            assert not_modified.status_code == 304 and not_modified.data == b''
+
+            client.patch('/api/v1/users/user1', json={'name': 'Renamed'})
+            modified = client.get('/api/v1/users/user1', headers={'If-None-Match': etag})
+            assert modified.status_code == 200 and modified.headers['ETag'] != etag
+        finally:
+            resources.controller = original
+
+    def test_asgi_conditional_get(self) -> None:
+        from server import asgi
+
+        sent = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            sent.append(message)
+
+        async def get(headers):
+            sent.clear()
+            await asgi.application({'type': 'http', 'method': 'GET', 'path': '/api/v1/users/rryan',
+                                    'query_string': b'', 'headers': headers}, receive, send)
+            return sent[0]['status'], dict(sent[0]['headers']), sent[1]['body']
+
+        status, headers, _ = asyncio.run(get([]))
+        assert status == 200
+
+        status, _, body = asyncio.run(get([(b'if-none-match', headers[b'etag'])]))
+        assert status == 304 and body == b''
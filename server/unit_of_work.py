@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+
+""" Units of work: the writes of a controller operation, committed together.
+
+A unit of work collects what one operation does across the repositories (say, a sign-up: the user, then its seeded
+recommendations). When the operation succeeds, its changes are committed as a single record of the journal, then
+published to the change feed. When it fails (or the journal can't be written), the writes already made are undone in
+reverse order and nothing is published.
+
+The journal does group commit: the units of work committing at the same time share one write and one fsync, so that
+write throughput doesn't fall to one operation per disk sync at sign-up peaks.
+
+Operations called from within a unit of work (add_user calls add_recommendations) join it rather than committing on
+their own. The current unit of work is tracked per thread, and per task in the async controller.
+
+"""
+
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+from contextlib import contextmanager, asynccontextmanager, ExitStack, AsyncExitStack
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from server import metrics
+from server.changes import ChangeFeed
+
+logger = logging.getLogger(__name__)
+
+journal_commits_total = metrics.REGISTRY.counter(
+    'journal_commits_total', 'Units of work committed to the journal.')
+
+journal_syncs_total = metrics.REGISTRY.counter(
+    'journal_syncs_total', 'Journal syncs (fsync), each one shared by a group of commits.')
+
+journal_sync_seconds = metrics.REGISTRY.histogram(
+    'journal_sync_seconds', 'Time to write and sync a group of commits to the journal.')
+
+_current = contextvars.ContextVar('unit_of_work', default=None)
+
+# the open journals, to restart their flushers in forked children
+_journals = weakref.WeakSet()
+
+
+class Journal(object):
+    """ an append-only log of the committed units of work, one json record per line, with group commit. Thread-safe.
+
+    Committers hand their record over to a flusher thread and wait for it to be synced. The flusher writes all the
+    records pending, then syncs once for all of them: while a sync is in progress, the next commits queue up and share
+    the next one.
+
+    """
+
+    def __init__(self, path: str, delay: float = 0.0, max_size: int = 256):
+        """
+        Args:
+            path: the journal file, appended to
+            delay: how long to wait for more commits to join a group before writing it (in seconds). 0 writes right
+                away, the commits arriving during a sync still share the next one
+            max_size: the maximum number of commits per group
+
+        """
+
+        self.path = path
+
+        self.delay = delay
+
+        self.max_size = max_size
+
+        self._file = open(path, 'a', encoding='utf-8')
+
+        self._condition = threading.Condition()
+
+        self._pending = []  # type: List[Tuple[str, Future]]
+
+        self._closed = False
+
+        self._flusher = threading.Thread(target=self._run, name='journal', daemon=True)
+
+        self._flusher.start()
+
+        _journals.add(self)
+
+    def submit(self, record: Dict) -> Future:
+        """ queues a record for the next group commit.
+
+        Args:
+            record: the record, json-serializable
+
+        Returns:
+            a future, done once the record is synced (or failed to be written)
+
+        """
+
+        # serialized by the caller, the flusher only writes
+        line = json.dumps(record, sort_keys=True) + '\n'
+
+        future = Future()
+
+        with self._condition:
+            if self._closed:
+                raise ValueError('the journal is closed: {}'.format(self.path))
+            self._pending.append((line, future))
+            self._condition.notify()
+
+        return future
+
+    def commit(self, record: Dict) -> None:
+        """ writes a record, and waits until it is synced.
+
+        Args:
+            record: the record, json-serializable
+
+        Returns:
+            None. An OSError is thrown if the record could not be written.
+
+        """
+
+        self.submit(record).result()
+
+    def _run(self) -> None:
+
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                waiting = len(self._pending)
+
+            if self.delay and waiting < self.max_size:
+                # let more commits join the group
+                time.sleep(self.delay)
+
+            with self._condition:
+                group = self._pending[:self.max_size]
+                del self._pending[:self.max_size]
+
+            start = time.perf_counter()
+
+            try:
+                self._file.write(''.join(line for line, _ in group))
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except Exception as e:
+                logger.exception('could not write %s commits to the journal %s', len(group), self.path)
+                for _, future in group:
+                    future.set_exception(e)
+                continue
+
+            journal_sync_seconds.observe((), time.perf_counter() - start)
+            journal_syncs_total.inc()
+            journal_commits_total.inc(amount=len(group))
+
+            for _, future in group:
+                future.set_result(None)
+
+    def close(self) -> None:
+        """ writes the commits pending, then closes the journal. """
+
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+        self._flusher.join()
+
+        self._file.close()
+
+    def _restart_after_fork(self) -> None:
+
+        # the flusher thread doesn't survive a fork. The child appends to the same file (in append mode, every group
+        # is written at the end, whichever process writes it)
+        self._condition = threading.Condition()
+
+        self._pending = []
+
+        if not self._closed:
+            self._flusher = threading.Thread(target=self._run, name='journal', daemon=True)
+            self._flusher.start()
+
+    @staticmethod
+    def read(path: str) -> Iterator[Dict]:
+        """ reads the records of a journal, oldest first (e.g. to replay them).
+
+        A last line cut short by a crash was never acknowledged to its committer: it is skipped.
+
+        Args:
+            path: the journal file
+
+        Returns:
+            an iterator of the records
+
+        """
+
+        with open(path, encoding='utf-8') as fl:
+            for line in fl:
+                if not line.endswith('\n'):
+                    logger.warning('skipping the incomplete last record of the journal %s', path)
+                    return
+                yield json.loads(line)
+
+
+def _restart_journals_after_fork() -> None:
+
+    for journal in list(_journals):
+        journal._restart_after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_journals_after_fork)
+
+
+class UnitOfWork(object):
+    """ the writes made by one operation, {@see unit_of_work}.
+
+    """
+
+    def __init__(self):
+
+        # (type, data) of the changes, published on commit
+        self.changes = []  # type: List[Tuple[str, Dict]]
+
+        # the inverse of every write made so far, run in reverse order on rollback
+        self._undo = []  # type: List[Callable]
+
+        # run once committed (still holding the locks): updates of derived state, like the name index, that must not
+        # be seen before the commit
+        self._after_commit = []  # type: List[Callable]
+
+        # held until the unit of work is over, so that the changes of an entity are published in the order they were
+        # made
+        self._locks = ExitStack()
+
+        self._held = set()
+
+    def publish(self, change_type: str, data: Dict) -> None:
+        """ records a change, appended to the journal and to the change feed on commit. """
+
+        self.changes.append((change_type, data))
+
+    def on_rollback(self, func: Callable, *args) -> None:
+        """ registers the inverse of a write that was just made. """
+
+        self._undo.append(functools.partial(func, *args))
+
+    def after_commit(self, func: Callable, *args) -> None:
+        """ registers something to do once the unit of work is committed. """
+
+        self._after_commit.append(functools.partial(func, *args))
+
+    def lock(self, lock) -> None:
+        """ acquires a lock until the unit of work is over. A lock already held by the unit of work is not re-acquired.
+
+        """
+
+        if id(lock) not in self._held:
+            self._locks.enter_context(lock)
+            self._held.add(id(lock))
+
+    def record(self) -> Dict:
+        """ the journal record of the unit of work. """
+
+        return {'time': time.time(), 'changes': [{'type': change_type, 'data': data}
+                                                 for change_type, data in self.changes]}
+
+    def rollback(self) -> None:
+
+        for undo in reversed(self._undo):
+            try:
+                undo()
+            except Exception:
+                logger.exception('could not undo a write of a failed unit of work')
+
+
+class AsyncUnitOfWork(UnitOfWork):
+    """ the async variant of UnitOfWork: the inverses of the writes are coroutine functions, the locks asyncio locks.
+
+    The functions to run after the commit may be coroutine functions as well.
+
+    """
+
+    def __init__(self):
+
+        super().__init__()
+
+        self._locks = AsyncExitStack()
+
+    async def lock(self, lock) -> None:
+
+        if id(lock) not in self._held:
+            await self._locks.enter_async_context(lock)
+            self._held.add(id(lock))
+
+    async def rollback(self) -> None:
+
+        for undo in reversed(self._undo):
+            try:
+                await undo()
+            except Exception:
+                logger.exception('could not undo a write of a failed unit of work')
+
+
+@contextmanager
+def unit_of_work(journal: Optional[Journal], change_feed: ChangeFeed) -> Iterator[UnitOfWork]:
+    """ runs an operation as a unit of work, or as part of the unit of work in progress.
+
+    Args:
+        journal: where to commit, None to keep the changes in memory only
+        change_feed: where to publish the changes once committed
+
+    Returns:
+        a context manager, giving the unit of work
+
+    """
+
+    work = _current.get()
+
+    if work is not None:
+        yield work
+        return
+
+    work = UnitOfWork()
+
+    token = _current.set(work)
+
+    try:
+        with work._locks:
+            try:
+                yield work
+                if work.changes and journal is not None:
+                    journal.commit(work.record())
+            except BaseException:
+                work.rollback()
+                raise
+
+            for change_type, data in work.changes:
+                change_feed.append(change_type, data)
+
+            for func in work._after_commit:
+                func()
+    finally:
+        _current.reset(token)
+
+
+@asynccontextmanager
+async def async_unit_of_work(journal: Optional[Journal], change_feed: ChangeFeed):
+    """ the async variant of unit_of_work: the commit is awaited, not waited for. {@see unit_of_work} """
+
+    work = _current.get()
+
+    if work is not None:
+        yield work
+        return
+
+    work = AsyncUnitOfWork()
+
+    token = _current.set(work)
+
+    try:
+        async with work._locks:
+            try:
+                yield work
+                if work.changes and journal is not None:
+                    await asyncio.wrap_future(journal.submit(work.record()))
+            except BaseException:
+                await work.rollback()
+                raise
+
+            for change_type, data in work.changes:
+                change_feed.append(change_type, data)
+
+            for func in work._after_commit:
+                result = func()
+                if asyncio.iscoroutine(result):
+                    await result
+    finally:
+        _current.reset(token)
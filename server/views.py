@@ -1,15 +1,47 @@
 # -*- coding: utf-8 -*-
 
-from server.app import api
+import os
+import time
 
-from server.resources import User, UserList, Connection, BatchConnection, Recommendation
+from flask import Response, jsonify
+
+from server import metrics, prefork
+from server.app import app, api
+
+from server.resources import User, UserList, UserLookup, Connection, BatchConnection, ConnectionSearch, \
+    Recommendation, Changes, HotUsers, Batch
 
 api.add_resource(UserList, '/users')
 
+api.add_resource(UserLookup, '/users/lookup')
+
 api.add_resource(User, '/users/<string:user_id>')
 
 api.add_resource(Connection, '/users/<string:user_id>/connections')
 
 api.add_resource(BatchConnection, '/users/<string:user_id>/connections/batch')
 
+api.add_resource(ConnectionSearch, '/users/<string:user_id>/connections/search')
+
 api.add_resource(Recommendation, '/users/<string:user_id>/recommendations')
+
+api.add_resource(Changes, '/changes')
+
+api.add_resource(HotUsers, '/admin/hot-users')
+
+api.add_resource(Batch, '/batch')
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+
+_started = time.time()
+
+
+@app.route('/health')
+def health():
+    # liveness of the process serving the request: a prefork worker that stopped accepting doesn't answer
+    return jsonify({'status': 'ok', 'pid': os.getpid(), 'worker': prefork.worker,
+                    'uptime_seconds': round(time.time() - _started, 3)})